@@ -0,0 +1,559 @@
+import numpy
+
+# this is a compressed bitmap in the roaring style
+# ids are split on their high 16 bits into containers, and each container holds the low 16 bits of its ids as either:
+# a sorted uint16 array, when it is sparse, at two bytes per id
+# a packed 65536-bit uint8 bitmap, when it is dense, at 8KB total
+# so a set of ten million ids is ~20MB at worst, rather than the ~500MB of a python set, and all the set operations are numpy work
+
+MAX_ARRAY_CONTAINER_SIZE = 4096
+MAX_PENDING_EDITS = 65536
+
+def _ArrayToBitmap( array ):
+    
+    bits = numpy.zeros( 65536, dtype = 'bool' )
+    
+    bits[ array ] = True
+    
+    return numpy.packbits( bits )
+    
+def _BitmapContains( bitmap, array ):
+    
+    array = array.astype( 'int64' )
+    
+    return ( bitmap[ array >> 3 ] & ( 0x80 >> ( array & 7 ) ) ) != 0
+    
+def _BitmapToArray( bitmap ):
+    
+    return numpy.flatnonzero( numpy.unpackbits( bitmap ) ).astype( 'uint16' )
+    
+def _GetContainerLength( container ):
+    
+    if container.dtype == 'uint16':
+        
+        return len( container )
+        
+    else:
+        
+        return int( numpy.count_nonzero( numpy.unpackbits( container ) ) )
+        
+    
+def _NormaliseContainer( container ):
+    
+    # returns the best representation of the container and its length, or ( None, 0 ) if it is empty
+    
+    num_ids = _GetContainerLength( container )
+    
+    if num_ids == 0:
+        
+        return ( None, 0 )
+        
+    
+    if container.dtype == 'uint16':
+        
+        if num_ids > MAX_ARRAY_CONTAINER_SIZE:
+            
+            container = _ArrayToBitmap( container )
+            
+        
+    else:
+        
+        if num_ids <= MAX_ARRAY_CONTAINER_SIZE:
+            
+            container = _BitmapToArray( container )
+            
+        
+    
+    return ( container, num_ids )
+    
+def _DifferenceContainers( container_a, container_b ):
+    
+    if container_a.dtype == 'uint16':
+        
+        if container_b.dtype == 'uint16':
+            
+            return numpy.setdiff1d( container_a, container_b, assume_unique = True )
+            
+        else:
+            
+            return container_a[ numpy.logical_not( _BitmapContains( container_b, container_a ) ) ]
+            
+        
+    else:
+        
+        if container_b.dtype == 'uint16':
+            
+            container_b = _ArrayToBitmap( container_b )
+            
+        
+        return numpy.bitwise_and( container_a, numpy.invert( container_b ) )
+        
+    
+def _IntersectContainers( container_a, container_b ):
+    
+    if container_a.dtype == 'uint16':
+        
+        if container_b.dtype == 'uint16':
+            
+            return numpy.intersect1d( container_a, container_b, assume_unique = True )
+            
+        else:
+            
+            return container_a[ _BitmapContains( container_b, container_a ) ]
+            
+        
+    else:
+        
+        if container_b.dtype == 'uint16':
+            
+            return container_b[ _BitmapContains( container_a, container_b ) ]
+            
+        else:
+            
+            return numpy.bitwise_and( container_a, container_b )
+            
+        
+    
+def _UnionContainers( container_a, container_b ):
+    
+    if container_a.dtype == 'uint16' and container_b.dtype == 'uint16':
+        
+        return numpy.union1d( container_a, container_b ).astype( 'uint16' )
+        
+    
+    if container_a.dtype == 'uint16':
+        
+        container_a = _ArrayToBitmap( container_a )
+        
+    
+    if container_b.dtype == 'uint16':
+        
+        container_b = _ArrayToBitmap( container_b )
+        
+    
+    return numpy.bitwise_or( container_a, container_b )
+    
+class HashIdBitmap( object ):
+    
+    # the methods here are named like set's, so this can go anywhere the search code used a set of hash_ids
+    # the 'other' of any operation can be another bitmap or any iterable of ints
+    # single adds and discards are queued in a dict and applied in one go before the containers are next looked at, so going element by element stays cheap
+    
+    def __init__( self, hash_ids = None ):
+        
+        self._containers = {}
+        self._num_ids = 0
+        
+        self._pending = {}
+        
+        if hash_ids is not None:
+            
+            self._InitialiseFromArray( self._ConvertToArray( hash_ids ) )
+            
+        
+    
+    def __and__( self, other ):
+        
+        return self.intersection( other )
+        
+    
+    def __contains__( self, hash_id ):
+        
+        if hash_id in self._pending:
+            
+            return self._pending[ hash_id ]
+            
+        
+        container = self._containers.get( hash_id >> 16, None )
+        
+        if container is None:
+            
+            return False
+            
+        
+        low = hash_id & 0xFFFF
+        
+        if container.dtype == 'uint16':
+            
+            i = numpy.searchsorted( container, low )
+            
+            return i < len( container ) and container[ i ] == low
+            
+        else:
+            
+            return ( container[ low >> 3 ] & ( 0x80 >> ( low & 7 ) ) ) != 0
+            
+        
+    
+    def __eq__( self, other ):
+        
+        self._Flush()
+        
+        if isinstance( other, HashIdBitmap ):
+            
+            other._Flush()
+            
+            if self._num_ids != other._num_ids or set( self._containers.keys() ) != set( other._containers.keys() ):
+                
+                return False
+                
+            
+            for ( high, container ) in self._containers.items():
+                
+                other_container = other._containers[ high ]
+                
+                if not numpy.array_equal( container, other_container ):
+                    
+                    return False
+                    
+                
+            
+            return True
+            
+        elif isinstance( other, ( set, frozenset ) ):
+            
+            return self._num_ids == len( other ) and numpy.array_equal( self.ToNumPyArray(), self._ConvertToArray( other ) )
+            
+        else:
+            
+            return NotImplemented
+            
+        
+    
+    def __iter__( self ):
+        
+        self._Flush()
+        
+        for high in sorted( self._containers.keys() ):
+            
+            container = self._containers[ high ]
+            
+            if container.dtype == 'uint8':
+                
+                container = _BitmapToArray( container )
+                
+            
+            base = high << 16
+            
+            for low in container.tolist():
+                
+                yield base + low
+                
+            
+        
+    
+    def __len__( self ):
+        
+        self._Flush()
+        
+        return self._num_ids
+        
+    
+    def __ne__( self, other ):
+        
+        result = self.__eq__( other )
+        
+        if result is NotImplemented:
+            
+            return result
+            
+        
+        return not result
+        
+    
+    def __nonzero__( self ):
+        
+        self._Flush()
+        
+        return self._num_ids > 0
+        
+    
+    def __or__( self, other ):
+        
+        return self.union( other )
+        
+    
+    def __sub__( self, other ):
+        
+        return self.difference( other )
+        
+    
+    def _ConvertToArray( self, hash_ids ):
+        
+        if isinstance( hash_ids, HashIdBitmap ):
+            
+            return hash_ids.ToNumPyArray()
+            
+        
+        if isinstance( hash_ids, numpy.ndarray ):
+            
+            array = hash_ids.astype( 'int64' )
+            
+        elif isinstance( hash_ids, ( list, tuple, set, frozenset ) ):
+            
+            array = numpy.fromiter( hash_ids, dtype = 'int64', count = len( hash_ids ) )
+            
+        else:
+            
+            array = numpy.fromiter( hash_ids, dtype = 'int64' )
+            
+        
+        return numpy.unique( array )
+        
+    
+    def _ConvertToBitmap( self, hash_ids ):
+        
+        if isinstance( hash_ids, HashIdBitmap ):
+            
+            hash_ids._Flush()
+            
+            return hash_ids
+            
+        
+        return HashIdBitmap( hash_ids )
+        
+    
+    def _Flush( self ):
+        
+        if len( self._pending ) == 0:
+            
+            return
+            
+        
+        pending = self._pending
+        
+        self._pending = {}
+        
+        hash_ids_to_add = [ hash_id for ( hash_id, add ) in pending.items() if add ]
+        hash_ids_to_discard = [ hash_id for ( hash_id, add ) in pending.items() if not add ]
+        
+        if len( hash_ids_to_discard ) > 0:
+            
+            self.difference_update( hash_ids_to_discard )
+            
+        
+        if len( hash_ids_to_add ) > 0:
+            
+            self.update( hash_ids_to_add )
+            
+        
+    
+    def _FlushIfBig( self ):
+        
+        if len( self._pending ) > MAX_PENDING_EDITS:
+            
+            self._Flush()
+            
+        
+    
+    def _InitialiseFromArray( self, array ):
+        
+        # array is sorted and unique
+        
+        self._containers = {}
+        self._num_ids = len( array )
+        
+        if len( array ) == 0:
+            
+            return
+            
+        
+        highs = array >> 16
+        lows = ( array & 0xFFFF ).astype( 'uint16' )
+        
+        boundaries = numpy.flatnonzero( numpy.diff( highs ) ) + 1
+        
+        starts = [ 0 ] + boundaries.tolist()
+        ends = boundaries.tolist() + [ len( array ) ]
+        
+        for ( start, end ) in zip( starts, ends ):
+            
+            container = lows[ start : end ]
+            
+            if len( container ) > MAX_ARRAY_CONTAINER_SIZE:
+                
+                container = _ArrayToBitmap( container )
+                
+            else:
+                
+                container = container.copy()
+                
+            
+            self._containers[ int( highs[ start ] ) ] = container
+            
+        
+    
+    def _SetContainer( self, high, container ):
+        
+        old_container = self._containers.get( high, None )
+        
+        if old_container is not None:
+            
+            self._num_ids -= _GetContainerLength( old_container )
+            
+            del self._containers[ high ]
+            
+        
+        if container is not None:
+            
+            ( container, num_ids ) = _NormaliseContainer( container )
+            
+            if container is not None:
+                
+                self._containers[ high ] = container
+                
+                self._num_ids += num_ids
+                
+            
+        
+    
+    def add( self, hash_id ):
+        
+        self._pending[ hash_id ] = True
+        
+        self._FlushIfBig()
+        
+    
+    def copy( self ):
+        
+        self._Flush()
+        
+        bitmap = HashIdBitmap()
+        
+        bitmap._containers = { high : container.copy() for ( high, container ) in self._containers.items() }
+        bitmap._num_ids = self._num_ids
+        
+        return bitmap
+        
+    
+    def difference( self, other ):
+        
+        bitmap = self.copy()
+        
+        bitmap.difference_update( other )
+        
+        return bitmap
+        
+    
+    def difference_update( self, other ):
+        
+        self._Flush()
+        
+        other = self._ConvertToBitmap( other )
+        
+        for ( high, other_container ) in other._containers.items():
+            
+            container = self._containers.get( high, None )
+            
+            if container is not None:
+                
+                self._SetContainer( high, _DifferenceContainers( container, other_container ) )
+                
+            
+        
+    
+    def discard( self, hash_id ):
+        
+        self._pending[ hash_id ] = False
+        
+        self._FlushIfBig()
+        
+    
+    def intersection( self, other ):
+        
+        bitmap = self.copy()
+        
+        bitmap.intersection_update( other )
+        
+        return bitmap
+        
+    
+    def intersection_update( self, other ):
+        
+        self._Flush()
+        
+        other = self._ConvertToBitmap( other )
+        
+        for ( high, container ) in self._containers.items():
+            
+            other_container = other._containers.get( high, None )
+            
+            if other_container is None:
+                
+                self._SetContainer( high, None )
+                
+            else:
+                
+                self._SetContainer( high, _IntersectContainers( container, other_container ) )
+                
+            
+        
+    
+    def issubset( self, other ):
+        
+        return len( self.difference( other ) ) == 0
+        
+    
+    def union( self, other ):
+        
+        bitmap = self.copy()
+        
+        bitmap.update( other )
+        
+        return bitmap
+        
+    
+    def update( self, other ):
+        
+        self._Flush()
+        
+        other = self._ConvertToBitmap( other )
+        
+        for ( high, other_container ) in other._containers.items():
+            
+            container = self._containers.get( high, None )
+            
+            if container is None:
+                
+                self._SetContainer( high, other_container.copy() )
+                
+            else:
+                
+                self._SetContainer( high, _UnionContainers( container, other_container ) )
+                
+            
+        
+    
+    def GetMemoryUsage( self ):
+        
+        self._Flush()
+        
+        return sum( ( container.nbytes for container in self._containers.values() ) )
+        
+    
+    def ToNumPyArray( self ):
+        
+        self._Flush()
+        
+        arrays = []
+        
+        for high in sorted( self._containers.keys() ):
+            
+            container = self._containers[ high ]
+            
+            if container.dtype == 'uint8':
+                
+                container = _BitmapToArray( container )
+                
+            
+            arrays.append( container.astype( 'int64' ) + ( high << 16 ) )
+            
+        
+        if len( arrays ) == 0:
+            
+            return numpy.empty( 0, dtype = 'int64' )
+            
+        
+        return numpy.concatenate( arrays )
+        
+    
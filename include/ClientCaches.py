@@ -1,6 +1,7 @@
+import ClientBitmaps
 import ClientDefaults
 import ClientDownloading
-import ClientParsing
+import ClientPackedThumbnails
 import ClientPaths
 import ClientRendering
 import ClientSearch
@@ -9,15 +10,20 @@ import ClientThreading
 import HydrusConstants as HC
 import HydrusExceptions
 import HydrusFileHandling
+import HydrusNetworking
 import HydrusPaths
 import HydrusSerialisable
 import HydrusSessions
 import HydrusThreading
+import HydrusVideoHandling
+import heapq
 import itertools
-import json
 import os
+import psutil
+import Queue
 import random
 import requests
+import struct
 import threading
 import time
 import urllib
@@ -204,6 +210,9 @@ def LoopInSimpleChildrenToParents( simple_children_to_parents, child, parent ):
     
     return False
     
+# a prefix folder is copied under this name beside where it is going, and only renamed into place when it is complete
+MIGRATING_PREFIX_SUFFIX = '.migrating'
+
 class ClientFilesManager( object ):
     
     def __init__( self, controller ):
@@ -212,7 +221,12 @@ class ClientFilesManager( object ):
         
         self._lock = threading.Lock()
         
+        # the integrity check and orphan search run for hours and talk to the db, which takes _lock to look up paths, so they hold this instead
+        
+        self._maintenance_lock = threading.Lock()
+        
         self._prefixes_to_locations = {}
+        self._prefixes_to_packed_thumbnail_stores = {}
         
         self._bad_error_occurred = False
         self._missing_locations = set()
@@ -220,6 +234,68 @@ class ClientFilesManager( object ):
         self._Reinit()
         
     
+    def _ClosePackedThumbnailStores( self ):
+        
+        # they hold open mmaps, which would stop their folders from being moved
+        
+        for packed_thumbnail_store in self._prefixes_to_packed_thumbnail_stores.values():
+            
+            packed_thumbnail_store.Close()
+            
+        
+        self._prefixes_to_packed_thumbnail_stores = {}
+        
+    
+    def _DeletePackedThumbnails( self, hashes ):
+        
+        # we always do this, even if packing is off, so nothing stale is waiting if it is turned back on
+        
+        prefixes_to_hashes = HydrusData.BuildKeyToListDict( ( ( 'r' + hash.encode( 'hex' )[:2], hash ) for hash in hashes ) )
+        
+        for prefix_hashes in prefixes_to_hashes.values():
+            
+            self._GetPackedThumbnailStore( prefix_hashes[0] ).DeleteThumbnails( prefix_hashes )
+            
+        
+    
+    def _FilterOrphanPaths( self, test_type, paths ):
+        
+        orphan_paths = []
+        hashes_to_paths = collections.defaultdict( list )
+        
+        for path in paths:
+            
+            filename = os.path.basename( path )
+            
+            try:
+                
+                should_be_a_hex_hash = filename[:64]
+                
+                hash = should_be_a_hex_hash.decode( 'hex' )
+                
+            except:
+                
+                orphan_paths.append( path )
+                
+                continue
+                
+            
+            hashes_to_paths[ hash ].append( path )
+            
+        
+        if len( hashes_to_paths ) > 0:
+            
+            orphan_hashes = self._controller.Read( 'filter_orphans', test_type, hashes_to_paths.keys() )
+            
+            for hash in orphan_hashes:
+                
+                orphan_paths.extend( hashes_to_paths[ hash ] )
+                
+            
+        
+        return orphan_paths
+        
+    
     def _GenerateExpectedFilePath( self, hash, mime ):
         
         hash_encoded = hash.encode( 'hex' )
@@ -342,15 +418,22 @@ class ClientFilesManager( object ):
             thumbnail_resized = HydrusFileHandling.GenerateThumbnailFromStaticImage( full_size_path, thumbnail_dimensions, fullsize_thumbnail_mime )
             
         
-        resized_path = self._GenerateExpectedResizedThumbnailPath( hash )
-        
         try:
             
-            HydrusPaths.MakeFileWritable( resized_path )
-            
-            with open( resized_path, 'wb' ) as f:
+            if self._UsePackedThumbnails():
+                
+                self._GetPackedThumbnailStore( hash ).SetThumbnail( hash, thumbnail_resized )
+                
+            else:
+                
+                resized_path = self._GenerateExpectedResizedThumbnailPath( hash )
+                
+                HydrusPaths.MakeFileWritable( resized_path )
                 
-                f.write( thumbnail_resized )
+                with open( resized_path, 'wb' ) as f:
+                    
+                    f.write( thumbnail_resized )
+                    
                 
             
         except Exception as e:
@@ -361,6 +444,32 @@ class ClientFilesManager( object ):
             
         
     
+    def _GetDevice( self, location ):
+        
+        device = HydrusPaths.GetDevice( location )
+        
+        if device is None:
+            
+            device = location
+            
+        
+        return device
+        
+    
+    def _GetPackedThumbnailStore( self, hash ):
+        
+        prefix = 'r' + hash.encode( 'hex' )[:2]
+        
+        if prefix not in self._prefixes_to_packed_thumbnail_stores:
+            
+            location = self._prefixes_to_locations[ prefix ]
+            
+            self._prefixes_to_packed_thumbnail_stores[ prefix ] = ClientPackedThumbnails.PackedThumbnailStore( os.path.join( location, prefix ) )
+            
+        
+        return self._prefixes_to_packed_thumbnail_stores[ prefix ]
+        
+    
     def _GetRecoverTuple( self ):
         
         all_locations = { location for location in self._prefixes_to_locations.values() }
@@ -385,7 +494,34 @@ class ClientFilesManager( object ):
         return None
         
     
-    def _GetRebalanceTuple( self ):
+    def _GetRebalanceMoves( self ):
+        
+        # we plan the whole rebalance up front, so all the moves can copy at once
+        
+        prefixes_to_locations = dict( self._prefixes_to_locations )
+        
+        rebalance_tuple = self._GetRebalanceTuple( prefixes_to_locations )
+        
+        while rebalance_tuple is not None:
+            
+            ( prefix, overweight_location, underweight_location ) = rebalance_tuple
+            
+            prefixes_to_locations[ prefix ] = underweight_location
+            
+            rebalance_tuple = self._GetRebalanceTuple( prefixes_to_locations )
+            
+        
+        return { prefix : ( self._prefixes_to_locations[ prefix ], location ) for ( prefix, location ) in prefixes_to_locations.items() if location != self._prefixes_to_locations[ prefix ] }
+        
+    
+    def _GetRebalanceTuple( self, prefixes_to_locations = None ):
+        
+        # pass a copy of the prefix locations to plan several moves ahead
+        
+        if prefixes_to_locations is None:
+            
+            prefixes_to_locations = self._prefixes_to_locations
+            
         
         ( locations_to_ideal_weights, resized_thumbnail_override, full_size_thumbnail_override ) = self._controller.new_options.GetClientFilesLocationsToIdealWeights()
         
@@ -395,11 +531,11 @@ class ClientFilesManager( object ):
         
         current_locations_to_normalised_weights = collections.defaultdict( lambda: 0 )
         
-        file_prefixes = [ prefix for prefix in self._prefixes_to_locations if prefix.startswith( 'f' ) ]
+        file_prefixes = [ prefix for prefix in prefixes_to_locations if prefix.startswith( 'f' ) ]
         
         for file_prefix in file_prefixes:
             
-            location = self._prefixes_to_locations[ file_prefix ]
+            location = prefixes_to_locations[ file_prefix ]
             
             current_locations_to_normalised_weights[ location ] += 1.0 / 256
             
@@ -449,7 +585,7 @@ class ClientFilesManager( object ):
             
             for file_prefix in file_prefixes:
                 
-                location = self._prefixes_to_locations[ file_prefix ]
+                location = prefixes_to_locations[ file_prefix ]
                 
                 if location == overweight_location:
                     
@@ -466,8 +602,8 @@ class ClientFilesManager( object ):
                     full_size_prefix = 't' + hex_prefix
                     file_prefix = 'f' + hex_prefix
                     
-                    full_size_location = self._prefixes_to_locations[ full_size_prefix ]
-                    file_location = self._prefixes_to_locations[ file_prefix ]
+                    full_size_location = prefixes_to_locations[ full_size_prefix ]
+                    file_location = prefixes_to_locations[ file_prefix ]
                     
                     if full_size_location != file_location:
                         
@@ -481,7 +617,7 @@ class ClientFilesManager( object ):
                     
                     full_size_prefix = 't' + hex_prefix
                     
-                    full_size_location = self._prefixes_to_locations[ full_size_prefix ]
+                    full_size_location = prefixes_to_locations[ full_size_prefix ]
                     
                     if full_size_location != full_size_thumbnail_override:
                         
@@ -497,8 +633,8 @@ class ClientFilesManager( object ):
                     resized_prefix = 'r' + hex_prefix
                     file_prefix = 'f' + hex_prefix
                     
-                    resized_location = self._prefixes_to_locations[ resized_prefix ]
-                    file_location = self._prefixes_to_locations[ file_prefix ]
+                    resized_location = prefixes_to_locations[ resized_prefix ]
+                    file_location = prefixes_to_locations[ file_prefix ]
                     
                     if resized_location != file_location:
                         
@@ -512,7 +648,7 @@ class ClientFilesManager( object ):
                     
                     resized_prefix = 'r' + hex_prefix
                     
-                    resized_location = self._prefixes_to_locations[ resized_prefix ]
+                    resized_location = prefixes_to_locations[ resized_prefix ]
                     
                     if resized_location != resized_thumbnail_override:
                         
@@ -543,41 +679,206 @@ class ClientFilesManager( object ):
             
         
     
-    def _IterateAllThumbnailPaths( self ):
+    def _LookForFilePath( self, hash ):
         
-        for ( prefix, location ) in self._prefixes_to_locations.items():
+        for potential_mime in HC.ALLOWED_MIMES:
+            
+            potential_path = self._GenerateExpectedFilePath( hash, potential_mime )
             
-            if prefix.startswith( 't' ) or prefix.startswith( 'r' ):
+            if os.path.exists( potential_path ):
                 
-                dir = os.path.join( location, prefix )
+                return potential_path
                 
-                filenames = os.listdir( dir )
+            
+        
+        raise HydrusExceptions.FileMissingException( 'File for ' + hash.encode( 'hex' ) + ' not found!' )
+        
+    
+    def _MigratePrefixes( self, job_key, prefixes_to_moves ):
+        
+        # each prefix is copied to a migrating folder while the client carries on using the original
+        # when a copy is done, we catch up on anything imported or deleted in the meantime and swap the folder in under the lock, so a read never sees a half-moved prefix
+        # there is one copier per pair of source and destination devices
+        
+        verify = self._controller.new_options.GetBoolean( 'verify_client_files_migration' )
+        
+        bandwidth_tracker = HydrusNetworking.BandwidthTracker()
+        
+        def throttle( num_bytes ):
+            
+            bandwidth_tracker.ReportDataUsed( num_bytes )
+            
+            while not job_key.IsCancelled() and not HG.model_shutdown:
                 
-                for filename in filenames:
+                busy_mb_per_second = self._controller.new_options.GetNoneableInteger( 'client_files_migration_busy_mb_per_second' )
+                
+                if busy_mb_per_second is None or self._controller.CurrentlyIdle():
                     
-                    yield os.path.join( dir, filename )
+                    return
+                    
+                
+                if bandwidth_tracker.GetUsage( HC.BANDWIDTH_TYPE_DATA, 1 ) < busy_mb_per_second * 1048576:
+                    
+                    return
                     
                 
+                time.sleep( 0.1 )
+                
             
         
-    
-    def _LookForFilePath( self, hash ):
+        def copy_prefix( prefix ):
+            
+            ( source_location, dest_location ) = prefixes_to_moves[ prefix ]
+            
+            source_path = os.path.join( source_location, prefix )
+            migrating_path = os.path.join( dest_location, prefix + MIGRATING_PREFIX_SUFFIX )
+            
+            num_files = 0
+            num_bytes = 0
+            
+            try:
+                
+                HydrusPaths.MakeSureDirectoryExists( migrating_path )
+                
+                if os.path.exists( source_path ):
+                    
+                    for filename in os.listdir( source_path ):
+                        
+                        if job_key.IsCancelled() or HG.model_shutdown:
+                            
+                            raise HydrusExceptions.CancelledException()
+                            
+                        
+                        source_file_path = os.path.join( source_path, filename )
+                        migrating_file_path = os.path.join( migrating_path, filename )
+                        
+                        # a migrating folder left over from an interrupted run is picked up where it was left
+                        
+                        if not os.path.isfile( source_file_path ) or HydrusPaths.PathsHaveSameSizeAndDate( source_file_path, migrating_file_path ):
+                            
+                            continue
+                            
+                        
+                        HydrusPaths.MakeFileWritable( migrating_file_path )
+                        
+                        try:
+                            
+                            HydrusPaths.CopyFileFast( source_file_path, migrating_file_path, block_copied_hook = throttle )
+                            
+                        except ( IOError, OSError ):
+                            
+                            if os.path.exists( source_file_path ):
+                                
+                                raise
+                                
+                            
+                            # it was deleted as we copied it, and the catch-up will clear our copy away
+                            
+                            continue
+                            
+                        
+                        if verify and prefix.startswith( 'f' ):
+                            
+                            expected_hash = os.path.splitext( filename )[0].decode( 'hex' )
+                            
+                            migrated_hash = HydrusFileHandling.GetHashFromPath( migrating_file_path )
+                            
+                            # if the original is already damaged, that is a job for the integrity check, not us
+                            
+                            if migrated_hash != expected_hash and migrated_hash != HydrusFileHandling.GetHashFromPath( source_file_path ):
+                                
+                                raise Exception( 'The copy of ' + source_file_path + ' to ' + migrating_file_path + ' did not verify!' )
+                                
+                            
+                        
+                        num_files += 1
+                        num_bytes += os.path.getsize( migrating_file_path )
+                        
+                    
+                
+            except:
+                
+                HydrusPaths.DeletePath( migrating_path )
+                
+                raise
+                
+            
+            return ( None, num_files, num_bytes )
+            
         
-        for potential_mime in HC.ALLOWED_MIMES:
+        def swap_prefix( prefix, result ):
             
-            potential_path = self._GenerateExpectedFilePath( hash, potential_mime )
+            ( source_location, dest_location ) = prefixes_to_moves[ prefix ]
             
-            if os.path.exists( potential_path ):
+            source_path = os.path.join( source_location, prefix )
+            migrating_path = os.path.join( dest_location, prefix + MIGRATING_PREFIX_SUFFIX )
+            dest_path = os.path.join( dest_location, prefix )
+            
+            HydrusData.Print( 'Moving \'' + prefix + '\' from ' + source_location + ' to ' + dest_location )
+            
+            with self._lock:
                 
-                return potential_path
+                self._ClosePackedThumbnailStores()
+                
+                if os.path.exists( source_path ):
+                    
+                    HydrusPaths.MirrorTree( source_path, migrating_path )
+                    
+                
+                HydrusPaths.MergeTree( migrating_path, dest_path )
+                
+            
+            # the db thread looks up file paths under our lock, so we cannot hold it while we wait on the db
+            # the original stays in use until the swap, so we catch up on it again once the db is done
+            
+            self._controller.WriteSynchronous( 'set_client_files_location', prefix, dest_location )
+            
+            with self._lock:
+                
+                self._ClosePackedThumbnailStores()
+                
+                if os.path.exists( source_path ):
+                    
+                    HydrusPaths.MirrorTree( source_path, dest_path )
+                    
+                
+                self._prefixes_to_locations[ prefix ] = dest_location
+                
+            
+            if os.path.exists( source_path ):
+                
+                try: HydrusPaths.RecyclePath( source_path )
+                except: pass
                 
             
         
-        raise HydrusExceptions.FileMissingException( 'File for ' + hash.encode( 'hex' ) + ' not found!' )
+        prefixes_to_devices = {}
+        
+        for ( prefix, ( source_location, dest_location ) ) in prefixes_to_moves.items():
+            
+            prefixes_to_devices[ prefix ] = self._GetDevice( source_location ) + ' -> ' + self._GetDevice( dest_location )
+            
+        
+        job_key.SetVariable( 'popup_text_1', 'moving ' + HydrusData.ToHumanInt( len( prefixes_to_moves ) ) + ' folders' )
+        
+        try:
+            
+            return self._ScanPrefixesByDevice( job_key, prefixes_to_moves.keys(), copy_prefix, swap_prefix, prefixes_to_devices = prefixes_to_devices )
+            
+        except:
+            
+            # this stops the other copiers
+            
+            job_key.Cancel()
+            
+            raise
+            
         
     
     def _Reinit( self ):
         
+        self._ClosePackedThumbnailStores()
+        
         self._prefixes_to_locations = self._controller.Read( 'client_files_locations' )
         
         if HG.client_controller.IsFirstStart():
@@ -680,182 +981,545 @@ class ClientFilesManager( object ):
             
         
     
-    def GetMissing( self ):
-        
-        return self._missing_locations
-        
-    
-    def LocklessAddFileFromString( self, hash, mime, data ):
+    def _ScanPrefixesByDevice( self, job_key, prefixes, scan_prefix_callable, prefix_done_callable, prefixes_to_devices = None ):
         
-        dest_path = self._GenerateExpectedFilePath( hash, mime )
+        # one reader per physical device, so all the disks work at once but no disk has two readers fighting over its heads
+        # scan_prefix_callable( prefix ) runs in the reader threads and returns ( result, num_files, num_bytes )
+        # prefix_done_callable( prefix, result ) runs in this thread, once per finished prefix, so it can checkpoint
+        # prefixes_to_devices overrides how the prefixes are split between the readers
+        # returns True if every prefix was scanned, False if the user cancelled
         
-        HydrusPaths.MakeFileWritable( dest_path )
+        devices_to_prefixes = collections.defaultdict( list )
         
-        with open( dest_path, 'wb' ) as f:
+        for prefix in sorted( prefixes ):
             
-            f.write( data )
+            if prefixes_to_devices is None:
+                
+                device = self._GetDevice( self._prefixes_to_locations[ prefix ] )
+                
+            else:
+                
+                device = prefixes_to_devices[ prefix ]
+                
+            
+            devices_to_prefixes[ device ].append( prefix )
             
         
-    
-    def LocklessAddFile( self, hash, mime, source_path ):
-        
-        dest_path = self._GenerateExpectedFilePath( hash, mime )
+        results_queue = Queue.Queue()
         
-        if not os.path.exists( dest_path ):
-            
-            successful = HydrusPaths.MirrorFile( source_path, dest_path )
+        def THREADScanDevice( device, device_prefixes ):
             
-            if not successful:
+            for prefix in device_prefixes:
                 
-                raise Exception( 'There was a problem copying the file from ' + source_path + ' to ' + dest_path + '!' )
+                ( i_paused, should_quit ) = job_key.WaitIfNeeded()
+                
+                if should_quit:
+                    
+                    return
+                    
+                
+                try:
+                    
+                    ( result, num_files, num_bytes ) = scan_prefix_callable( prefix )
+                    
+                except HydrusExceptions.CancelledException:
+                    
+                    return
+                    
+                except Exception as e:
+                    
+                    results_queue.put( ( device, prefix, None, 0, 0, e ) )
+                    
+                    return
+                    
+                
+                results_queue.put( ( device, prefix, result, num_files, num_bytes, None ) )
                 
             
         
-    
-    def AddFullSizeThumbnail( self, hash, thumbnail ):
-        
-        with self._lock:
+        for ( device, device_prefixes ) in devices_to_prefixes.items():
             
-            self.LocklessAddFullSizeThumbnail( hash, thumbnail )
+            self._controller.CallToThreadLongRunning( THREADScanDevice, device, device_prefixes )
             
         
-    
-    def LocklessAddFullSizeThumbnail( self, hash, thumbnail ):
+        devices_to_num_prefixes_done = collections.Counter()
+        devices_to_num_files = collections.Counter()
+        devices_to_num_bytes = collections.Counter()
         
-        path = self._GenerateExpectedFullSizeThumbnailPath( hash )
+        start_time = HydrusData.GetNowPrecise()
         
-        HydrusPaths.MakeFileWritable( path )
+        num_prefixes_done = 0
         
-        with open( path, 'wb' ) as f:
+        while num_prefixes_done < len( prefixes ):
             
-            f.write( thumbnail )
-            
-        
-        resized_path = self._GenerateExpectedResizedThumbnailPath( hash )
-        
-        if os.path.exists( resized_path ):
+            if job_key.IsCancelled():
+                
+                return False
+                
             
-            ClientPaths.DeletePath( resized_path, always_delete_fully = True )
+            try:
+                
+                ( device, prefix, result, num_files, num_bytes, e ) = results_queue.get( timeout = 1.0 )
+                
+            except Queue.Empty:
+                
+                continue
+                
+            
+            if e is not None:
+                
+                # this stops the other readers
+                
+                job_key.Cancel()
+                
+                raise e
+                
+            
+            prefix_done_callable( prefix, result )
+            
+            num_prefixes_done += 1
+            
+            devices_to_num_prefixes_done[ device ] += 1
+            devices_to_num_files[ device ] += num_files
+            devices_to_num_bytes[ device ] += num_bytes
+            
+            time_running = max( 0.001, HydrusData.GetNowPrecise() - start_time )
+            
+            device_statuses = []
+            
+            for device in sorted( devices_to_prefixes.keys() ):
+                
+                device_status = device + ': ' + HydrusData.ConvertValueRangeToPrettyString( devices_to_num_prefixes_done[ device ], len( devices_to_prefixes[ device ] ) ) + ' folders, ' + HydrusData.ToHumanInt( devices_to_num_files[ device ] ) + ' files'
+                
+                if devices_to_num_bytes[ device ] > 0:
+                    
+                    device_status += ', ' + HydrusData.ConvertIntToBytes( devices_to_num_bytes[ device ] / time_running ) + '/s'
+                    
+                
+                device_statuses.append( device_status )
+                
+            
+            job_key.SetVariable( 'popup_text_2', os.linesep.join( device_statuses ) )
+            job_key.SetVariable( 'popup_gauge_1', ( num_prefixes_done, len( prefixes ) ) )
             
         
-        self._controller.pub( 'clear_thumbnails', { hash } )
-        self._controller.pub( 'new_thumbnails', { hash } )
+        return True
         
     
-    def CheckFileIntegrity( self, *args, **kwargs ):
+    def _UsePackedThumbnails( self ):
         
-        with self._lock:
+        return self._controller.new_options.GetBoolean( 'pack_resized_thumbnails' )
+        
+    
+    def GetMissing( self ):
+        
+        return self._missing_locations
+        
+    
+    def LocklessAddFileFromString( self, hash, mime, data ):
+        
+        dest_path = self._GenerateExpectedFilePath( hash, mime )
+        
+        HydrusPaths.MakeFileWritable( dest_path )
+        
+        with open( dest_path, 'wb' ) as f:
             
-            self._controller.WriteSynchronous( 'file_integrity', *args, **kwargs )
+            f.write( data )
             
         
     
-    def ClearOrphans( self, move_location = None ):
+    def LocklessAddFile( self, hash, mime, source_path ):
+        
+        dest_path = self._GenerateExpectedFilePath( hash, mime )
+        
+        if not os.path.exists( dest_path ):
+            
+            successful = HydrusPaths.MirrorFile( source_path, dest_path )
+            
+            if not successful:
+                
+                raise Exception( 'There was a problem copying the file from ' + source_path + ' to ' + dest_path + '!' )
+                
+            
+        
+    
+    def AddFullSizeThumbnail( self, hash, thumbnail ):
         
         with self._lock:
             
-            job_key = ClientThreading.JobKey( cancellable = True )
+            self.LocklessAddFullSizeThumbnail( hash, thumbnail )
             
-            job_key.SetVariable( 'popup_title', 'clearing orphans' )
-            job_key.SetVariable( 'popup_text_1', 'preparing' )
+        
+    
+    def LocklessAddFullSizeThumbnail( self, hash, thumbnail ):
+        
+        path = self._GenerateExpectedFullSizeThumbnailPath( hash )
+        
+        HydrusPaths.MakeFileWritable( path )
+        
+        with open( path, 'wb' ) as f:
             
-            self._controller.pub( 'message', job_key )
+            f.write( thumbnail )
+            
+        
+        resized_path = self._GenerateExpectedResizedThumbnailPath( hash )
+        
+        if os.path.exists( resized_path ):
             
-            orphan_paths = []
-            orphan_thumbnails = []
+            ClientPaths.DeletePath( resized_path, always_delete_fully = True )
             
-            for ( i, path ) in enumerate( self._IterateAllFilePaths() ):
+        
+        self._DeletePackedThumbnails( ( hash, ) )
+        
+        self._controller.pub( 'clear_thumbnails', { hash } )
+        self._controller.pub( 'new_thumbnails', { hash } )
+        
+    
+    def CheckFileIntegrity( self, mode, allowed_mimes = None, move_location = None ):
+        
+        with self._maintenance_lock:
+            
+            prefix_string = 'checking file integrity: '
+            
+            job_key = ClientThreading.JobKey( pausable = True, cancellable = True )
+            
+            try:
                 
-                ( i_paused, should_quit ) = job_key.WaitIfNeeded()
+                job_key.SetVariable( 'popup_text_1', prefix_string + 'preparing' )
                 
-                if should_quit:
+                self._controller.pub( 'modal_message', job_key )
+                
+                if allowed_mimes is not None:
                     
-                    return
+                    allowed_mimes = sorted( allowed_mimes )
                     
                 
-                if i % 100 == 0:
-                    
-                    status = 'reviewed ' + HydrusData.ToHumanInt( i ) + ' files, found ' + HydrusData.ToHumanInt( len( orphan_paths ) ) + ' orphans'
+                # a cancelled check of the same kind picks up from the last folder it finished
+                
+                scan_description = [ mode, allowed_mimes, move_location ]
+                
+                checkpoint = self._controller.Read( 'serialisable_simple', 'file_integrity_checkpoint' )
+                
+                if checkpoint is None or checkpoint[ 'scan_description' ] != scan_description:
                     
-                    job_key.SetVariable( 'popup_text_1', status )
+                    checkpoint = { 'scan_description' : scan_description, 'done_prefixes' : [], 'missing_hashes' : [], 'incorrect_hashes' : [] }
                     
                 
-                try:
+                hashes_and_mimes = self._controller.Read( 'file_integrity_info', allowed_mimes )
+                
+                # we only need the lock for a moment--a folder that moves while we scan is caught by the recheck at the end
+                
+                with self._lock:
                     
-                    is_an_orphan = False
+                    prefixes_to_locations = dict( self._prefixes_to_locations )
                     
-                    ( directory, filename ) = os.path.split( path )
+                
+                prefixes_to_hashes_and_mimes = HydrusData.BuildKeyToListDict( ( ( 'f' + hash.encode( 'hex' )[:2], ( hash, mime ) ) for ( hash, mime ) in hashes_and_mimes ) )
+                
+                done_prefixes = set( checkpoint[ 'done_prefixes' ] )
+                
+                prefixes = [ prefix for prefix in prefixes_to_hashes_and_mimes.keys() if prefix not in done_prefixes ]
+                
+                if len( done_prefixes ) > 0:
                     
-                    should_be_a_hex_hash = filename[:64]
+                    job_key.SetVariable( 'popup_text_1', prefix_string + 'resuming, ' + HydrusData.ToHumanInt( len( done_prefixes ) ) + ' folders already done' )
                     
-                    hash = should_be_a_hex_hash.decode( 'hex' )
+                else:
                     
-                    is_an_orphan = HG.client_controller.Read( 'is_an_orphan', 'file', hash )
+                    job_key.SetVariable( 'popup_text_1', prefix_string + 'checking' )
                     
-                except:
+                
+                def scan_prefix( prefix ):
                     
-                    is_an_orphan = True
+                    missing_hashes = []
+                    incorrect_hashes = []
                     
-                
-                if is_an_orphan:
+                    num_bytes = 0
                     
-                    if move_location is not None:
+                    for ( hash, mime ) in prefixes_to_hashes_and_mimes[ prefix ]:
                         
-                        ( source_dir, filename ) = os.path.split( path )
+                        ( i_paused, should_quit ) = job_key.WaitIfNeeded()
                         
-                        dest = os.path.join( move_location, filename )
+                        if should_quit:
+                            
+                            raise HydrusExceptions.CancelledException( 'File integrity check cancelled!' )
+                            
                         
-                        dest = HydrusPaths.AppendPathUntilNoConflicts( dest )
+                        path = os.path.join( prefixes_to_locations[ prefix ], prefix, hash.encode( 'hex' ) + HC.mime_ext_lookup[ mime ] )
                         
-                        HydrusData.Print( 'Moving the orphan ' + path + ' to ' + dest )
+                        if not os.path.exists( path ):
+                            
+                            HydrusData.Print( 'Could not find the file for ' + hash.encode( 'hex' ) + '!' )
+                            
+                            missing_hashes.append( hash )
+                            
+                            continue
+                            
                         
-                        HydrusPaths.MergeFile( path, dest )
+                        if mode == 'thorough':
+                            
+                            num_bytes += os.path.getsize( path )
+                            
+                            actual_hash = HydrusFileHandling.GetHashFromPath( path )
+                            
+                            if actual_hash != hash:
+                                
+                                incorrect_hashes.append( hash )
+                                
+                                if move_location is not None:
+                                    
+                                    move_filename = 'believed ' + hash.encode( 'hex' ) + ' actually ' + actual_hash.encode( 'hex' ) + HC.mime_ext_lookup[ mime ]
+                                    
+                                    move_path = os.path.join( move_location, move_filename )
+                                    
+                                    HydrusPaths.MergeFile( path, move_path )
+                                    
+                                
+                            
                         
                     
-                    orphan_paths.append( path )
+                    return ( ( missing_hashes, incorrect_hashes ), len( prefixes_to_hashes_and_mimes[ prefix ] ), num_bytes )
                     
                 
-            
-            time.sleep( 2 )
-            
-            for ( i, path ) in enumerate( self._IterateAllThumbnailPaths() ):
+                def prefix_done( prefix, ( missing_hashes, incorrect_hashes ) ):
+                    
+                    checkpoint[ 'done_prefixes' ].append( prefix )
+                    checkpoint[ 'missing_hashes' ].extend( ( hash.encode( 'hex' ) for hash in missing_hashes ) )
+                    checkpoint[ 'incorrect_hashes' ].extend( ( hash.encode( 'hex' ) for hash in incorrect_hashes ) )
+                    
+                    self._controller.WriteSynchronous( 'serialisable_simple', 'file_integrity_checkpoint', checkpoint )
+                    
                 
-                ( i_paused, should_quit ) = job_key.WaitIfNeeded()
+                prefixes_to_devices = { prefix : self._GetDevice( prefixes_to_locations[ prefix ] ) for prefix in prefixes }
                 
-                if should_quit:
+                completed = self._ScanPrefixesByDevice( job_key, prefixes, scan_prefix, prefix_done, prefixes_to_devices = prefixes_to_devices )
+                
+                if not completed:
+                    
+                    job_key.SetVariable( 'popup_text_1', prefix_string + 'cancelled--it will resume from here next time' )
                     
                     return
                     
                 
-                if i % 100 == 0:
+                missing_hashes = [ encoded_hash.decode( 'hex' ) for encoded_hash in checkpoint[ 'missing_hashes' ] ]
+                incorrect_hashes = [ encoded_hash.decode( 'hex' ) for encoded_hash in checkpoint[ 'incorrect_hashes' ] ]
+                
+                # a resumed check may have found some of these missing a while ago, so make sure they still are before we clear their records
+                
+                def still_missing( hash ):
                     
-                    status = 'reviewed ' + HydrusData.ToHumanInt( i ) + ' thumbnails, found ' + HydrusData.ToHumanInt( len( orphan_thumbnails ) ) + ' orphans'
+                    try:
+                        
+                        self._LookForFilePath( hash )
+                        
+                        return False
+                        
+                    except HydrusExceptions.FileMissingException:
+                        
+                        return True
+                        
                     
-                    job_key.SetVariable( 'popup_text_1', status )
+                
+                with self._lock:
+                    
+                    missing_hashes = [ hash for hash in missing_hashes if still_missing( hash ) ]
                     
                 
-                try:
+                job_key.DeleteVariable( 'popup_gauge_1' )
+                job_key.SetVariable( 'popup_text_1', prefix_string + 'deleting the incorrect records' )
+                
+                self._controller.WriteSynchronous( 'clear_file_records', missing_hashes + incorrect_hashes )
+                
+                self._controller.WriteSynchronous( 'serialisable_simple', 'file_integrity_checkpoint', None )
+                
+                final_text = 'done! '
+                
+                if len( missing_hashes ) + len( incorrect_hashes ) == 0:
                     
-                    is_an_orphan = False
+                    final_text += 'all files ok!'
                     
-                    ( directory, filename ) = os.path.split( path )
+                else:
                     
-                    should_be_a_hex_hash = filename[:64]
+                    final_text += HydrusData.ToHumanInt( len( missing_hashes ) ) + ' files were missing!'
                     
-                    hash = should_be_a_hex_hash.decode( 'hex' )
+                    if mode == 'thorough':
+                        
+                        final_text += ' ' + HydrusData.ToHumanInt( len( incorrect_hashes ) ) + ' files were incorrect and thus '
+                        
+                        if move_location is None:
+                            
+                            final_text += 'deleted!'
+                            
+                        else:
+                            
+                            final_text += 'moved!'
+                            
+                        
                     
-                    is_an_orphan = HG.client_controller.Read( 'is_an_orphan', 'thumbnail', hash )
+                
+                job_key.SetVariable( 'popup_text_1', prefix_string + final_text )
+                
+            finally:
+                
+                HydrusData.Print( job_key.ToString() )
+                
+                job_key.Finish()
+                
+            
+        
+    
+    def ClearOrphans( self, move_location = None ):
+        
+        with self._maintenance_lock:
+            
+            job_key = ClientThreading.JobKey( pausable = True, cancellable = True )
+            
+            job_key.SetVariable( 'popup_title', 'clearing orphans' )
+            job_key.SetVariable( 'popup_text_1', 'preparing' )
+            
+            self._controller.pub( 'message', job_key )
+            
+            # a cancelled search picks up from the last folder it finished
+            
+            scan_description = [ move_location ]
+            
+            checkpoint = self._controller.Read( 'serialisable_simple', 'clear_orphans_checkpoint' )
+            
+            if checkpoint is None or checkpoint[ 'scan_description' ] != scan_description:
+                
+                checkpoint = { 'scan_description' : scan_description, 'done_prefixes' : [], 'orphan_paths' : [], 'orphan_thumbnails' : [] }
+                
+            
+            done_prefixes = set( checkpoint[ 'done_prefixes' ] )
+            
+            with self._lock:
+                
+                prefixes_to_locations = dict( self._prefixes_to_locations )
+                
+            
+            prefixes = [ prefix for prefix in prefixes_to_locations.keys() if prefix not in done_prefixes ]
+            
+            job_key.SetVariable( 'popup_text_1', 'looking for orphans' )
+            
+            def scan_prefix( prefix ):
+                
+                is_file_prefix = prefix.startswith( 'f' )
+                
+                dir = os.path.join( prefixes_to_locations[ prefix ], prefix )
+                
+                filenames = os.listdir( dir )
+                
+                orphan_paths = []
+                hashes_and_paths = []
+                
+                for filename in filenames:
                     
-                except:
+                    if not is_file_prefix and ClientPackedThumbnails.IsPackedThumbnailFilename( filename ):
+                        
+                        continue
+                        
                     
-                    is_an_orphan = True
+                    path = os.path.join( dir, filename )
+                    
+                    try:
+                        
+                        should_be_a_hex_hash = filename[:64]
+                        
+                        hash = should_be_a_hex_hash.decode( 'hex' )
+                        
+                    except:
+                        
+                        orphan_paths.append( path )
+                        
+                        continue
+                        
+                    
+                    hashes_and_paths.append( ( hash, path ) )
                     
                 
-                if is_an_orphan:
+                if is_file_prefix:
+                    
+                    test_type = 'file'
+                    
+                else:
                     
-                    orphan_thumbnails.append( path )
+                    test_type = 'thumbnail'
                     
                 
+                orphan_hashes = set( self._controller.Read( 'filter_orphans', test_type, [ hash for ( hash, path ) in hashes_and_paths ] ) )
+                
+                orphan_paths.extend( ( path for ( hash, path ) in hashes_and_paths if hash in orphan_hashes ) )
+                
+                if is_file_prefix and move_location is not None:
+                    
+                    for path in orphan_paths:
+                        
+                        ( source_dir, filename ) = os.path.split( path )
+                        
+                        dest = os.path.join( move_location, filename )
+                        
+                        dest = HydrusPaths.AppendPathUntilNoConflicts( dest )
+                        
+                        HydrusData.Print( 'Moving the orphan ' + path + ' to ' + dest )
+                        
+                        HydrusPaths.MergeFile( path, dest )
+                        
+                    
+                
+                return ( ( is_file_prefix, orphan_paths ), len( filenames ), 0 )
+                
+            
+            def prefix_done( prefix, ( is_file_prefix, orphan_paths ) ):
+                
+                checkpoint[ 'done_prefixes' ].append( prefix )
+                
+                if is_file_prefix:
+                    
+                    checkpoint[ 'orphan_paths' ].extend( orphan_paths )
+                    
+                else:
+                    
+                    checkpoint[ 'orphan_thumbnails' ].extend( orphan_paths )
+                    
+                
+                status = 'found ' + HydrusData.ToHumanInt( len( checkpoint[ 'orphan_paths' ] ) ) + ' orphan files and ' + HydrusData.ToHumanInt( len( checkpoint[ 'orphan_thumbnails' ] ) ) + ' orphan thumbnails so far'
+                
+                job_key.SetVariable( 'popup_text_1', status )
+                
+                self._controller.WriteSynchronous( 'serialisable_simple', 'clear_orphans_checkpoint', checkpoint )
+                
+            
+            prefixes_to_devices = { prefix : self._GetDevice( prefixes_to_locations[ prefix ] ) for prefix in prefixes }
+            
+            completed = self._ScanPrefixesByDevice( job_key, prefixes, scan_prefix, prefix_done, prefixes_to_devices = prefixes_to_devices )
+            
+            if not completed:
+                
+                job_key.SetVariable( 'popup_text_1', 'cancelled--it will resume from here next time' )
+                
+                HydrusData.Print( job_key.ToString() )
+                
+                job_key.Finish()
+                
+                return
+                
+            
+            job_key.DeleteVariable( 'popup_gauge_1' )
+            
+            # a resumed scan may have found some of these a while ago, so make sure they are still orphans before we delete anything
+            
+            job_key.SetVariable( 'popup_text_1', 'checking the orphans are still orphans' )
+            
+            if move_location is None:
+                
+                orphan_paths = self._FilterOrphanPaths( 'file', checkpoint[ 'orphan_paths' ] )
+                
+            else:
+                
+                orphan_paths = checkpoint[ 'orphan_paths' ]
+                
+            
+            orphan_thumbnails = self._FilterOrphanPaths( 'thumbnail', checkpoint[ 'orphan_thumbnails' ] )
             
             time.sleep( 2 )
             
@@ -867,7 +1531,7 @@ class ClientFilesManager( object ):
                 
                 time.sleep( 5 )
                 
-                for path in orphan_paths:
+                for ( i, path ) in enumerate( orphan_paths ):
                     
                     ( i_paused, should_quit ) = job_key.WaitIfNeeded()
                     
@@ -876,6 +1540,11 @@ class ClientFilesManager( object ):
                         return
                         
                     
+                    if not os.path.exists( path ):
+                        
+                        continue
+                        
+                    
                     HydrusData.Print( 'Deleting the orphan ' + path )
                     
                     status = 'deleting orphan files: ' + HydrusData.ConvertValueRangeToPrettyString( i + 1, len( orphan_paths ) )
@@ -903,6 +1572,11 @@ class ClientFilesManager( object ):
                         return
                         
                     
+                    if not os.path.exists( path ):
+                        
+                        continue
+                        
+                    
                     status = 'deleting orphan thumbnails: ' + HydrusData.ConvertValueRangeToPrettyString( i + 1, len( orphan_thumbnails ) )
                     
                     job_key.SetVariable( 'popup_text_1', status )
@@ -913,7 +1587,13 @@ class ClientFilesManager( object ):
                     
                 
             
-            if len( orphan_paths ) == 0 and len( orphan_thumbnails ) == 0:
+            job_key.SetVariable( 'popup_text_1', 'clearing orphan video keyframe indices' )
+            
+            num_orphan_keyframe_indices = self._controller.GetCache( 'video_keyframes' ).ClearOrphans()
+            
+            self._controller.WriteSynchronous( 'serialisable_simple', 'clear_orphans_checkpoint', None )
+            
+            if len( orphan_paths ) == 0 and len( orphan_thumbnails ) == 0 and num_orphan_keyframe_indices == 0:
                 
                 final_text = 'no orphans found!'
                 
@@ -921,6 +1601,11 @@ class ClientFilesManager( object ):
                 
                 final_text = HydrusData.ToHumanInt( len( orphan_paths ) ) + ' orphan files and ' + HydrusData.ToHumanInt( len( orphan_thumbnails ) ) + ' orphan thumbnails cleared!'
                 
+                if num_orphan_keyframe_indices > 0:
+                    
+                    final_text += ' ' + HydrusData.ToHumanInt( num_orphan_keyframe_indices ) + ' orphan video keyframe indices cleared!'
+                    
+                
             
             job_key.SetVariable( 'popup_text_1', final_text )
             
@@ -957,6 +1642,9 @@ class ClientFilesManager( object ):
                 big_pauser.Pause()
                 
             
+        
+        self._controller.pub( 'delete_video_keyframe_indices', hashes )
+        
     
     def DelayedDeleteThumbnails( self, hashes, time_to_delete ):
         
@@ -980,6 +1668,8 @@ class ClientFilesManager( object ):
                 big_pauser.Pause()
                 
             
+            self._DeletePackedThumbnails( hashes )
+            
         
     
     def GetFilePath( self, hash, mime = None ):
@@ -1067,6 +1757,47 @@ class ClientFilesManager( object ):
             
         
     
+    def GetPackedResizedThumbnail( self, hash, mime ):
+        
+        with self._lock:
+            
+            packed_thumbnail_store = self._GetPackedThumbnailStore( hash )
+            
+            if not packed_thumbnail_store.HasThumbnail( hash ):
+                
+                self._GenerateResizedThumbnail( hash, mime )
+                
+            
+            hashes_to_thumbnails = packed_thumbnail_store.GetThumbnails( ( hash, ) )
+            
+            if hash not in hashes_to_thumbnails:
+                
+                raise HydrusExceptions.FileMissingException( 'The resized thumbnail for file ' + hash.encode( 'hex' ) + ' could not be found in its pack!' )
+                
+            
+            return hashes_to_thumbnails[ hash ]
+            
+        
+    
+    def GetPackedResizedThumbnails( self, hashes ):
+        
+        # fetches whatever is already packed in one go, for the waterfall
+        
+        with self._lock:
+            
+            prefixes_to_hashes = HydrusData.BuildKeyToListDict( ( ( 'r' + hash.encode( 'hex' )[:2], hash ) for hash in hashes ) )
+            
+            hashes_to_thumbnails = {}
+            
+            for prefix_hashes in prefixes_to_hashes.values():
+                
+                hashes_to_thumbnails.update( self._GetPackedThumbnailStore( prefix_hashes[0] ).GetThumbnails( prefix_hashes ) )
+                
+            
+            return hashes_to_thumbnails
+            
+        
+    
     def GetResizedThumbnailPath( self, hash, mime ):
         
         with self._lock:
@@ -1102,30 +1833,15 @@ class ClientFilesManager( object ):
             
             with self._lock:
                 
-                rebalance_tuple = self._GetRebalanceTuple()
+                prefixes_to_moves = self._GetRebalanceMoves()
                 
-                while rebalance_tuple is not None:
-                    
-                    if job_key.IsCancelled():
-                        
-                        break
-                        
-                    
-                    ( prefix, overweight_location, underweight_location ) = rebalance_tuple
-                    
-                    text = 'Moving \'' + prefix + '\' from ' + overweight_location + ' to ' + underweight_location
-                    
-                    HydrusData.Print( text )
-                    
-                    job_key.SetVariable( 'popup_text_1', text )
-                    
-                    # these two lines can cause a deadlock because the db sometimes calls stuff in here.
-                    self._controller.Write( 'relocate_client_files', prefix, overweight_location, underweight_location )
-                    
-                    self._Reinit()
-                    
-                    rebalance_tuple = self._GetRebalanceTuple()
-                    
+            
+            if len( prefixes_to_moves ) > 0:
+                
+                self._MigratePrefixes( job_key, prefixes_to_moves )
+                
+            
+            with self._lock:
                 
                 recover_tuple = self._GetRecoverTuple()
                 
@@ -1147,6 +1863,8 @@ class ClientFilesManager( object ):
                     recoverable_path = os.path.join( recoverable_location, prefix )
                     correct_path = os.path.join( correct_location, prefix )
                     
+                    self._ClosePackedThumbnailStores()
+                    
                     HydrusPaths.MergeTree( recoverable_path, correct_path )
                     
                     recover_tuple = self._GetRecoverTuple()
@@ -1250,6 +1968,8 @@ class ClientFilesManager( object ):
                             ClientPaths.DeletePath( thumbnail_resized_path, always_delete_fully = True )
                             
                         
+                        self._DeletePackedThumbnails( ( hash, ) )
+                        
                     
                 except:
                     
@@ -1277,6 +1997,10 @@ class ClientFilesManager( object ):
     
 class DataCache( object ):
     
+    # eviction is greedy-dual-size-frequency, so what goes first is whatever is least (hits per byte), aged by an inflation value
+    # a huge rarely-seen image will go long before a thousand small thumbnails that keep getting hit
+    # the heap is lazy--a touch pushes a new entry and stale entries are skipped when they come up
+    
     def __init__( self, controller, cache_size, timeout = 1200 ):
         
         self._controller = controller
@@ -1284,15 +2008,33 @@ class DataCache( object ):
         self._timeout = timeout
         
         self._keys_to_data = {}
+        self._keys_to_footprints = {}
+        self._keys_to_frequencies = {}
+        self._keys_to_priorities = {}
         self._keys_fifo = collections.OrderedDict()
         
+        self._priority_heap = []
+        self._heap_counter = itertools.count()
+        self._inflation = 0.0
+        
         self._total_estimated_memory_footprint = 0
         
+        self._num_hits = 0
+        self._num_misses = 0
+        self._num_evictions = 0
+        
         self._lock = threading.Lock()
         
         self._controller.sub( self, 'MaintainCache', 'memory_maintenance_pulse' )
         
     
+    def _CompactHeap( self ):
+        
+        self._priority_heap = [ ( priority, next( self._heap_counter ), key ) for ( key, priority ) in self._keys_to_priorities.items() ]
+        
+        heapq.heapify( self._priority_heap )
+        
+    
     def _Delete( self, key ):
         
         if key not in self._keys_to_data:
@@ -1300,23 +2042,37 @@ class DataCache( object ):
             return
             
         
-        deletee_data = self._keys_to_data[ key ]
-        
         del self._keys_to_data[ key ]
+        del self._keys_to_frequencies[ key ]
+        del self._keys_to_priorities[ key ]
         
-        self._RecalcMemoryUsage()
-        
-    
-    def _DeleteItem( self ):
+        if key in self._keys_fifo:
+            
+            del self._keys_fifo[ key ]
+            
         
-        ( deletee_key, last_access_time ) = self._keys_fifo.popitem( last = False )
+        self._total_estimated_memory_footprint -= self._keys_to_footprints[ key ]
         
-        self._Delete( deletee_key )
+        del self._keys_to_footprints[ key ]
         
     
-    def _RecalcMemoryUsage( self ):
+    def _DeleteItem( self ):
         
-        self._total_estimated_memory_footprint = sum( ( data.GetEstimatedMemoryFootprint() for data in self._keys_to_data.values() ) )
+        while len( self._priority_heap ) > 0:
+            
+            ( priority, counter, key ) = heapq.heappop( self._priority_heap )
+            
+            if self._keys_to_priorities.get( key, None ) == priority:
+                
+                self._inflation = priority
+                
+                self._Delete( key )
+                
+                self._num_evictions += 1
+                
+                return
+                
+            
         
     
     def _TouchKey( self, key ):
@@ -1329,14 +2085,33 @@ class DataCache( object ):
         
         self._keys_fifo[ key ] = HydrusData.GetNow()
         
+        self._keys_to_frequencies[ key ] += 1
+        
+        priority = self._inflation + float( self._keys_to_frequencies[ key ] ) / max( self._keys_to_footprints[ key ], 1 )
+        
+        self._keys_to_priorities[ key ] = priority
+        
+        heapq.heappush( self._priority_heap, ( priority, next( self._heap_counter ), key ) )
+        
+        if len( self._priority_heap ) > 2 * len( self._keys_to_priorities ) + 64:
+            
+            self._CompactHeap()
+            
+        
     
     def Clear( self ):
         
         with self._lock:
             
             self._keys_to_data = {}
+            self._keys_to_footprints = {}
+            self._keys_to_frequencies = {}
+            self._keys_to_priorities = {}
             self._keys_fifo = collections.OrderedDict()
             
+            self._priority_heap = []
+            self._inflation = 0.0
+            
             self._total_estimated_memory_footprint = 0
             
         
@@ -1347,16 +2122,20 @@ class DataCache( object ):
             
             if key not in self._keys_to_data:
                 
-                while self._total_estimated_memory_footprint > self._cache_size:
+                footprint = data.GetEstimatedMemoryFootprint()
+                
+                while len( self._keys_to_data ) > 0 and self._total_estimated_memory_footprint + footprint > self._cache_size:
                     
                     self._DeleteItem()
                     
                 
                 self._keys_to_data[ key ] = data
+                self._keys_to_footprints[ key ] = footprint
+                self._keys_to_frequencies[ key ] = 0
                 
-                self._TouchKey( key )
+                self._total_estimated_memory_footprint += footprint
                 
-                self._RecalcMemoryUsage()
+                self._TouchKey( key )
                 
             
         
@@ -1375,9 +2154,13 @@ class DataCache( object ):
             
             if key not in self._keys_to_data:
                 
+                self._num_misses += 1
+                
                 raise Exception( 'Cache error! Looking for ' + HydrusData.ToUnicode( key ) + ', but it was missing.' )
                 
             
+            self._num_hits += 1
+            
             self._TouchKey( key )
             
             return self._keys_to_data[ key ]
@@ -1390,17 +2173,29 @@ class DataCache( object ):
             
             if key in self._keys_to_data:
                 
+                self._num_hits += 1
+                
                 self._TouchKey( key )
                 
                 return self._keys_to_data[ key ]
                 
             else:
                 
+                self._num_misses += 1
+                
                 return None
                 
             
         
     
+    def GetStatistics( self ):
+        
+        with self._lock:
+            
+            return ( len( self._keys_to_data ), self._total_estimated_memory_footprint, self._cache_size, self._num_hits, self._num_misses, self._num_evictions )
+            
+        
+    
     def HasData( self, key ):
         
         with self._lock:
@@ -1425,7 +2220,7 @@ class DataCache( object ):
                     
                     if HydrusData.TimeHasPassed( last_access_time + self._timeout ):
                         
-                        self._DeleteItem()
+                        self._Delete( key )
                         
                     else:
                         
@@ -1434,6 +2229,11 @@ class DataCache( object ):
                     
                 
             
+            if len( self._priority_heap ) > 2 * len( self._keys_to_priorities ) + 64:
+                
+                self._CompactHeap()
+                
+            
         
     
 class LocalBooruCache( object ):
@@ -1682,124 +2482,47 @@ class MenuEventIdToActionCache( object ):
     
 MENU_EVENT_ID_TO_ACTION_CACHE = MenuEventIdToActionCache()
 
-class ParsingCache( object ):
+IMAGE_PREFETCH_NUM_WORKERS = 2
+
+class RenderedImageCache( object ):
     
-    def __init__( self ):
+    def __init__( self, controller ):
         
-        self._next_clean_cache_time = HydrusData.GetNow()
+        self._controller = controller
         
-        self._html_to_soups = {}
-        self._json_to_jsons = {}
+        cache_size = self._controller.options[ 'fullscreen_cache_size' ]
+        cache_timeout = self._controller.new_options.GetInteger( 'image_cache_timeout' )
         
-        self._lock = threading.Lock()
+        self._data_cache = DataCache( self._controller, cache_size, timeout = cache_timeout )
         
-    
-    def _CleanCache( self ):
+        self._lock = threading.Lock()
         
-        if HydrusData.TimeHasPassed( self._next_clean_cache_time ):
-            
-            for cache in ( self._html_to_soups, self._json_to_jsons ):
-                
-                dead_datas = set()
-                
-                for ( data, ( last_accessed, parsed_object ) ) in cache.items():
-                    
-                    if HydrusData.TimeHasPassed( last_accessed + 10 ):
-                        
-                        dead_datas.add( data )
-                        
-                    
-                
-                for dead_data in dead_datas:
-                    
-                    del cache[ dead_data ]
-                    
-                
-            
-            self._next_clean_cache_time = HydrusData.GetNow() + 5
-            
+        # prefetched images can only take up half the cache, so they never push out what the user is looking at
         
-    
-    def CleanCache( self ):
+        self._prefetch_budget = cache_size / 2
         
-        with self._lock:
-            
-            self._CleanCache()
-            
+        self._prefetch_pool = HydrusThreading.WorkerPool( self._controller, 'image prefetch', num_workers = IMAGE_PREFETCH_NUM_WORKERS )
         
-    
-    def GetJSON( self, json_text ):
+        self._prefetched_hashes_to_image_renderers = {}
         
-        with self._lock:
-            
-            now = HydrusData.GetNow()
-            
-            if json_text not in self._json_to_jsons:
-                
-                json_object = json.loads( json_text )
-                
-                self._json_to_jsons[ json_text ] = ( now, json_object )
-                
-            
-            ( last_accessed, json_object ) = self._json_to_jsons[ json_text ]
-            
-            if last_accessed != now:
-                
-                self._json_to_jsons[ json_text ] = ( now, json_object )
-                
-            
-            if len( self._json_to_jsons ) > 10:
-                
-                self._CleanCache()
-                
-            
-            return json_object
-            
+        self._num_prefetch_hits = 0
+        self._num_prefetch_late = 0
+        self._num_prefetch_misses = 0
+        self._num_prefetch_cancelled = 0
         
     
-    def GetSoup( self, html ):
+    def Clear( self ):
         
         with self._lock:
             
-            now = HydrusData.GetNow()
-            
-            if html not in self._html_to_soups:
-                
-                soup = ClientParsing.GetSoup( html )
-                
-                self._html_to_soups[ html ] = ( now, soup )
-                
-            
-            ( last_accessed, soup ) = self._html_to_soups[ html ]
-            
-            if last_accessed != now:
-                
-                self._html_to_soups[ html ] = ( now, soup )
-                
-            
-            if len( self._html_to_soups ) > 10:
+            for image_renderer in self._prefetched_hashes_to_image_renderers.values():
                 
-                self._CleanCache()
+                image_renderer.Cancel()
                 
             
-            return soup
+            self._prefetched_hashes_to_image_renderers = {}
             
         
-    
-class RenderedImageCache( object ):
-    
-    def __init__( self, controller ):
-        
-        self._controller = controller
-        
-        cache_size = self._controller.options[ 'fullscreen_cache_size' ]
-        cache_timeout = self._controller.new_options.GetInteger( 'image_cache_timeout' )
-        
-        self._data_cache = DataCache( self._controller, cache_size, timeout = cache_timeout )
-        
-    
-    def Clear( self ):
-        
         self._data_cache.Clear()
         
     
@@ -1811,6 +2534,27 @@ class RenderedImageCache( object ):
         
         result = self._data_cache.GetIfHasData( key )
         
+        with self._lock:
+            
+            was_prefetched = self._prefetched_hashes_to_image_renderers.pop( hash, None ) is not None
+            
+            if result is None:
+                
+                self._num_prefetch_misses += 1
+                
+            elif was_prefetched:
+                
+                if result.IsReady():
+                    
+                    self._num_prefetch_hits += 1
+                    
+                else:
+                    
+                    self._num_prefetch_late += 1
+                    
+                
+            
+        
         if result is None:
             
             image_renderer = ClientRendering.ImageRenderer( media )
@@ -1825,6 +2569,19 @@ class RenderedImageCache( object ):
         return image_renderer
         
     
+    def GetPrefetchStatistics( self ):
+        
+        with self._lock:
+            
+            return ( self._num_prefetch_hits, self._num_prefetch_late, self._num_prefetch_misses, self._num_prefetch_cancelled )
+            
+        
+    
+    def GetStatistics( self ):
+        
+        return self._data_cache.GetStatistics()
+        
+    
     def HasImageRenderer( self, hash ):
         
         key = hash
@@ -1832,6 +2589,75 @@ class RenderedImageCache( object ):
         return self._data_cache.HasData( key )
         
     
+    def PrefetchImageRenderers( self, medias_and_target_resolutions ):
+        
+        # the list is most wanted first
+        # whatever we were prefetching that is no longer in it, usually because the user changed direction, is cancelled
+        
+        with self._lock:
+            
+            wanted_hashes = { media.GetHash() for ( media, target_resolution ) in medias_and_target_resolutions }
+            
+            for ( hash, image_renderer ) in self._prefetched_hashes_to_image_renderers.items():
+                
+                if hash in wanted_hashes and self._data_cache.HasData( hash ):
+                    
+                    continue
+                    
+                
+                del self._prefetched_hashes_to_image_renderers[ hash ]
+                
+                if not image_renderer.IsReady():
+                    
+                    image_renderer.Cancel()
+                    
+                    self._data_cache.DeleteData( hash )
+                    
+                    self._num_prefetch_cancelled += 1
+                    
+                
+            
+            total_footprint = sum( ( image_renderer.GetEstimatedMemoryFootprint() for image_renderer in self._prefetched_hashes_to_image_renderers.values() ) )
+            
+            for ( priority, ( media, target_resolution ) ) in enumerate( medias_and_target_resolutions ):
+                
+                hash = media.GetHash()
+                
+                if hash in self._prefetched_hashes_to_image_renderers or self._data_cache.HasData( hash ):
+                    
+                    continue
+                    
+                
+                image_renderer = ClientRendering.ImageRenderer( media, target_resolution = target_resolution, initialise = False )
+                
+                footprint = image_renderer.GetEstimatedMemoryFootprint()
+                
+                if total_footprint + footprint > self._prefetch_budget:
+                    
+                    break
+                    
+                
+                image_renderer.Prefetch( self._prefetch_pool, priority )
+                
+                self._data_cache.AddData( hash, image_renderer )
+                
+                self._prefetched_hashes_to_image_renderers[ hash ] = image_renderer
+                
+                total_footprint += footprint
+                
+            
+        
+    
+WATERFALL_BATCH_SIZE = 16
+WATERFALL_MAX_NUM_WORKERS = 4
+WATERFALL_PACKED_PREFETCH_SIZE = 64
+
+# what the user can see goes first, then the screens either side, then the rest, and pages in the undo list go last
+WATERFALL_TIER_VISIBLE = 0
+WATERFALL_TIER_NEARBY = 1
+WATERFALL_TIER_REST = 2
+WATERFALL_TIER_CLOSED = 3
+
 class ThumbnailCache( object ):
     
     def __init__( self, controller ):
@@ -1846,10 +2672,19 @@ class ThumbnailCache( object ):
         self._lock = threading.Lock()
         
         self._waterfall_queue_quick = set()
-        self._waterfall_queue_random = []
+        self._waterfall_queue = []
+        
+        self._viewport_page_key = None
+        self._viewport_medias_to_tiers = {}
         
         self._waterfall_event = threading.Event()
         
+        num_workers = max( 1, min( WATERFALL_MAX_NUM_WORKERS, psutil.cpu_count() or 1 ) )
+        
+        self._waterfall_pool = HydrusThreading.WorkerPool( self._controller, 'thumbnail waterfall', num_workers = num_workers )
+        
+        self._prefetched_packed_thumbnails = {}
+        
         self._special_thumbs = {}
         
         self.Clear()
@@ -1860,6 +2695,18 @@ class ThumbnailCache( object ):
         self._controller.sub( self, 'ClearThumbnails', 'clear_thumbnails' )
         
     
+    def _GenerateHydrusBitmap( self, mime, path, thumbnail ):
+        
+        if thumbnail is None:
+            
+            return ClientRendering.GenerateHydrusBitmap( path, mime )
+            
+        else:
+            
+            return ClientRendering.GenerateHydrusBitmapFromBytes( thumbnail, mime )
+            
+        
+    
     def _GetResizedHydrusBitmapFromHardDrive( self, display_media ):
         
         thumbnail_dimensions = self._controller.options[ 'thumbnail_dimensions' ]
@@ -1873,95 +2720,226 @@ class ThumbnailCache( object ):
             full_size = False
             
         
+        use_packed = self._UsePackedThumbnails()
+        
         hash = display_media.GetHash()
         mime = display_media.GetMime()
         
         locations_manager = display_media.GetLocationsManager()
         
+        path = None
+        thumbnail = None
+        
         try:
             
             if full_size:
                 
                 path = self._controller.client_files_manager.GetFullSizeThumbnailPath( hash, mime )
                 
+            elif use_packed:
+                
+                with self._lock:
+                    
+                    thumbnail = self._prefetched_packed_thumbnails.pop( hash, None )
+                    
+                
+                if thumbnail is None:
+                    
+                    thumbnail = self._controller.client_files_manager.GetPackedResizedThumbnail( hash, mime )
+                    
+                
             else:
                 
                 path = self._controller.client_files_manager.GetResizedThumbnailPath( hash, mime )
                 
             
-        except HydrusExceptions.FileMissingException as e:
+        except HydrusExceptions.FileMissingException as e:
+            
+            if locations_manager.IsLocal():
+                
+                HydrusData.ShowException( e )
+                
+            
+            return self._special_thumbs[ 'hydrus' ]
+            
+        
+        mime = display_media.GetMime()
+        
+        try:
+            
+            hydrus_bitmap = self._GenerateHydrusBitmap( mime, path, thumbnail )
+            
+        except Exception as e:
+            
+            try:
+                
+                self._controller.client_files_manager.RegenerateResizedThumbnail( hash, mime )
+                
+                try:
+                    
+                    if use_packed:
+                        
+                        thumbnail = self._controller.client_files_manager.GetPackedResizedThumbnail( hash, mime )
+                        
+                    
+                    hydrus_bitmap = self._GenerateHydrusBitmap( mime, path, thumbnail )
+                    
+                except Exception as e:
+                    
+                    HydrusData.ShowException( e )
+                    
+                    raise HydrusExceptions.FileMissingException( 'The thumbnail for file ' + hash.encode( 'hex' ) + ' was broken. It was regenerated, but the new file would not render for the above reason. Please inform the hydrus developer what has happened.' )
+                    
+                
+            except Exception as e:
+                
+                HydrusData.ShowException( e )
+                
+                return self._special_thumbs[ 'hydrus' ]
+                
+            
+        
+        ( media_x, media_y ) = display_media.GetResolution()
+        ( actual_x, actual_y ) = hydrus_bitmap.GetSize()
+        ( desired_x, desired_y ) = self._controller.options[ 'thumbnail_dimensions' ]
+        
+        too_large = actual_x > desired_x or actual_y > desired_y
+        
+        small_original_image = actual_x == media_x and actual_y == media_y
+        
+        too_small = actual_x < desired_x and actual_y < desired_y
+        
+        if too_large or ( too_small and not small_original_image ):
+            
+            self._controller.client_files_manager.RegenerateResizedThumbnail( hash, mime )
+            
+            if use_packed:
+                
+                thumbnail = self._controller.client_files_manager.GetPackedResizedThumbnail( hash, mime )
+                
+            
+            hydrus_bitmap = self._GenerateHydrusBitmap( mime, path, thumbnail )
+            
+        
+        return hydrus_bitmap
+        
+    
+    def _PrefetchPackedThumbnails( self ):
+        
+        # the waterfall is about to do the end of its queue, so let's read all those thumbs from their packs in one go
+        
+        with self._lock:
+            
+            if len( self._waterfall_queue ) == 0:
+                
+                return
+                
+            
+            upcoming = self._waterfall_queue[ - WATERFALL_PACKED_PREFETCH_SIZE : ]
+            
+        
+        hashes = []
+        
+        for ( page_key, media ) in upcoming:
+            
+            try:
+                
+                display_media = media.GetDisplayMedia()
+                
+            except:
+                
+                continue
+                
+            
+            if display_media.GetMime() in HC.MIMES_WITH_THUMBNAILS:
+                
+                hash = display_media.GetHash()
+                
+                if not self._data_cache.HasData( hash ):
+                    
+                    hashes.append( hash )
+                    
+                
+            
+        
+        if len( hashes ) == 0:
+            
+            return
+            
+        
+        with self._lock:
             
-            if locations_manager.IsLocal():
+            if hashes[-1] in self._prefetched_packed_thumbnails:
                 
-                HydrusData.ShowException( e )
+                return
                 
             
-            return self._special_thumbs[ 'hydrus' ]
-            
         
-        mime = display_media.GetMime()
+        prefetched_packed_thumbnails = self._controller.client_files_manager.GetPackedResizedThumbnails( hashes )
         
-        try:
+        with self._lock:
             
-            hydrus_bitmap = ClientRendering.GenerateHydrusBitmap( path, mime )
+            self._prefetched_packed_thumbnails = prefetched_packed_thumbnails
             
-        except Exception as e:
+        
+    
+    def _RecalcWaterfallQueue( self ):
+        
+        page_keys = { page_key for ( page_key, media ) in self._waterfall_queue_quick }
+        
+        dead_page_keys = { page_key for page_key in page_keys if not self._controller.PageAlive( page_key ) }
+        
+        if len( dead_page_keys ) > 0:
             
-            try:
-                
-                self._controller.client_files_manager.RegenerateResizedThumbnail( hash, mime )
-                
-                try:
-                    
-                    hydrus_bitmap = ClientRendering.GenerateHydrusBitmap( path, mime )
-                    
-                except Exception as e:
-                    
-                    HydrusData.ShowException( e )
-                    
-                    raise HydrusExceptions.FileMissingException( 'The thumbnail for file ' + hash.encode( 'hex' ) + ' was broken. It was regenerated, but the new file would not render for the above reason. Please inform the hydrus developer what has happened.' )
-                    
-                
-            except Exception as e:
-                
-                HydrusData.ShowException( e )
+            self._waterfall_queue_quick = { ( page_key, media ) for ( page_key, media ) in self._waterfall_queue_quick if page_key not in dead_page_keys }
+            
+            if self._viewport_page_key in dead_page_keys:
                 
-                return self._special_thumbs[ 'hydrus' ]
+                self._viewport_page_key = None
+                self._viewport_medias_to_tiers = {}
                 
             
         
-        ( media_x, media_y ) = display_media.GetResolution()
-        ( actual_x, actual_y ) = hydrus_bitmap.GetSize()
-        ( desired_x, desired_y ) = self._controller.options[ 'thumbnail_dimensions' ]
-        
-        too_large = actual_x > desired_x or actual_y > desired_y
-        
-        small_original_image = actual_x == media_x and actual_y == media_y
+        closed_page_keys = { page_key for page_key in page_keys if self._controller.PageClosedButNotDestroyed( page_key ) }
         
-        too_small = actual_x < desired_x and actual_y < desired_y
+        # the queue is popped from the end, so the most important go at the end
+        # within a tier, we sort by the hash since this is both breddy random and more likely to access faster on a well defragged hard drive!
         
-        if too_large or ( too_small and not small_original_image ):
+        def sort_key( ( page_key, media ) ):
             
-            self._controller.client_files_manager.RegenerateResizedThumbnail( hash, mime )
+            if page_key in closed_page_keys:
+                
+                tier = WATERFALL_TIER_CLOSED
+                
+            elif page_key == self._viewport_page_key:
+                
+                tier = self._viewport_medias_to_tiers.get( media, WATERFALL_TIER_REST )
+                
+            else:
+                
+                tier = WATERFALL_TIER_REST
+                
             
-            hydrus_bitmap = ClientRendering.GenerateHydrusBitmap( path, mime )
+            return ( - tier, media.GetDisplayMedia().GetHash() )
             
         
-        return hydrus_bitmap
+        self._waterfall_queue = list( self._waterfall_queue_quick )
+        
+        self._waterfall_queue.sort( key = sort_key )
         
     
-    def _RecalcWaterfallQueueRandom( self ):
+    def _UsePackedThumbnails( self ):
+        
+        thumbnail_dimensions = self._controller.options[ 'thumbnail_dimensions' ]
         
-        # here we sort by the hash since this is both breddy random and more likely to access faster on a well defragged hard drive!
+        # full size thumbnails are never packed
         
-        def sort_by_hash_key( ( page_key, media ) ):
+        if tuple( thumbnail_dimensions ) == HC.UNSCALED_THUMBNAIL_DIMENSIONS:
             
-            return media.GetDisplayMedia().GetHash()
+            return False
             
         
-        self._waterfall_queue_random = list( self._waterfall_queue_quick )
-        
-        self._waterfall_queue_random.sort( key = sort_by_hash_key )
+        return self._controller.new_options.GetBoolean( 'pack_resized_thumbnails' )
         
     
     def CancelWaterfall( self, page_key, medias ):
@@ -1970,7 +2948,7 @@ class ThumbnailCache( object ):
             
             self._waterfall_queue_quick.difference_update( ( ( page_key, media ) for media in medias ) )
             
-            self._RecalcWaterfallQueueRandom()
+            self._RecalcWaterfallQueue()
             
         
     
@@ -1980,6 +2958,8 @@ class ThumbnailCache( object ):
             
             self._data_cache.Clear()
             
+            self._prefetched_packed_thumbnails = {}
+            
             self._special_thumbs = {}
             
             names = [ 'hydrus', 'pdf', 'audio', 'video', 'zip' ]
@@ -2021,6 +3001,8 @@ class ThumbnailCache( object ):
                 
                 self._data_cache.DeleteData( hash )
                 
+                self._prefetched_packed_thumbnails.pop( hash, None )
+                
             
         
     
@@ -2028,7 +3010,7 @@ class ThumbnailCache( object ):
         
         with self._lock:
             
-            return len( self._waterfall_queue_random ) > 0
+            return len( self._waterfall_queue ) > 0
             
         
     
@@ -2101,6 +3083,11 @@ class ThumbnailCache( object ):
             
         
     
+    def GetStatistics( self ):
+        
+        return self._data_cache.GetStatistics()
+        
+    
     def HasThumbnailCached( self, media ):
         
         display_media = media.GetDisplayMedia()
@@ -2119,13 +3106,32 @@ class ThumbnailCache( object ):
             
         
     
+    def SetWaterfallViewport( self, page_key, visible_medias, nearby_medias ):
+        
+        # the thumbnail grid on screen tells us what it is showing, so we can do those thumbs first
+        
+        with self._lock:
+            
+            self._viewport_page_key = page_key
+            
+            self._viewport_medias_to_tiers = { media : WATERFALL_TIER_NEARBY for media in nearby_medias }
+            
+            self._viewport_medias_to_tiers.update( ( ( media, WATERFALL_TIER_VISIBLE ) for media in visible_medias ) )
+            
+            if len( self._waterfall_queue_quick ) > 0:
+                
+                self._RecalcWaterfallQueue()
+                
+            
+        
+    
     def Waterfall( self, page_key, medias ):
         
         with self._lock:
             
             self._waterfall_queue_quick.update( ( ( page_key, media ) for media in medias ) )
             
-            self._RecalcWaterfallQueueRandom()
+            self._RecalcWaterfallQueue()
             
         
         self._waterfall_event.set()
@@ -2139,7 +3145,7 @@ class ThumbnailCache( object ):
             
             with self._lock:
                 
-                do_wait = len( self._waterfall_queue_random ) == 0
+                do_wait = len( self._waterfall_queue ) == 0
                 
             
             if do_wait:
@@ -2151,30 +3157,51 @@ class ThumbnailCache( object ):
                 last_paused = HydrusData.GetNowPrecise()
                 
             
-            start_time = HydrusData.GetNowPrecise()
-            stop_time = start_time + 0.005 # a bit of a typical frame
+            if self._UsePackedThumbnails():
+                
+                self._PrefetchPackedThumbnails()
+                
             
-            page_keys_to_rendered_medias = collections.defaultdict( list )
+            batch = []
+            
+            with self._lock:
+                
+                while len( self._waterfall_queue ) > 0 and len( batch ) < WATERFALL_BATCH_SIZE:
+                    
+                    result = self._waterfall_queue.pop()
+                    
+                    self._waterfall_queue_quick.discard( result )
+                    
+                    batch.append( result )
+                    
+                
             
-            while not HydrusData.TimeHasPassedPrecise( stop_time ):
+            # the decoding and resizing is mostly opencv and pil, which let go of the GIL, so we spread it over a few threads
+            
+            jobs = []
+            
+            try:
                 
-                with self._lock:
+                for ( page_key, media ) in batch:
                     
-                    if len( self._waterfall_queue_random ) == 0:
+                    if self._controller.PageAlive( page_key ):
                         
-                        break
+                        jobs.append( ( page_key, media, self._waterfall_pool.Submit( self.GetThumbnail, media ) ) ) # to load it
                         
                     
-                    result = self._waterfall_queue_random.pop()
-                    
-                    self._waterfall_queue_quick.discard( result )
-                    
                 
-                ( page_key, media ) = result
+            except HydrusExceptions.ShutdownException:
+                
+                return
+                
+            
+            page_keys_to_rendered_medias = collections.defaultdict( list )
+            
+            for ( page_key, media, job ) in jobs:
                 
                 try:
                     
-                    self.GetThumbnail( media ) # to load it
+                    job.GetResult()
                     
                     page_keys_to_rendered_medias[ page_key ].append( media )
                     
@@ -2564,123 +3591,325 @@ class TagParentsManager( object ):
         
         # now collapse current and pending
         
-        service_keys_to_pairs_flat = HydrusData.default_dict_set()
+        service_keys_to_pairs_flat = HydrusData.default_dict_set()
+        
+        for ( service_key, statuses_to_pairs ) in collapsed_service_keys_to_statuses_to_pairs.items():
+            
+            pairs_flat = statuses_to_pairs[ HC.CONTENT_STATUS_CURRENT ].union( statuses_to_pairs[ HC.CONTENT_STATUS_PENDING ] )
+            
+            service_keys_to_pairs_flat[ service_key ] = pairs_flat
+            
+        
+        # now create the combined tag service
+        
+        combined_pairs_flat = set()
+        
+        for pairs_flat in service_keys_to_pairs_flat.values():
+            
+            combined_pairs_flat.update( pairs_flat )
+            
+        
+        service_keys_to_pairs_flat[ CC.COMBINED_TAG_SERVICE_KEY ] = combined_pairs_flat
+        
+        #
+        
+        service_keys_to_simple_children_to_parents = BuildServiceKeysToSimpleChildrenToParents( service_keys_to_pairs_flat )
+        
+        self._service_keys_to_children_to_parents = BuildServiceKeysToChildrenToParents( service_keys_to_simple_children_to_parents )
+        
+    
+    def ExpandPredicates( self, service_key, predicates ):
+        
+        if self._controller.new_options.GetBoolean( 'apply_all_parents_to_all_services' ):
+            
+            service_key = CC.COMBINED_TAG_SERVICE_KEY
+            
+        
+        results = []
+        
+        with self._lock:
+            
+            for predicate in predicates:
+                
+                results.append( predicate )
+                
+                if predicate.GetType() == HC.PREDICATE_TYPE_TAG:
+                    
+                    tag = predicate.GetValue()
+                    
+                    parents = self._service_keys_to_children_to_parents[ service_key ][ tag ]
+                    
+                    for parent in parents:
+                        
+                        parent_predicate = ClientSearch.Predicate( HC.PREDICATE_TYPE_PARENT, parent )
+                        
+                        results.append( parent_predicate )
+                        
+                    
+                
+            
+            return results
+            
+        
+    
+    def ExpandTags( self, service_key, tags ):
+        
+        if self._controller.new_options.GetBoolean( 'apply_all_parents_to_all_services' ):
+            
+            service_key = CC.COMBINED_TAG_SERVICE_KEY
+            
+        
+        with self._lock:
+            
+            tags_results = set( tags )
+            
+            for tag in tags:
+                
+                tags_results.update( self._service_keys_to_children_to_parents[ service_key ][ tag ] )
+                
+            
+            return tags_results
+            
+        
+    
+    def GetParents( self, service_key, tag ):
+        
+        if self._controller.new_options.GetBoolean( 'apply_all_parents_to_all_services' ):
+            
+            service_key = CC.COMBINED_TAG_SERVICE_KEY
+            
+        
+        with self._lock:
+            
+            return self._service_keys_to_children_to_parents[ service_key ][ tag ]
+            
+        
+    
+    def NotifyNewParents( self ):
+        
+        with self._lock:
+            
+            self._dirty = True
+            
+            self._controller.CallLater( 1.0, self.RefreshParentsIfDirty )
+            
+        
+    
+    def RefreshParentsIfDirty( self ):
+        
+        with self._lock:
+            
+            if self._dirty:
+                
+                self._RefreshParents()
+                
+                self._dirty = False
+                
+            
+        
+    
+class TagPostingListCache( object ):
+    
+    # holds the hash_ids of popular tags, as ( file_service_id, tag_service_id, tag_id, status ) -> HashIdBitmap
+    # the db updates these in place as mappings and files change, so a busy tag does not have to be refetched after every edit
+    
+    def __init__( self, cache_size ):
+        
+        self._cache_size = cache_size
+        
+        self._keys_to_posting_lists = {}
+        self._keys_fifo = collections.OrderedDict()
+        self._domains_to_keys = collections.defaultdict( set )
+        
+        self._total_estimated_memory_footprint = 0
+        
+        self._lock = threading.Lock()
+        
+    
+    def _Delete( self, key ):
+        
+        if key not in self._keys_to_posting_lists:
+            
+            return
+            
+        
+        posting_list = self._keys_to_posting_lists[ key ]
+        
+        del self._keys_to_posting_lists[ key ]
+        del self._keys_fifo[ key ]
+        
+        ( file_service_id, tag_service_id, tag_id, status ) = key
+        
+        domain = ( file_service_id, tag_service_id )
+        
+        self._domains_to_keys[ domain ].discard( key )
+        
+        if len( self._domains_to_keys[ domain ] ) == 0:
+            
+            del self._domains_to_keys[ domain ]
+            
+        
+        self._total_estimated_memory_footprint -= posting_list.GetMemoryUsage()
+        
+    
+    def _Edit( self, key, edit_callable ):
+        
+        if key not in self._keys_to_posting_lists:
+            
+            return
+            
+        
+        posting_list = self._keys_to_posting_lists[ key ]
+        
+        self._total_estimated_memory_footprint -= posting_list.GetMemoryUsage()
+        
+        edit_callable( posting_list )
+        
+        self._total_estimated_memory_footprint += posting_list.GetMemoryUsage()
+        
+    
+    def _ReduceToSize( self ):
         
-        for ( service_key, statuses_to_pairs ) in collapsed_service_keys_to_statuses_to_pairs.items():
+        while self._total_estimated_memory_footprint > self._cache_size and len( self._keys_fifo ) > 0:
             
-            pairs_flat = statuses_to_pairs[ HC.CONTENT_STATUS_CURRENT ].union( statuses_to_pairs[ HC.CONTENT_STATUS_PENDING ] )
+            ( deletee_key, last_access_time ) = next( self._keys_fifo.iteritems() )
             
-            service_keys_to_pairs_flat[ service_key ] = pairs_flat
+            self._Delete( deletee_key )
             
         
-        # now create the combined tag service
-        
-        combined_pairs_flat = set()
+    
+    def _TouchKey( self, key ):
         
-        for pairs_flat in service_keys_to_pairs_flat.values():
+        if key in self._keys_fifo:
             
-            combined_pairs_flat.update( pairs_flat )
+            del self._keys_fifo[ key ]
             
         
-        service_keys_to_pairs_flat[ CC.COMBINED_TAG_SERVICE_KEY ] = combined_pairs_flat
-        
-        #
-        
-        service_keys_to_simple_children_to_parents = BuildServiceKeysToSimpleChildrenToParents( service_keys_to_pairs_flat )
-        
-        self._service_keys_to_children_to_parents = BuildServiceKeysToChildrenToParents( service_keys_to_simple_children_to_parents )
+        self._keys_fifo[ key ] = HydrusData.GetNow()
         
     
-    def ExpandPredicates( self, service_key, predicates ):
+    def AddHashIds( self, file_service_id, tag_service_id, tag_id, status, hash_ids ):
         
-        if self._controller.new_options.GetBoolean( 'apply_all_parents_to_all_services' ):
+        with self._lock:
             
-            service_key = CC.COMBINED_TAG_SERVICE_KEY
+            self._Edit( ( file_service_id, tag_service_id, tag_id, status ), lambda posting_list: posting_list.update( hash_ids ) )
+            
+            self._ReduceToSize()
             
         
-        results = []
+    
+    def AddPostingList( self, file_service_id, tag_service_id, tag_id, status, posting_list ):
         
         with self._lock:
             
-            for predicate in predicates:
-                
-                results.append( predicate )
+            if posting_list.GetMemoryUsage() > self._cache_size:
                 
-                if predicate.GetType() == HC.PREDICATE_TYPE_TAG:
-                    
-                    tag = predicate.GetValue()
-                    
-                    parents = self._service_keys_to_children_to_parents[ service_key ][ tag ]
-                    
-                    for parent in parents:
-                        
-                        parent_predicate = ClientSearch.Predicate( HC.PREDICATE_TYPE_PARENT, parent )
-                        
-                        results.append( parent_predicate )
-                        
-                    
+                return
                 
             
-            return results
+            key = ( file_service_id, tag_service_id, tag_id, status )
+            
+            self._Delete( key )
+            
+            self._keys_to_posting_lists[ key ] = posting_list
+            self._domains_to_keys[ ( file_service_id, tag_service_id ) ].add( key )
+            
+            self._total_estimated_memory_footprint += posting_list.GetMemoryUsage()
+            
+            self._TouchKey( key )
+            
+            self._ReduceToSize()
             
         
     
-    def ExpandTags( self, service_key, tags ):
+    def Clear( self ):
         
-        if self._controller.new_options.GetBoolean( 'apply_all_parents_to_all_services' ):
+        with self._lock:
             
-            service_key = CC.COMBINED_TAG_SERVICE_KEY
+            self._keys_to_posting_lists = {}
+            self._keys_fifo = collections.OrderedDict()
+            self._domains_to_keys = collections.defaultdict( set )
             
+            self._total_estimated_memory_footprint = 0
+            
+        
+    
+    def DeleteDomain( self, file_service_id, tag_service_id ):
         
         with self._lock:
             
-            tags_results = set( tags )
-            
-            for tag in tags:
+            for key in list( self._domains_to_keys.get( ( file_service_id, tag_service_id ), [] ) ):
                 
-                tags_results.update( self._service_keys_to_children_to_parents[ service_key ][ tag ] )
+                self._Delete( key )
                 
             
-            return tags_results
-            
         
     
-    def GetParents( self, service_key, tag ):
+    def DeleteHashIds( self, file_service_id, tag_service_id, tag_id, status, hash_ids ):
         
-        if self._controller.new_options.GetBoolean( 'apply_all_parents_to_all_services' ):
+        with self._lock:
             
-            service_key = CC.COMBINED_TAG_SERVICE_KEY
+            self._Edit( ( file_service_id, tag_service_id, tag_id, status ), lambda posting_list: posting_list.difference_update( hash_ids ) )
             
         
+    
+    def DeleteHashIdsFromDomain( self, file_service_id, tag_service_id, hash_ids ):
+        
         with self._lock:
             
-            return self._service_keys_to_children_to_parents[ service_key ][ tag ]
+            keys = list( self._domains_to_keys.get( ( file_service_id, tag_service_id ), [] ) )
+            
+            if len( keys ) == 0:
+                
+                return
+                
+            
+            hash_ids = ClientBitmaps.HashIdBitmap( hash_ids )
+            
+            for key in keys:
+                
+                self._Edit( key, lambda posting_list: posting_list.difference_update( hash_ids ) )
+                
             
         
     
-    def NotifyNewParents( self ):
+    def GetCacheSize( self ):
         
         with self._lock:
             
-            self._dirty = True
-            
-            self._controller.CallLater( 1.0, self.RefreshParentsIfDirty )
+            return self._cache_size
             
         
     
-    def RefreshParentsIfDirty( self ):
+    def GetPostingList( self, file_service_id, tag_service_id, tag_id, status ):
         
         with self._lock:
             
-            if self._dirty:
+            key = ( file_service_id, tag_service_id, tag_id, status )
+            
+            if key in self._keys_to_posting_lists:
                 
-                self._RefreshParents()
+                self._TouchKey( key )
                 
-                self._dirty = False
+                return self._keys_to_posting_lists[ key ]
+                
+            else:
+                
+                return None
                 
             
         
     
+    def SetCacheSize( self, cache_size ):
+        
+        with self._lock:
+            
+            self._cache_size = cache_size
+            
+            self._ReduceToSize()
+            
+        
+    
 class TagSiblingsManager( object ):
     
     def __init__( self, controller ):
@@ -3297,3 +4526,238 @@ class UndoManager( object ):
             
         
     
+class VideoKeyframeIndexCache( object ):
+    
+    # finding the keyframes is a pass over the whole file, so we do it once per file and keep the result on disk
+    
+    def __init__( self, controller ):
+        
+        self._controller = controller
+        
+        self._dir = os.path.join( self._controller.GetDBDir(), 'client_video_keyframes' )
+        
+        self._data_cache = DataCache( self._controller, 4 * 1048576 )
+        
+        # two canvases can open the same video at once, so the second waits for the first's index rather than running ffmpeg again
+        
+        self._lock = threading.Lock()
+        self._indexing_done = threading.Condition( self._lock )
+        
+        self._hashes_being_indexed = set()
+        
+        self._controller.sub( self, 'DeleteKeyframeIndices', 'delete_video_keyframe_indices' )
+        
+    
+    def _GenerateKeyframeIndex( self, media ):
+        
+        hash = media.GetHash()
+        
+        timestamps = self._ReadTimestamps( hash )
+        
+        if timestamps is None:
+            
+            path = self._controller.client_files_manager.GetFilePath( hash, media.GetMime() )
+            
+            timestamps = HydrusVideoHandling.GetFFMPEGKeyframeTimestamps( path )
+            
+            # an empty result means ffmpeg failed or could not be given the path, so we do not save it, and we try again next session
+            
+            if len( timestamps ) > 0:
+                
+                self._WriteTimestamps( hash, timestamps )
+                
+            
+        
+        duration = media.GetDuration()
+        num_frames = media.GetNumFrames()
+        
+        if duration is None or duration == 0 or num_frames is None or num_frames == 0:
+            
+            fps = 24.0
+            
+        else:
+            
+            fps = float( num_frames ) / ( float( duration ) / 1000.0 )
+            
+        
+        keyframe_index = HydrusVideoHandling.VideoKeyframeIndex( timestamps, fps )
+        
+        self._data_cache.AddData( hash, keyframe_index )
+        
+        return keyframe_index
+        
+    
+    def _GetIndexPaths( self ):
+        
+        hashes_to_paths = {}
+        junk_paths = []
+        
+        if not os.path.exists( self._dir ):
+            
+            return ( hashes_to_paths, junk_paths )
+            
+        
+        for filename in os.listdir( self._dir ):
+            
+            path = os.path.join( self._dir, filename )
+            
+            ( hash_encoded, ext ) = os.path.splitext( filename )
+            
+            try:
+                
+                hash = hash_encoded.decode( 'hex' )
+                
+            except TypeError:
+                
+                hash = None
+                
+            
+            if hash is None or len( hash ) != 32 or ext != '.keyframes':
+                
+                junk_paths.append( path )
+                
+            else:
+                
+                hashes_to_paths[ hash ] = path
+                
+            
+        
+        return ( hashes_to_paths, junk_paths )
+        
+    
+    def _GetPath( self, hash ):
+        
+        return os.path.join( self._dir, hash.encode( 'hex' ) + '.keyframes' )
+        
+    
+    def _ReadTimestamps( self, hash ):
+        
+        path = self._GetPath( hash )
+        
+        if not os.path.exists( path ):
+            
+            return None
+            
+        
+        try:
+            
+            with open( path, 'rb' ) as f:
+                
+                data = f.read()
+                
+            
+            if len( data ) < 8:
+                
+                # an empty index was saved by an older version after ffmpeg failed, so try again
+                
+                return None
+                
+            
+            return list( struct.unpack( '>' + str( len( data ) // 8 ) + 'd', data[ : len( data ) // 8 * 8 ] ) )
+            
+        except Exception as e:
+            
+            return None
+            
+        
+    
+    def _WriteTimestamps( self, hash, timestamps ):
+        
+        HydrusPaths.MakeSureDirectoryExists( self._dir )
+        
+        path = self._GetPath( hash )
+        
+        with open( path, 'wb' ) as f:
+            
+            f.write( struct.pack( '>' + str( len( timestamps ) ) + 'd', *timestamps ) )
+            
+        
+    
+    def ClearOrphans( self ):
+        
+        ( hashes_to_paths, junk_paths ) = self._GetIndexPaths()
+        
+        if len( hashes_to_paths ) > 0:
+            
+            orphan_hashes = self._controller.Read( 'filter_orphans', 'file', hashes_to_paths.keys() )
+            
+        else:
+            
+            orphan_hashes = []
+            
+        
+        for hash in orphan_hashes:
+            
+            self._data_cache.DeleteData( hash )
+            
+        
+        orphan_paths = junk_paths + [ hashes_to_paths[ hash ] for hash in orphan_hashes ]
+        
+        for path in orphan_paths:
+            
+            HydrusData.Print( 'Deleting the orphan ' + path )
+            
+            HydrusPaths.DeletePath( path )
+            
+        
+        return len( orphan_paths )
+        
+    
+    def DeleteKeyframeIndices( self, hashes ):
+        
+        for hash in hashes:
+            
+            self._data_cache.DeleteData( hash )
+            
+            path = self._GetPath( hash )
+            
+            if os.path.exists( path ):
+                
+                HydrusPaths.DeletePath( path )
+                
+            
+        
+    
+    def GetKeyframeIndex( self, media ):
+        
+        # this can take a few seconds the first time for a long video, so call it off the gui thread
+        
+        hash = media.GetHash()
+        
+        with self._lock:
+            
+            while hash in self._hashes_being_indexed:
+                
+                if HG.model_shutdown:
+                    
+                    raise HydrusExceptions.ShutdownException()
+                    
+                
+                self._indexing_done.wait( 1.0 )
+                
+            
+            result = self._data_cache.GetIfHasData( hash )
+            
+            if result is not None:
+                
+                return result
+                
+            
+            self._hashes_being_indexed.add( hash )
+            
+        
+        try:
+            
+            return self._GenerateKeyframeIndex( media )
+            
+        finally:
+            
+            with self._lock:
+                
+                self._hashes_being_indexed.discard( hash )
+                
+                self._indexing_done.notify_all()
+                
+            
+        
+    
@@ -379,6 +379,50 @@ class Controller( HydrusController.HydrusController ):
         return False
         
     
+    def DebugShowCacheStatistics( self ):
+        
+        HydrusData.ShowText( 'cache statistics:' )
+        
+        lines = []
+        
+        for name in ( 'images', 'thumbnail' ):
+            
+            ( num_items, total_footprint, cache_size, num_hits, num_misses, num_evictions ) = self._caches[ name ].GetStatistics()
+            
+            num_requests = num_hits + num_misses
+            
+            if num_requests == 0:
+                
+                pretty_hit_rate = 'no requests yet'
+                
+            else:
+                
+                pretty_hit_rate = HydrusData.ConvertFloatToPercentage( float( num_hits ) / num_requests ) + ' hit rate'
+                
+            
+            lines.append( name + ': ' + HydrusData.ToHumanInt( num_items ) + ' items, ' + HydrusData.ConvertValueRangeToBytes( total_footprint, cache_size ) + ', ' + pretty_hit_rate + ' (' + HydrusData.ToHumanInt( num_hits ) + ' hits, ' + HydrusData.ToHumanInt( num_misses ) + ' misses), ' + HydrusData.ToHumanInt( num_evictions ) + ' evictions' )
+            
+        
+        # a late prefetch was still decoding when the user got to it
+        
+        ( num_prefetch_hits, num_prefetch_late, num_prefetch_misses, num_prefetch_cancelled ) = self._caches[ 'images' ].GetPrefetchStatistics()
+        
+        num_prefetch_requests = num_prefetch_hits + num_prefetch_late + num_prefetch_misses
+        
+        if num_prefetch_requests == 0:
+            
+            pretty_prefetch_hit_rate = 'no requests yet'
+            
+        else:
+            
+            pretty_prefetch_hit_rate = HydrusData.ConvertFloatToPercentage( float( num_prefetch_hits ) / num_prefetch_requests ) + ' hit rate'
+            
+        
+        lines.append( 'image prefetch: ' + pretty_prefetch_hit_rate + ' (' + HydrusData.ToHumanInt( num_prefetch_hits ) + ' hits, ' + HydrusData.ToHumanInt( num_prefetch_late ) + ' late, ' + HydrusData.ToHumanInt( num_prefetch_misses ) + ' misses), ' + HydrusData.ToHumanInt( num_prefetch_cancelled ) + ' cancelled' )
+        
+        HydrusData.ShowText( os.linesep.join( lines ) )
+        
+    
     def DoIdleShutdownWork( self ):
         
         stop_time = HydrusData.GetNow() + ( self.options[ 'idle_shutdown_max_minutes' ] * 60 )
@@ -580,12 +624,12 @@ class Controller( HydrusController.HydrusController ):
         
         self.InitClientFilesManager()
         
+        self.file_processing_pool = HydrusThreading.WorkerPool( self, 'file processing' )
+        
         #
         
         self.pub( 'splash_set_status_subtext', u'network' )
         
-        self.parsing_cache = ClientCaches.ParsingCache()
-        
         bandwidth_manager = self.Read( 'serialisable', HydrusSerialisable.SERIALISABLE_TYPE_NETWORK_BANDWIDTH_MANAGER )
         
         if bandwidth_manager is None:
@@ -654,6 +698,7 @@ class Controller( HydrusController.HydrusController ):
             
             self._caches[ 'images' ] = ClientCaches.RenderedImageCache( self )
             self._caches[ 'thumbnail' ] = ClientCaches.ThumbnailCache( self )
+            self._caches[ 'video_keyframes' ] = ClientCaches.VideoKeyframeIndexCache( self )
             
             CC.GlobalBMPs.STATICInitialise()
             
@@ -834,13 +879,6 @@ class Controller( HydrusController.HydrusController ):
             
         
     
-    def MaintainMemoryFast( self ):
-        
-        HydrusController.HydrusController.MaintainMemoryFast( self )
-        
-        self.parsing_cache.CleanCache()
-        
-    
     def MaintainMemorySlow( self ):
         
         HydrusController.HydrusController.MaintainMemorySlow( self )
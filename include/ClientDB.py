@@ -1,3 +1,5 @@
+import ClientBitmaps
+import ClientCaches
 import ClientData
 import ClientDefaults
 import ClientGUIShortcuts
@@ -11,6 +13,7 @@ import ClientOptions
 import ClientRatings
 import ClientSearch
 import ClientServices
+import ClientSimilarFiles
 import ClientThreading
 import collections
 import gc
@@ -37,6 +40,7 @@ import psutil
 import random
 import re
 import sqlite3
+import threading
 import time
 import traceback
 import wx
@@ -83,6 +87,30 @@ def GenerateMappingsTableNames( service_id ):
     
     return ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name )
     
+def GeneratePHashTileForMaintenance( path_and_mime ):
+    
+    if path_and_mime is None:
+        
+        return None
+        
+    
+    ( path, mime ) = path_and_mime
+    
+    try:
+        
+        numpy_image = ClientImageHandling.GenerateNumpyImage( path, mime )
+        
+        return ClientImageHandling.GenerateShapePerceptualHashTileFromNumPyImage( numpy_image )
+        
+    except Exception as e:
+        
+        HydrusData.Print( 'Could not generate phashes for ' + path )
+        
+        HydrusData.PrintException( e )
+        
+        return None
+        
+    
 def GenerateRepositoryMasterCacheTableNames( service_id ):
     
     suffix = str( service_id )
@@ -114,6 +142,21 @@ def GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id ):
     
     return ( cache_files_table_name, cache_current_mappings_table_name, cache_deleted_mappings_table_name, cache_pending_mappings_table_name, ac_cache_table_name )
     
+def LoadRepositoryUpdate( update_path ):
+    
+    precise_timestamp = HydrusData.GetNowPrecise()
+    
+    with open( update_path, 'rb' ) as f:
+        
+        update_network_string = f.read()
+        
+    
+    update = HydrusSerialisable.CreateFromNetworkString( update_network_string )
+    
+    time_took = HydrusData.GetNowPrecise() - precise_timestamp
+    
+    return ( update, time_took )
+    
 def report_content_speed_to_job_key( job_key, rows_done, total_rows, precise_timestamp, num_rows, row_name ):
     
     it_took = HydrusData.GetNowPrecise() - precise_timestamp
@@ -125,6 +168,46 @@ def report_content_speed_to_job_key( job_key, rows_done, total_rows, precise_tim
     HG.client_controller.pub( 'splash_set_status_text', popup_message, print_to_log = False )
     job_key.SetVariable( 'popup_text_2', popup_message )
     
+def report_query_plan( query_plan ):
+    
+    lines = [ 'file search query plan:' ]
+    
+    for ( i, ( step, estimate, strategy, num_results, time_took ) ) in enumerate( query_plan ):
+        
+        if estimate is None:
+            
+            estimate_text = 'no estimate'
+            
+        else:
+            
+            estimate_text = 'estimated ' + HydrusData.ToHumanInt( estimate )
+            
+        
+        lines.append( str( i + 1 ) + '. ' + step + ' - ' + estimate_text + ', ' + strategy + ' - ' + HydrusData.ToHumanInt( num_results ) + ' results in ' + HydrusData.TimeDeltaToPrettyTimeDelta( time_took ) )
+        
+    
+    HydrusData.ShowText( os.linesep.join( lines ) )
+    
+def report_pipeline_to_log( pipeline_report, row_name ):
+    
+    num_updates = pipeline_report[ 'num_updates' ]
+    
+    if num_updates == 0:
+        
+        return
+        
+    
+    load_time = pipeline_report[ 'load_time' ]
+    wait_time = pipeline_report[ 'wait_time' ]
+    apply_time = pipeline_report[ 'apply_time' ]
+    
+    summary = 'loaded ' + HydrusData.ToHumanInt( num_updates ) + ' ' + row_name + ' updates'
+    summary += ' - load and decode: ' + HydrusData.ToHumanInt( num_updates / max( load_time, 0.001 ) ) + ' updates/s over ' + HydrusData.TimeDeltaToPrettyTimeDelta( load_time )
+    summary += ', db waiting on loads: ' + HydrusData.TimeDeltaToPrettyTimeDelta( wait_time )
+    summary += ', db processing: ' + HydrusData.TimeDeltaToPrettyTimeDelta( apply_time )
+    
+    HydrusData.Print( summary )
+    
 def report_speed_to_job_key( job_key, precise_timestamp, num_rows, row_name ):
     
     it_took = HydrusData.GetNowPrecise() - precise_timestamp
@@ -149,11 +232,28 @@ def report_speed_to_log( precise_timestamp, num_rows, row_name ):
 class DB( HydrusDB.HydrusDB ):
     
     READ_WRITE_ACTIONS = [ 'service_info', 'system_predicates', 'missing_thumbnail_hashes' ]
+    READ_ONLY_ACTIONS = [ 'autocomplete_predicates', 'media_results', 'media_results_from_ids' ]
+    
+    FIRST_SYNC_DEFERRED_AC_CACHES_THRESHOLD = 50
+    
+    SIMILAR_FILES_BATCH_SEARCH_THRESHOLD = 1000
+    SIMILAR_FILES_BATCH_SEARCH_BLOCK_SIZE = 1024
     
     def __init__( self, controller, db_dir, db_name, no_wal = False ):
         
         self._initial_messages = []
         
+        # these are loaded in _InitCaches, but the db may set options or roll back before that
+        
+        self._deferred_ac_caches = None
+        self._tag_posting_lists_cache = ClientCaches.TagPostingListCache( 0 )
+        
+        # the read-only connections look at the inbox while the main loop edits it in place, so edits and those reads go under this
+        # the main loop's own reads do not need it, as nothing else writes
+        # the other in-memory caches the read-only actions touch are either locked themselves or swapped out whole rather than edited
+        
+        self._inbox_lock = threading.Lock()
+        
         HydrusDB.HydrusDB.__init__( self, controller, db_dir, db_name, no_wal = no_wal )
         
         self._controller.pub( 'splash_set_title_text', u'booting db\u2026' )
@@ -192,13 +292,18 @@ class DB( HydrusDB.HydrusDB ):
             
             self._c.executemany( 'INSERT OR IGNORE INTO current_files VALUES ( ?, ?, ? );', ( ( service_id, hash_id, timestamp ) for ( hash_id, timestamp ) in valid_rows ) )
             
+            if service_id in self._current_files_bitmaps:
+                
+                self._current_files_bitmaps[ service_id ].update( valid_hash_ids )
+                
+            
             self._c.execute( 'DELETE FROM file_transfers WHERE service_id = ? AND hash_id IN ' + splayed_valid_hash_ids + ';', ( service_id, ) )
             
             info = self._c.execute( 'SELECT hash_id, size, mime FROM files_info WHERE hash_id IN ' + splayed_valid_hash_ids + ';' ).fetchall()
             
             num_files = len( valid_hash_ids )
             delta_size = sum( ( size for ( hash_id, size, mime ) in info ) )
-            num_inbox = len( valid_hash_ids.intersection( self._inbox_hash_ids ) )
+            num_inbox = len( self._inbox_hash_ids.intersection( valid_hash_ids ) )
             
             service_info_updates = []
             
@@ -438,7 +543,9 @@ class DB( HydrusDB.HydrusDB ):
     
     def _ArchiveFiles( self, hash_ids ):
         
-        valid_hash_ids = [ hash_id for hash_id in hash_ids if hash_id in self._inbox_hash_ids ]
+        # wrap the small side, so the intersection only walks the containers these ids touch
+        
+        valid_hash_ids = list( ClientBitmaps.HashIdBitmap( hash_ids ).intersection( self._inbox_hash_ids ) )
         
         if len( valid_hash_ids ) > 0:
             
@@ -450,7 +557,10 @@ class DB( HydrusDB.HydrusDB ):
             
             self._c.executemany( 'UPDATE service_info SET info = info - ? WHERE service_id = ? AND info_type = ?;', [ ( count, service_id, HC.SERVICE_INFO_NUM_INBOX ) for ( service_id, count ) in updates ] )
             
-            self._inbox_hash_ids.difference_update( valid_hash_ids )
+            with self._inbox_lock:
+                
+                self._inbox_hash_ids.difference_update( valid_hash_ids )
+                
             
         
     
@@ -566,58 +676,15 @@ class DB( HydrusDB.HydrusDB ):
         
         ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( service_id )
         
-        current_mappings_exist = self._c.execute( 'SELECT 1 FROM ' + current_mappings_table_name + ' LIMIT 1;' ).fetchone() is not None
-        pending_mappings_exist = self._c.execute( 'SELECT 1 FROM ' + pending_mappings_table_name + ' LIMIT 1;' ).fetchone() is not None
+        # the mappings tables are keyed on tag_id first, so sqlite can count these in one ordered pass
         
-        if current_mappings_exist or pending_mappings_exist:
-            
-            all_known_ids = self._STL( self._c.execute( 'SELECT tag_id FROM tags;' ) )
-            
-            for group_of_ids in HydrusData.SplitListIntoChunks( all_known_ids, 10000 ):
-                
-                current_counter = collections.Counter()
-                
-                if current_mappings_exist:
-                    
-                    select_statement = 'SELECT tag_id, COUNT( * ) FROM ' + current_mappings_table_name + ' WHERE tag_id IN %s GROUP BY tag_id;'
-                    
-                    for ( tag_id, count ) in self._SelectFromList( select_statement, group_of_ids ):
-                        
-                        if count > 0:
-                            
-                            current_counter[ tag_id ] = count
-                            
-                        
-                    
-                
-                #
-                
-                pending_counter = collections.Counter()
-                
-                if pending_mappings_exist:
-                    
-                    select_statement = 'SELECT tag_id, COUNT( * ) FROM ' + pending_mappings_table_name + ' WHERE tag_id IN %s GROUP BY tag_id;'
-                    
-                    for ( tag_id, count ) in self._SelectFromList( select_statement, group_of_ids ):
-                        
-                        if count > 0:
-                            
-                            pending_counter[ tag_id ] = count
-                            
-                        
-                    
-                
-                all_ids_seen = set( current_counter.keys() )
-                all_ids_seen.update( pending_counter.keys() )
-                
-                count_ids = [ ( tag_id, current_counter[ tag_id ], pending_counter[ tag_id ] ) for tag_id in all_ids_seen ]
-                
-                if len( count_ids ) > 0:
-                    
-                    self._CacheCombinedFilesMappingsUpdate( service_id, count_ids )
-                    
-                
-            
+        self._c.execute( 'INSERT INTO ' + ac_cache_table_name + ' ( tag_id, current_count, pending_count ) SELECT tag_id, COUNT( * ), 0 FROM ' + current_mappings_table_name + ' GROUP BY tag_id;' )
+        
+        pending_counts = self._c.execute( 'SELECT tag_id, COUNT( * ) FROM ' + pending_mappings_table_name + ' GROUP BY tag_id;' ).fetchall()
+        
+        self._c.executemany( 'INSERT OR IGNORE INTO ' + ac_cache_table_name + ' ( tag_id, current_count, pending_count ) VALUES ( ?, ?, ? );', ( ( tag_id, 0, 0 ) for ( tag_id, count ) in pending_counts ) )
+        
+        self._c.executemany( 'UPDATE ' + ac_cache_table_name + ' SET pending_count = ? WHERE tag_id = ?;', ( ( count, tag_id ) for ( tag_id, count ) in pending_counts ) )
         
     
     def _CacheCombinedFilesMappingsGetAutocompleteCounts( self, service_id, tag_ids ):
@@ -824,6 +891,11 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.execute( 'INSERT OR REPLACE INTO shape_vptree ( phash_id, parent_id, radius, inner_id, inner_population, outer_id, outer_population ) VALUES ( ?, ?, ?, ?, ?, ?, ? );', ( phash_id, parent_id, radius, inner_id, inner_population, outer_id, outer_population ) )
         
+        if self._phash_index is not None:
+            
+            self._phash_index.AddPHashes( [ ( phash_id, phash ) ] )
+            
+        
     
     def _CacheSimilarFilesAssociatePHashes( self, hash_id, phashes ):
         
@@ -850,6 +922,8 @@ class DB( HydrusDB.HydrusDB ):
         
         phash_ids = self._STS( self._c.execute( 'SELECT phash_id FROM shape_perceptual_hash_map WHERE hash_id = ?;', ( hash_id, ) ) )
         
+        # the phashes stay in the tree and the in-memory index until their branch is regenerated, but with no map rows, they no longer produce results
+        
         self._CacheSimilarFilesDisassociatePHashes( hash_id, phash_ids )
         
         self._c.execute( 'DELETE FROM shape_search_cache WHERE hash_id = ?;', ( hash_id, ) )
@@ -1223,6 +1297,35 @@ class DB( HydrusDB.HydrusDB ):
         return ( num_phashes_to_regen, num_branches_to_regen, searched_distances_to_count, duplicate_types_to_count )
         
     
+    def _CacheSimilarFilesGetPHashIndex( self ):
+        
+        if not self._controller.new_options.GetBoolean( 'similar_files_use_in_memory_index' ):
+            
+            self._phash_index = None
+            self._phash_index_does_not_fit = False
+            
+            return None
+            
+        
+        if self._phash_index is None and not self._phash_index_does_not_fit:
+            
+            ( num_phashes, ) = self._c.execute( 'SELECT COUNT( * ) FROM shape_perceptual_hashes;' ).fetchone()
+            
+            if ClientSimilarFiles.PHashIndexWillFitInMemory( num_phashes ):
+                
+                self._phash_index = ClientSimilarFiles.PHashIndex( self._c.execute( 'SELECT phash_id, phash FROM shape_perceptual_hashes;' ) )
+                
+            else:
+                
+                HydrusData.Print( 'Not enough free memory to load the ' + HydrusData.ToHumanInt( num_phashes ) + ' similar files phashes into memory, so falling back to the on-disk search tree.' )
+                
+                self._phash_index_does_not_fit = True
+                
+            
+        
+        return self._phash_index
+        
+    
     def _CacheSimilarFilesGetPHashId( self, phash ):
         
         result = self._c.execute( 'SELECT phash_id FROM shape_perceptual_hashes WHERE phash = ?;', ( sqlite3.Binary( phash ), ) ).fetchone()
@@ -1374,6 +1477,30 @@ class DB( HydrusDB.HydrusDB ):
             
             total_done_previously = total_num_hash_ids_in_cache - len( hash_ids )
             
+            phash_index = self._CacheSimilarFilesGetPHashIndex()
+            
+            if phash_index is None and len( hash_ids ) >= self.SIMILAR_FILES_BATCH_SEARCH_THRESHOLD:
+                
+                # a big job, so it is worth loading a temporary index for it if we can
+                
+                ( num_phashes, ) = self._c.execute( 'SELECT COUNT( * ) FROM shape_perceptual_hashes;' ).fetchone()
+                
+                if ClientSimilarFiles.PHashIndexWillFitInMemory( num_phashes ):
+                    
+                    job_key.SetVariable( 'popup_title', 'similar files duplicate pair discovery' )
+                    job_key.SetVariable( 'popup_text_1', 'loading ' + HydrusData.ToHumanInt( num_phashes ) + ' phashes into memory' )
+                    
+                    phash_index = ClientSimilarFiles.PHashIndex( self._c.execute( 'SELECT phash_id, phash FROM shape_perceptual_hashes;' ) )
+                    
+                
+            
+            if phash_index is not None:
+                
+                self._CacheSimilarFilesMaintainDuplicatePairsBatched( phash_index, hash_ids, search_distance, total_done_previously, total_num_hash_ids_in_cache, job_key, stop_time, pub_job_key, time_started )
+                
+                return
+                
+            
             for ( i, hash_id ) in enumerate( hash_ids ):
                 
                 job_key.SetVariable( 'popup_title', 'similar files duplicate pair discovery' )
@@ -1426,6 +1553,86 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _CacheSimilarFilesMaintainDuplicatePairsBatched( self, phash_index, hash_ids, search_distance, total_done_previously, total_num_hash_ids_in_cache, job_key, stop_time, pub_job_key, time_started ):
+        
+        job_key_pubbed = False
+        
+        num_done = 0
+        pairs_found = 0
+        
+        batch_started = HydrusData.GetNowPrecise()
+        
+        for block_of_hash_ids in HydrusData.SplitListIntoChunks( hash_ids, self.SIMILAR_FILES_BATCH_SEARCH_BLOCK_SIZE ):
+            
+            job_key.SetVariable( 'popup_title', 'similar files duplicate pair discovery' )
+            
+            if pub_job_key and not job_key_pubbed and HydrusData.TimeHasPassed( time_started + 5 ):
+                
+                self._controller.pub( 'modal_message', job_key )
+                
+                job_key_pubbed = True
+                
+            
+            ( i_paused, should_quit ) = job_key.WaitIfNeeded()
+            
+            should_stop = stop_time is not None and HydrusData.TimeHasPassed( stop_time )
+            
+            if should_quit or should_stop:
+                
+                return
+                
+            
+            select_statement = 'SELECT hash_id, phash FROM shape_perceptual_hashes NATURAL JOIN shape_perceptual_hash_map WHERE hash_id IN %s;'
+            
+            search_rows = self._SelectFromListFetchAll( select_statement, block_of_hash_ids )
+            
+            hash_ids_and_similar_phash_ids = phash_index.SearchBlock( search_rows, search_distance )
+            
+            similar_phash_ids = { phash_id for ( hash_id, phash_id ) in hash_ids_and_similar_phash_ids }
+            
+            select_statement = 'SELECT phash_id, hash_id FROM shape_perceptual_hash_map WHERE phash_id IN %s;'
+            
+            phash_ids_to_hash_ids = HydrusData.BuildKeyToListDict( self._SelectFromList( select_statement, similar_phash_ids ) )
+            
+            pairs = set()
+            
+            for ( hash_id, phash_id ) in hash_ids_and_similar_phash_ids:
+                
+                for duplicate_hash_id in phash_ids_to_hash_ids[ phash_id ]:
+                    
+                    if duplicate_hash_id != hash_id:
+                        
+                        pairs.add( ( min( hash_id, duplicate_hash_id ), max( hash_id, duplicate_hash_id ) ) )
+                        
+                    
+                
+            
+            self._c.executemany( 'INSERT OR IGNORE INTO duplicate_pairs ( smaller_hash_id, larger_hash_id, duplicate_type ) VALUES ( ?, ?, ? );', ( ( smaller_hash_id, larger_hash_id, HC.DUPLICATE_UNKNOWN ) for ( smaller_hash_id, larger_hash_id ) in pairs ) )
+            
+            pairs_found += self._GetRowCount()
+            
+            self._c.executemany( 'UPDATE shape_search_cache SET searched_distance = ? WHERE hash_id = ?;', ( ( search_distance, hash_id ) for hash_id in block_of_hash_ids ) )
+            
+            num_done += len( block_of_hash_ids )
+            
+            time_took = HydrusData.GetNowPrecise() - batch_started
+            
+            files_per_second = int( num_done / max( time_took, 0.001 ) )
+            
+            text = 'searched ' + HydrusData.ConvertValueRangeToPrettyString( total_done_previously + num_done, total_num_hash_ids_in_cache ) + ' files at ' + HydrusData.ToHumanInt( files_per_second ) + ' files/s, ' + HydrusData.ToHumanInt( pairs_found ) + ' new pairs found'
+            
+            job_key.SetVariable( 'popup_text_1', text )
+            job_key.SetVariable( 'popup_gauge_1', ( total_done_previously + num_done, total_num_hash_ids_in_cache ) )
+            
+            HG.client_controller.pub( 'splash_set_status_subtext', text )
+            
+        
+        if HG.db_report_mode:
+            
+            HydrusData.ShowText( 'Batched similar files duplicate pair discovery searched ' + HydrusData.ToHumanInt( num_done ) + ' files in ' + HydrusData.TimeDeltaToPrettyTimeDelta( HydrusData.GetNowPrecise() - batch_started ) + ' and found ' + HydrusData.ToHumanInt( pairs_found ) + ' new pairs.' )
+            
+        
+    
     def _CacheSimilarFilesMaintainFiles( self, job_key = None, stop_time = None ):
         
         time_started = HydrusData.GetNow()
@@ -1446,10 +1653,17 @@ class DB( HydrusDB.HydrusDB ):
             hash_ids = self._STL( self._c.execute( 'SELECT hash_id FROM shape_maintenance_phash_regen;' ) )
             
             client_files_manager = self._controller.client_files_manager
+            file_processing_pool = self._controller.file_processing_pool
             
             total_done_previously = total_num_hash_ids_in_cache - len( hash_ids )
             
-            for ( i, hash_id ) in enumerate( hash_ids ):
+            # decoding and phashing is done across all cores, a chunk at a time, and only the phashes come back here to be written
+            
+            chunk_size = file_processing_pool.GetNumWorkers() * 4
+            
+            num_done = 0
+            
+            for block_of_hash_ids in HydrusData.SplitListIntoChunks( hash_ids, chunk_size ):
                 
                 job_key.SetVariable( 'popup_title', 'similar files metadata maintenance' )
                 
@@ -1469,67 +1683,85 @@ class DB( HydrusDB.HydrusDB ):
                     return
                     
                 
-                if i % 50 == 0:
-                    
-                    gc.collect()
-                    
+                text = 'regenerating similar file metadata - ' + HydrusData.ConvertValueRangeToPrettyString( total_done_previously + num_done, total_num_hash_ids_in_cache )
                 
-                if i % 10 == 0:
-                    
-                    text = 'regenerating similar file metadata - ' + HydrusData.ConvertValueRangeToPrettyString( total_done_previously + i, total_num_hash_ids_in_cache )
-                    
-                    HG.client_controller.pub( 'splash_set_status_subtext', text )
-                    job_key.SetVariable( 'popup_text_1', text )
-                    job_key.SetVariable( 'popup_gauge_1', ( total_done_previously + i, total_num_hash_ids_in_cache ) )
-                    
+                HG.client_controller.pub( 'splash_set_status_subtext', text )
+                job_key.SetVariable( 'popup_text_1', text )
+                job_key.SetVariable( 'popup_gauge_1', ( total_done_previously + num_done, total_num_hash_ids_in_cache ) )
                 
-                try:
+                paths_and_mimes = []
+                
+                for hash_id in block_of_hash_ids:
                     
-                    hash = self._GetHash( hash_id )
-                    mime = self._GetMime( hash_id )
+                    path_and_mime = None
                     
-                    if mime in HC.MIMES_WE_CAN_PHASH:
+                    try:
                         
-                        path = client_files_manager.GetFilePath( hash, mime )
+                        hash = self._GetHash( hash_id )
+                        mime = self._GetMime( hash_id )
                         
                         if mime in HC.MIMES_WE_CAN_PHASH:
                             
-                            try:
-                                
-                                phashes = ClientImageHandling.GenerateShapePerceptualHashes( path, mime )
-                                
-                            except Exception as e:
-                                
-                                HydrusData.Print( 'Could not generate phashes for ' + path )
-                                
-                                HydrusData.PrintException( e )
-                                
-                                phashes = []
-                                
+                            path = client_files_manager.GetFilePath( hash, mime )
+                            
+                            path_and_mime = ( path, mime )
                             
                         
-                    else:
+                    except HydrusExceptions.FileMissingException:
                         
-                        phashes = []
+                        pass
                         
                     
-                except HydrusExceptions.FileMissingException:
-                    
-                    phashes = []
+                    paths_and_mimes.append( path_and_mime )
                     
                 
-                existing_phash_ids = self._STS( self._c.execute( 'SELECT phash_id FROM shape_perceptual_hash_map WHERE hash_id = ?;', ( hash_id, ) ) )
+                phash_tiles = file_processing_pool.Map( GeneratePHashTileForMaintenance, paths_and_mimes )
+                
+                # the dcts are cheap once everything is decoded, so do the whole chunk in one go
+                
+                good_phash_tiles = [ phash_tile for phash_tile in phash_tiles if phash_tile is not None ]
+                
+                good_phashes = ClientSimilarFiles.ConvertUInt64sToPHashes( ClientImageHandling.GenerateShapePerceptualHashUInt64sFromTiles( good_phash_tiles ) )
                 
-                correct_phash_ids = self._CacheSimilarFilesAssociatePHashes( hash_id, phashes )
+                good_phashes.reverse()
                 
-                incorrect_phash_ids = existing_phash_ids.difference( correct_phash_ids )
+                list_of_phashes = []
                 
-                if len( incorrect_phash_ids ) > 0:
+                for phash_tile in phash_tiles:
                     
-                    self._CacheSimilarFilesDisassociatePHashes( hash_id, incorrect_phash_ids )
+                    if phash_tile is None:
+                        
+                        phashes = set()
+                        
+                    else:
+                        
+                        phashes = { good_phashes.pop() }
+                        
+                        phashes.discard( CC.BLANK_PHASH )
+                        
+                    
+                    list_of_phashes.append( phashes )
                     
                 
-                self._c.execute( 'DELETE FROM shape_maintenance_phash_regen WHERE hash_id = ?;', ( hash_id, ) )
+                for ( hash_id, phashes ) in zip( block_of_hash_ids, list_of_phashes ):
+                    
+                    existing_phash_ids = self._STS( self._c.execute( 'SELECT phash_id FROM shape_perceptual_hash_map WHERE hash_id = ?;', ( hash_id, ) ) )
+                    
+                    correct_phash_ids = self._CacheSimilarFilesAssociatePHashes( hash_id, phashes )
+                    
+                    incorrect_phash_ids = existing_phash_ids.difference( correct_phash_ids )
+                    
+                    if len( incorrect_phash_ids ) > 0:
+                        
+                        self._CacheSimilarFilesDisassociatePHashes( hash_id, incorrect_phash_ids )
+                        
+                    
+                    self._c.execute( 'DELETE FROM shape_maintenance_phash_regen WHERE hash_id = ?;', ( hash_id, ) )
+                    
+                
+                num_done += len( block_of_hash_ids )
+                
+                gc.collect()
                 
             
         finally:
@@ -1774,6 +2006,11 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.executemany( 'DELETE FROM shape_perceptual_hashes WHERE phash_id = ?;', ( ( p_id, ) for p_id in orphan_phash_ids ) )
         
+        if self._phash_index is not None:
+            
+            self._phash_index.DeletePHashIds( orphan_phash_ids )
+            
+        
         useful_nodes = [ row for row in unbalanced_nodes if row[0] in useful_phash_ids ]
         
         useful_population = len( useful_nodes )
@@ -1868,6 +2105,19 @@ class DB( HydrusDB.HydrusDB ):
             
             search_radius = max_hamming_distance
             
+            phash_index = self._CacheSimilarFilesGetPHashIndex()
+            
+            if phash_index is not None:
+                
+                search_phashes = [ phash for ( phash, ) in self._c.execute( 'SELECT phash FROM shape_perceptual_hashes NATURAL JOIN shape_perceptual_hash_map WHERE hash_id = ?;', ( hash_id, ) ) ]
+                
+                similar_phash_ids = phash_index.Search( search_phashes, search_radius )
+                
+                select_statement = 'SELECT hash_id FROM shape_perceptual_hash_map WHERE phash_id IN %s;'
+                
+                return self._STL( self._SelectFromList( select_statement, similar_phash_ids ) )
+                
+            
             result = self._c.execute( 'SELECT phash_id FROM shape_vptree WHERE parent_id IS NULL;' ).fetchone()
             
             if result is None:
@@ -2207,6 +2457,8 @@ class DB( HydrusDB.HydrusDB ):
                     
                     self._c.executemany( 'INSERT OR IGNORE INTO ' + cache_current_mappings_table_name + ' ( hash_id, tag_id ) VALUES ( ?, ? );', ( ( hash_id, tag_id ) for hash_id in current_hash_ids ) )
                     
+                    self._tag_posting_lists_cache.AddHashIds( file_service_id, tag_service_id, tag_id, HC.CONTENT_STATUS_CURRENT, current_hash_ids )
+                    
                 
                 #
                 
@@ -2229,6 +2481,8 @@ class DB( HydrusDB.HydrusDB ):
                     
                     self._c.executemany( 'INSERT OR IGNORE INTO ' + cache_pending_mappings_table_name + ' ( hash_id, tag_id ) VALUES ( ?, ? );', ( ( hash_id, tag_id ) for hash_id in pending_hash_ids ) )
                     
+                    self._tag_posting_lists_cache.AddHashIds( file_service_id, tag_service_id, tag_id, HC.CONTENT_STATUS_PENDING, pending_hash_ids )
+                    
                 
                 if num_current > 0 or num_pending > 0:
                     
@@ -2245,7 +2499,7 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
-    def _CacheSpecificMappingsAddMappings( self, file_service_id, tag_service_id, mappings_ids ):
+    def _CacheSpecificMappingsAddMappings( self, file_service_id, tag_service_id, mappings_ids, update_ac_counts = True ):
         
         ( cache_files_table_name, cache_current_mappings_table_name, cache_deleted_mappings_table_name, cache_pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id )
         
@@ -2265,15 +2519,21 @@ class DB( HydrusDB.HydrusDB ):
                 
                 num_added = self._GetRowCount()
                 
-                if num_pending_rescinded > 0:
-                    
-                    self._c.execute( 'UPDATE ' + ac_cache_table_name + ' SET current_count = current_count + ?, pending_count = pending_count - ? WHERE tag_id = ?;', ( num_added, num_pending_rescinded, tag_id ) )
-                    
-                elif num_added > 0:
-                    
-                    self._c.execute( 'INSERT OR IGNORE INTO ' + ac_cache_table_name + ' ( tag_id, current_count, pending_count ) VALUES ( ?, ?, ? );', ( tag_id, 0, 0 ) )
+                self._tag_posting_lists_cache.DeleteHashIds( file_service_id, tag_service_id, tag_id, HC.CONTENT_STATUS_PENDING, hash_ids )
+                self._tag_posting_lists_cache.AddHashIds( file_service_id, tag_service_id, tag_id, HC.CONTENT_STATUS_CURRENT, hash_ids )
+                
+                if update_ac_counts:
                     
-                    self._c.execute( 'UPDATE ' + ac_cache_table_name + ' SET current_count = current_count + ? WHERE tag_id = ?;', ( num_added, tag_id ) )
+                    if num_pending_rescinded > 0:
+                        
+                        self._c.execute( 'UPDATE ' + ac_cache_table_name + ' SET current_count = current_count + ?, pending_count = pending_count - ? WHERE tag_id = ?;', ( num_added, num_pending_rescinded, tag_id ) )
+                        
+                    elif num_added > 0:
+                        
+                        self._c.execute( 'INSERT OR IGNORE INTO ' + ac_cache_table_name + ' ( tag_id, current_count, pending_count ) VALUES ( ?, ?, ? );', ( tag_id, 0, 0 ) )
+                        
+                        self._c.execute( 'UPDATE ' + ac_cache_table_name + ' SET current_count = current_count + ? WHERE tag_id = ?;', ( num_added, tag_id ) )
+                        
                     
                 
                 #
@@ -2297,6 +2557,8 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.execute( 'DROP TABLE IF EXISTS ' + ac_cache_table_name + ';' )
         
+        self._tag_posting_lists_cache.DeleteDomain( file_service_id, tag_service_id )
+        
     
     def _CacheSpecificMappingsDeleteFiles( self, file_service_id, tag_service_id, hash_ids ):
         
@@ -2304,6 +2566,8 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.executemany( 'DELETE FROM ' + cache_files_table_name + ' WHERE hash_id = ?;', ( ( hash_id, ) for hash_id in hash_ids ) )
         
+        self._tag_posting_lists_cache.DeleteHashIdsFromDomain( file_service_id, tag_service_id, hash_ids )
+        
         ac_cache_changes = []
         
         for group_of_hash_ids in HydrusData.SplitListIntoChunks( hash_ids, 100 ):
@@ -2371,7 +2635,7 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
-    def _CacheSpecificMappingsDeleteMappings( self, file_service_id, tag_service_id, mappings_ids ):
+    def _CacheSpecificMappingsDeleteMappings( self, file_service_id, tag_service_id, mappings_ids, update_ac_counts = True ):
         
         ( cache_files_table_name, cache_current_mappings_table_name, cache_deleted_mappings_table_name, cache_pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id )
         
@@ -2385,7 +2649,9 @@ class DB( HydrusDB.HydrusDB ):
                 
                 num_deleted = self._GetRowCount()
                 
-                if num_deleted > 0:
+                self._tag_posting_lists_cache.DeleteHashIds( file_service_id, tag_service_id, tag_id, HC.CONTENT_STATUS_CURRENT, hash_ids )
+                
+                if update_ac_counts and num_deleted > 0:
                     
                     self._c.execute( 'UPDATE ' + ac_cache_table_name + ' SET current_count = current_count - ? WHERE tag_id = ?;', ( num_deleted, tag_id ) )
                     
@@ -2424,13 +2690,19 @@ class DB( HydrusDB.HydrusDB ):
         
         #
         
-        hash_ids = self._STL( self._c.execute( 'SELECT hash_id FROM current_files WHERE service_id = ?;', ( file_service_id, ) ) )
+        # rather than adding files in chunks, we fill the whole cache in a few set-based statements
+        
+        ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( tag_service_id )
+        
+        self._c.execute( 'INSERT INTO ' + cache_files_table_name + ' ( hash_id ) SELECT hash_id FROM current_files WHERE service_id = ?;', ( file_service_id, ) )
         
-        if len( hash_ids ) > 0:
+        for ( cache_mappings_table_name, mappings_table_name ) in ( ( cache_current_mappings_table_name, current_mappings_table_name ), ( cache_deleted_mappings_table_name, deleted_mappings_table_name ), ( cache_pending_mappings_table_name, pending_mappings_table_name ) ):
             
-            self._CacheSpecificMappingsAddFiles( file_service_id, tag_service_id, hash_ids )
+            self._c.execute( 'INSERT OR IGNORE INTO ' + cache_mappings_table_name + ' ( hash_id, tag_id ) SELECT hash_id, tag_id FROM ' + cache_files_table_name + ' CROSS JOIN ' + mappings_table_name + ' USING ( hash_id );' )
             
         
+        self._CacheSpecificMappingsRegenerateAutocompleteCounts( file_service_id, tag_service_id )
+        
     
     def _CacheSpecificMappingsGetAutocompleteCounts( self, file_service_id, tag_service_id, tag_ids ):
         
@@ -2441,7 +2713,7 @@ class DB( HydrusDB.HydrusDB ):
         return self._SelectFromListFetchAll( select_statement, tag_ids )
         
     
-    def _CacheSpecificMappingsPendMappings( self, file_service_id, tag_service_id, mappings_ids ):
+    def _CacheSpecificMappingsPendMappings( self, file_service_id, tag_service_id, mappings_ids, update_ac_counts = True ):
         
         ( cache_files_table_name, cache_current_mappings_table_name, cache_deleted_mappings_table_name, cache_pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id )
         
@@ -2455,18 +2727,34 @@ class DB( HydrusDB.HydrusDB ):
                 
                 num_added = self._GetRowCount()
                 
-                if num_added > 0:
+                self._tag_posting_lists_cache.AddHashIds( file_service_id, tag_service_id, tag_id, HC.CONTENT_STATUS_PENDING, hash_ids )
+                
+                if update_ac_counts and num_added > 0:
                     
                     self._c.execute( 'INSERT OR IGNORE INTO ' + ac_cache_table_name + ' ( tag_id, current_count, pending_count ) VALUES ( ?, ?, ? );', ( tag_id, 0, 0 ) )
                     
                     self._c.execute( 'UPDATE ' + ac_cache_table_name + ' SET pending_count = pending_count + ? WHERE tag_id = ?;', ( num_added, tag_id ) )
                     
                 
-                
             
         
     
-    def _CacheSpecificMappingsRescindPendingMappings( self, file_service_id, tag_service_id, mappings_ids ):
+    def _CacheSpecificMappingsRegenerateAutocompleteCounts( self, file_service_id, tag_service_id ):
+        
+        ( cache_files_table_name, cache_current_mappings_table_name, cache_deleted_mappings_table_name, cache_pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id )
+        
+        self._c.execute( 'DELETE FROM ' + ac_cache_table_name + ';' )
+        
+        self._c.execute( 'INSERT INTO ' + ac_cache_table_name + ' ( tag_id, current_count, pending_count ) SELECT tag_id, COUNT( * ), 0 FROM ' + cache_current_mappings_table_name + ' GROUP BY tag_id;' )
+        
+        pending_counts = self._c.execute( 'SELECT tag_id, COUNT( * ) FROM ' + cache_pending_mappings_table_name + ' GROUP BY tag_id;' ).fetchall()
+        
+        self._c.executemany( 'INSERT OR IGNORE INTO ' + ac_cache_table_name + ' ( tag_id, current_count, pending_count ) VALUES ( ?, ?, ? );', ( ( tag_id, 0, 0 ) for ( tag_id, count ) in pending_counts ) )
+        
+        self._c.executemany( 'UPDATE ' + ac_cache_table_name + ' SET pending_count = ? WHERE tag_id = ?;', ( ( count, tag_id ) for ( tag_id, count ) in pending_counts ) )
+        
+    
+    def _CacheSpecificMappingsRescindPendingMappings( self, file_service_id, tag_service_id, mappings_ids, update_ac_counts = True ):
         
         ( cache_files_table_name, cache_current_mappings_table_name, cache_deleted_mappings_table_name, cache_pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id )
         
@@ -2480,7 +2768,9 @@ class DB( HydrusDB.HydrusDB ):
                 
                 num_deleted = self._GetRowCount()
                 
-                if num_deleted > 0:
+                self._tag_posting_lists_cache.DeleteHashIds( file_service_id, tag_service_id, tag_id, HC.CONTENT_STATUS_PENDING, hash_ids )
+                
+                if update_ac_counts and num_deleted > 0:
                     
                     self._c.execute( 'UPDATE ' + ac_cache_table_name + ' SET pending_count = pending_count - ? WHERE tag_id = ?;', ( num_deleted, tag_id ) )
                     
@@ -2490,6 +2780,22 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _CanRegenerateDeferredACCaches( self, service_id ):
+        
+        if len( self._GetDeferredACCaches( service_id ) ) == 0:
+            
+            return False
+            
+        
+        # we wait until the repository is fully caught up, so a sync that is still downloading keeps its bulk speed
+        
+        repository_updates_table_name = GenerateRepositoryRepositoryUpdatesTableName( service_id )
+        
+        result = self._c.execute( 'SELECT 1 FROM ' + repository_updates_table_name + ' WHERE processed = ?;', ( False, ) ).fetchone()
+        
+        return result is None
+        
+    
     def _CheckDBIntegrity( self ):
         
         prefix_string = 'checking db integrity: '
@@ -2535,135 +2841,15 @@ class DB( HydrusDB.HydrusDB ):
                         num_errors += 1
                         
                     
-                    job_key.SetVariable( 'popup_text_1', 'errors found so far: ' + HydrusData.ToHumanInt( num_errors ) )
-                    
-                
-            
-        finally:
-            
-            job_key.SetVariable( 'popup_title', prefix_string + 'completed' )
-            job_key.SetVariable( 'popup_text_1', 'errors found: ' + HydrusData.ToHumanInt( num_errors ) )
-            
-            HydrusData.Print( job_key.ToString() )
-            
-            job_key.Finish()
-            
-        
-    
-    def _CheckFileIntegrity( self, mode, allowed_mimes = None, move_location = None ):
-        
-        prefix_string = 'checking file integrity: '
-        
-        job_key = ClientThreading.JobKey( cancellable = True )
-        
-        try:
-            
-            job_key.SetVariable( 'popup_text_1', prefix_string + 'preparing' )
-            
-            self._controller.pub( 'modal_message', job_key )
-            
-            if allowed_mimes is None:
-                
-                select = 'SELECT hash_id, mime FROM current_files NATURAL JOIN files_info WHERE service_id = ?;'
-                
-            else:
-                
-                select = 'SELECT hash_id, mime FROM current_files NATURAL JOIN files_info WHERE service_id = ? AND mime IN ' + HydrusData.SplayListForDB( allowed_mimes ) + ';'
-                
-            
-            info = self._c.execute( select, ( self._combined_local_file_service_id, ) ).fetchall()
-            
-            missing_count = 0
-            deletee_hash_ids = []
-            
-            client_files_manager = self._controller.client_files_manager
-            
-            for ( i, ( hash_id, mime ) ) in enumerate( info ):
-                
-                ( i_paused, should_quit ) = job_key.WaitIfNeeded()
-                
-                if should_quit:
-                    
-                    return
-                    
-                
-                job_key.SetVariable( 'popup_text_1', prefix_string + HydrusData.ConvertValueRangeToPrettyString( i, len( info ) ) )
-                job_key.SetVariable( 'popup_gauge_1', ( i, len( info ) ) )
-                
-                hash = self._GetHash( hash_id )
-                
-                try:
-                    
-                    # lockless because this db call is made by the locked client files manager
-                    path = client_files_manager.LocklessGetFilePath( hash, mime )
-                    
-                except HydrusExceptions.FileMissingException:
-                    
-                    HydrusData.Print( 'Could not find the file for ' + hash.encode( 'hex' ) + '!' )
-                    
-                    deletee_hash_ids.append( hash_id )
-                    
-                    missing_count += 1
-                    
-                    continue
-                    
-                
-                if mode == 'thorough':
-                    
-                    actual_hash = HydrusFileHandling.GetHashFromPath( path )
-                    
-                    if actual_hash != hash:
-                        
-                        deletee_hash_ids.append( hash_id )
-                        
-                        if move_location is not None:
-                            
-                            move_filename = 'believed ' + hash.encode( 'hex' ) + ' actually ' + actual_hash.encode( 'hex' ) + HC.mime_ext_lookup[ mime ]
-                            
-                            move_path = os.path.join( move_location, move_filename )
-                            
-                            HydrusPaths.MergeFile( path, move_path )
-                            
-                        
-                    
-                
-            
-            job_key.DeleteVariable( 'popup_gauge_1' )
-            job_key.SetVariable( 'popup_text_1', prefix_string + 'deleting the incorrect records' )
-            
-            self._DeleteFiles( self._local_file_service_id, deletee_hash_ids )
-            self._DeleteFiles( self._trash_service_id, deletee_hash_ids )
-            self._DeleteFiles( self._combined_local_file_service_id, deletee_hash_ids )
-            
-            final_text = 'done! '
-            
-            if len( deletee_hash_ids ) == 0:
-                
-                final_text += 'all files ok!'
-                
-            else:
-                
-                final_text += HydrusData.ToHumanInt( missing_count ) + ' files were missing!'
-                
-                if mode == 'thorough':
-                    
-                    final_text += ' ' + HydrusData.ToHumanInt( len( deletee_hash_ids ) - missing_count ) + ' files were incorrect and thus '
-                    
-                    if move_location is None:
-                        
-                        final_text += 'deleted!'
-                        
-                    else:
-                        
-                        final_text += 'moved!'
-                        
-                    
+                    job_key.SetVariable( 'popup_text_1', 'errors found so far: ' + HydrusData.ToHumanInt( num_errors ) )
+                    
                 
             
-            job_key.SetVariable( 'popup_text_1', prefix_string + final_text )
-            
         finally:
             
+            job_key.SetVariable( 'popup_title', prefix_string + 'completed' )
+            job_key.SetVariable( 'popup_text_1', 'errors found: ' + HydrusData.ToHumanInt( num_errors ) )
+            
             HydrusData.Print( job_key.ToString() )
             
             job_key.Finish()
@@ -2675,6 +2861,23 @@ class DB( HydrusDB.HydrusDB ):
         self._subscriptions_cache = {}
         self._service_cache = {}
         
+        self._current_files_bitmaps = {}
+        
+        self._tag_posting_lists_cache.Clear()
+        
+        self._phash_index = None
+        
+    
+    def _ClearFileRecords( self, hashes ):
+        
+        # the client files manager found these files missing or incorrect
+        
+        hash_ids = self._GetHashIds( hashes )
+        
+        self._DeleteFiles( self._local_file_service_id, hash_ids )
+        self._DeleteFiles( self._trash_service_id, hash_ids )
+        self._DeleteFiles( self._combined_local_file_service_id, hash_ids )
+        
     
     def _ClearOrphanFileRecords( self ):
         
@@ -3005,6 +3208,24 @@ class DB( HydrusDB.HydrusDB ):
         self._CreateIndex( 'external_caches.integer_subtags', [ 'integer_subtag' ] )
         
     
+    def _DeferACCaches( self, tag_service_id ):
+        
+        # while a tag service's ac caches are deferred, _UpdateMappings does not maintain their counts, and they are regenerated in one go later
+        
+        deferred_ac_caches = self._GetDeferredACCaches()
+        
+        file_service_ids = self._GetServiceIds( HC.AUTOCOMPLETE_CACHE_SPECIFIC_FILE_SERVICES )
+        
+        for file_service_id in file_service_ids:
+            
+            deferred_ac_caches.add( ( file_service_id, tag_service_id ) )
+            
+        
+        deferred_ac_caches.add( ( self._combined_file_service_id, tag_service_id ) )
+        
+        self._SetDeferredACCaches( deferred_ac_caches )
+        
+    
     def _DeleteFiles( self, service_id, hash_ids ):
         
         # the gui sometimes gets out of sync and sends a DELETE FROM TRASH call before the SEND TO TRASH call
@@ -3038,13 +3259,18 @@ class DB( HydrusDB.HydrusDB ):
             
             self._c.execute( 'DELETE FROM current_files WHERE service_id = ? AND hash_id IN ' + splayed_existing_hash_ids + ';', ( service_id, ) )
             
+            if service_id in self._current_files_bitmaps:
+                
+                self._current_files_bitmaps[ service_id ].difference_update( existing_hash_ids )
+                
+            
             self._c.execute( 'DELETE FROM file_petitions WHERE service_id = ? AND hash_id IN ' + splayed_existing_hash_ids + ';', ( service_id, ) )
             
             info = self._c.execute( 'SELECT size, mime FROM files_info WHERE hash_id IN ' + splayed_existing_hash_ids + ';' ).fetchall()
             
             num_existing_files_removed = len( existing_hash_ids )
             delta_size = sum( ( size for ( size, mime ) in info ) )
-            num_inbox = len( existing_hash_ids.intersection( self._inbox_hash_ids ) )
+            num_inbox = len( self._inbox_hash_ids.intersection( existing_hash_ids ) )
             
             service_info_updates.append( ( -delta_size, service_id, HC.SERVICE_INFO_TOTAL_SIZE ) )
             service_info_updates.append( ( -num_existing_files_removed, service_id, HC.SERVICE_INFO_NUM_FILES ) )
@@ -3235,6 +3461,13 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.execute( 'DELETE FROM remote_thumbnails WHERE service_id = ?;', ( service_id, ) )
         
+        if service_id in self._current_files_bitmaps:
+            
+            del self._current_files_bitmaps[ service_id ]
+            
+        
+        self._tag_posting_lists_cache.Clear()
+        
         if service_type in HC.REPOSITORIES:
             
             repository_updates_table_name = GenerateRepositoryRepositoryUpdatesTableName( service_id )
@@ -3267,6 +3500,12 @@ class DB( HydrusDB.HydrusDB ):
                 self._CacheSpecificMappingsDrop( file_service_id, service_id )
                 
             
+            deferred_ac_caches = self._GetDeferredACCaches()
+            
+            deferred_ac_caches.difference_update( self._GetDeferredACCaches( service_id ) )
+            
+            self._SetDeferredACCaches( deferred_ac_caches )
+            
         
         if service_type in HC.AUTOCOMPLETE_CACHE_SPECIFIC_FILE_SERVICES:
             
@@ -3277,6 +3516,12 @@ class DB( HydrusDB.HydrusDB ):
                 self._CacheSpecificMappingsDrop( service_id, tag_service_id )
                 
             
+            deferred_ac_caches = self._GetDeferredACCaches()
+            
+            deferred_ac_caches = { ( file_service_id, tag_service_id ) for ( file_service_id, tag_service_id ) in deferred_ac_caches if file_service_id != service_id }
+            
+            self._SetDeferredACCaches( deferred_ac_caches )
+            
         
         if service_id in self._service_cache:
             
@@ -3603,6 +3848,13 @@ class DB( HydrusDB.HydrusDB ):
         return hashes_result
         
     
+    def _FilterOrphans( self, test_type, possible_hashes ):
+        
+        # doing a whole folder of files in one go, rather than one db job per file
+        
+        return [ possible_hash for possible_hash in possible_hashes if self._IsAnOrphan( test_type, possible_hash ) ]
+        
+    
     def _GenerateMappingsTables( self, service_id ):
         
         ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( service_id )
@@ -3633,7 +3885,14 @@ class DB( HydrusDB.HydrusDB ):
         
         if file_service_id == self._combined_file_service_id:
             
-            cache_results = self._CacheCombinedFilesMappingsGetAutocompleteCounts( tag_service_id, tag_ids )
+            if ( file_service_id, tag_service_id ) in self._deferred_ac_caches:
+                
+                cache_results = self._GetAutocompleteCountsFromMappings( file_service_id, tag_service_id, tag_ids )
+                
+            else:
+                
+                cache_results = self._CacheCombinedFilesMappingsGetAutocompleteCounts( tag_service_id, tag_ids )
+                
             
         else:
             
@@ -3641,7 +3900,14 @@ class DB( HydrusDB.HydrusDB ):
             
             for search_tag_service_id in search_tag_service_ids:
                 
-                cache_results.extend( self._CacheSpecificMappingsGetAutocompleteCounts( file_service_id, search_tag_service_id, tag_ids ) )
+                if ( file_service_id, search_tag_service_id ) in self._deferred_ac_caches:
+                    
+                    cache_results.extend( self._GetAutocompleteCountsFromMappings( file_service_id, search_tag_service_id, tag_ids ) )
+                    
+                else:
+                    
+                    cache_results.extend( self._CacheSpecificMappingsGetAutocompleteCounts( file_service_id, search_tag_service_id, tag_ids ) )
+                    
                 
             
         
@@ -3680,6 +3946,35 @@ class DB( HydrusDB.HydrusDB ):
         return ids_to_count
         
     
+    def _GetAutocompleteCountsFromMappings( self, file_service_id, tag_service_id, tag_ids ):
+        
+        # a deferred ac cache is stale until it is regenerated, so until then we count straight from the mappings tables
+        
+        ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( tag_service_id )
+        
+        if file_service_id == self._combined_file_service_id:
+            
+            current_select_statement = 'SELECT tag_id, COUNT( * ) FROM ' + current_mappings_table_name + ' WHERE tag_id IN %s GROUP BY tag_id;'
+            pending_select_statement = 'SELECT tag_id, COUNT( * ) FROM ' + pending_mappings_table_name + ' WHERE tag_id IN %s GROUP BY tag_id;'
+            
+        else:
+            
+            # the specific mappings tables are still maintained while their counts are deferred
+            
+            ( cache_files_table_name, cache_current_mappings_table_name, cache_deleted_mappings_table_name, cache_pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id )
+            
+            current_select_statement = 'SELECT tag_id, COUNT( * ) FROM ' + cache_current_mappings_table_name + ' WHERE tag_id IN %s GROUP BY tag_id;'
+            pending_select_statement = 'SELECT tag_id, COUNT( * ) FROM ' + cache_pending_mappings_table_name + ' WHERE tag_id IN %s GROUP BY tag_id;'
+            
+        
+        current_counts = dict( self._SelectFromList( current_select_statement, tag_ids ) )
+        pending_counts = dict( self._SelectFromList( pending_select_statement, tag_ids ) )
+        
+        counted_tag_ids = set( current_counts.keys() ).union( pending_counts.keys() )
+        
+        return [ ( tag_id, current_counts.get( tag_id, 0 ), pending_counts.get( tag_id, 0 ) ) for tag_id in counted_tag_ids ]
+        
+    
     def _GetAutocompleteTagIds( self, service_key, search_text, exact_match ):
         
         if exact_match:
@@ -3934,6 +4229,30 @@ class DB( HydrusDB.HydrusDB ):
         return result
         
     
+    def _GetCurrentFilesBitmap( self, service_id ):
+        
+        # search filters against the same few file domains over and over, so we keep them in memory as bitmaps rather than reselecting them every time
+        
+        if service_id not in self._current_files_bitmaps:
+            
+            self._current_files_bitmaps[ service_id ] = ClientBitmaps.HashIdBitmap( self._STL( self._c.execute( 'SELECT hash_id FROM current_files WHERE service_id = ?;', ( service_id, ) ) ) )
+            
+        
+        return self._current_files_bitmaps[ service_id ]
+        
+    
+    def _GetDeferredACCaches( self, tag_service_id = None ):
+        
+        if tag_service_id is None:
+            
+            return set( self._deferred_ac_caches )
+            
+        else:
+            
+            return { ( file_service_id, deferred_tag_service_id ) for ( file_service_id, deferred_tag_service_id ) in self._deferred_ac_caches if deferred_tag_service_id == tag_service_id }
+            
+        
+    
     def _GetDownloads( self ):
         
         return { hash for ( hash, ) in self._c.execute( 'SELECT hash FROM file_transfers NATURAL JOIN hashes WHERE service_id = ?;', ( self._combined_local_file_service_id, ) ) }
@@ -3979,6 +4298,22 @@ class DB( HydrusDB.HydrusDB ):
         return desired_hashes
         
     
+    def _GetFileIntegrityInfo( self, allowed_mimes = None ):
+        
+        if allowed_mimes is None:
+            
+            select = 'SELECT hash_id, mime FROM current_files NATURAL JOIN files_info WHERE service_id = ?;'
+            
+        else:
+            
+            select = 'SELECT hash_id, mime FROM current_files NATURAL JOIN files_info WHERE service_id = ? AND mime IN ' + HydrusData.SplayListForDB( allowed_mimes ) + ';'
+            
+        
+        info = self._c.execute( select, ( self._combined_local_file_service_id, ) ).fetchall()
+        
+        return [ ( self._GetHash( hash_id ), mime ) for ( hash_id, mime ) in info ]
+        
+    
     def _GetFileNotes( self, hash ):
         
         hash_id = self._GetHashId( hash )
@@ -4358,9 +4693,9 @@ class DB( HydrusDB.HydrusDB ):
             
             if query_hash_ids is None:
                 
-                if not isinstance( some_hash_ids, set ):
+                if not isinstance( some_hash_ids, ClientBitmaps.HashIdBitmap ):
                     
-                    some_hash_ids = set( some_hash_ids )
+                    some_hash_ids = ClientBitmaps.HashIdBitmap( some_hash_ids )
                     
                 
                 return some_hash_ids
@@ -4547,40 +4882,74 @@ class DB( HydrusDB.HydrusDB ):
         
         if len( tags_to_include ) > 0 or len( namespaces_to_include ) > 0 or len( wildcards_to_include ) > 0:
             
-            def sort_longest_first_key( s ):
-                
-                return -len( s )
-                
+            # plan the tag search: do the tag that matches the fewest files first, so every later tag only has to filter that small set, rather than materialising its whole result
+            
+            query_plan = []
             
-            tags_to_include = list( tags_to_include )
+            tag_estimates_and_tags = [ ( self._GetTagCountEstimate( file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags ), tag ) for tag in tags_to_include ]
             
-            tags_to_include.sort( key = sort_longest_first_key )
+            tag_estimates_and_tags.sort()
             
-            for tag in tags_to_include:
+            for ( estimate, tag ) in tag_estimates_and_tags:
                 
-                tag_query_hash_ids = self._GetHashIdsFromTag( file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags, allowed_hash_ids = query_hash_ids )
+                precise_timestamp = HydrusData.GetNowPrecise()
+                
+                if query_hash_ids is None or estimate < len( query_hash_ids ):
+                    
+                    # we have nothing to filter yet, or the tag is smaller than what we have, so fetch it and intersect
+                    
+                    strategy = 'fetch'
+                    
+                    tag_query_hash_ids = self._GetHashIdsFromTag( file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags )
+                    
+                else:
+                    
+                    strategy = 'filter ' + HydrusData.ToHumanInt( len( query_hash_ids ) )
+                    
+                    tag_query_hash_ids = self._GetHashIdsFromTag( file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags, allowed_hash_ids = query_hash_ids )
+                    
                 
                 query_hash_ids = update_qhi( query_hash_ids, tag_query_hash_ids )
                 
-                if query_hash_ids == set():
+                query_plan.append( ( 'tag "' + tag + '"', estimate, strategy, len( query_hash_ids ), HydrusData.GetNowPrecise() - precise_timestamp ) )
+                
+                if len( query_hash_ids ) == 0:
                     
-                    return query_hash_ids
+                    break
                     
                 
             
-            if len( namespaces_to_include ) > 0:
+            if ( query_hash_ids is None or len( query_hash_ids ) > 0 ) and len( namespaces_to_include ) > 0:
+                
+                precise_timestamp = HydrusData.GetNowPrecise()
                 
                 namespace_query_hash_ids = HydrusData.IntelligentMassIntersect( ( self._GetHashIdsFromNamespace( file_service_key, tag_service_key, namespace, include_current_tags, include_pending_tags ) for namespace in namespaces_to_include ) )
                 
                 query_hash_ids = update_qhi( query_hash_ids, namespace_query_hash_ids )
                 
+                query_plan.append( ( 'namespaces ' + ', '.join( namespaces_to_include ), None, 'fetch', len( query_hash_ids ), HydrusData.GetNowPrecise() - precise_timestamp ) )
+                
             
-            if len( wildcards_to_include ) > 0:
+            if ( query_hash_ids is None or len( query_hash_ids ) > 0 ) and len( wildcards_to_include ) > 0:
+                
+                precise_timestamp = HydrusData.GetNowPrecise()
                 
                 wildcard_query_hash_ids = HydrusData.IntelligentMassIntersect( ( self._GetHashIdsFromWildcard( file_service_key, tag_service_key, wildcard, include_current_tags, include_pending_tags ) for wildcard in wildcards_to_include ) )
                 
                 query_hash_ids = update_qhi( query_hash_ids, wildcard_query_hash_ids )
                 
+                query_plan.append( ( 'wildcards ' + ', '.join( wildcards_to_include ), None, 'fetch', len( query_hash_ids ), HydrusData.GetNowPrecise() - precise_timestamp ) )
+                
+            
+            if HG.db_report_mode:
+                
+                report_query_plan( query_plan )
+                
+            
+            if len( query_hash_ids ) == 0:
+                
+                return set()
+                
             
             if len( files_info_predicates ) > 0:
                 
@@ -4622,6 +4991,8 @@ class DB( HydrusDB.HydrusDB ):
                     
                 
             
+            query_hash_ids = ClientBitmaps.HashIdBitmap( query_hash_ids )
+            
         
         if job_key.IsCancelled():
             
@@ -4634,14 +5005,12 @@ class DB( HydrusDB.HydrusDB ):
         
         if file_service_key == CC.COMBINED_LOCAL_FILE_SERVICE_KEY:
             
-            repo_update_hash_ids = self._STS( self._c.execute( 'SELECT hash_id FROM current_files NATURAL JOIN files_info WHERE service_id = ?;', ( self._local_update_service_id, ) ) )
-            
-            query_hash_ids.difference_update( repo_update_hash_ids )
+            query_hash_ids.difference_update( self._GetCurrentFilesBitmap( self._local_update_service_id ) )
             
         
         # now subtract bad results
         
-        exclude_query_hash_ids = set()
+        exclude_query_hash_ids = ClientBitmaps.HashIdBitmap()
         
         for tag in tags_to_exclude:
             
@@ -4673,7 +5042,7 @@ class DB( HydrusDB.HydrusDB ):
             
             service_id = self._GetServiceId( service_key )
             
-            query_hash_ids.intersection_update( self._STI( self._c.execute( 'SELECT hash_id FROM current_files WHERE service_id = ?;', ( service_id, ) ) ) )
+            query_hash_ids.intersection_update( self._GetCurrentFilesBitmap( service_id ) )
             
         
         for service_key in file_services_to_include_pending:
@@ -4687,7 +5056,7 @@ class DB( HydrusDB.HydrusDB ):
             
             service_id = self._GetServiceId( service_key )
             
-            query_hash_ids.difference_update( self._STI( self._c.execute( 'SELECT hash_id FROM current_files WHERE service_id = ?;', ( service_id, ) ) ) )
+            query_hash_ids.difference_update( self._GetCurrentFilesBitmap( service_id ) )
             
         
         for service_key in file_services_to_exclude_pending:
@@ -4750,12 +5119,12 @@ class DB( HydrusDB.HydrusDB ):
             
             if must_not_be_local:
                 
-                query_hash_ids = set()
+                query_hash_ids = ClientBitmaps.HashIdBitmap()
                 
             
         elif must_be_local or must_not_be_local:
             
-            local_hash_ids = self._STL( self._c.execute( 'SELECT hash_id FROM current_files WHERE service_id = ?;', ( self._combined_local_file_service_id, ) ) )
+            local_hash_ids = self._GetCurrentFilesBitmap( self._combined_local_file_service_id )
             
             if must_be_local:
                 
@@ -4910,14 +5279,12 @@ class DB( HydrusDB.HydrusDB ):
         
         limit = system_predicates.GetLimit()
         
+        query_hash_ids = list( query_hash_ids )
+        
         if limit is not None and limit <= len( query_hash_ids ):
             
             query_hash_ids = random.sample( query_hash_ids, limit )
             
-        else:
-            
-            query_hash_ids = list( query_hash_ids )
-            
         
         return query_hash_ids
         
@@ -4979,113 +5346,134 @@ class DB( HydrusDB.HydrusDB ):
     
     def _GetHashIdsFromTag( self, file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags, allowed_hash_ids = None ):
         
-        siblings_manager = self._controller.GetManager( 'tag_siblings' )
-        
-        tags = siblings_manager.GetAllSiblings( tag_service_key, tag )
+        TEMP_TABLE_THRESHOLD = 10000
         
         file_service_id = self._GetServiceId( file_service_key )
         
-        if tag_service_key == CC.COMBINED_TAG_SERVICE_KEY:
+        ( search_tag_service_ids, tag_ids ) = self._GetTagSearchIds( tag_service_key, tag )
+        
+        # whole posting lists go in the cache, so the next search for this tag can come straight from memory
+        # when filtering, we only fetch them if the ac counts say they will fit--otherwise the cache would throw them away and we would have read the whole tag for nothing
+        
+        if allowed_hash_ids is None:
             
-            search_tag_service_ids = self._GetServiceIds( HC.TAG_SERVICES )
+            fetch_whole_posting_lists = True
             
         else:
             
-            search_tag_service_ids = [ self._GetServiceId( tag_service_key ) ]
+            cache_size = self._tag_posting_lists_cache.GetCacheSize()
+            
+            # a posting list is at worst two bytes per hash_id
+            
+            fetch_whole_posting_lists = cache_size > 0 and self._GetTagCountEstimate( file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags ) * 2 <= cache_size
             
         
-        current_selects = []
-        pending_selects = []
+        hash_ids = ClientBitmaps.HashIdBitmap()
         
-        for tag in tags:
+        selects = []
+        
+        for search_tag_service_id in search_tag_service_ids:
             
-            ( namespace, subtag ) = HydrusTags.SplitTag( tag )
+            if file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
+                
+                ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( search_tag_service_id )
+                
+            else:
+                
+                ( cache_files_table_name, current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, search_tag_service_id )
+                
             
-            if namespace != '':
+            tables_and_statuses = []
+            
+            if include_current_tags:
                 
-                if not self._TagExists( tag ):
-                    
-                    continue
-                    
+                tables_and_statuses.append( ( current_mappings_table_name, HC.CONTENT_STATUS_CURRENT ) )
                 
-                namespace_id = self._GetNamespaceId( namespace )
-                subtag_id = self._GetSubtagId( subtag )
+            
+            if include_pending_tags:
                 
-                for search_tag_service_id in search_tag_service_ids:
+                tables_and_statuses.append( ( pending_mappings_table_name, HC.CONTENT_STATUS_PENDING ) )
+                
+            
+            for ( mappings_table_name, status ) in tables_and_statuses:
+                
+                uncached_tag_ids = []
+                
+                for tag_id in tag_ids:
                     
-                    if file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
-                        
-                        ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( search_tag_service_id )
+                    posting_list = self._tag_posting_lists_cache.GetPostingList( file_service_id, search_tag_service_id, tag_id, status )
+                    
+                    if posting_list is None:
                         
-                        current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ' NATURAL JOIN tags WHERE namespace_id = ' + str( namespace_id ) + ' AND subtag_id = ' + str( subtag_id ) + ';' )
-                        pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ' NATURAL JOIN tags WHERE namespace_id = ' + str( namespace_id ) + ' AND subtag_id = ' + str( subtag_id ) + ';' )
+                        uncached_tag_ids.append( tag_id )
                         
                     else:
                         
-                        ( cache_files_table_name, cache_current_mappings_table_name, cache_deleted_mappings_table_name, cache_pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, search_tag_service_id )
-                        
-                        current_selects.append( 'SELECT hash_id FROM ' + cache_current_mappings_table_name + ' NATURAL JOIN tags WHERE namespace_id = ' + str( namespace_id ) + ' AND subtag_id = ' + str( subtag_id ) + ';' )
-                        pending_selects.append( 'SELECT hash_id FROM ' + cache_pending_mappings_table_name + ' NATURAL JOIN tags WHERE namespace_id = ' + str( namespace_id ) + ' AND subtag_id = ' + str( subtag_id ) + ';' )
+                        hash_ids.update( posting_list )
                         
                     
                 
-            else:
-                
-                if not self._SubtagExists( subtag ):
+                if len( uncached_tag_ids ) == 0:
                     
                     continue
                     
                 
-                subtag_id = self._GetSubtagId( subtag )
-                
-                for search_tag_service_id in search_tag_service_ids:
+                if fetch_whole_posting_lists:
                     
-                    if file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
-                        
-                        ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( search_tag_service_id )
-                        
-                        current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ' NATURAL JOIN tags WHERE subtag_id = ' + str( subtag_id ) + ';' )
-                        pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ' NATURAL JOIN tags WHERE subtag_id = ' + str( subtag_id ) + ';' )
+                    tag_ids_to_hash_ids = HydrusData.BuildKeyToListDict( self._c.execute( 'SELECT tag_id, hash_id FROM ' + mappings_table_name + ' WHERE tag_id IN ' + HydrusData.SplayListForDB( uncached_tag_ids ) + ';' ) )
+                    
+                    for tag_id in uncached_tag_ids:
                         
-                    else:
+                        posting_list = ClientBitmaps.HashIdBitmap( tag_ids_to_hash_ids[ tag_id ] )
                         
-                        ( cache_files_table_name, cache_current_mappings_table_name, cache_deleted_mappings_table_name, cache_pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, search_tag_service_id )
+                        self._tag_posting_lists_cache.AddPostingList( file_service_id, search_tag_service_id, tag_id, status, posting_list )
                         
-                        current_selects.append( 'SELECT hash_id FROM ' + cache_current_mappings_table_name + ' NATURAL JOIN tags WHERE subtag_id = ' + str( subtag_id ) + ';' )
-                        pending_selects.append( 'SELECT hash_id FROM ' + cache_pending_mappings_table_name + ' NATURAL JOIN tags WHERE subtag_id = ' + str( subtag_id ) + ';' )
+                        hash_ids.update( posting_list )
                         
                     
+                else:
+                    
+                    selects.append( 'SELECT hash_id FROM ' + mappings_table_name + ' WHERE tag_id IN ' + HydrusData.SplayListForDB( uncached_tag_ids ) + ';' )
+                    
                 
             
         
-        hash_ids = set()
-        
-        selects = []
-        
-        if include_current_tags:
-            
-            selects.extend( current_selects )
-            
-        
-        if include_pending_tags:
+        if allowed_hash_ids is not None:
             
-            selects.extend( pending_selects )
+            # the whole posting lists we have are intersected here, the filtered selects below only ever return allowed hash_ids
             
-        
-        if allowed_hash_ids is None:
+            hash_ids.intersection_update( allowed_hash_ids )
             
-            for select in selects:
+            if len( selects ) > 0 and len( allowed_hash_ids ) > TEMP_TABLE_THRESHOLD:
                 
-                hash_ids.update( self._STI( self._c.execute( select ) ) )
+                # a big filter is better as one join against a temp table than many chunked IN lists that each rescan the tag
                 
-            
-        else:
-            
-            selects = [ select.replace( ';', ' AND hash_id IN %s;' ) for select in selects ]
-            
-            for select in selects:
+                self._c.execute( 'CREATE TABLE mem.temp_allowed_hash_ids ( hash_id INTEGER PRIMARY KEY );' )
+                
+                try:
+                    
+                    self._c.executemany( 'INSERT INTO temp_allowed_hash_ids ( hash_id ) VALUES ( ? );', ( ( hash_id, ) for hash_id in allowed_hash_ids ) )
+                    
+                    selects = [ select.replace( ';', ' AND hash_id IN temp_allowed_hash_ids;' ) for select in selects ]
+                    
+                    for select in selects:
+                        
+                        hash_ids.update( self._STI( self._c.execute( select ) ) )
+                        
+                    
+                finally:
+                    
+                    self._c.execute( 'DROP TABLE temp_allowed_hash_ids;' )
+                    
+                
+            else:
+                
+                selects = [ select.replace( ';', ' AND hash_id IN %s;' ) for select in selects ]
                 
-                hash_ids.update( self._STI( self._SelectFromList( select, allowed_hash_ids ) ) )
+                for select in selects:
+                    
+                    hash_ids.update( self._STI( self._SelectFromList( select, allowed_hash_ids ) ) )
+                    
                 
             
         
@@ -5621,6 +6009,13 @@ class DB( HydrusDB.HydrusDB ):
         
         service_ids_to_service_keys = { service_id : service_key for ( service_id, service_key ) in self._c.execute( 'SELECT service_id, service_key FROM services;' ) }
         
+        # one bulk intersection, rather than testing every hash_id against the whole inbox bitmap
+        
+        with self._inbox_lock:
+            
+            inbox_hash_ids = set( ClientBitmaps.HashIdBitmap( hash_ids ).intersection( self._inbox_hash_ids ) )
+            
+        
         media_results = []
         
         tag_censorship_manager = self._controller.GetManager( 'tag_censorship' )
@@ -5655,7 +6050,7 @@ class DB( HydrusDB.HydrusDB ):
             
             petitioned_file_service_keys = { service_ids_to_service_keys[ service_id ] for service_id in hash_ids_to_petitioned_file_service_ids[ hash_id ] }
             
-            inbox = hash_id in self._inbox_hash_ids
+            inbox = hash_id in inbox_hash_ids
             
             urls = hash_ids_to_urls[ hash_id ]
             
@@ -6169,11 +6564,11 @@ class DB( HydrusDB.HydrusDB ):
     
     def _GetService( self, service_id ):
         
-        if service_id in self._service_cache:
-            
-            service = self._service_cache[ service_id ]
-            
-        else:
+        # a single get, as the main loop may delete from the cache while a read-only connection is in here
+        
+        service = self._service_cache.get( service_id, None )
+        
+        if service is None:
             
             result = self._c.execute( 'SELECT service_key, service_type, name, dictionary_string FROM services WHERE service_id = ?;', ( service_id, ) ).fetchone()
             
@@ -6188,7 +6583,10 @@ class DB( HydrusDB.HydrusDB ):
             
             service = ClientServices.GenerateService( service_key, service_type, name, dictionary )
             
-            self._service_cache[ service_id ] = service
+            if not self._InReadOnlyConnection():
+                
+                self._service_cache[ service_id ] = service
+                
             
         
         return service
@@ -6514,23 +6912,70 @@ class DB( HydrusDB.HydrusDB ):
             
             for ( service_id, blacklist, tags ) in self._c.execute( 'SELECT service_id, blacklist, tags FROM tag_censorship;' ).fetchall():
                 
-                service = self._GetService( service_id )
+                service = self._GetService( service_id )
+                
+                service_key = service.GetServiceKey()
+                
+                result.append( ( service_key, blacklist, tags ) )
+                
+            
+        else:
+            
+            service_id = self._GetServiceId( service_key )
+            
+            result = self._c.execute( 'SELECT blacklist, tags FROM tag_censorship WHERE service_id = ?;', ( service_id, ) ).fetchone()
+            
+            if result is None: result = ( True, [] )
+            
+        
+        return result
+        
+    
+    def _GetTagCountEstimate( self, file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags ):
+        
+        # this is an upper bound for the number of files _GetHashIdsFromTag will return, read from the autocomplete caches (or counted live while they are deferred), so it is cheap
+        
+        file_service_id = self._GetServiceId( file_service_key )
+        
+        ( search_tag_service_ids, tag_ids ) = self._GetTagSearchIds( tag_service_key, tag )
+        
+        estimate = 0
+        
+        if len( tag_ids ) == 0:
+            
+            return estimate
+            
+        
+        for search_tag_service_id in search_tag_service_ids:
+            
+            if ( file_service_id, search_tag_service_id ) in self._deferred_ac_caches:
+                
+                cache_results = self._GetAutocompleteCountsFromMappings( file_service_id, search_tag_service_id, tag_ids )
+                
+            elif file_service_id == self._combined_file_service_id:
                 
-                service_key = service.GetServiceKey()
+                cache_results = self._CacheCombinedFilesMappingsGetAutocompleteCounts( search_tag_service_id, tag_ids )
                 
-                result.append( ( service_key, blacklist, tags ) )
+            else:
+                
+                cache_results = self._CacheSpecificMappingsGetAutocompleteCounts( file_service_id, search_tag_service_id, tag_ids )
                 
             
-        else:
-            
-            service_id = self._GetServiceId( service_key )
-            
-            result = self._c.execute( 'SELECT blacklist, tags FROM tag_censorship WHERE service_id = ?;', ( service_id, ) ).fetchone()
-            
-            if result is None: result = ( True, [] )
+            for ( tag_id, current_count, pending_count ) in cache_results:
+                
+                if include_current_tags:
+                    
+                    estimate += current_count
+                    
+                
+                if include_pending_tags:
+                    
+                    estimate += pending_count
+                    
+                
             
         
-        return result
+        return estimate
         
     
     def _GetTagId( self, tag ):
@@ -6655,6 +7100,55 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _GetTagSearchIds( self, tag_service_key, tag ):
+        
+        # the tag services and tag_ids a search for this tag covers, which is all its siblings, and every namespace for an unnamespaced tag
+        # the search and its planner's estimate both use this, so they always agree on what the tag is
+        
+        if tag_service_key == CC.COMBINED_TAG_SERVICE_KEY:
+            
+            search_tag_service_ids = self._GetServiceIds( HC.TAG_SERVICES )
+            
+        else:
+            
+            search_tag_service_ids = [ self._GetServiceId( tag_service_key ) ]
+            
+        
+        siblings_manager = self._controller.GetManager( 'tag_siblings' )
+        
+        tags = siblings_manager.GetAllSiblings( tag_service_key, tag )
+        
+        tag_ids = set()
+        
+        for tag in tags:
+            
+            ( namespace, subtag ) = HydrusTags.SplitTag( tag )
+            
+            if namespace != '':
+                
+                if not self._TagExists( tag ):
+                    
+                    continue
+                    
+                
+                tag_ids.add( self._GetTagId( tag ) )
+                
+            else:
+                
+                if not self._SubtagExists( subtag ):
+                    
+                    continue
+                    
+                
+                subtag_id = self._GetSubtagId( subtag )
+                
+                tag_ids.update( self._STI( self._c.execute( 'SELECT tag_id FROM tags WHERE subtag_id = ?;', ( subtag_id, ) ) ) )
+                
+            
+        
+        return ( search_tag_service_ids, tag_ids )
+        
+    
     def _GetTagSiblings( self, service_key = None ):
         
         def convert_statuses_and_pair_ids_to_statuses_to_pairs( statuses_and_pair_ids ):
@@ -7044,7 +7538,10 @@ class DB( HydrusDB.HydrusDB ):
             
             self._c.executemany( 'UPDATE service_info SET info = info + ? WHERE service_id = ? AND info_type = ?;', [ ( count, service_id, HC.SERVICE_INFO_NUM_INBOX ) for ( service_id, count ) in updates ] )
             
-            self._inbox_hash_ids.update( hash_ids )
+            with self._inbox_lock:
+                
+                self._inbox_hash_ids.update( hash_ids )
+                
             
         
     
@@ -7069,7 +7566,20 @@ class DB( HydrusDB.HydrusDB ):
         
         HG.client_controller.pub( 'splash_set_status_subtext', 'inbox' )
         
-        self._inbox_hash_ids = self._STS( self._c.execute( 'SELECT hash_id FROM file_inbox;' ) )
+        self._inbox_hash_ids = ClientBitmaps.HashIdBitmap( self._STL( self._c.execute( 'SELECT hash_id FROM file_inbox;' ) ) )
+        
+        self._LoadDeferredACCaches()
+        
+        # these are loaded lazily on first use
+        
+        self._current_files_bitmaps = {}
+        
+        new_options = self._GetJSONDump( HydrusSerialisable.SERIALISABLE_TYPE_CLIENT_OPTIONS )
+        
+        self._tag_posting_lists_cache = ClientCaches.TagPostingListCache( new_options.GetInteger( 'tag_search_cache_size_mb' ) * 1048576 )
+        
+        self._phash_index = None
+        self._phash_index_does_not_fit = False
         
     
     def _InitDiskCache( self ):
@@ -7109,19 +7619,11 @@ class DB( HydrusDB.HydrusDB ):
             
             hashes = hash_param
             
-            inbox_hashes = []
+            hashes_and_hash_ids = [ ( hash, self._GetHashId( hash ) ) for hash in hashes ]
             
-            for hash in hashes:
-                
-                hash_id = self._GetHashId( hash )
-                
-                if hash_id in self._inbox_hash_ids:
-                    
-                    inbox_hashes.append( hash )
-                    
-                
+            inbox_hash_ids = set( ClientBitmaps.HashIdBitmap( [ hash_id for ( hash, hash_id ) in hashes_and_hash_ids ] ).intersection( self._inbox_hash_ids ) )
             
-            return inbox_hashes
+            return [ hash for ( hash, hash_id ) in hashes_and_hash_ids if hash_id in inbox_hash_ids ]
             
         else:
             
@@ -7172,6 +7674,21 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _LoadDeferredACCaches( self ):
+        
+        # the deferred marks are checked on every mappings update and ac lookup, so we keep them in memory and only go to json_dict when they change
+        # the set is only ever replaced, never edited, so the read-only connections can look at it without a lock
+        
+        result = self._GetJSONSimple( 'deferred_ac_caches' )
+        
+        if result is None:
+            
+            result = []
+            
+        
+        self._deferred_ac_caches = frozenset( ( ( file_service_id, tag_service_id ) for ( file_service_id, tag_service_id ) in result ) )
+        
+    
     def _LoadIntoDiskCache( self, stop_time = None, caller_limit = None ):
         
         self._CloseDBCursor()
@@ -7343,6 +7860,14 @@ class DB( HydrusDB.HydrusDB ):
     
     def _ManageDBError( self, job, e ):
         
+        # the rollback may have undone file, mapping and phash changes the in-memory caches already saw, so reload them on next use
+        
+        self._current_files_bitmaps = {}
+        
+        self._tag_posting_lists_cache.Clear()
+        
+        self._phash_index = None
+        
         if isinstance( e, MemoryError ):
             
             HydrusData.ShowText( 'The client is running out of memory! Restart it ASAP!' )
@@ -8069,6 +8594,81 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _IterateRepositoryUpdates( self, hash_ids, pipeline_report ):
+        
+        # loading and decompressing/parsing an update is a lot of work sqlite does not need to wait on, so we let the worker pool do the next few while we process this one
+        
+        client_files_manager = self._controller.client_files_manager
+        
+        lookahead = self._controller.new_options.GetInteger( 'repository_update_processing_lookahead' )
+        
+        update_paths = [ ( hash_id, client_files_manager.LocklessGetFilePath( self._GetHash( hash_id ), HC.APPLICATION_HYDRUS_UPDATE_DEFINITIONS ) ) for hash_id in hash_ids ]
+        
+        if lookahead == 0:
+            
+            for ( hash_id, update_path ) in update_paths:
+                
+                precise_timestamp = HydrusData.GetNowPrecise()
+                
+                ( update, time_took ) = LoadRepositoryUpdate( update_path )
+                
+                pipeline_report[ 'num_updates' ] += 1
+                pipeline_report[ 'load_time' ] += time_took
+                pipeline_report[ 'wait_time' ] += HydrusData.GetNowPrecise() - precise_timestamp
+                
+                precise_timestamp = HydrusData.GetNowPrecise()
+                
+                yield ( hash_id, update )
+                
+                pipeline_report[ 'apply_time' ] += HydrusData.GetNowPrecise() - precise_timestamp
+                
+            
+        else:
+            
+            file_processing_pool = self._controller.file_processing_pool
+            
+            update_paths.reverse()
+            
+            load_jobs = collections.deque()
+            
+            try:
+                
+                while len( update_paths ) > 0 or len( load_jobs ) > 0:
+                    
+                    while len( update_paths ) > 0 and len( load_jobs ) < lookahead + 1:
+                        
+                        ( hash_id, update_path ) = update_paths.pop()
+                        
+                        load_jobs.append( ( hash_id, file_processing_pool.Submit( LoadRepositoryUpdate, update_path ) ) )
+                        
+                    
+                    ( hash_id, load_job ) = load_jobs.popleft()
+                    
+                    precise_timestamp = HydrusData.GetNowPrecise()
+                    
+                    ( update, time_took ) = load_job.GetResult()
+                    
+                    pipeline_report[ 'num_updates' ] += 1
+                    pipeline_report[ 'load_time' ] += time_took
+                    pipeline_report[ 'wait_time' ] += HydrusData.GetNowPrecise() - precise_timestamp
+                    
+                    precise_timestamp = HydrusData.GetNowPrecise()
+                    
+                    yield ( hash_id, update )
+                    
+                    pipeline_report[ 'apply_time' ] += HydrusData.GetNowPrecise() - precise_timestamp
+                    
+                
+            finally:
+                
+                for ( hash_id, load_job ) in load_jobs:
+                    
+                    load_job.Cancel()
+                    
+                
+            
+        
+    
     def _ProcessRepositoryContentUpdate( self, job_key, service_id, content_update ):
         
         FILES_CHUNK_SIZE = 20
@@ -8377,7 +8977,7 @@ class DB( HydrusDB.HydrusDB ):
         
         service_id = self._GetServiceId( service_key )
         
-        ( name, ) = self._c.execute( 'SELECT name FROM services WHERE service_id = ?;', ( service_id, ) ).fetchone()
+        ( name, service_type ) = self._c.execute( 'SELECT name, service_type FROM services WHERE service_id = ?;', ( service_id, ) ).fetchone()
         
         repository_updates_table_name = GenerateRepositoryRepositoryUpdatesTableName( service_id )
         
@@ -8445,8 +9045,6 @@ class DB( HydrusDB.HydrusDB ):
                 
                 num_updates_done = 0
                 
-                client_files_manager = self._controller.client_files_manager
-                
                 select_statement = 'SELECT hash_id FROM files_info WHERE mime = ' + str( HC.APPLICATION_HYDRUS_UPDATE_DEFINITIONS ) + ' AND hash_id IN %s;'
                 
                 definition_hash_ids = self._STL( self._SelectFromList( select_statement, hash_ids_i_can_process ) )
@@ -8457,9 +9055,13 @@ class DB( HydrusDB.HydrusDB ):
                     
                     total_definitions_rows = 0
                     
+                    pipeline_report = collections.Counter()
+                    
+                    definition_updates = self._IterateRepositoryUpdates( definition_hash_ids, pipeline_report )
+                    
                     try:
                         
-                        for hash_id in definition_hash_ids:
+                        for ( hash_id, definition_update ) in definition_updates:
                             
                             ( i_paused, should_quit ) = job_key.WaitIfNeeded()
                             
@@ -8473,17 +9075,6 @@ class DB( HydrusDB.HydrusDB ):
                             job_key.SetVariable( 'popup_text_1', status )
                             job_key.SetVariable( 'popup_gauge_1', ( num_updates_done, num_updates_to_do ) )
                             
-                            update_hash = self._GetHash( hash_id )
-                            
-                            update_path = client_files_manager.LocklessGetFilePath( update_hash, HC.APPLICATION_HYDRUS_UPDATE_DEFINITIONS )
-                            
-                            with open( update_path, 'rb' ) as f:
-                                
-                                update_network_string = f.read()
-                                
-                            
-                            definition_update = HydrusSerialisable.CreateFromNetworkString( update_network_string )
-                            
                             precise_timestamp = HydrusData.GetNowPrecise()
                             
                             self._ProcessRepositoryDefinitionUpdate( service_id, definition_update )
@@ -8512,7 +9103,10 @@ class DB( HydrusDB.HydrusDB ):
                         
                     finally:
                         
+                        definition_updates.close()
+                        
                         report_speed_to_log( larger_precise_timestamp, total_definitions_rows, 'definitions' )
+                        report_pipeline_to_log( pipeline_report, 'definition' )
                         
                     
                 
@@ -8522,13 +9116,24 @@ class DB( HydrusDB.HydrusDB ):
                 
                 if len( content_hash_ids ) > 0:
                     
+                    if this_is_first_sync and service_type == HC.TAG_REPOSITORY and len( content_hash_ids ) >= self.FIRST_SYNC_DEFERRED_AC_CACHES_THRESHOLD:
+                        
+                        # keeping the ac caches up to date row by row is most of the work of a big first sync, so let's just count everything at the end
+                        
+                        self._DeferACCaches( service_id )
+                        
+                    
                     precise_timestamp = HydrusData.GetNowPrecise()
                     
                     total_content_rows = 0
                     
+                    pipeline_report = collections.Counter()
+                    
+                    content_updates = self._IterateRepositoryUpdates( content_hash_ids, pipeline_report )
+                    
                     try:
                         
-                        for hash_id in content_hash_ids:
+                        for ( hash_id, content_update ) in content_updates:
                             
                             ( i_paused, should_quit ) = job_key.WaitIfNeeded()
                             
@@ -8542,17 +9147,6 @@ class DB( HydrusDB.HydrusDB ):
                             job_key.SetVariable( 'popup_text_1', status )
                             job_key.SetVariable( 'popup_gauge_1', ( num_updates_done, num_updates_to_do ) )
                             
-                            update_hash = self._GetHash( hash_id )
-                            
-                            update_path = client_files_manager.LocklessGetFilePath( update_hash, HC.APPLICATION_HYDRUS_UPDATE_DEFINITIONS )
-                            
-                            with open( update_path, 'rb' ) as f:
-                                
-                                update_network_string = f.read()
-                                
-                            
-                            content_update = HydrusSerialisable.CreateFromNetworkString( update_network_string )
-                            
                             did_whole_update = self._ProcessRepositoryContentUpdate( job_key, service_id, content_update )
                             
                             ( i_paused, should_quit ) = job_key.WaitIfNeeded()
@@ -8573,7 +9167,20 @@ class DB( HydrusDB.HydrusDB ):
                         
                     finally:
                         
+                        content_updates.close()
+                        
                         report_speed_to_log( precise_timestamp, total_content_rows, 'content rows' )
+                        report_pipeline_to_log( pipeline_report, 'content' )
+                        
+                    
+                
+                if self._CanRegenerateDeferredACCaches( service_id ):
+                    
+                    did_all = self._RegenerateDeferredACCaches( job_key, service_id )
+                    
+                    if not did_all:
+                        
+                        return ( True, False )
                         
                     
                 
@@ -8593,6 +9200,36 @@ class DB( HydrusDB.HydrusDB ):
             
             return ( True, True )
             
+        elif self._CanRegenerateDeferredACCaches( service_id ):
+            
+            # a previous regen was interrupted
+            
+            job_key = ClientThreading.JobKey( cancellable = True, only_when_idle = only_when_idle, stop_time = stop_time )
+            
+            try:
+                
+                title = name + ' sync: regenerating autocomplete counts'
+                
+                job_key.SetVariable( 'popup_title', title )
+                
+                HydrusData.Print( title )
+                
+                HG.client_controller.pub( 'modal_message', job_key )
+                
+                did_all = self._RegenerateDeferredACCaches( job_key, service_id )
+                
+            finally:
+                
+                job_key.SetVariable( 'popup_text_1', 'finished' )
+                job_key.DeleteVariable( 'popup_gauge_1' )
+                
+                job_key.Finish()
+                
+                job_key.Delete( 5 )
+                
+            
+            return ( True, did_all )
+            
         else:
             
             return ( False, True )
@@ -8626,11 +9263,13 @@ class DB( HydrusDB.HydrusDB ):
         elif action == 'duplicate_types_to_counts': result = self._CacheSimilarFilesGetDupeStatusesToCounts( *args, **kwargs )
         elif action == 'unique_duplicate_pairs': result = self._CacheSimilarFilesGetUniqueDuplicatePairs( *args, **kwargs )
         elif action == 'file_hashes': result = self._GetFileHashes( *args, **kwargs )
+        elif action == 'file_integrity_info': result = self._GetFileIntegrityInfo( *args, **kwargs )
         elif action == 'file_notes': result = self._GetFileNotes( *args, **kwargs )
         elif action == 'file_query_ids': result = self._GetHashIdsFromQuery( *args, **kwargs )
         elif action == 'file_system_predicates': result = self._GetFileSystemPredicates( *args, **kwargs )
         elif action == 'filter_existing_tags': result = self._FilterExistingTags( *args, **kwargs )
         elif action == 'filter_hashes': result = self._FilterHashes( *args, **kwargs )
+        elif action == 'filter_orphans': result = self._FilterOrphans( *args, **kwargs )
         elif action == 'hash_status': result = self._GetHashStatus( *args, **kwargs )
         elif action == 'hydrus_sessions': result = self._GetHydrusSessions( *args, **kwargs )
         elif action == 'imageboards': result = self._GetYAMLDump( YAML_DUMP_ID_IMAGEBOARD, *args, **kwargs )
@@ -8714,6 +9353,11 @@ class DB( HydrusDB.HydrusDB ):
                 self._CacheCombinedFilesMappingsGenerate( tag_service_id )
                 
             
+            if not job_key.IsCancelled():
+                
+                self._SetDeferredACCaches( set() )
+                
+            
         finally:
             
             job_key.SetVariable( 'popup_text_1', 'done!' )
@@ -8724,29 +9368,58 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
-    def _RelocateClientFiles( self, prefix, source, dest ):
+    def _RegenerateDeferredACCaches( self, job_key, tag_service_id ):
+        
+        # each cache is committed as it is finished, so if we are interrupted we pick up from the next one
+        
+        file_service_ids = [ file_service_id for ( file_service_id, deferred_tag_service_id ) in self._GetDeferredACCaches( tag_service_id ) ]
         
-        full_source = os.path.join( source, prefix )
-        full_dest = os.path.join( dest, prefix )
+        file_service_ids.sort()
         
-        if os.path.exists( full_source ):
+        for ( i, file_service_id ) in enumerate( file_service_ids ):
+            
+            ( i_paused, should_quit ) = job_key.WaitIfNeeded()
+            
+            if should_quit:
+                
+                return False
+                
             
-            HydrusPaths.MergeTree( full_source, full_dest )
+            status = 'regenerating autocomplete counts ' + HydrusData.ConvertValueRangeToPrettyString( i + 1, len( file_service_ids ) )
             
-        elif not os.path.exists( full_dest ):
+            self._controller.pub( 'splash_set_status_text', status, print_to_log = False )
+            job_key.SetVariable( 'popup_text_1', status )
+            job_key.SetVariable( 'popup_gauge_1', ( i, len( file_service_ids ) ) )
             
-            HydrusPaths.MakeSureDirectoryExists( full_dest )
+            precise_timestamp = HydrusData.GetNowPrecise()
             
-        
-        portable_dest = HydrusPaths.ConvertAbsPathToPortablePath( dest )
-        
-        self._c.execute( 'UPDATE client_files_locations SET location = ? WHERE prefix = ?;', ( portable_dest, prefix ) )
-        
-        if os.path.exists( full_source ):
+            if file_service_id == self._combined_file_service_id:
+                
+                self._CacheCombinedFilesMappingsDrop( tag_service_id )
+                
+                self._CacheCombinedFilesMappingsGenerate( tag_service_id )
+                
+            else:
+                
+                # the specific mappings tables are kept up to date while deferred, so only the counts need redoing
+                
+                self._CacheSpecificMappingsRegenerateAutocompleteCounts( file_service_id, tag_service_id )
+                
             
-            try: HydrusPaths.RecyclePath( full_source )
-            except: pass
+            all_deferred_ac_caches = self._GetDeferredACCaches()
             
+            all_deferred_ac_caches.discard( ( file_service_id, tag_service_id ) )
+            
+            self._SetDeferredACCaches( all_deferred_ac_caches )
+            
+            self._Commit()
+            
+            self._BeginImmediate()
+            
+            HydrusData.Print( 'regenerated autocomplete cache ' + str( file_service_id ) + '_' + str( tag_service_id ) + ' in ' + HydrusData.TimeDeltaToPrettyTimeDelta( HydrusData.GetNowPrecise() - precise_timestamp ) )
+            
+        
+        return True
         
     
     def _RepairClientFiles( self, correct_rows ):
@@ -9046,6 +9719,18 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _Rollback( self ):
+        
+        HydrusDB.HydrusDB._Rollback( self )
+        
+        # the in-memory deferred marks have to go back with the db, or we would skip upkeep on a cache the db does not know is stale
+        
+        if self._deferred_ac_caches is not None:
+            
+            self._LoadDeferredACCaches()
+            
+        
+    
     def _SaveDirtyServices( self, dirty_services ):
         
         # if allowed to save objects
@@ -9131,6 +9816,11 @@ class DB( HydrusDB.HydrusDB ):
             
             self._c.execute( 'INSERT INTO json_dumps ( dump_type, version, dump ) VALUES ( ?, ?, ? );', ( dump_type, version, sqlite3.Binary( dump ) ) )
             
+            if dump_type == HydrusSerialisable.SERIALISABLE_TYPE_CLIENT_OPTIONS:
+                
+                self._tag_posting_lists_cache.SetCacheSize( obj.GetInteger( 'tag_search_cache_size_mb' ) * 1048576 )
+                
+            
         
     
     def _SetJSONSimple( self, name, value ):
@@ -9147,6 +9837,29 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _SetClientFilesLocation( self, prefix, location ):
+        
+        # the client files manager has already moved the folder, so this just records where it went
+        
+        portable_location = HydrusPaths.ConvertAbsPathToPortablePath( location )
+        
+        self._c.execute( 'UPDATE client_files_locations SET location = ? WHERE prefix = ?;', ( portable_location, prefix ) )
+        
+    
+    def _SetDeferredACCaches( self, deferred_ac_caches ):
+        
+        self._deferred_ac_caches = frozenset( deferred_ac_caches )
+        
+        if len( deferred_ac_caches ) == 0:
+            
+            self._SetJSONSimple( 'deferred_ac_caches', None )
+            
+        else:
+            
+            self._SetJSONSimple( 'deferred_ac_caches', [ list( pair ) for pair in sorted( deferred_ac_caches ) ] )
+            
+        
+    
     def _SetPassword( self, password ):
         
         if password is not None:
@@ -10785,6 +11498,12 @@ class DB( HydrusDB.HydrusDB ):
         
         file_service_ids = self._GetServiceIds( HC.AUTOCOMPLETE_CACHE_SPECIFIC_FILE_SERVICES )
         
+        # searches and media results read the specific mappings tables, so they are always maintained, and only the counts of deferred caches are skipped
+        
+        deferred_ac_caches = self._GetDeferredACCaches( tag_service_id )
+        
+        file_service_ids_to_update_ac_counts = { file_service_id : ( file_service_id, tag_service_id ) not in deferred_ac_caches for file_service_id in file_service_ids }
+        
         change_in_num_mappings = 0
         change_in_num_deleted_mappings = 0
         change_in_num_pending_mappings = 0
@@ -10843,6 +11562,9 @@ class DB( HydrusDB.HydrusDB ):
                 
                 num_current_inserted = self._GetRowCount()
                 
+                self._tag_posting_lists_cache.DeleteHashIds( self._combined_file_service_id, tag_service_id, tag_id, HC.CONTENT_STATUS_PENDING, hash_ids )
+                self._tag_posting_lists_cache.AddHashIds( self._combined_file_service_id, tag_service_id, tag_id, HC.CONTENT_STATUS_CURRENT, hash_ids )
+                
                 change_in_num_deleted_mappings -= num_deleted_deleted
                 change_in_num_pending_mappings -= num_pending_deleted
                 change_in_num_mappings += num_current_inserted
@@ -10853,7 +11575,7 @@ class DB( HydrusDB.HydrusDB ):
             
             for file_service_id in file_service_ids:
                 
-                self._CacheSpecificMappingsAddMappings( file_service_id, tag_service_id, mappings_ids )
+                self._CacheSpecificMappingsAddMappings( file_service_id, tag_service_id, mappings_ids, update_ac_counts = file_service_ids_to_update_ac_counts[ file_service_id ] )
                 
             
         
@@ -10865,6 +11587,8 @@ class DB( HydrusDB.HydrusDB ):
                 
                 num_current_deleted = self._GetRowCount()
                 
+                self._tag_posting_lists_cache.DeleteHashIds( self._combined_file_service_id, tag_service_id, tag_id, HC.CONTENT_STATUS_CURRENT, hash_ids )
+                
                 self._c.executemany( 'DELETE FROM ' + petitioned_mappings_table_name + ' WHERE tag_id = ? AND hash_id = ?;', ( ( tag_id, hash_id ) for hash_id in hash_ids ) )
                 
                 num_petitions_deleted = self._GetRowCount()
@@ -10882,7 +11606,7 @@ class DB( HydrusDB.HydrusDB ):
             
             for file_service_id in file_service_ids:
                 
-                self._CacheSpecificMappingsDeleteMappings( file_service_id, tag_service_id, deleted_mappings_ids )
+                self._CacheSpecificMappingsDeleteMappings( file_service_id, tag_service_id, deleted_mappings_ids, update_ac_counts = file_service_ids_to_update_ac_counts[ file_service_id ] )
                 
             
         
@@ -10909,6 +11633,8 @@ class DB( HydrusDB.HydrusDB ):
                 
                 num_pending_inserted = self._GetRowCount()
                 
+                self._tag_posting_lists_cache.AddHashIds( self._combined_file_service_id, tag_service_id, tag_id, HC.CONTENT_STATUS_PENDING, hash_ids )
+                
                 change_in_num_pending_mappings += num_pending_inserted
                 
                 combined_files_pending_counter[ tag_id ] += num_pending_inserted
@@ -10916,7 +11642,7 @@ class DB( HydrusDB.HydrusDB ):
             
             for file_service_id in file_service_ids:
                 
-                self._CacheSpecificMappingsPendMappings( file_service_id, tag_service_id, pending_mappings_ids )
+                self._CacheSpecificMappingsPendMappings( file_service_id, tag_service_id, pending_mappings_ids, update_ac_counts = file_service_ids_to_update_ac_counts[ file_service_id ] )
                 
             
         
@@ -10928,6 +11654,8 @@ class DB( HydrusDB.HydrusDB ):
                 
                 num_pending_deleted = self._GetRowCount()
                 
+                self._tag_posting_lists_cache.DeleteHashIds( self._combined_file_service_id, tag_service_id, tag_id, HC.CONTENT_STATUS_PENDING, hash_ids )
+                
                 change_in_num_pending_mappings -= num_pending_deleted
                 
                 combined_files_pending_counter[ tag_id ] -= num_pending_deleted
@@ -10935,7 +11663,7 @@ class DB( HydrusDB.HydrusDB ):
             
             for file_service_id in file_service_ids:
                 
-                self._CacheSpecificMappingsRescindPendingMappings( file_service_id, tag_service_id, pending_rescinded_mappings_ids )
+                self._CacheSpecificMappingsRescindPendingMappings( file_service_id, tag_service_id, pending_rescinded_mappings_ids, update_ac_counts = file_service_ids_to_update_ac_counts[ file_service_id ] )
                 
             
         
@@ -10944,7 +11672,10 @@ class DB( HydrusDB.HydrusDB ):
         
         combined_files_counts = [ ( tag_id, combined_files_current_counter[ tag_id ], combined_files_pending_counter[ tag_id ] ) for tag_id in combined_files_seen_ids ]
         
-        self._CacheCombinedFilesMappingsUpdate( tag_service_id, combined_files_counts )
+        if ( self._combined_file_service_id, tag_service_id ) not in deferred_ac_caches:
+            
+            self._CacheCombinedFilesMappingsUpdate( tag_service_id, combined_files_counts )
+            
         
         # 
         
@@ -11331,6 +12062,7 @@ class DB( HydrusDB.HydrusDB ):
         if action == 'analyze': result = self._AnalyzeStaleBigTables( *args, **kwargs )
         elif action == 'associate_repository_update_hashes': result = self._AssociateRepositoryUpdateHashes( *args, **kwargs )
         elif action == 'backup': result = self._Backup( *args, **kwargs )
+        elif action == 'clear_file_records': result = self._ClearFileRecords( *args, **kwargs )
         elif action == 'clear_orphan_file_records': result = self._ClearOrphanFileRecords( *args, **kwargs )
         elif action == 'clear_orphan_tables': result = self._ClearOrphanTables( *args, **kwargs )
         elif action == 'content_updates': result = self._ProcessContentUpdates( *args, **kwargs )
@@ -11346,7 +12078,6 @@ class DB( HydrusDB.HydrusDB ):
         elif action == 'dirty_services': result = self._SaveDirtyServices( *args, **kwargs )
         elif action == 'duplicate_pair_status': result = self._CacheSimilarFilesSetDuplicatePairStatus( *args, **kwargs )
         elif action == 'export_mappings': result = self._ExportToTagArchive( *args, **kwargs )
-        elif action == 'file_integrity': result = self._CheckFileIntegrity( *args, **kwargs )
         elif action == 'hydrus_session': result = self._AddHydrusSession( *args, **kwargs )
         elif action == 'imageboard': result = self._SetYAMLDump( YAML_DUMP_ID_IMAGEBOARD, *args, **kwargs )
         elif action == 'import_file': result = self._ImportFile( *args, **kwargs )
@@ -11360,7 +12091,6 @@ class DB( HydrusDB.HydrusDB ):
         elif action == 'push_recent_tags': result = self._PushRecentTags( *args, **kwargs )
         elif action == 'regenerate_ac_cache': result = self._RegenerateACCache( *args, **kwargs )
         elif action == 'regenerate_similar_files': result = self._CacheSimilarFilesRegenerateTree( *args, **kwargs )
-        elif action == 'relocate_client_files': result = self._RelocateClientFiles( *args, **kwargs )
         elif action == 'remote_booru': result = self._SetYAMLDump( YAML_DUMP_ID_REMOTE_BOORU, *args, **kwargs )
         elif action == 'repair_client_files': result = self._RepairClientFiles( *args, **kwargs )
         elif action == 'reparse_files': result = self._ReparseFiles( *args, **kwargs )
@@ -11370,6 +12100,7 @@ class DB( HydrusDB.HydrusDB ):
         elif action == 'serialisable_simple': result = self._SetJSONSimple( *args, **kwargs )
         elif action == 'serialisable': result = self._SetJSONDump( *args, **kwargs )
         elif action == 'serialisables_overwrite': result = self._OverwriteJSONDumps( *args, **kwargs )
+        elif action == 'set_client_files_location': result = self._SetClientFilesLocation( *args, **kwargs )
         elif action == 'set_password': result = self._SetPassword( *args, **kwargs )
         elif action == 'sync_hashes_to_tag_archive': result = self._SyncHashesToTagArchive( *args, **kwargs )
         elif action == 'tag_censorship': result = self._SetTagCensorship( *args, **kwargs )
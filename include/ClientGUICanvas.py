@@ -3842,6 +3842,9 @@ class CanvasMediaList( ClientMedia.ListeningMediaList, CanvasWithHovers ):
         
         self._just_started = True
         
+        self._last_prefetch_media = None
+        self._prefetch_direction = 1
+        
         self.Bind( wx.EVT_LEFT_DOWN, self.EventDragBegin )
         self.Bind( wx.EVT_LEFT_UP, self.EventDragEnd )
         
@@ -3873,86 +3876,92 @@ class CanvasMediaList( ClientMedia.ListeningMediaList, CanvasWithHovers ):
     
     def _PrefetchNeighbours( self ):
         
-        media_looked_at = set()
+        # we decode ahead in the direction the user is going, and keep one behind in case they step back
         
-        to_render = []
+        previous_prefetch_media = self._last_prefetch_media
         
-        previous = self._current_media
-        next = self._current_media
+        self._last_prefetch_media = self._current_media
         
-        if self._just_started:
+        if previous_prefetch_media is not None:
+            
+            try:
+                
+                if self._current_media == self._GetNext( previous_prefetch_media ):
+                    
+                    self._prefetch_direction = 1
+                    
+                elif self._current_media == self._GetPrevious( previous_prefetch_media ):
+                    
+                    self._prefetch_direction = -1
+                    
+                
+            except HydrusExceptions.DataMissing:
+                
+                pass
+                
             
-            delay_base = 0.8
+        
+        if self._just_started:
             
-            num_to_go_back = 1
-            num_to_go_forward = 1
+            num_to_go_ahead = 1
+            num_to_go_behind = 1
             
             self._just_started = False
             
         else:
             
-            delay_base = 0.4
-            
-            num_to_go_back = 3
-            num_to_go_forward = 5
+            num_to_go_ahead = 5
+            num_to_go_behind = 1
             
         
-        # if media_looked_at nukes the list, we want shorter delays, so do next first
-        
-        for i in range( num_to_go_forward ):
-            
-            next = self._GetNext( next )
+        if self._prefetch_direction == 1:
             
-            if next in media_looked_at:
-                
-                break
-                
-            else:
-                
-                media_looked_at.add( next )
-                
+            ( go_ahead, go_behind ) = ( self._GetNext, self._GetPrevious )
             
-            delay = delay_base * ( i + 1 )
+        else:
             
-            to_render.append( ( next, delay ) )
+            ( go_ahead, go_behind ) = ( self._GetPrevious, self._GetNext )
             
         
-        for i in range( num_to_go_back ):
+        media_looked_at = { self._current_media }
+        
+        to_render = []
+        
+        for ( step, num_to_go ) in ( ( go_ahead, num_to_go_ahead ), ( go_behind, num_to_go_behind ) ):
             
-            previous = self._GetPrevious( previous )
+            media = self._current_media
             
-            if previous in media_looked_at:
+            for i in range( num_to_go ):
                 
-                break
+                media = step( media )
                 
-            else:
+                if media in media_looked_at:
+                    
+                    break
+                    
                 
-                media_looked_at.add( previous )
+                media_looked_at.add( media )
+                
+                to_render.append( media )
                 
             
-            delay = delay_base * 2 * ( i + 1 )
-            
-            to_render.append( ( previous, delay ) )
-            
-        
-        ( my_width, my_height ) = self.GetClientSize()
         
-        image_cache = HG.client_controller.GetCache( 'images' )
+        medias_and_target_resolutions = []
         
-        for ( media, delay ) in to_render:
-            
-            hash = media.GetHash()
-            mime = media.GetMime()
+        for media in to_render:
             
-            if mime in ( HC.IMAGE_JPEG, HC.IMAGE_PNG ):
+            if media.GetMime() in ( HC.IMAGE_JPEG, HC.IMAGE_PNG ):
                 
-                if not image_cache.HasImageRenderer( hash ):
-                    
-                    HG.client_controller.CallLaterWXSafe( self, delay, image_cache.GetImageRenderer, media )
-                    
+                show_action = self._GetShowAction( media )
+                
+                ( zoom, canvas_zoom ) = CalculateCanvasZooms( self, media, show_action )
+                
+                medias_and_target_resolutions.append( ( media, CalculateMediaSize( media, zoom ) ) )
                 
             
         
+        HG.client_controller.GetCache( 'images' ).PrefetchImageRenderers( medias_and_target_resolutions )
+        
     
     def _Remove( self ):
         
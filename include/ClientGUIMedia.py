@@ -2021,6 +2021,8 @@ class MediaPanelThumbnails( MediaPanel ):
         self._thumbnails_being_faded_in = {}
         self._hashes_faded = set()
         
+        self._last_waterfall_viewport = None
+        
         ( thumbnail_span_width, thumbnail_span_height ) = self._GetThumbnailSpanDimensions()
         
         thumbnail_scroll_rate = float( HG.client_controller.new_options.GetString( 'thumbnail_scroll_rate' ) )
@@ -2103,6 +2105,8 @@ class MediaPanelThumbnails( MediaPanel ):
             self._DirtyPage( clean_index )
             
         
+        self._last_waterfall_viewport = None
+        
     
     def _DirtyPage( self, clean_index ):
 
@@ -2639,6 +2643,25 @@ class MediaPanelThumbnails( MediaPanel ):
         self.Refresh()
         
     
+    def _UpdateWaterfallViewport( self, visible_page_indices, nearby_page_indices ):
+        
+        # tell the thumbnail cache what is on screen and what is a scroll away, so it can load those thumbs first
+        
+        viewport = ( tuple( visible_page_indices ), tuple( nearby_page_indices ), self._num_columns, self._num_rows_per_canvas_page )
+        
+        if viewport == self._last_waterfall_viewport:
+            
+            return
+            
+        
+        self._last_waterfall_viewport = viewport
+        
+        visible_thumbnails = [ thumbnail for page_index in visible_page_indices for ( thumbnail_index, thumbnail ) in self._GetThumbnailsFromPageIndex( page_index ) ]
+        nearby_thumbnails = [ thumbnail for page_index in nearby_page_indices for ( thumbnail_index, thumbnail ) in self._GetThumbnailsFromPageIndex( page_index ) ]
+        
+        HG.client_controller.GetCache( 'thumbnail' ).SetWaterfallViewport( self._page_key, visible_thumbnails, nearby_thumbnails )
+        
+    
     def AddMediaResults( self, page_key, media_results, append = True ):
         
         if page_key == self._page_key:
@@ -2647,6 +2670,8 @@ class MediaPanelThumbnails( MediaPanel ):
             
             self._RecalculateVirtualSize()
             
+            self._last_waterfall_viewport = None
+            
             HG.client_controller.GetCache( 'thumbnail' ).Waterfall( self._page_key, thumbnails )
             
             if len( self._selected_media ) == 0:
@@ -2822,6 +2847,8 @@ class MediaPanelThumbnails( MediaPanel ):
         
         page_indices_to_draw.sort()
         
+        self._UpdateWaterfallViewport( page_indices_to_display, [ page_index for page_index in page_indices_to_draw if page_index not in page_indices_to_display ] )
+        
         potential_clean_indices_to_steal = [ page_index for page_index in self._clean_canvas_pages.keys() if page_index not in page_indices_to_draw ]
         
         random.shuffle( potential_clean_indices_to_steal )
@@ -4807,7 +4807,11 @@ class TestPanel( wx.Panel ):
         
         try:
             
-            results_text = obj.ParsePretty( example_parsing_context, example_data )
+            parse_session = ClientParsing.ParseSession()
+            
+            results_text = obj.ParsePretty( example_parsing_context, example_data, parse_session = parse_session )
+            
+            results_text += os.linesep * 2 + '*** TIMINGS ***' + os.linesep + parse_session.GetPrettyTimings()
             
             self._results.SetValue( results_text )
             
@@ -4895,24 +4899,28 @@ class TestPanelSubsidiary( TestPanel ):
             
             example_parsing_context = self._example_parsing_context.GetValue()
             
+            parse_session = ClientParsing.ParseSession()
+            
             if formula is None:
                 
                 posts = [ self._example_data ]
                 
             else:
                 
-                posts = formula.Parse( example_parsing_context, self._example_data )
+                posts = formula.Parse( example_parsing_context, self._example_data, parse_session = parse_session )
                 
             
             pretty_texts = []
             
             for post in posts:
                 
-                pretty_text = page_parser.ParsePretty( example_parsing_context, post )
+                pretty_text = page_parser.ParsePretty( example_parsing_context, post, parse_session = parse_session )
                 
                 pretty_texts.append( pretty_text )
                 
             
+            pretty_texts.append( '*** TIMINGS ***' + os.linesep + parse_session.GetPrettyTimings() )
+            
             separator = os.linesep * 2
             
             end_pretty_text = separator.join( pretty_texts )
@@ -1561,6 +1561,11 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             self._network_timeout = wx.SpinCtrl( self, min = 3, max = 300 )
             self._network_timeout.SetToolTip( 'If a network connection experiences any uninterrupted inactivity for this duration, it will throw an error.' )
             
+            self._max_network_jobs = wx.SpinCtrl( self, min = 1, max = 100 )
+            
+            self._max_network_jobs_per_domain = wx.SpinCtrl( self, min = 1, max = 20 )
+            self._max_network_jobs_per_domain.SetToolTip( 'This stops one slow server from taking every download slot.' )
+            
             proxy_panel = ClientGUICommon.StaticBox( self, 'proxy settings' )
             
             self._proxy_type = ClientGUICommon.BetterChoice( proxy_panel )
@@ -1583,6 +1588,8 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
                 
             
             self._network_timeout.SetValue( self._new_options.GetInteger( 'network_timeout' ) )
+            self._max_network_jobs.SetValue( self._new_options.GetInteger( 'max_network_jobs' ) )
+            self._max_network_jobs_per_domain.SetValue( self._new_options.GetInteger( 'max_network_jobs_per_domain' ) )
             
             self._proxy_type.Append( 'http', 'http' )
             self._proxy_type.Append( 'socks4', 'socks4' )
@@ -1650,6 +1657,8 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             
             rows.append( ( 'external ip/host override: ', self._external_host ) )
             rows.append( ( 'network timeout (seconds): ', self._network_timeout ) )
+            rows.append( ( 'max number of simultaneous network jobs: ', self._max_network_jobs ) )
+            rows.append( ( 'max number of simultaneous network jobs per domain: ', self._max_network_jobs_per_domain ) )
             
             gridbox = ClientGUICommon.WrapInGrid( self, rows )
             
@@ -1694,6 +1703,8 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             HC.options[ 'external_host' ] = external_host
             
             self._new_options.SetInteger( 'network_timeout', self._network_timeout.GetValue() )
+            self._new_options.SetInteger( 'max_network_jobs', self._max_network_jobs.GetValue() )
+            self._new_options.SetInteger( 'max_network_jobs_per_domain', self._max_network_jobs_per_domain.GetValue() )
             
         
     
@@ -1744,6 +1755,9 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             
             self._show_deleted_on_file_seed_short_summary = wx.CheckBox( misc )
             
+            self._parse_html_with_lxml = wx.CheckBox( misc )
+            self._parse_html_with_lxml.SetToolTip( 'lxml parses html much faster than html5lib, but it can build a slightly different tree (for instance, it does not add <tbody> to tables), so some parsers may need editing to work with it. This needs lxml to be installed.' )
+            
             #
             
             gallery_page_tt = 'Gallery page fetches are heavy requests with unusual fetch-time requirements. It is important they not wait too long, but it is also useful to throttle them:'
@@ -1771,6 +1785,8 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             
             self._show_deleted_on_file_seed_short_summary.SetValue( self._new_options.GetBoolean( 'show_deleted_on_file_seed_short_summary' ) )
             
+            self._parse_html_with_lxml.SetValue( self._new_options.GetBoolean( 'parse_html_with_lxml' ) )
+            
             self._highlight_new_watcher.SetValue( self._new_options.GetBoolean( 'highlight_new_watcher' ) )
             
             #
@@ -1814,6 +1830,7 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             rows = []
             
             rows.append( ( 'Show the \'D\' (for \'deleted\') count on short file import summaries:', self._show_deleted_on_file_seed_short_summary ) )
+            rows.append( ( 'Parse html with lxml (faster, but some parsers may need editing):', self._parse_html_with_lxml ) )
             
             gridbox = ClientGUICommon.WrapInGrid( misc, rows )
             
@@ -1848,6 +1865,8 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             
             self._new_options.SetBoolean( 'show_deleted_on_file_seed_short_summary', self._show_deleted_on_file_seed_short_summary.GetValue() )
             
+            self._new_options.SetBoolean( 'parse_html_with_lxml', self._parse_html_with_lxml.GetValue() )
+            
         
     
     class _DuplicatesPanel( wx.Panel ):
@@ -1869,6 +1888,13 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             self._duplicate_comparison_score_more_tags = wx.SpinCtrl( weights_panel, min = 0, max = 100 )
             self._duplicate_comparison_score_older = wx.SpinCtrl( weights_panel, min = 0, max = 100 )
             
+            #
+            
+            search_panel = ClientGUICommon.StaticBox( self, 'similar files search' )
+            
+            self._similar_files_use_in_memory_index = wx.CheckBox( search_panel )
+            self._similar_files_use_in_memory_index.SetToolTip( 'If checked, the client will load all its similar files data into memory (about 16 bytes per phash) on the first similar files search and answer searches from there, which is much faster than walking the on-disk search tree. If there is not enough free memory, the client will fall back to the on-disk tree.' )
+            
             #
             self._duplicate_comparison_score_higher_filesize.SetValue( self._new_options.GetInteger( 'duplicate_comparison_score_higher_filesize' ) )
             self._duplicate_comparison_score_much_higher_filesize.SetValue( self._new_options.GetInteger( 'duplicate_comparison_score_much_higher_filesize' ) )
@@ -1877,6 +1903,8 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             self._duplicate_comparison_score_more_tags.SetValue( self._new_options.GetInteger( 'duplicate_comparison_score_more_tags' ) )
             self._duplicate_comparison_score_older.SetValue( self._new_options.GetInteger( 'duplicate_comparison_score_older' ) )
             
+            self._similar_files_use_in_memory_index.SetValue( self._new_options.GetBoolean( 'similar_files_use_in_memory_index' ) )
+            
             #
             
             rows = []
@@ -1901,9 +1929,20 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             
             #
             
+            rows = []
+            
+            rows.append( ( 'Keep similar files search data in memory: ', self._similar_files_use_in_memory_index ) )
+            
+            gridbox = ClientGUICommon.WrapInGrid( search_panel, rows )
+            
+            search_panel.Add( gridbox, CC.FLAGS_EXPAND_SIZER_PERPENDICULAR )
+            
+            #
+            
             vbox = wx.BoxSizer( wx.VERTICAL )
             
             vbox.Add( weights_panel, CC.FLAGS_EXPAND_BOTH_WAYS )
+            vbox.Add( search_panel, CC.FLAGS_EXPAND_PERPENDICULAR )
             
             self.SetSizer( vbox )
             
@@ -1917,6 +1956,8 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             self._new_options.SetInteger( 'duplicate_comparison_score_more_tags', self._duplicate_comparison_score_more_tags.GetValue() )
             self._new_options.SetInteger( 'duplicate_comparison_score_older', self._duplicate_comparison_score_older.GetValue() )
             
+            self._new_options.SetBoolean( 'similar_files_use_in_memory_index', self._similar_files_use_in_memory_index.GetValue() )
+            
         
     
     class _ImportingPanel( wx.Panel ):
@@ -2012,6 +2053,12 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             
             self._maintenance_vacuum_period_days.SetToolTip( tts )
             
+            self._repository_update_processing_lookahead = wx.SpinCtrl( self._maintenance_panel, min = 0, max = 32 )
+            
+            tts = 'While processing repository updates, this many of the following update files will be loaded and decompressed in the background, so the database does not have to wait on them. Set to 0 to load each update in turn.'
+            
+            self._repository_update_processing_lookahead.SetToolTip( tts )
+            
             #
             
             self._idle_normal.SetValue( HC.options[ 'idle_normal' ] )
@@ -2023,6 +2070,7 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             self._idle_shutdown_max_minutes.SetValue( HC.options[ 'idle_shutdown_max_minutes' ] )
             
             self._maintenance_vacuum_period_days.SetValue( self._new_options.GetNoneableInteger( 'maintenance_vacuum_period_days' ) )
+            self._repository_update_processing_lookahead.SetValue( self._new_options.GetInteger( 'repository_update_processing_lookahead' ) )
             
             #
             
@@ -2077,6 +2125,7 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             rows = []
             
             rows.append( ( 'Number of days to wait between vacuums: ', self._maintenance_vacuum_period_days ) )
+            rows.append( ( 'Number of repository updates to load ahead while processing: ', self._repository_update_processing_lookahead ) )
             
             gridbox = ClientGUICommon.WrapInGrid( self._maintenance_panel, rows )
             
@@ -2145,6 +2194,7 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             HC.options[ 'idle_shutdown_max_minutes' ] = self._idle_shutdown_max_minutes.GetValue()
             
             self._new_options.SetNoneableInteger( 'maintenance_vacuum_period_days', self._maintenance_vacuum_period_days.GetValue() )
+            self._new_options.SetInteger( 'repository_update_processing_lookahead', self._repository_update_processing_lookahead.GetValue() )
             
         
     
@@ -2238,6 +2288,9 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             
             self._temp_path_override = wx.DirPickerCtrl( self, style = wx.DIRP_USE_TEXTCTRL )
             
+            self._verify_client_files_migration = wx.CheckBox( self, label = '' )
+            self._client_files_migration_busy_mb_per_second = ClientGUICommon.NoneableSpinCtrl( self, '', none_phrase = 'no limit', min = 1, max = 10240 )
+            
             mime_panel = ClientGUICommon.StaticBox( self, '\'open externally\' launch paths' )
             
             self._web_browser_path = wx.TextCtrl( mime_panel )
@@ -2264,6 +2317,9 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             self._trash_max_age.SetValue( HC.options[ 'trash_max_age' ] )
             self._trash_max_size.SetValue( HC.options[ 'trash_max_size' ] )
             
+            self._verify_client_files_migration.SetValue( self._new_options.GetBoolean( 'verify_client_files_migration' ) )
+            self._client_files_migration_busy_mb_per_second.SetValue( self._new_options.GetNoneableInteger( 'client_files_migration_busy_mb_per_second' ) )
+            
             temp_path_override = self._new_options.GetNoneableString( 'temp_path_override' )
             
             if temp_path_override is not None:
@@ -2304,6 +2360,8 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             rows.append( ( 'Number of hours a file can be in the trash before being deleted: ', self._trash_max_age ) )
             rows.append( ( 'Maximum size of trash (MB): ', self._trash_max_size ) )
             rows.append( ( 'BUGFIX: Temp folder override (set blank for OS default): ', self._temp_path_override ) )
+            rows.append( ( 'When moving files between locations, check the copies against their hashes: ', self._verify_client_files_migration ) )
+            rows.append( ( 'When moving files between locations while the client is in use, limit to (MB/s): ', self._client_files_migration_busy_mb_per_second ) )
             
             gridbox = ClientGUICommon.WrapInGrid( self, rows )
             
@@ -2409,6 +2467,9 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             HC.options[ 'trash_max_age' ] = self._trash_max_age.GetValue()
             HC.options[ 'trash_max_size' ] = self._trash_max_size.GetValue()
             
+            self._new_options.SetBoolean( 'verify_client_files_migration', self._verify_client_files_migration.GetValue() )
+            self._new_options.SetNoneableInteger( 'client_files_migration_busy_mb_per_second', self._client_files_migration_busy_mb_per_second.GetValue() )
+            
             temp_path_override = self._temp_path_override.GetPath()
             
             if temp_path_override == '':
@@ -3198,6 +3259,9 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             self._image_cache_timeout = ClientGUITime.TimeDeltaButton( media_panel, min = 300, days = True, hours = True, minutes = True )
             self._image_cache_timeout.SetToolTip( 'The amount of time after which a rendered image in the cache will naturally be removed, if it is not shunted out due to a new member exceeding the size limit. Requires restart to kick in.' )
             
+            self._pack_resized_thumbnails = wx.CheckBox( media_panel )
+            self._pack_resized_thumbnails.SetToolTip( 'Store resized thumbnails in one packed file per folder, rather than one file each. This makes loading a big page of thumbnails much faster on HDDs and network drives. Existing resized thumbnails will be regenerated into the packs as they are needed.' )
+            
             #
             
             buffer_panel = ClientGUICommon.StaticBox( self, 'video buffer' )
@@ -3232,6 +3296,9 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             
             self._forced_search_limit = ClientGUICommon.NoneableSpinCtrl( misc_panel, '', min = 1, max = 100000 )
             
+            self._tag_search_cache_size_mb = wx.SpinCtrl( misc_panel, min = 0, max = 16 * 1024 )
+            self._tag_search_cache_size_mb.SetToolTip( 'The client remembers which files have the tags you search for most often, so repeat searches for busy tags are fast. This is how much memory it may use for that. Set 0 to disable.' )
+            
             #
             
             self._disk_cache_init_period.SetValue( self._new_options.GetNoneableInteger( 'disk_cache_init_period' ) )
@@ -3262,6 +3329,8 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             self._thumbnail_cache_timeout.SetValue( self._new_options.GetInteger( 'thumbnail_cache_timeout' ) )
             self._image_cache_timeout.SetValue( self._new_options.GetInteger( 'image_cache_timeout' ) )
             
+            self._pack_resized_thumbnails.SetValue( self._new_options.GetBoolean( 'pack_resized_thumbnails' ) )
+            
             self._video_buffer_size_mb.SetValue( self._new_options.GetInteger( 'video_buffer_size_mb' ) )
             
             self._num_autocomplete_chars.SetValue( HC.options[ 'num_autocomplete_chars' ] )
@@ -3278,6 +3347,8 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             
             self._forced_search_limit.SetValue( self._new_options.GetNoneableInteger( 'forced_search_limit' ) )
             
+            self._tag_search_cache_size_mb.SetValue( self._new_options.GetInteger( 'tag_search_cache_size_mb' ) )
+            
             #
             
             rows = []
@@ -3319,6 +3390,7 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             rows.append( ( 'MB memory reserved for image cache: ', fullscreens_sizer ) )
             rows.append( ( 'Thumbnail cache timeout: ', self._thumbnail_cache_timeout ) )
             rows.append( ( 'Image cache timeout: ', self._image_cache_timeout ) )
+            rows.append( ( 'Pack resized thumbnails into one file per folder: ', self._pack_resized_thumbnails ) )
             
             gridbox = ClientGUICommon.WrapInGrid( media_panel, rows )
             
@@ -3373,6 +3445,7 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             rows = []
             
             rows.append( ( 'Forced system:limit for all searches: ', self._forced_search_limit ) )
+            rows.append( ( 'MB memory reserved for tag search cache: ', self._tag_search_cache_size_mb ) )
             
             gridbox = ClientGUICommon.WrapInGrid( misc_panel, rows )
             
@@ -3477,10 +3550,14 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             self._new_options.SetInteger( 'thumbnail_cache_timeout', self._thumbnail_cache_timeout.GetValue() )
             self._new_options.SetInteger( 'image_cache_timeout', self._image_cache_timeout.GetValue() )
             
+            self._new_options.SetBoolean( 'pack_resized_thumbnails', self._pack_resized_thumbnails.GetValue() )
+            
             self._new_options.SetInteger( 'video_buffer_size_mb', self._video_buffer_size_mb.GetValue() )
             
             self._new_options.SetNoneableInteger( 'forced_search_limit', self._forced_search_limit.GetValue() )
             
+            self._new_options.SetInteger( 'tag_search_cache_size_mb', self._tag_search_cache_size_mb.GetValue() )
+            
             HC.options[ 'num_autocomplete_chars' ] = self._num_autocomplete_chars.GetValue()
             
             HC.options[ 'fetch_ac_results_automatically' ] = self._fetch_ac_results_automatically.GetValue()
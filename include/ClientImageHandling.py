@@ -1,5 +1,6 @@
 import numpy.core.multiarray # important this comes before cv!
 import ClientConstants as CC
+import ClientSimilarFiles
 import cv2
 import HydrusConstants as HC
 import HydrusImageHandling
@@ -32,6 +33,39 @@ cv_interpolation_enum_lookup[ CC.ZOOM_AREA ] = cv2.INTER_AREA
 cv_interpolation_enum_lookup[ CC.ZOOM_CUBIC ] = cv2.INTER_CUBIC
 cv_interpolation_enum_lookup[ CC.ZOOM_LANCZOS4 ] = cv2.INTER_LANCZOS4
 
+def ConvertCVImageToRGB( numpy_image ):
+    
+    if numpy_image.dtype == 'uint16':
+        
+        numpy_image /= 256
+        
+        numpy_image = numpy.array( numpy_image, dtype = 'uint8' )
+        
+    
+    shape = numpy_image.shape
+    
+    if len( shape ) == 2:
+        
+        # monochrome image
+        
+        convert = cv2.COLOR_GRAY2RGB
+        
+    else:
+        
+        ( im_y, im_x, depth ) = shape
+        
+        if depth == 4:
+            
+            convert = cv2.COLOR_BGRA2RGBA
+            
+        else:
+            
+            convert = cv2.COLOR_BGR2RGB
+            
+        
+    
+    return cv2.cvtColor( numpy_image, convert )
+    
 def EfficientlyResizeNumpyImage( numpy_image, ( target_x, target_y ) ):
     
     ( im_y, im_x, depth ) = numpy_image.shape
@@ -72,55 +106,45 @@ def GenerateNumpyImage( path, mime ):
         
     else:
         
-        if mime == HC.IMAGE_JPEG:
+        numpy_image = cv2.imread( path, flags = GetCVImReadFlags( mime ) )
+        
+        if numpy_image is None: # doesn't support static gifs and some random other stuff
+            
+            pil_image = HydrusImageHandling.GeneratePILImage( path )
             
-            flags = CV_IMREAD_FLAGS_SUPPORTS_EXIF_REORIENTATION
+            numpy_image = GenerateNumPyImageFromPILImage( pil_image )
             
         else:
             
-            flags = CV_IMREAD_FLAGS_SUPPORTS_ALPHA
+            numpy_image = ConvertCVImageToRGB( numpy_image )
             
         
-        numpy_image = cv2.imread( path, flags = flags )
+    
+    return numpy_image
+    
+def GenerateNumpyImageFromBytes( data, mime ):
+    
+    # for thumbnails that are not in their own file
+    
+    if mime == HC.IMAGE_GIF or HG.client_controller.new_options.GetBoolean( 'load_images_with_pil' ):
         
-        if numpy_image is None: # doesn't support static gifs and some random other stuff
+        pil_image = HydrusImageHandling.GeneratePILImageFromBytes( data )
+        
+        numpy_image = GenerateNumPyImageFromPILImage( pil_image )
+        
+    else:
+        
+        numpy_image = cv2.imdecode( numpy.fromstring( data, dtype = 'uint8' ), GetCVImReadFlags( mime ) )
+        
+        if numpy_image is None:
             
-            pil_image = HydrusImageHandling.GeneratePILImage( path )
+            pil_image = HydrusImageHandling.GeneratePILImageFromBytes( data )
             
             numpy_image = GenerateNumPyImageFromPILImage( pil_image )
             
         else:
             
-            if numpy_image.dtype == 'uint16':
-                
-                numpy_image /= 256
-                
-                numpy_image = numpy.array( numpy_image, dtype = 'uint8' )
-                
-            
-            shape = numpy_image.shape
-            
-            if len( shape ) == 2:
-                
-                # monochrome image
-                
-                convert = cv2.COLOR_GRAY2RGB
-                
-            else:
-                
-                ( im_y, im_x, depth ) = shape
-                
-                if depth == 4:
-                    
-                    convert = cv2.COLOR_BGRA2RGBA
-                    
-                else:
-                    
-                    convert = cv2.COLOR_BGR2RGB
-                    
-                
-            
-            numpy_image = cv2.cvtColor( numpy_image, convert )
+            numpy_image = ConvertCVImageToRGB( numpy_image )
             
         
     
@@ -140,6 +164,26 @@ def GenerateShapePerceptualHashes( path, mime ):
     
     numpy_image = GenerateNumpyImage( path, mime )
     
+    return GenerateShapePerceptualHashesFromNumPyImage( numpy_image )
+    
+def GenerateShapePerceptualHashesFromNumPyImage( numpy_image ):
+    
+    phash_tile = GenerateShapePerceptualHashTileFromNumPyImage( numpy_image )
+    
+    phashes_uint64 = GenerateShapePerceptualHashUInt64sFromTiles( [ phash_tile ] )
+    
+    phashes = set( ClientSimilarFiles.ConvertUInt64sToPHashes( phashes_uint64 ) )
+    
+    # now discard the blank hash, which is 1000000... and not useful
+    
+    phashes.discard( CC.BLANK_PHASH )
+    
+    # we good
+    
+    return phashes
+    
+def GenerateShapePerceptualHashTileFromNumPyImage( numpy_image ):
+    
     ( y, x, depth ) = numpy_image.shape
     
     if depth == 4:
@@ -174,78 +218,40 @@ def GenerateShapePerceptualHashes( path, mime ):
     
     numpy_image_tiny = cv2.resize( numpy_image_gray, ( 32, 32 ), interpolation = cv2.INTER_AREA )
     
-    # convert to float and calc dct
+    return numpy_image_tiny
+    
+def GenerateShapePerceptualHashUInt64sFromTiles( phash_tiles ):
     
-    numpy_image_tiny_float = numpy.float32( numpy_image_tiny )
+    # phash_tiles is a stack of 32x32 greyscale images, and we return one uint64 phash for each
     
-    dct = cv2.dct( numpy_image_tiny_float )
+    if len( phash_tiles ) == 0:
+        
+        return numpy.empty( 0, dtype = 'uint64' )
+        
     
-    # take top left 8x8 of dct
+    # convert to float and take the top left 8x8 of the dct of every tile
+    # this is the very same float32 cv2.dct we have always used, so the phashes are bit-identical to the ones already in the db
+    # a 32x32 dct is cheap--the batch win is in the median and bit packing below
     
-    dct_88 = dct[:8,:8]
+    dct_88s = numpy.array( [ cv2.dct( numpy.float32( phash_tile ) )[ :8, :8 ] for phash_tile in phash_tiles ] )
+    
+    dct_64s = dct_88s.reshape( ( -1, 64 ) )
     
     # get median of dct
     # exclude [0,0], which represents flat colour
     # this [0,0] exclusion is apparently important for mean, but maybe it ain't so important for median--w/e
     
-    # old mean code
-    # mask = numpy.ones( ( 8, 8 ) )
-    # mask[0,0] = 0
-    # average = numpy.average( dct_88, weights = mask )
-    
-    median = numpy.median( dct_88.reshape( 64 )[1:] )
+    medians = numpy.median( dct_64s[ :, 1: ], axis = 1 )
     
     # make a monochromatic, 64-bit hash of whether the entry is above or below the median
     
-    dct_88_boolean = dct_88 > median
-    
-    # convert TTTFTFTF to 11101010 by repeatedly shifting answer and adding 0 or 1
-    # you can even go ( a << 1 ) + b and leave out the initial param on the reduce call as bools act like ints for this
-    # but let's not go crazy for another two nanoseconds
-    def collapse_bools_to_binary_uint( a, b ):
-        
-        return ( a << 1 ) + int( b )
-        
+    dct_64s_boolean = dct_64s > medians[ :, None ]
     
-    bytes = []
+    # packbits puts the first bool in the high bit, so TTTFTFTF becomes 11101010, and the 8 bytes read big-endian give the uint64
     
-    for i in range( 8 ):
-        
-        '''
-        # old way of doing it, which compared value to median every time
-        byte = 0
-        
-        for j in range( 8 ):
-            
-            byte <<= 1 # shift byte one left
-            
-            value = dct_88[i,j]
-            
-            if value > median:
-                
-                byte |= 1
-                
-            
-        '''
-        
-        byte = reduce( collapse_bools_to_binary_uint, dct_88_boolean[i], 0 )
-        
-        bytes.append( byte )
-        
-    
-    phash = str( bytearray( bytes ) )
-    
-    # now discard the blank hash, which is 1000000... and not useful
-    
-    phashes = set()
-    
-    phashes.add( phash )
-    
-    phashes.discard( CC.BLANK_PHASH )
-    
-    # we good
+    phash_bytes = numpy.packbits( dct_64s_boolean, axis = 1 )
     
-    return phashes
+    return phash_bytes.view( '>u8' ).reshape( -1 ).astype( 'uint64' )
     
 def GenerateThumbnailFromStaticImageCV( path, dimensions = HC.UNSCALED_THUMBNAIL_DIMENSIONS, mime = None ):
     
@@ -261,6 +267,17 @@ def GenerateThumbnailFromStaticImageCV( path, dimensions = HC.UNSCALED_THUMBNAIL
     
     numpy_image = GenerateNumpyImage( path, mime )
     
+    thumbnail = GenerateThumbnailFromNumPyImage( numpy_image, dimensions, mime )
+    
+    if thumbnail is None:
+        
+        return HydrusFileHandling.GenerateThumbnailFromStaticImagePIL( path, dimensions, mime )
+        
+    
+    return thumbnail
+    
+def GenerateThumbnailFromNumPyImage( numpy_image, dimensions, mime ):
+    
     thumbnail_numpy_image = EfficientlyThumbnailNumpyImage( numpy_image, dimensions )
     
     ( im_y, im_x, depth ) = thumbnail_numpy_image.shape
@@ -299,13 +316,41 @@ def GenerateThumbnailFromStaticImageCV( path, dimensions = HC.UNSCALED_THUMBNAIL
         
     else:
         
-        return HydrusFileHandling.GenerateThumbnailFromStaticImagePIL( path, dimensions, mime )
+        return None
         
     
+def GenerateThumbnailAndShapePerceptualHashes( path, mime, dimensions = HC.UNSCALED_THUMBNAIL_DIMENSIONS ):
+    
+    # for the static images we can phash, decode the file once and make both from the same pixels
+    
+    numpy_image = GenerateNumpyImage( path, mime )
+    
+    thumbnail = GenerateThumbnailFromNumPyImage( numpy_image, dimensions, mime )
+    
+    if thumbnail is None:
+        
+        thumbnail = HydrusFileHandling.GenerateThumbnailFromStaticImagePIL( path, dimensions, mime )
+        
+    
+    phashes = GenerateShapePerceptualHashesFromNumPyImage( numpy_image )
+    
+    return ( thumbnail, phashes )
+    
 import HydrusFileHandling
 
 HydrusFileHandling.GenerateThumbnailFromStaticImage = GenerateThumbnailFromStaticImageCV
     
+def GetCVImReadFlags( mime ):
+    
+    if mime == HC.IMAGE_JPEG:
+        
+        return CV_IMREAD_FLAGS_SUPPORTS_EXIF_REORIENTATION
+        
+    else:
+        
+        return CV_IMREAD_FLAGS_SUPPORTS_ALPHA
+        
+    
 def ResizeNumpyImage( mime, numpy_image, ( target_x, target_y ) ):
     
     new_options = HG.client_controller.new_options
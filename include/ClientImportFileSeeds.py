@@ -147,7 +147,7 @@ def GenerateStatusesToCountsStatus( statuses_to_counts ):
     
 class FileImportJob( object ):
     
-    def __init__( self, temp_path, file_import_options = None ):
+    def __init__( self, temp_path, file_import_options = None, file_hasher = None ):
         
         if file_import_options is None:
             
@@ -165,6 +165,10 @@ class FileImportJob( object ):
         self._phashes = None
         self._extra_hashes = None
         
+        # a download or a local copy may have hashed the file on its way in, which saves us reading it again
+        
+        self._file_hasher = file_hasher
+        
     
     def CheckIsGoodToImport( self ):
         
@@ -250,7 +254,14 @@ class FileImportJob( object ):
         
         HydrusImageHandling.ConvertToPngIfBmp( self._temp_path )
         
-        self._hash = HydrusFileHandling.GetHashFromPath( self._temp_path )
+        if self._file_hasher is None or self._file_hasher.GetMime() == HC.IMAGE_BMP:
+            
+            # a bmp has just been rewritten as a png, so anything we were given is out of date
+            
+            self._file_hasher = HydrusFileHandling.GetFileHasherFromPath( self._temp_path )
+            
+        
+        self._hash = self._file_hasher.GetHash()
         
         ( self._pre_import_status, hash, note ) = HG.client_controller.Read( 'hash_status', 'sha256', self._hash, prefix = 'recognised during import' )
         
@@ -259,7 +270,12 @@ class FileImportJob( object ):
     
     def GenerateInfo( self ):
         
-        mime = HydrusFileHandling.GetMime( self._temp_path )
+        mime = self._file_hasher.GetMime()
+        
+        if mime is None:
+            
+            mime = HydrusFileHandling.GetMime( self._temp_path )
+            
         
         new_options = HG.client_controller.new_options
         
@@ -275,19 +291,18 @@ class FileImportJob( object ):
         
         ( size, mime, width, height, duration, num_frames, num_words ) = self._file_info
         
-        if mime in HC.MIMES_WITH_THUMBNAILS:
+        if mime in HC.MIMES_WE_CAN_PHASH:
             
-            percentage_in = HG.client_controller.new_options.GetInteger( 'video_thumbnail_percentage_in' )
+            ( self._thumbnail, self._phashes ) = ClientImageHandling.GenerateThumbnailAndShapePerceptualHashes( self._temp_path, mime )
             
-            self._thumbnail = HydrusFileHandling.GenerateThumbnail( self._temp_path, mime, percentage_in = percentage_in )
+        elif mime in HC.MIMES_WITH_THUMBNAILS:
             
-        
-        if mime in HC.MIMES_WE_CAN_PHASH:
+            percentage_in = HG.client_controller.new_options.GetInteger( 'video_thumbnail_percentage_in' )
             
-            self._phashes = ClientImageHandling.GenerateShapePerceptualHashes( self._temp_path, mime )
+            self._thumbnail = HydrusFileHandling.GenerateThumbnail( self._temp_path, mime, percentage_in = percentage_in )
             
         
-        self._extra_hashes = HydrusFileHandling.GetExtraHashesFromPath( self._temp_path )
+        self._extra_hashes = self._file_hasher.GetExtraHashes()
         
     
 FILE_SEED_TYPE_HDD = 0
@@ -531,7 +546,7 @@ class FileSeed( HydrusSerialisable.SerialisableBase ):
                 network_job.WaitUntilDone()
                 
             
-            self.Import( temp_path, file_import_options )
+            self.Import( temp_path, file_import_options, file_hasher = network_job.GetFileHasher() )
             
         finally:
             
@@ -575,9 +590,9 @@ class FileSeed( HydrusSerialisable.SerialisableBase ):
         return self.GetHash() is not None
         
     
-    def Import( self, temp_path, file_import_options ):
+    def Import( self, temp_path, file_import_options, file_hasher = None ):
         
-        file_import_job = FileImportJob( temp_path, file_import_options )
+        file_import_job = FileImportJob( temp_path, file_import_options, file_hasher = file_hasher )
         
         ( status, hash, note ) = HG.client_controller.client_files_manager.ImportFile( file_import_job )
         
@@ -615,14 +630,20 @@ class FileSeed( HydrusSerialisable.SerialisableBase ):
             
             try:
                 
-                copied = HydrusPaths.MirrorFile( path, temp_path )
-                
-                if not copied:
+                try:
+                    
+                    file_hasher = HydrusFileHandling.CopyAndHashFile( path, temp_path )
+                    
+                except Exception as e:
+                    
+                    HydrusData.ShowText( 'Trying to copy ' + path + ' to ' + temp_path + ' caused the following problem:' )
+                    
+                    HydrusData.ShowException( e )
                     
                     raise Exception( 'File failed to copy to temp path--see log for error.' )
                     
                 
-                self.Import( temp_path, file_import_options )
+                self.Import( temp_path, file_import_options, file_hasher = file_hasher )
                 
             finally:
                 
@@ -49,7 +49,7 @@ class HydrusResourceBooruFile( HydrusResourceBooru ):
         
         path = client_files_manager.GetFilePath( hash, mime )
         
-        response_context = HydrusServerResources.ResponseContext( 200, mime = mime, path = path )
+        response_context = HydrusServerResources.ResponseContext( 200, mime = mime, path = path, etag = hash.encode( 'hex' ) )
         
         return response_context
         
@@ -265,7 +265,7 @@ class HydrusResourceBooruThumbnail( HydrusResourceBooru ):
             path = os.path.join( HC.STATIC_DIR, 'hydrus.png' )
             
         
-        response_context = HydrusServerResources.ResponseContext( 200, mime = response_context_mime, path = path )
+        response_context = HydrusServerResources.ResponseContext( 200, mime = response_context_mime, path = path, etag = hash.encode( 'hex' ) )
         
         return response_context
         
@@ -280,7 +280,7 @@ class HydrusResourceLocalFile( HydrusServerResources.HydrusResource ):
         
         path = client_files_manager.GetFilePath( hash )
         
-        response_context = HydrusServerResources.ResponseContext( 200, mime = HC.APPLICATION_UNKNOWN, path = path )
+        response_context = HydrusServerResources.ResponseContext( 200, mime = HC.APPLICATION_UNKNOWN, path = path, etag = hash.encode( 'hex' ) )
         
         return response_context
         
@@ -295,7 +295,7 @@ class HydrusResourceLocalThumbnail( HydrusServerResources.HydrusResource ):
         
         path = client_files_manager.GetFullSizeThumbnailPath( hash )
         
-        response_context = HydrusServerResources.ResponseContext( 200, mime = HC.APPLICATION_UNKNOWN, path = path )
+        response_context = HydrusServerResources.ResponseContext( 200, mime = HC.APPLICATION_UNKNOWN, path = path, etag = hash.encode( 'hex' ) )
         
         return response_context
         
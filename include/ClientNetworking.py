@@ -41,8 +41,6 @@ job_status_str_lookup[ JOB_STATUS_RUNNING ] = 'running'
 
 class NetworkEngine( object ):
     
-    MAX_JOBS = 10 # turn this into an option
-    
     def __init__( self, controller, bandwidth_manager, session_manager, domain_manager, login_manager ):
         
         self.controller = controller
@@ -271,42 +269,85 @@ class NetworkEngine( object ):
                 
             
         
-        def ProcessReadyJob( job ):
+        def ProcessReadyJobs():
             
-            if job.IsDone():
+            # each domain gets a few slots, so one slow server cannot hog them all
+            # then each downloader page, subscription, watcher and hydrus service takes its turn at the free slots, so a big queue cannot starve the others
+            # within a turn, login and one-off jobs go first, and then it is first come, first served
+            
+            self._jobs_awaiting_slot = [ job for job in self._jobs_awaiting_slot if not job.IsDone() ]
+            
+            if len( self._jobs_awaiting_slot ) == 0:
                 
-                return False
+                return
                 
-            elif len( self._jobs_running ) < self.MAX_JOBS:
+            
+            if self._pause_all_new_network_traffic:
                 
-                if self._pause_all_new_network_traffic:
+                for job in self._jobs_awaiting_slot:
                     
                     job.SetStatus( u'all new network traffic is paused\u2026' )
                     
-                    return True
-                    
-                elif self.controller.JustWokeFromSleep():
+                
+                return
+                
+            elif self.controller.JustWokeFromSleep():
+                
+                for job in self._jobs_awaiting_slot:
                     
                     job.SetStatus( u'looks like computer just woke up, waiting a bit' )
                     
-                    return True
-                    
-                else:
-                    
-                    self.controller.CallToThread( job.Start )
-                    
-                    self._jobs_running.append( job )
+                
+                return
+                
+            
+            max_jobs = self.controller.new_options.GetInteger( 'max_network_jobs' )
+            max_jobs_per_domain = self.controller.new_options.GetInteger( 'max_network_jobs_per_domain' )
+            
+            self.session_manager.SetConnectionPoolSize( max_jobs_per_domain )
+            
+            slot_contexts_to_num_running = collections.Counter( ( job.GetSlotNetworkContext() for job in self._jobs_running ) )
+            queue_contexts_to_num_running = collections.Counter( ( job.GetQueueNetworkContext() for job in self._jobs_running ) )
+            
+            waiting_jobs = [ ( job.GetPriority(), i, job.GetSlotNetworkContext(), job.GetQueueNetworkContext(), job ) for ( i, job ) in enumerate( self._jobs_awaiting_slot ) ]
+            
+            while len( self._jobs_running ) < max_jobs:
+                
+                startable_jobs = [ row for row in waiting_jobs if slot_contexts_to_num_running[ row[2] ] < max_jobs_per_domain ]
+                
+                if len( startable_jobs ) == 0:
                     
-                    return False
+                    break
                     
                 
-            else:
+                row = min( startable_jobs, key = lambda ( priority, i, slot_context, queue_context, job ): ( priority, queue_contexts_to_num_running[ queue_context ], i ) )
                 
-                job.SetStatus( u'waiting for download slot\u2026' )
+                waiting_jobs.remove( row )
                 
-                return True
+                ( priority, i, slot_context, queue_context, job ) = row
+                
+                self.controller.CallToThread( job.Start )
+                
+                self._jobs_running.append( job )
+                
+                slot_contexts_to_num_running[ slot_context ] += 1
+                queue_contexts_to_num_running[ queue_context ] += 1
                 
             
+            for ( priority, i, slot_context, queue_context, job ) in waiting_jobs:
+                
+                if slot_contexts_to_num_running[ slot_context ] >= max_jobs_per_domain:
+                    
+                    job.SetStatus( u'waiting for a slot on ' + slot_context.ToUnicode() + u'\u2026' )
+                    
+                else:
+                    
+                    job.SetStatus( u'waiting for download slot\u2026' )
+                    
+                
+            
+            self._jobs_awaiting_slot = [ job for ( priority, i, slot_context, queue_context, job ) in waiting_jobs ]
+            
         
         def ProcessRunningJob( job ):
             
@@ -336,10 +377,12 @@ class NetworkEngine( object ):
                 
                 ProcessCurrentLoginJob()
                 
-                self._jobs_awaiting_slot = filter( ProcessReadyJob, self._jobs_awaiting_slot )
+                # clearing out the finished jobs first frees their slots for this pass
                 
                 self._jobs_running = filter( ProcessRunningJob, self._jobs_running )
                 
+                ProcessReadyJobs()
+                
             
             # we want to catch the rollover of the second for bandwidth jobs
             
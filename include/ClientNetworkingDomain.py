@@ -132,6 +132,27 @@ def ConvertURLMatchesIntoAPIPairs( url_matches ):
     
     return pairs
     
+def ConvertURLIntoComponents( url ):
+    
+    # the bits of a url a url class tests, so we only have to parse it once to test it against many
+    
+    p = urlparse.urlparse( url )
+    
+    url_path = p.path
+    
+    while url_path.startswith( '/' ):
+        
+        url_path = url_path[ 1 : ]
+        
+    
+    url_path_components = url_path.split( '/' )
+    
+    url_parameters_list = urlparse.parse_qsl( p.query )
+    
+    url_parameters = dict( url_parameters_list )
+    
+    return ( p, url_path_components, url_parameters )
+    
 def ConvertURLIntoDomain( url ):
     
     parser_result = urlparse.urlparse( url )
@@ -272,7 +293,7 @@ class NetworkDomainManager( HydrusSerialisable.SerialisableBase ):
         self._url_match_keys_to_display = set()
         self._url_match_keys_to_parser_keys = HydrusSerialisable.SerialisableBytesDictionary()
         
-        self._domains_to_url_matches = collections.defaultdict( list )
+        self._url_match_index = URLMatchIndex( [] )
         
         import ClientImportOptions
         
@@ -434,28 +455,7 @@ class NetworkDomainManager( HydrusSerialisable.SerialisableBase ):
     
     def _GetURLMatch( self, url ):
         
-        domain = ConvertDomainIntoSecondLevelDomain( ConvertURLIntoDomain( url ) )
-        
-        if domain in self._domains_to_url_matches:
-            
-            url_matches = self._domains_to_url_matches[ domain ]
-            
-            for url_match in url_matches:
-                
-                try:
-                    
-                    url_match.Test( url )
-                    
-                    return url_match
-                    
-                except HydrusExceptions.URLMatchException:
-                    
-                    continue
-                    
-                
-            
-        
-        return None
+        return self._url_match_index.GetURLMatch( url )
         
     
     def _InitialiseFromSerialisableInfo( self, serialisable_info ):
@@ -489,19 +489,25 @@ class NetworkDomainManager( HydrusSerialisable.SerialisableBase ):
     
     def _RecalcCache( self ):
         
-        self._domains_to_url_matches = collections.defaultdict( list )
+        domains_to_url_matches = collections.defaultdict( list )
         
         for url_match in self._url_matches:
             
             domain = url_match.GetDomain()
             
-            self._domains_to_url_matches[ domain ].append( url_match )
+            domains_to_url_matches[ domain ].append( url_match )
             
         
-        for url_matches in self._domains_to_url_matches.values():
+        sorted_url_matches = []
+        
+        for url_matches in domains_to_url_matches.values():
             
             NetworkDomainManager.STATICSortURLMatchesDescendingComplexity( url_matches )
             
+            sorted_url_matches.extend( url_matches )
+            
+        
+        self._url_match_index = URLMatchIndex( sorted_url_matches )
         
         self._parser_keys_to_parsers = {}
         
@@ -1713,7 +1719,12 @@ class URLMatch( HydrusSerialisable.SerialisableBaseNamed ):
     
     def Test( self, url ):
         
-        p = urlparse.urlparse( url )
+        ( p, url_path_components, url_parameters ) = ConvertURLIntoComponents( url )
+        
+        self.TestComponents( p, url_path_components, url_parameters )
+        
+    
+    def TestComponents( self, p, url_path_components, url_parameters ):
         
         if self._match_subdomains:
             
@@ -1730,17 +1741,10 @@ class URLMatch( HydrusSerialisable.SerialisableBaseNamed ):
                 
             
         
-        url_path = p.path
-        
-        while url_path.startswith( '/' ):
-            
-            url_path = url_path[ 1 : ]
-            
-        
-        url_path_components = url_path.split( '/' )
-        
         if len( url_path_components ) < len( self._path_components ):
             
+            url_path = '/'.join( url_path_components )
+            
             raise HydrusExceptions.URLMatchException( url_path + ' did not have ' + str( len( self._path_components ) ) + ' components' )
             
         
@@ -1756,10 +1760,6 @@ class URLMatch( HydrusSerialisable.SerialisableBaseNamed ):
                 
             
         
-        url_parameters_list = urlparse.parse_qsl( p.query )
-        
-        url_parameters = dict( url_parameters_list )
-        
         if len( url_parameters ) < len( self._parameters ):
             
             raise HydrusExceptions.URLMatchException( p.query + ' did not have ' + str( len( self._parameters ) ) + ' parameters' )
@@ -1797,3 +1797,158 @@ class URLMatch( HydrusSerialisable.SerialisableBaseNamed ):
     
 HydrusSerialisable.SERIALISABLE_TYPES_TO_OBJECT_TYPES[ HydrusSerialisable.SERIALISABLE_TYPE_URL_MATCH ] = URLMatch
 
+class URLMatchIndex( object ):
+    
+    # testing every url class for a domain means a parse and an exception per miss, and we look up a lot of urls
+    # so we parse the url once, look up candidates by netloc and first path component, and quickly check path length, literal path components and parameter keys before doing a full test
+    # url_matches should be in the order they are to be tried
+    
+    CACHE_SIZE = 2000
+    
+    def __init__( self, url_matches ):
+        
+        self._url_matches = list( url_matches )
+        
+        self._keys_to_positions = collections.defaultdict( list )
+        self._quick_test_infos = []
+        
+        for ( position, url_match ) in enumerate( self._url_matches ):
+            
+            ( url_type, preferred_scheme, netloc, match_subdomains, keep_matched_subdomains, path_components, parameters, api_lookup_converter, can_produce_multiple_files, should_be_associated_with_files, example_url ) = url_match.ToTuple()
+            
+            literal_path_components = []
+            
+            for ( i, string_match ) in enumerate( path_components ):
+                
+                ( match_type, match_value, min_chars, max_chars, example_string ) = string_match.ToTuple()
+                
+                if match_type == ClientParsing.STRING_MATCH_FIXED:
+                    
+                    literal_path_components.append( ( i, match_value ) )
+                    
+                
+            
+            if len( literal_path_components ) > 0 and literal_path_components[0][0] == 0:
+                
+                ( i, first_path_component ) = literal_path_components[0]
+                
+            else:
+                
+                first_path_component = None
+                
+            
+            self._keys_to_positions[ ( netloc, match_subdomains, first_path_component ) ].append( position )
+            
+            self._quick_test_infos.append( ( len( path_components ), literal_path_components, parameters.keys() ) )
+            
+        
+        self._urls_to_url_matches = collections.OrderedDict()
+        
+    
+    def _GetCandidatePositions( self, netloc, url_path_components ):
+        
+        netloc_keys = [ ( netloc, False ) ]
+        
+        # non-subdomain url classes forgive a www., www2. or similar
+        
+        m = re.search( r'^www[^\.]*\.', netloc )
+        
+        if m is not None:
+            
+            netloc_keys.append( ( netloc[ m.end() : ], False ) )
+            
+        
+        # subdomain url classes match their netloc or anything that ends with '.' + it
+        
+        netloc_components = netloc.split( '.' )
+        
+        for i in range( len( netloc_components ) ):
+            
+            netloc_keys.append( ( '.'.join( netloc_components[ i : ] ), True ) )
+            
+        
+        positions = set()
+        
+        for ( netloc_key, match_subdomains ) in netloc_keys:
+            
+            for first_path_component in ( url_path_components[0], None ):
+                
+                key = ( netloc_key, match_subdomains, first_path_component )
+                
+                if key in self._keys_to_positions:
+                    
+                    positions.update( self._keys_to_positions[ key ] )
+                    
+                
+            
+        
+        return sorted( positions )
+        
+    
+    def _GetURLMatch( self, url ):
+        
+        # this raises URLMatchException on a url we cannot understand, as the old domain lookup did
+        
+        ConvertDomainIntoSecondLevelDomain( ConvertURLIntoDomain( url ) )
+        
+        ( p, url_path_components, url_parameters ) = ConvertURLIntoComponents( url )
+        
+        for position in self._GetCandidatePositions( p.netloc, url_path_components ):
+            
+            ( num_path_components, literal_path_components, parameter_keys ) = self._quick_test_infos[ position ]
+            
+            if len( url_path_components ) < num_path_components:
+                
+                continue
+                
+            
+            if True in ( url_path_components[ i ] != value for ( i, value ) in literal_path_components ):
+                
+                continue
+                
+            
+            if True in ( key not in url_parameters for key in parameter_keys ):
+                
+                continue
+                
+            
+            url_match = self._url_matches[ position ]
+            
+            try:
+                
+                url_match.TestComponents( p, url_path_components, url_parameters )
+                
+                return url_match
+                
+            except HydrusExceptions.URLMatchException:
+                
+                continue
+                
+            
+        
+        return None
+        
+    
+    def GetURLMatch( self, url ):
+        
+        if url in self._urls_to_url_matches:
+            
+            url_match = self._urls_to_url_matches.pop( url )
+            
+        else:
+            
+            url_match = self._GetURLMatch( url )
+            
+            while len( self._urls_to_url_matches ) >= self.CACHE_SIZE:
+                
+                self._urls_to_url_matches.popitem( last = False )
+                
+            
+        
+        # most recently used goes to the end
+        
+        self._urls_to_url_matches[ url ] = url_match
+        
+        return url_match
+        
+    
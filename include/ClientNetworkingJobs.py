@@ -5,6 +5,7 @@ import ClientNetworkingDomain
 import HydrusConstants as HC
 import HydrusData
 import HydrusExceptions
+import HydrusFileHandling
 import HydrusGlobals as HG
 import HydrusNetworking
 import os
@@ -78,10 +79,62 @@ def ConvertStatusCodeAndDataIntoExceptionInfo( status_code, data, is_hydrus_serv
     
     return ( e, error_text )
     
+def GetResumeValidator( response ):
+    
+    # a server that takes ranges and tells us how to check the file has not changed lets us pick up a broken download where it stopped
+    # returns ( header, value ) for an If-Range, or None
+    
+    if response.headers.get( 'Accept-Ranges', '' ).lower() != 'bytes':
+        
+        return None
+        
+    
+    etag = response.headers.get( 'ETag', None )
+    
+    # If-Range only works with a strong etag
+    
+    if etag is not None and not etag.startswith( 'W/' ):
+        
+        return ( 'ETag', etag )
+        
+    
+    if 'Last-Modified' in response.headers:
+        
+        return ( 'Last-Modified', response.headers[ 'Last-Modified' ] )
+        
+    
+    return None
+    
+def ResponseContinuesDownload( response, resume_offset, resume_validator ):
+    
+    if response.status_code != 206:
+        
+        return False
+        
+    
+    if not response.headers.get( 'Content-Range', '' ).startswith( 'bytes ' + str( resume_offset ) + '-' ):
+        
+        return False
+        
+    
+    # If-Range should have covered this, but not every server gets it right
+    
+    ( header, value ) = resume_validator
+    
+    if header in response.headers and response.headers[ header ] != value:
+        
+        return False
+        
+    
+    return True
+    
 class NetworkJob( object ):
     
     IS_HYDRUS_SERVICE = False
     
+    # one-off jobs are usually something the user is waiting on, so they go ahead of the big queues
+    PRIORITY = HC.HIGH_PRIORITY
+    
     def __init__( self, method, url, body = None, referral_url = None, temp_path = None ):
         
         self.engine = None
@@ -129,6 +182,11 @@ class NetworkJob( object ):
         self._num_bytes_to_read = 1
         
         self._file_import_options = None
+        self._file_hasher = None
+        
+        # what we have of a broken download, and how to ask the server for the rest
+        self._partial_file_hasher = None
+        self._resume_validator = None
         
         self._network_contexts = self._GenerateNetworkContexts()
         
@@ -156,6 +214,12 @@ class NetworkJob( object ):
         return self._current_connection_attempt_number <= max_attempts_allowed
         
     
+    def _ClearPartialDownload( self ):
+        
+        self._partial_file_hasher = None
+        self._resume_validator = None
+        
+    
     def _GenerateNetworkContexts( self ):
         
         network_contexts = []
@@ -212,6 +276,16 @@ class NetworkJob( object ):
                 headers[ key ] = value
                 
             
+            resume_offset = self._GetResumeOffset()
+            
+            if resume_offset > 0:
+                
+                ( header, value ) = self._resume_validator
+                
+                headers[ 'Range' ] = 'bytes=' + str( resume_offset ) + '-'
+                headers[ 'If-Range' ] = value
+                
+            
             self._status_text = u'sending request\u2026'
             
         
@@ -224,6 +298,16 @@ class NetworkJob( object ):
         return response
         
     
+    def _GetResumeOffset( self ):
+        
+        if self._partial_file_hasher is None or self._resume_validator is None:
+            
+            return 0
+            
+        
+        return self._partial_file_hasher.GetNumBytes()
+        
+    
     def _GetSession( self ):
         
         return self.engine.session_manager.GetSession( self._session_network_context )
@@ -305,10 +389,12 @@ class NetworkJob( object ):
             
         
     
-    def _ReadResponse( self, response, stream_dest, max_allowed = None ):
+    def _ReadResponse( self, response, stream_dest, max_allowed = None, file_hasher = None, num_bytes_already_read = 0 ):
         
         with self._lock:
             
+            self._num_bytes_read = num_bytes_already_read
+            
             if self._content_type is not None and self._content_type in HC.mime_enum_lookup:
                 
                 mime = HC.mime_enum_lookup[ self._content_type ]
@@ -319,8 +405,8 @@ class NetworkJob( object ):
                 
             
             if 'content-length' in response.headers:
-            
-                self._num_bytes_to_read = int( response.headers[ 'content-length' ] )
+                
+                self._num_bytes_to_read = num_bytes_already_read + int( response.headers[ 'content-length' ] )
                 
                 if max_allowed is not None and self._num_bytes_to_read > max_allowed:
                     
@@ -349,6 +435,11 @@ class NetworkJob( object ):
             
             stream_dest.write( chunk )
             
+            if file_hasher is not None:
+                
+                file_hasher.Update( chunk )
+                
+            
             chunk_length = len( chunk )
             
             with self._lock:
@@ -604,6 +695,16 @@ class NetworkJob( object ):
             
         
     
+    def GetFileHasher( self ):
+        
+        # only set once the whole file has come in
+        
+        with self._lock:
+            
+            return self._file_hasher
+            
+        
+    
     def GetNetworkContexts( self ):
         
         with self._lock:
@@ -612,6 +713,38 @@ class NetworkJob( object ):
             
         
     
+    def GetPriority( self ):
+        
+        with self._lock:
+            
+            # other jobs may be waiting on a login
+            
+            if self._for_login:
+                
+                return HC.HIGH_PRIORITY
+                
+            
+            return self.PRIORITY
+            
+        
+    
+    def GetQueueNetworkContext( self ):
+        
+        # jobs with the same queue context take turns with other queues for the download slots
+        
+        return ClientNetworkingContexts.GLOBAL_NETWORK_CONTEXT
+        
+    
+    def GetSlotNetworkContext( self ):
+        
+        # jobs with the same slot context share a connection limit and a session's keep-alive connections
+        
+        with self._lock:
+            
+            return self._session_network_context
+            
+        
+    
     def GetStatus( self ):
         
         with self._lock:
@@ -778,8 +911,23 @@ class NetworkJob( object ):
                 
                 try:
                     
+                    with self._lock:
+                        
+                        resume_offset = self._GetResumeOffset()
+                        
+                    
                     response = self._SendRequestAndGetResponse()
                     
+                    if resume_offset > 0 and response.status_code == 416:
+                        
+                        with self._lock:
+                            
+                            self._ClearPartialDownload()
+                            
+                        
+                        raise HydrusExceptions.ShouldReattemptNetworkException( 'Server would not resume the download.' )
+                        
+                    
                     with self._lock:
                         
                         if self._body is not None:
@@ -806,9 +954,66 @@ class NetworkJob( object ):
                             
                         else:
                             
-                            with open( self._temp_path, 'wb' ) as f:
+                            with self._lock:
+                                
+                                if resume_offset > 0 and ResponseContinuesDownload( response, resume_offset, self._resume_validator ):
+                                    
+                                    file_hasher = self._partial_file_hasher
+                                    
+                                    num_bytes_already_read = resume_offset
+                                    
+                                elif response.status_code == 206:
+                                    
+                                    self._ClearPartialDownload()
+                                    
+                                    raise HydrusExceptions.ShouldReattemptNetworkException( 'Server sent the wrong part of the file.' )
+                                    
+                                else:
+                                    
+                                    # we hash as the file comes in, so the import does not have to read it all again
+                                    
+                                    file_hasher = HydrusFileHandling.FileHasher()
+                                    
+                                    num_bytes_already_read = 0
+                                    
+                                    if self._method == 'GET':
+                                        
+                                        self._resume_validator = GetResumeValidator( response )
+                                        
+                                    
                                 
-                                self._ReadResponse( response, f )
+                                # if the read breaks, the hasher knows how much of the file we have
+                                
+                                self._partial_file_hasher = file_hasher
+                                
+                            
+                            if num_bytes_already_read > 0:
+                                
+                                open_mode = 'r+b'
+                                
+                            else:
+                                
+                                open_mode = 'wb'
+                                
+                            
+                            with open( self._temp_path, open_mode ) as f:
+                                
+                                # anything past what we hashed is junk from the broken read
+                                
+                                f.seek( num_bytes_already_read )
+                                f.truncate()
+                                
+                                self._ReadResponse( response, f, file_hasher = file_hasher, num_bytes_already_read = num_bytes_already_read )
+                                
+                            
+                            with self._lock:
+                                
+                                self._ClearPartialDownload()
+                                
+                                if not self._IsCancelled():
+                                    
+                                    self._file_hasher = file_hasher
+                                    
                                 
                             
                         
@@ -975,6 +1180,8 @@ class NetworkJob( object ):
     
 class NetworkJobDownloader( NetworkJob ):
     
+    PRIORITY = HC.LOW_PRIORITY
+    
     def __init__( self, downloader_page_key, method, url, body = None, referral_url = None, temp_path = None ):
         
         self._downloader_page_key = downloader_page_key
@@ -991,8 +1198,15 @@ class NetworkJobDownloader( NetworkJob ):
         return network_contexts
         
     
+    def GetQueueNetworkContext( self ):
+        
+        return ClientNetworkingContexts.NetworkContext( CC.NETWORK_CONTEXT_DOWNLOADER_PAGE, self._downloader_page_key )
+        
+    
 class NetworkJobSubscription( NetworkJob ):
     
+    PRIORITY = HC.LOW_PRIORITY
+    
     def __init__( self, subscription_key, method, url, body = None, referral_url = None, temp_path = None ):
         
         self._subscription_key = subscription_key
@@ -1009,9 +1223,15 @@ class NetworkJobSubscription( NetworkJob ):
         return network_contexts
         
     
+    def GetQueueNetworkContext( self ):
+        
+        return ClientNetworkingContexts.NetworkContext( CC.NETWORK_CONTEXT_SUBSCRIPTION, self._subscription_key )
+        
+    
 class NetworkJobHydrus( NetworkJob ):
     
     IS_HYDRUS_SERVICE = True
+    PRIORITY = HC.LOW_PRIORITY
     
     def __init__( self, service_key, method, url, body = None, referral_url = None, temp_path = None ):
         
@@ -1111,8 +1331,15 @@ class NetworkJobHydrus( NetworkJob ):
         return response
         
     
+    def GetQueueNetworkContext( self ):
+        
+        return ClientNetworkingContexts.NetworkContext( CC.NETWORK_CONTEXT_HYDRUS, self._service_key )
+        
+    
 class NetworkJobWatcherPage( NetworkJob ):
     
+    PRIORITY = HC.LOW_PRIORITY
+    
     def __init__( self, watcher_key, method, url, body = None, referral_url = None, temp_path = None ):
         
         self._watcher_key = watcher_key
@@ -1129,3 +1356,8 @@ class NetworkJobWatcherPage( NetworkJob ):
         return network_contexts
         
     
+    def GetQueueNetworkContext( self ):
+        
+        return ClientNetworkingContexts.NetworkContext( CC.NETWORK_CONTEXT_WATCHER_PAGE, self._watcher_key )
+        
+    
@@ -29,6 +29,8 @@ class NetworkSessionManager( HydrusSerialisable.SerialisableBase ):
         
         self._network_contexts_to_session_timeouts = {}
         
+        self._connection_pool_size = requests.adapters.DEFAULT_POOLSIZE
+        
     
     def _CleanSessionCookies( self, network_context, session ):
         
@@ -81,6 +83,22 @@ class NetworkSessionManager( HydrusSerialisable.SerialisableBase ):
             
         
     
+    def _MaintainConnectionPool( self, session ):
+        
+        # the engine can run several jobs on one session's domain at once, so the pool has to be able to keep a keep-alive connection for each of them
+        # otherwise urllib3 throws the spare connections away and the next job has to reconnect
+        
+        for prefix in ( 'http://', 'https://' ):
+            
+            adapter = session.get_adapter( prefix )
+            
+            if getattr( adapter, '_pool_maxsize', self._connection_pool_size ) < self._connection_pool_size:
+                
+                session.mount( prefix, requests.adapters.HTTPAdapter( pool_maxsize = self._connection_pool_size ) )
+                
+            
+        
+    
     def _SetDirty( self ):
         
         self._dirty = True
@@ -130,6 +148,8 @@ class NetworkSessionManager( HydrusSerialisable.SerialisableBase ):
             
             self._CleanSessionCookies( network_context, session )
             
+            self._MaintainConnectionPool( session )
+            
             #
             
             # tumblr can't into ssl for some reason, and the data subdomain they use has weird cert properties, looking like amazon S3
@@ -164,4 +184,12 @@ class NetworkSessionManager( HydrusSerialisable.SerialisableBase ):
             
         
     
+    def SetConnectionPoolSize( self, connection_pool_size ):
+        
+        with self._lock:
+            
+            self._connection_pool_size = max( connection_pool_size, requests.adapters.DEFAULT_POOLSIZE )
+            
+        
+    
 HydrusSerialisable.SERIALISABLE_TYPES_TO_OBJECT_TYPES[ HydrusSerialisable.SERIALISABLE_TYPE_NETWORK_SESSION_MANAGER ] = NetworkSessionManager
@@ -70,9 +70,12 @@ class ClientOptions( HydrusSerialisable.SerialisableBase ):
         
         self._dictionary[ 'booleans' ][ 'load_images_with_pil' ] = False
         
+        self._dictionary[ 'booleans' ][ 'pack_resized_thumbnails' ] = False
+        
         self._dictionary[ 'booleans' ][ 'use_system_ffmpeg' ] = False
         
         self._dictionary[ 'booleans' ][ 'maintain_similar_files_duplicate_pairs_during_idle' ] = False
+        self._dictionary[ 'booleans' ][ 'similar_files_use_in_memory_index' ] = False
         
         self._dictionary[ 'booleans' ][ 'show_namespaces' ] = True
         
@@ -109,6 +112,10 @@ class ClientOptions( HydrusSerialisable.SerialisableBase ):
         self._dictionary[ 'booleans' ][ 'highlight_new_watcher' ] = False
         self._dictionary[ 'booleans' ][ 'highlight_new_query' ] = False
         
+        self._dictionary[ 'booleans' ][ 'verify_client_files_migration' ] = False
+        
+        self._dictionary[ 'booleans' ][ 'parse_html_with_lxml' ] = False
+        
         #
         
         self._dictionary[ 'colours' ] = HydrusSerialisable.SerialisableDictionary()
@@ -162,6 +169,8 @@ class ClientOptions( HydrusSerialisable.SerialisableBase ):
         
         self._dictionary[ 'integers' ][ 'video_buffer_size_mb' ] = 96
         
+        self._dictionary[ 'integers' ][ 'tag_search_cache_size_mb' ] = 64
+        
         self._dictionary[ 'integers' ][ 'related_tags_search_1_duration_ms' ] = 250
         self._dictionary[ 'integers' ][ 'related_tags_search_2_duration_ms' ] = 2000
         self._dictionary[ 'integers' ][ 'related_tags_search_3_duration_ms' ] = 6000
@@ -177,6 +186,9 @@ class ClientOptions( HydrusSerialisable.SerialisableBase ):
         
         self._dictionary[ 'integers' ][ 'network_timeout' ] = 10
         
+        self._dictionary[ 'integers' ][ 'max_network_jobs' ] = 15
+        self._dictionary[ 'integers' ][ 'max_network_jobs_per_domain' ] = 3
+        
         self._dictionary[ 'integers' ][ 'thumbnail_visibility_scroll_percent' ] = 75
         
         self._dictionary[ 'integers' ][ 'total_pages_warning' ] = 165
@@ -199,6 +211,8 @@ class ClientOptions( HydrusSerialisable.SerialisableBase ):
         self._dictionary[ 'integers' ][ 'duplicate_comparison_score_more_tags' ] = 8
         self._dictionary[ 'integers' ][ 'duplicate_comparison_score_older' ] = 5
         
+        self._dictionary[ 'integers' ][ 'repository_update_processing_lookahead' ] = 4
+        
         self._dictionary[ 'integers' ][ 'thumbnail_cache_timeout' ] = 86400
         self._dictionary[ 'integers' ][ 'image_cache_timeout' ] = 600
         
@@ -229,6 +243,8 @@ class ClientOptions( HydrusSerialisable.SerialisableBase ):
         
         self._dictionary[ 'noneable_integers' ][ 'last_review_bandwidth_search_distance' ] = 7 * 86400
         
+        self._dictionary[ 'noneable_integers' ][ 'client_files_migration_busy_mb_per_second' ] = 32
+        
         #
         
         self._dictionary[ 'simple_downloader_formulae' ] = HydrusSerialisable.SerialisableList()
@@ -0,0 +1,316 @@
+import mmap
+import os
+import struct
+import threading
+
+# an optional store for the resized thumbnails of one 'r' prefix directory, so a page of thumbs is a few reads of one file rather than thousands of opens
+# the pack file is append-only thumbnail data, and the index file is append-only ( hash, offset, length ) entries, where a later entry for a hash supersedes an earlier one
+# a length of 0 means the hash was deleted
+# this is only a cache--if anything goes wrong, the thumbnails are regenerated from the full size ones
+
+PACK_FILENAME = 'resized_thumbnails.pack'
+INDEX_FILENAME = 'resized_thumbnails.index'
+COMPACTING_SUFFIX = '.compacting'
+
+INDEX_ENTRY_STRUCT = '>32sQI'
+INDEX_ENTRY_SIZE = struct.calcsize( INDEX_ENTRY_STRUCT )
+
+# we rewrite the pack once more than half of it is superseded or deleted data
+MIN_DEAD_BYTES_FOR_COMPACTION = 4 * 1048576
+
+def IsPackedThumbnailFilename( filename ):
+    
+    return filename in ( PACK_FILENAME, INDEX_FILENAME, PACK_FILENAME + COMPACTING_SUFFIX, INDEX_FILENAME + COMPACTING_SUFFIX )
+    
+class PackedThumbnailStore( object ):
+    
+    def __init__( self, dir ):
+        
+        self._pack_path = os.path.join( dir, PACK_FILENAME )
+        self._index_path = os.path.join( dir, INDEX_FILENAME )
+        
+        self._hashes_to_offsets_and_lengths = None
+        self._pack_size = 0
+        self._live_bytes = 0
+        
+        self._mmap = None
+        
+        self._lock = threading.Lock()
+        
+    
+    def _AppendIndexEntries( self, entries ):
+        
+        with open( self._index_path, 'ab' ) as f:
+            
+            f.write( ''.join( ( struct.pack( INDEX_ENTRY_STRUCT, hash, offset, length ) for ( hash, offset, length ) in entries ) ) )
+            
+        
+    
+    def _CloseMMap( self ):
+        
+        if self._mmap is not None:
+            
+            self._mmap.close()
+            
+            self._mmap = None
+            
+        
+    
+    def _Compact( self ):
+        
+        self._CloseMMap()
+        
+        temp_pack_path = self._pack_path + COMPACTING_SUFFIX
+        temp_index_path = self._index_path + COMPACTING_SUFFIX
+        
+        # writing in hash order means a waterfall, which goes in hash order, reads the new pack front to back
+        
+        hashes = sorted( self._hashes_to_offsets_and_lengths.keys() )
+        
+        new_hashes_to_offsets_and_lengths = {}
+        
+        offset = 0
+        
+        with open( self._pack_path, 'rb' ) as source:
+            
+            with open( temp_pack_path, 'wb' ) as dest:
+                
+                for hash in hashes:
+                    
+                    ( old_offset, length ) = self._hashes_to_offsets_and_lengths[ hash ]
+                    
+                    source.seek( old_offset )
+                    
+                    dest.write( source.read( length ) )
+                    
+                    new_hashes_to_offsets_and_lengths[ hash ] = ( offset, length )
+                    
+                    offset += length
+                    
+                
+            
+        
+        with open( temp_index_path, 'wb' ) as f:
+            
+            f.write( ''.join( ( struct.pack( INDEX_ENTRY_STRUCT, hash, new_offset, length ) for ( hash, ( new_offset, length ) ) in new_hashes_to_offsets_and_lengths.items() ) ) )
+            
+        
+        # the index goes first, so a crash halfway leaves us with no index, which is just an empty cache, rather than a bad one
+        
+        os.remove( self._index_path )
+        os.remove( self._pack_path )
+        
+        os.rename( temp_pack_path, self._pack_path )
+        os.rename( temp_index_path, self._index_path )
+        
+        self._hashes_to_offsets_and_lengths = new_hashes_to_offsets_and_lengths
+        self._pack_size = offset
+        
+    
+    def _GetMMap( self, end ):
+        
+        # an mmap does not grow with its file, so we remake it if the pack has been appended to since
+        
+        if self._mmap is None or len( self._mmap ) < end:
+            
+            self._CloseMMap()
+            
+            with open( self._pack_path, 'rb' ) as f:
+                
+                self._mmap = mmap.mmap( f.fileno(), 0, access = mmap.ACCESS_READ )
+                
+            
+        
+        return self._mmap
+        
+    
+    def _InitialiseIndex( self ):
+        
+        if self._hashes_to_offsets_and_lengths is not None:
+            
+            return
+            
+        
+        for path in ( self._pack_path + COMPACTING_SUFFIX, self._index_path + COMPACTING_SUFFIX ):
+            
+            if os.path.exists( path ):
+                
+                os.remove( path )
+                
+            
+        
+        self._hashes_to_offsets_and_lengths = {}
+        
+        if not os.path.exists( self._index_path ) or not os.path.exists( self._pack_path ):
+            
+            for path in ( self._pack_path, self._index_path ):
+                
+                if os.path.exists( path ):
+                    
+                    os.remove( path )
+                    
+                
+            
+            self._pack_size = 0
+            self._live_bytes = 0
+            
+            return
+            
+        
+        self._pack_size = os.path.getsize( self._pack_path )
+        
+        with open( self._index_path, 'rb' ) as f:
+            
+            index_data = f.read()
+            
+        
+        num_entries = len( index_data ) // INDEX_ENTRY_SIZE
+        
+        if num_entries * INDEX_ENTRY_SIZE != len( index_data ):
+            
+            # we were interrupted in the middle of an append, so drop the partial entry
+            
+            with open( self._index_path, 'r+b' ) as f:
+                
+                f.truncate( num_entries * INDEX_ENTRY_SIZE )
+                
+            
+        
+        for i in range( num_entries ):
+            
+            ( hash, offset, length ) = struct.unpack_from( INDEX_ENTRY_STRUCT, index_data, i * INDEX_ENTRY_SIZE )
+            
+            if length == 0 or offset + length > self._pack_size:
+                
+                self._hashes_to_offsets_and_lengths.pop( hash, None )
+                
+            else:
+                
+                self._hashes_to_offsets_and_lengths[ hash ] = ( offset, length )
+                
+            
+        
+        self._live_bytes = sum( ( length for ( offset, length ) in self._hashes_to_offsets_and_lengths.values() ) )
+        
+    
+    def _MaintainPack( self ):
+        
+        dead_bytes = self._pack_size - self._live_bytes
+        
+        if dead_bytes > MIN_DEAD_BYTES_FOR_COMPACTION and dead_bytes > self._live_bytes:
+            
+            self._Compact()
+            
+        
+    
+    def Close( self ):
+        
+        with self._lock:
+            
+            self._CloseMMap()
+            
+            self._hashes_to_offsets_and_lengths = None
+            
+        
+    
+    def DeleteThumbnails( self, hashes ):
+        
+        with self._lock:
+            
+            self._InitialiseIndex()
+            
+            entries = []
+            
+            for hash in hashes:
+                
+                if hash in self._hashes_to_offsets_and_lengths:
+                    
+                    ( offset, length ) = self._hashes_to_offsets_and_lengths[ hash ]
+                    
+                    del self._hashes_to_offsets_and_lengths[ hash ]
+                    
+                    self._live_bytes -= length
+                    
+                    entries.append( ( hash, 0, 0 ) )
+                    
+                
+            
+            if len( entries ) > 0:
+                
+                self._AppendIndexEntries( entries )
+                
+                self._MaintainPack()
+                
+            
+        
+    
+    def GetThumbnails( self, hashes ):
+        
+        # returns hash -> thumbnail bytes for those we have
+        # we read in pack order, so a whole page of thumbs is as close to one sequential read as we can get
+        
+        with self._lock:
+            
+            self._InitialiseIndex()
+            
+            rows = [ ( self._hashes_to_offsets_and_lengths[ hash ], hash ) for hash in hashes if hash in self._hashes_to_offsets_and_lengths ]
+            
+            if len( rows ) == 0:
+                
+                return {}
+                
+            
+            rows.sort()
+            
+            end = max( ( offset + length for ( ( offset, length ), hash ) in rows ) )
+            
+            pack_mmap = self._GetMMap( end )
+            
+            return { hash : pack_mmap[ offset : offset + length ] for ( ( offset, length ), hash ) in rows }
+            
+        
+    
+    def HasThumbnail( self, hash ):
+        
+        with self._lock:
+            
+            self._InitialiseIndex()
+            
+            return hash in self._hashes_to_offsets_and_lengths
+            
+        
+    
+    def SetThumbnail( self, hash, thumbnail ):
+        
+        with self._lock:
+            
+            self._InitialiseIndex()
+            
+            if hash in self._hashes_to_offsets_and_lengths:
+                
+                ( old_offset, old_length ) = self._hashes_to_offsets_and_lengths[ hash ]
+                
+                self._live_bytes -= old_length
+                
+            
+            # data first, so an interrupted append leaves unindexed junk rather than an index entry to nowhere
+            
+            with open( self._pack_path, 'ab' ) as f:
+                
+                f.seek( 0, os.SEEK_END )
+                
+                offset = f.tell()
+                
+                f.write( thumbnail )
+                
+            
+            self._AppendIndexEntries( [ ( hash, offset, len( thumbnail ) ) ] )
+            
+            self._hashes_to_offsets_and_lengths[ hash ] = ( offset, len( thumbnail ) )
+            self._pack_size = offset + len( thumbnail )
+            self._live_bytes += len( thumbnail )
+            
+            self._MaintainPack()
+            
+        
+    
@@ -201,6 +201,8 @@ def GetChildrenContent( job_key, children, data, referral_url ):
     
     content = []
     
+    parse_session = ParseSession()
+    
     for child in children:
         
         try:
@@ -211,7 +213,7 @@ def GetChildrenContent( job_key, children, data, referral_url ):
                 
             elif isinstance( child, ContentParser ):
                 
-                child_content = child.Parse( {}, data )
+                child_content = child.Parse( {}, data, parse_session = parse_session )
                 
             
         except HydrusExceptions.VetoException:
@@ -261,9 +263,13 @@ def GetNamespacesFromParsableContent( parsable_content ):
     
     return namespaces
     
-def GetSoup( html ):
+def GetSoup( html, prefer_lxml = False ):
     
-    if HTML5LIB_IS_OK:
+    if prefer_lxml and LXML_IS_OK:
+        
+        parser = 'lxml'
+        
+    elif HTML5LIB_IS_OK:
         
         parser = 'html5lib'
         
@@ -466,6 +472,146 @@ def RenderJSONParseRule( parse_rule ):
     
     return s
     
+class ParseSession( object ):
+    
+    # one parse of a document, shared by all the formulas that look at it
+    # documents are keyed on the identity of their data, which we hold on to, so a lookup is free however big the page is
+    # html formulas that start with the same rules also share the nodes those rules found
+    # html is parsed with html5lib like everywhere else unless the user has switched on lxml, which is faster but can build a different tree
+    # this is not thread-safe--make a new one for each job
+    
+    def __init__( self, prefer_lxml = None ):
+        
+        if prefer_lxml is None:
+            
+            prefer_lxml = HG.client_controller.new_options.GetBoolean( 'parse_html_with_lxml' )
+            
+        
+        self._prefer_lxml = prefer_lxml
+        
+        self._ids_to_datas_and_soups = {}
+        self._ids_to_datas_and_jsons = {}
+        
+        self._node_keys_to_nodes = {}
+        
+        self._timings = []
+        
+    
+    def GetHTMLNodes( self, html, tag_rules ):
+        
+        root = self.GetSoup( html )
+        
+        nodes = ( root, )
+        
+        rule_keys = ()
+        
+        for tag_rule in tag_rules:
+            
+            rule_keys += ( tag_rule.GetCacheKey(), )
+            
+            node_key = ( id( html ), rule_keys )
+            
+            if node_key not in self._node_keys_to_nodes:
+                
+                self._node_keys_to_nodes[ node_key ] = tag_rule.GetNodes( nodes )
+                
+            
+            nodes = self._node_keys_to_nodes[ node_key ]
+            
+        
+        return nodes
+        
+    
+    def GetJSON( self, json_text ):
+        
+        data_id = id( json_text )
+        
+        if data_id not in self._ids_to_datas_and_jsons:
+            
+            started = HydrusData.GetNowPrecise()
+            
+            j = json.loads( json_text )
+            
+            self.ReportTime( 'parsing the json', HydrusData.GetNowPrecise() - started )
+            
+            self._ids_to_datas_and_jsons[ data_id ] = ( json_text, j )
+            
+        
+        ( json_text, j ) = self._ids_to_datas_and_jsons[ data_id ]
+        
+        return j
+        
+    
+    def GetPrettyTimings( self ):
+        
+        # a subsidiary page parser runs its content parsers once per post, so we add those up
+        
+        descriptions = []
+        descriptions_to_times_and_counts = {}
+        
+        for ( description, time_taken ) in self._timings:
+            
+            if description not in descriptions_to_times_and_counts:
+                
+                descriptions.append( description )
+                
+                descriptions_to_times_and_counts[ description ] = ( 0.0, 0 )
+                
+            
+            ( total_time_taken, count ) = descriptions_to_times_and_counts[ description ]
+            
+            descriptions_to_times_and_counts[ description ] = ( total_time_taken + time_taken, count + 1 )
+            
+        
+        lines = []
+        
+        for description in descriptions:
+            
+            ( total_time_taken, count ) = descriptions_to_times_and_counts[ description ]
+            
+            line = description + ': ' + HydrusData.TimeDeltaToPrettyTimeDelta( total_time_taken )
+            
+            if count > 1:
+                
+                line += ' over ' + HydrusData.ToHumanInt( count ) + ' runs'
+                
+            
+            lines.append( line )
+            
+        
+        return os.linesep.join( lines )
+        
+    
+    def GetSoup( self, html ):
+        
+        data_id = id( html )
+        
+        if data_id not in self._ids_to_datas_and_soups:
+            
+            started = HydrusData.GetNowPrecise()
+            
+            soup = GetSoup( html, prefer_lxml = self._prefer_lxml )
+            
+            self.ReportTime( 'parsing the html', HydrusData.GetNowPrecise() - started )
+            
+            self._ids_to_datas_and_soups[ data_id ] = ( html, soup )
+            
+        
+        ( html, soup ) = self._ids_to_datas_and_soups[ data_id ]
+        
+        return soup
+        
+    
+    def GetTimings( self ):
+        
+        return list( self._timings )
+        
+    
+    def ReportTime( self, description, time_taken ):
+        
+        self._timings.append( ( description, time_taken ) )
+        
+    
 class ParseFormula( HydrusSerialisable.SerialisableBase ):
     
     def __init__( self, string_match = None, string_converter = None ):
@@ -489,14 +635,19 @@ class ParseFormula( HydrusSerialisable.SerialisableBase ):
         return os.linesep
         
     
-    def _ParseRawContents( self, parsing_context, data ):
+    def _ParseRawContents( self, parsing_context, data, parse_session ):
         
         raise NotImplementedError()
         
     
-    def Parse( self, parsing_context, data ):
+    def Parse( self, parsing_context, data, parse_session = None ):
+        
+        if parse_session is None:
+            
+            parse_session = ParseSession()
+            
         
-        raw_texts = self._ParseRawContents( parsing_context, data )
+        raw_texts = self._ParseRawContents( parsing_context, data, parse_session )
         
         texts = []
         
@@ -519,9 +670,9 @@ class ParseFormula( HydrusSerialisable.SerialisableBase ):
         return texts
         
     
-    def ParsePretty( self, parsing_context, data ):
+    def ParsePretty( self, parsing_context, data, parse_session = None ):
         
-        texts = self.Parse( parsing_context, data )
+        texts = self.Parse( parsing_context, data, parse_session = parse_session )
         
         pretty_texts = [ MakeParsedTextPretty( text ) for text in texts ]
         
@@ -594,7 +745,7 @@ class ParseFormulaCompound( ParseFormula ):
         self._string_converter = HydrusSerialisable.CreateFromSerialisableTuple( serialisable_string_converter )
         
     
-    def _ParseRawContents( self, parsing_context, data ):
+    def _ParseRawContents( self, parsing_context, data, parse_session ):
         
         def get_stream_data( index, s ):
             
@@ -616,7 +767,7 @@ class ParseFormulaCompound( ParseFormula ):
         
         for formula in self._formulae:
             
-            stream = formula.Parse( parsing_context, data )
+            stream = formula.Parse( parsing_context, data, parse_session = parse_session )
             
             if len( stream ) == 0: # no contents were found for one of the /1 replace components, so no valid strings can be made.
                 
@@ -713,7 +864,7 @@ class ParseFormulaContextVariable( ParseFormula ):
         self._string_converter = HydrusSerialisable.CreateFromSerialisableTuple( serialisable_string_converter )
         
     
-    def _ParseRawContents( self, parsing_context, data ):
+    def _ParseRawContents( self, parsing_context, data, parse_session ):
         
         raw_contents = []
         
@@ -788,18 +939,6 @@ class ParseFormulaHTML( ParseFormula ):
         self._attribute_to_fetch = attribute_to_fetch
         
     
-    def _FindHTMLTags( self, root ):
-        
-        tags = ( root, )
-        
-        for tag_rule in self._tag_rules:
-            
-            tags = tag_rule.GetNodes( tags )
-            
-        
-        return tags
-        
-    
     def _GetParsePrettySeparator( self ):
         
         if self._content_to_fetch == HTML_CONTENT_HTML:
@@ -900,18 +1039,18 @@ class ParseFormulaHTML( ParseFormula ):
         self._string_converter = HydrusSerialisable.CreateFromSerialisableTuple( serialisable_string_converter )
         
     
-    def _ParseRawContents( self, parsing_context, data ):
+    def _ParseRawContents( self, parsing_context, data, parse_session ):
         
         try:
             
-            root = HG.client_controller.parsing_cache.GetSoup( data )
+            parse_session.GetSoup( data )
             
         except Exception as e:
             
             raise HydrusExceptions.ParseException( 'Unable to parse that HTML: ' + HydrusData.ToUnicode( e ) )
             
         
-        tags = self._FindHTMLTags( root )
+        tags = parse_session.GetHTMLNodes( data, self._tag_rules )
         
         raw_contents = self._GetRawContentsFromTags( tags )
         
@@ -1157,6 +1296,22 @@ class ParseRuleHTML( HydrusSerialisable.SerialisableBase ):
             
         
     
+    def GetCacheKey( self ):
+        
+        # two rules with the same key find the same nodes
+        
+        if self._tag_attributes is None:
+            
+            tag_attributes = None
+            
+        else:
+            
+            tag_attributes = tuple( sorted( self._tag_attributes.items() ) )
+            
+        
+        return ( self._rule_type, self._tag_name, tag_attributes, self._tag_index, self._tag_depth, self._should_test_tag_string, self._tag_string_string_match.ToTuple() )
+        
+    
     def GetNodes( self, nodes ):
         
         new_nodes = []
@@ -1438,11 +1593,11 @@ class ParseFormulaJSON( ParseFormula ):
         self._string_converter = HydrusSerialisable.CreateFromSerialisableTuple( serialisable_string_converter )
         
     
-    def _ParseRawContents( self, parsing_context, data ):
+    def _ParseRawContents( self, parsing_context, data, parse_session ):
         
         try:
             
-            j = HG.client_controller.parsing_cache.GetJSON( data )
+            j = parse_session.GetJSON( data )
             
         except Exception as e:
             
@@ -1686,11 +1841,18 @@ class ContentParser( HydrusSerialisable.SerialisableBase ):
         return { ( self._name, self._content_type, self._additional_info ) }
         
     
-    def Parse( self, parsing_context, data ):
+    def Parse( self, parsing_context, data, parse_session = None ):
+        
+        if parse_session is None:
+            
+            parse_session = ParseSession()
+            
+        
+        started = HydrusData.GetNowPrecise()
         
         try:
             
-            parsed_texts = self._formula.Parse( parsing_context, data )
+            parsed_texts = self._formula.Parse( parsing_context, data, parse_session = parse_session )
             
         except HydrusExceptions.ParseException as e:
             
@@ -1701,6 +1863,8 @@ class ContentParser( HydrusSerialisable.SerialisableBase ):
             raise e
             
         
+        parse_session.ReportTime( 'content parser "' + self._name + '"', HydrusData.GetNowPrecise() - started )
+        
         if self._content_type == HC.CONTENT_TYPE_URLS:
             
             if 'url' in parsing_context:
@@ -1738,11 +1902,11 @@ class ContentParser( HydrusSerialisable.SerialisableBase ):
             
         
     
-    def ParsePretty( self, parsing_context, data ):
+    def ParsePretty( self, parsing_context, data, parse_session = None ):
         
         try:
             
-            parse_results = self.Parse( parsing_context, data )
+            parse_results = self.Parse( parsing_context, data, parse_session = parse_session )
             
             results = [ ConvertParseResultToPrettyString( parse_result ) for parse_result in parse_results ]
             
@@ -1928,7 +2092,12 @@ class PageParser( HydrusSerialisable.SerialisableBaseNamed ):
         return self._string_converter
         
     
-    def Parse( self, parsing_context, page_data ):
+    def Parse( self, parsing_context, page_data, parse_session = None ):
+        
+        if parse_session is None:
+            
+            parse_session = ParseSession()
+            
         
         page_data = HydrusData.ToUnicode( page_data )
         
@@ -1958,7 +2127,7 @@ class PageParser( HydrusSerialisable.SerialisableBaseNamed ):
             
             for content_parser in self._content_parsers:
                 
-                whole_page_parse_results.extend( content_parser.Parse( parsing_context, converted_page_data ) )
+                whole_page_parse_results.extend( content_parser.Parse( parsing_context, converted_page_data, parse_session = parse_session ) )
                 
             
         except HydrusExceptions.ParseException as e:
@@ -1998,13 +2167,17 @@ class PageParser( HydrusSerialisable.SerialisableBaseNamed ):
                 
                 for ( formula, page_parser ) in self._sub_page_parsers:
                     
-                    posts = formula.Parse( parsing_context, converted_page_data )
+                    started = HydrusData.GetNowPrecise()
+                    
+                    posts = formula.Parse( parsing_context, converted_page_data, parse_session = parse_session )
+                    
+                    parse_session.ReportTime( 'subsidiary page parser "' + page_parser.GetName() + '" post separation', HydrusData.GetNowPrecise() - started )
                     
                     for post in posts:
                         
                         try:
                             
-                            page_parser_all_parse_results = page_parser.Parse( parsing_context, post )
+                            page_parser_all_parse_results = page_parser.Parse( parsing_context, post, parse_session = parse_session )
                             
                         except HydrusExceptions.VetoException:
                             
@@ -2033,11 +2206,11 @@ class PageParser( HydrusSerialisable.SerialisableBaseNamed ):
         return all_parse_results
         
     
-    def ParsePretty( self, parsing_context, page_data ):
+    def ParsePretty( self, parsing_context, page_data, parse_session = None ):
         
         try:
             
-            all_parse_results = self.Parse( parsing_context, page_data )
+            all_parse_results = self.Parse( parsing_context, page_data, parse_session = parse_session )
             
             pretty_groups_of_parse_results = [ os.linesep.join( [ ConvertParseResultToPrettyString( parse_result ) for parse_result in parse_results ] ) for parse_results in all_parse_results ]
             
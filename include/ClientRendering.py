@@ -31,6 +31,12 @@ def GenerateHydrusBitmap( path, mime, compressed = True ):
     
     return GenerateHydrusBitmapFromNumPyImage( numpy_image, compressed = compressed )
     
+def GenerateHydrusBitmapFromBytes( data, mime, compressed = True ):
+    
+    numpy_image = ClientImageHandling.GenerateNumpyImageFromBytes( data, mime )
+    
+    return GenerateHydrusBitmapFromNumPyImage( numpy_image, compressed = compressed )
+    
 def GenerateHydrusBitmapFromNumPyImage( numpy_image, compressed = True ):
     
     ( y, x, depth ) = numpy_image.shape
@@ -54,11 +60,26 @@ def GenerateHydrusBitmapFromPILImage( pil_image, compressed = True ):
     
 class ImageRenderer( object ):
     
-    def __init__( self, media ):
+    def __init__( self, media, target_resolution = None, initialise = True ):
         
         self._media = media
         self._numpy_image = None
         
+        if target_resolution is not None:
+            
+            target_resolution = tuple( target_resolution )
+            
+            if target_resolution == self._media.GetResolution():
+                
+                target_resolution = None
+                
+            
+        
+        self._target_resolution = target_resolution
+        self._resized_numpy_image = None
+        
+        self._job = None
+        
         self._hash = self._media.GetHash()
         self._mime = self._media.GetMime()
         
@@ -66,14 +87,34 @@ class ImageRenderer( object ):
         
         self._path = client_files_manager.GetFilePath( self._hash, self._mime )
         
-        HG.client_controller.CallToThread( self._Initialise )
+        if initialise:
+            
+            HG.client_controller.CallToThread( self._Initialise )
+            
         
     
     def _Initialise( self ):
         
         time.sleep( 0.00001 )
         
-        self._numpy_image = ClientImageHandling.GenerateNumpyImage( self._path, self._mime )
+        numpy_image = ClientImageHandling.GenerateNumpyImage( self._path, self._mime )
+        
+        if self._target_resolution is not None:
+            
+            # doing this here, off the gui thread, means showing the image at the zoom we expected is just a bitmap copy
+            
+            self._resized_numpy_image = ClientImageHandling.ResizeNumpyImage( self._mime, numpy_image, self._target_resolution )
+            
+        
+        self._numpy_image = numpy_image
+        
+    
+    def Cancel( self ):
+        
+        if self._job is not None:
+            
+            self._job.Cancel()
+            
         
     
     def GetEstimatedMemoryFootprint( self ):
@@ -82,14 +123,23 @@ class ImageRenderer( object ):
             
             ( width, height ) = self.GetResolution()
             
-            return width * height * 3
+            footprint = width * height * 3
             
         else:
             
             ( height, width, depth ) = self._numpy_image.shape
             
-            return height * width * depth
+            footprint = height * width * depth
+            
+        
+        if self._target_resolution is not None:
             
+            ( target_width, target_height ) = self._target_resolution
+            
+            footprint += target_width * target_height * 3
+            
+        
+        return footprint
         
     
     def GetHash( self ): return self._media.GetHash()
@@ -106,6 +156,10 @@ class ImageRenderer( object ):
             
             wx_numpy_image = self._numpy_image
             
+        elif self._resized_numpy_image is not None and tuple( target_resolution ) == self._target_resolution:
+            
+            wx_numpy_image = self._resized_numpy_image
+            
         else:
             
             wx_numpy_image = ClientImageHandling.ResizeNumpyImage( self._media.GetMime(), self._numpy_image, target_resolution )
@@ -130,6 +184,11 @@ class ImageRenderer( object ):
         return self._numpy_image is not None
         
     
+    def Prefetch( self, worker_pool, priority ):
+        
+        self._job = worker_pool.SubmitWithPriority( priority, self._Initialise )
+        
+    
 class RasterContainer( object ):
     
     def __init__( self, media, target_resolution = None ):
@@ -182,6 +241,8 @@ class RasterContainerVideo( RasterContainer ):
         
         self._initialised = False
         
+        self._keyframe_index = None
+        
         self._frames = {}
         self._buffer_start_index = -1
         self._buffer_end_index = -1
@@ -274,6 +335,29 @@ class RasterContainerVideo( RasterContainer ):
             
         
     
+    def THREADLoadKeyframeIndex( self ):
+        
+        try:
+            
+            keyframe_index = HG.client_controller.GetCache( 'video_keyframes' ).GetKeyframeIndex( self._media )
+            
+        except Exception as e:
+            
+            HydrusData.Print( 'Could not index the keyframes of ' + self._media.GetHash().encode( 'hex' ) + ', so seeking it will be slower.' )
+            
+            HydrusData.PrintException( e )
+            
+            return
+            
+        
+        with self._render_lock:
+            
+            self._renderer.set_keyframe_index( keyframe_index )
+            
+        
+        self._keyframe_index = keyframe_index
+        
+    
     def THREADMoveRenderTo( self, render_to_index ):
         
         with self._render_lock:
@@ -343,6 +427,13 @@ class RasterContainerVideo( RasterContainer ):
             
             self._renderer = HydrusVideoHandling.VideoRendererFFMPEG( self._path, mime, duration, num_frames, self._target_resolution )
             
+            we_will_seek = num_frames > self._num_frames_backwards + 1 + self._num_frames_forwards
+            
+            if we_will_seek and mime != HC.IMAGE_APNG:
+                
+                HG.client_controller.CallToThread( self.THREADLoadKeyframeIndex )
+                
+            
         
         self.GetReadyForFrame( self._init_position )
         
@@ -505,6 +596,13 @@ class RasterContainerVideo( RasterContainer ):
                 
                 self._buffer_start_index = ideal_buffer_start_index
                 
+                if self._keyframe_index is not None:
+                    
+                    # if we start on a keyframe, ffmpeg has nothing to decode and throw away before the first frame we keep, and we rush to the new frame quicker
+                    
+                    self._buffer_start_index = max( ideal_buffer_start_index, self._keyframe_index.GetKeyframeAtOrBefore( next_index_to_expect ) )
+                    
+                
                 self._buffer_end_index = ideal_buffer_end_index
                 
                 HG.client_controller.CallToThread( self.THREADMoveRenderer, self._buffer_start_index, next_index_to_expect, self._buffer_end_index )
@@ -1045,6 +1045,34 @@ class ServiceRepository( ServiceRestricted ):
         ServiceRestricted._CheckFunctional( self, including_external_communication = including_external_communication, including_account = including_account )
         
     
+    def _DownloadUpdateNetworkString( self, update_hash ):
+        
+        update_network_string = self.Request( HC.GET, 'update', { 'update_hash' : update_hash, 'binary' : 1 } )
+        
+        if update_network_string.startswith( HydrusSerialisable.BINARY_NETWORK_STRING_PREFIX ):
+            
+            # the binary is just for the trip--the update is hashed and stored as json, so rebuild that and make sure it matches
+            
+            try:
+                
+                update = HydrusSerialisable.CreateFromNetworkString( update_network_string )
+                
+                update_network_string = update.DumpToNetworkString()
+                
+            except:
+                
+                update_network_string = None
+                
+            
+            if update_network_string is None or hashlib.sha256( update_network_string ).digest() != update_hash:
+                
+                update_network_string = self.Request( HC.GET, 'update', { 'update_hash' : update_hash } )
+                
+            
+        
+        return update_network_string
+        
+    
     def _GetSerialisableDictionary( self ):
         
         dictionary = ServiceRestricted._GetSerialisableDictionary( self )
@@ -1238,7 +1266,7 @@ class ServiceRepository( ServiceRestricted ):
                     
                     try:
                         
-                        update_network_string = self.Request( HC.GET, 'update', { 'update_hash' : update_hash } )
+                        update_network_string = self._DownloadUpdateNetworkString( update_hash )
                         
                     except HydrusExceptions.NetworkException as e:
                         
@@ -0,0 +1,182 @@
+import HydrusData
+import numpy
+import psutil
+
+# popcount of every possible byte, so we can count the bits of a whole array of uint64s by viewing it as uint8s
+BYTE_POPCOUNTS = numpy.array( [ bin( i ).count( '1' ) for i in range( 256 ) ], dtype = 'uint8' )
+
+# the phash and phash_id arrays, plus the xor/popcount temporaries a search makes
+ESTIMATED_BYTES_PER_PHASH = 48
+
+# a block search compares every search phash against this many indexed phashes at once, so the temp matrices stay about 24MB each
+BLOCK_SEARCH_SIZE = 96
+BLOCK_SEARCH_INDEX_CHUNK_SIZE = 32768
+
+def ConvertPHashesToUInt64s( phashes ):
+    
+    # phashes are 8-byte big-endian strings (or buffers, straight from the db), which is the same order Get64BitHammingDistance unpacks them with
+    
+    return numpy.frombuffer( ''.join( ( str( phash ) for phash in phashes ) ), dtype = '>u8' ).astype( 'uint64' )
+    
+def ConvertUInt64sToPHashes( phashes_uint64 ):
+    
+    phashes_bytes = numpy.asarray( phashes_uint64, dtype = 'uint64' ).astype( '>u8' ).tostring()
+    
+    return [ phashes_bytes[ i : i + 8 ] for i in range( 0, len( phashes_bytes ), 8 ) ]
+    
+def GetHammingDistances( search_phash_uint64, phashes_uint64 ):
+    
+    xors = numpy.bitwise_xor( phashes_uint64, search_phash_uint64 )
+    
+    return BYTE_POPCOUNTS[ xors.view( 'uint8' ) ].reshape( ( -1, 8 ) ).sum( axis = 1 )
+    
+def PHashIndexWillFitInMemory( num_phashes ):
+    
+    estimated_memory = num_phashes * ESTIMATED_BYTES_PER_PHASH
+    
+    # leave plenty of room for everything else the client wants to do
+    
+    return estimated_memory * 4 < psutil.virtual_memory().available
+    
+class PHashIndex( object ):
+    
+    def __init__( self, rows = None ):
+        
+        self._phash_ids = numpy.empty( 1024, dtype = 'int64' )
+        self._phashes = numpy.empty( 1024, dtype = 'uint64' )
+        
+        self._num_phashes = 0
+        
+        if rows is not None:
+            
+            self.AddPHashes( rows )
+            
+        
+    
+    def _EnsureCapacity( self, num_to_add ):
+        
+        capacity = len( self._phash_ids )
+        
+        needed = self._num_phashes + num_to_add
+        
+        if needed > capacity:
+            
+            while capacity < needed:
+                
+                capacity *= 2
+                
+            
+            new_phash_ids = numpy.empty( capacity, dtype = 'int64' )
+            new_phashes = numpy.empty( capacity, dtype = 'uint64' )
+            
+            new_phash_ids[ : self._num_phashes ] = self._phash_ids[ : self._num_phashes ]
+            new_phashes[ : self._num_phashes ] = self._phashes[ : self._num_phashes ]
+            
+            self._phash_ids = new_phash_ids
+            self._phashes = new_phashes
+            
+        
+    
+    def AddPHashes( self, rows ):
+        
+        rows = list( rows )
+        
+        if len( rows ) == 0:
+            
+            return
+            
+        
+        self._EnsureCapacity( len( rows ) )
+        
+        start = self._num_phashes
+        end = start + len( rows )
+        
+        self._phash_ids[ start : end ] = [ phash_id for ( phash_id, phash ) in rows ]
+        self._phashes[ start : end ] = ConvertPHashesToUInt64s( [ phash for ( phash_id, phash ) in rows ] )
+        
+        self._num_phashes = end
+        
+    
+    def DeletePHashIds( self, phash_ids ):
+        
+        if len( phash_ids ) == 0 or self._num_phashes == 0:
+            
+            return
+            
+        
+        phash_ids_to_delete = numpy.fromiter( phash_ids, dtype = 'int64', count = len( phash_ids ) )
+        
+        keep = numpy.logical_not( numpy.in1d( self._phash_ids[ : self._num_phashes ], phash_ids_to_delete ) )
+        
+        num_to_keep = int( keep.sum() )
+        
+        self._phash_ids[ : num_to_keep ] = self._phash_ids[ : self._num_phashes ][ keep ]
+        self._phashes[ : num_to_keep ] = self._phashes[ : self._num_phashes ][ keep ]
+        
+        self._num_phashes = num_to_keep
+        
+    
+    def GetNumPHashes( self ):
+        
+        return self._num_phashes
+        
+    
+    def Search( self, search_phashes, max_hamming_distance ):
+        
+        similar_phash_ids = set()
+        
+        if self._num_phashes == 0:
+            
+            return similar_phash_ids
+            
+        
+        phash_ids = self._phash_ids[ : self._num_phashes ]
+        phashes = self._phashes[ : self._num_phashes ]
+        
+        for search_phash_uint64 in ConvertPHashesToUInt64s( search_phashes ):
+            
+            distances = GetHammingDistances( search_phash_uint64, phashes )
+            
+            similar_phash_ids.update( phash_ids[ distances <= max_hamming_distance ].tolist() )
+            
+        
+        return similar_phash_ids
+        
+    
+    def SearchBlock( self, search_rows, max_hamming_distance ):
+        
+        # search_rows is [ ( search_id, phash ) ], and we return every ( search_id, phash_id ) pair within the distance
+        # the search phashes and a chunk of the index are compared as a matrix, so all the work is in numpy
+        
+        results = []
+        
+        if self._num_phashes == 0 or len( search_rows ) == 0:
+            
+            return results
+            
+        
+        for block_of_search_rows in HydrusData.SplitListIntoChunks( search_rows, BLOCK_SEARCH_SIZE ):
+            
+            search_ids = numpy.array( [ search_id for ( search_id, phash ) in block_of_search_rows ], dtype = 'int64' )
+            search_phashes = ConvertPHashesToUInt64s( [ phash for ( search_id, phash ) in block_of_search_rows ] )
+            
+            for start in range( 0, self._num_phashes, BLOCK_SEARCH_INDEX_CHUNK_SIZE ):
+                
+                end = min( start + BLOCK_SEARCH_INDEX_CHUNK_SIZE, self._num_phashes )
+                
+                xors = numpy.bitwise_xor( search_phashes[ :, None ], self._phashes[ None, start : end ] )
+                
+                distances = BYTE_POPCOUNTS[ xors.view( 'uint8' ) ].reshape( xors.shape + ( 8, ) ).sum( axis = 2 )
+                
+                ( search_indices, chunk_indices ) = numpy.nonzero( distances <= max_hamming_distance )
+                
+                if len( search_indices ) > 0:
+                    
+                    results.extend( zip( search_ids[ search_indices ].tolist(), self._phash_ids[ start : end ][ chunk_indices ].tolist() ) )
+                    
+                
+            
+        
+        return results
+        
+    
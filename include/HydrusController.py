@@ -334,6 +334,18 @@ class HydrusController( object ):
             
         
     
+    def DebugShowDBActionLatencies( self ):
+        
+        action_latencies = self.db.GetActionLatencies()
+        
+        rows = sorted( action_latencies.items(), key = lambda ( action, ( num_jobs, num_read_only_jobs, average_latency, max_latency ) ): num_jobs * average_latency, reverse = True )
+        
+        lines = [ action + ': ' + HydrusData.ToHumanInt( num_jobs ) + ' jobs (' + HydrusData.ToHumanInt( num_read_only_jobs ) + ' in parallel), average ' + HydrusData.ConvertMillisecondsToPrettyTime( int( average_latency * 1000 ) ) + ', max ' + HydrusData.ConvertMillisecondsToPrettyTime( int( max_latency * 1000 ) ) for ( action, ( num_jobs, num_read_only_jobs, average_latency, max_latency ) ) in rows ]
+        
+        HydrusData.ShowText( 'db action latencies:' )
+        HydrusData.ShowText( os.linesep.join( lines ) )
+        
+    
     def DebugShowScheduledJobs( self ):
         
         summary = self._fast_job_scheduler.GetPrettyJobSummary()
@@ -7,11 +7,16 @@ import HydrusPaths
 import os
 import Queue
 import sqlite3
+import threading
 import traceback
 import time
 
 CONNECTION_REFRESH_TIME = 60 * 30
 
+# the read-only connections may only write to their own in-memory tables
+READ_ONLY_DENIED_ACTIONS = { sqlite3.SQLITE_INSERT, sqlite3.SQLITE_UPDATE, sqlite3.SQLITE_DELETE, sqlite3.SQLITE_CREATE_TABLE, sqlite3.SQLITE_DROP_TABLE, sqlite3.SQLITE_CREATE_INDEX, sqlite3.SQLITE_DROP_INDEX }
+READ_ONLY_ALLOWED_DB_NAMES = ( 'mem', 'temp' )
+
 def CanVacuum( db_path, stop_time = None ):
     
     try:
@@ -103,8 +108,19 @@ class HydrusDB( object ):
     
     TRANSACTION_COMMIT_TIME = 10
     
+    # actions that only select, and so can be served by the read-only connections in parallel with the main loop
+    # anything that turns out to want to write after all is caught by the authoriser and handed back to the main loop
+    READ_ONLY_ACTIONS = []
+    NUM_READ_ONLY_CONNECTIONS = 2
+    
+    # every thread talking to the db has its own connection, so the cursor is thread-local
+    _db = property( lambda self: getattr( self._thread_local, 'db', None ), lambda self, db: setattr( self._thread_local, 'db', db ), lambda self: delattr( self._thread_local, 'db' ) )
+    _c = property( lambda self: getattr( self._thread_local, 'c', None ), lambda self, c: setattr( self._thread_local, 'c', c ), lambda self: delattr( self._thread_local, 'c' ) )
+    
     def __init__( self, controller, db_dir, db_name, no_wal = False ):
         
+        self._thread_local = threading.local()
+        
         self._controller = controller
         self._db_dir = db_dir
         self._db_name = db_name
@@ -148,6 +164,19 @@ class HydrusDB( object ):
         self._jobs = Queue.PriorityQueue()
         self._pubsubs = []
         
+        self._read_only_jobs = Queue.PriorityQueue()
+        self._num_read_only_loops_running = 0
+        
+        # writes that are queued or done but not yet committed, so the read-only connections cannot see them yet
+        # _num_pending_writes is shared with the threads submitting jobs and always goes under _lock, _num_uncommitted_writes is main loop only
+        
+        self._num_pending_writes = 0
+        self._num_uncommitted_writes = 0
+        
+        self._action_latencies = {}
+        
+        self._lock = threading.Lock()
+        
         self._currently_doing_job = False
         self._current_status = ''
         self._current_job_name = ''
@@ -235,6 +264,16 @@ class HydrusDB( object ):
                 
             
         
+        # without WAL, a reader blocks the writer, so there is nothing to gain
+        
+        if len( self.READ_ONLY_ACTIONS ) > 0 and not self._no_wal:
+            
+            for i in range( self.NUM_READ_ONLY_CONNECTIONS ):
+                
+                self._controller.CallToThreadLongRunning( self.ReadOnlyLoop )
+                
+            
+        
     
     def _AttachExternalDatabases( self ):
         
@@ -264,6 +303,21 @@ class HydrusDB( object ):
             
         
     
+    def _CanUseReadOnlyConnection( self, action ):
+        
+        if action not in self.READ_ONLY_ACTIONS or HG.db_profile_mode:
+            
+            return False
+            
+        
+        # the read-only connections only see committed data, so if the main loop has writes queued or uncommitted, the read has to wait behind them as normal
+        
+        with self._lock:
+            
+            return self._num_read_only_loops_running > 0 and self._num_pending_writes == 0
+            
+        
+    
     def _CleanUpCaches( self ):
         
         pass
@@ -297,6 +351,13 @@ class HydrusDB( object ):
             
             self._in_transaction = False
             
+            with self._lock:
+                
+                self._num_pending_writes -= self._num_uncommitted_writes
+                
+            
+            self._num_uncommitted_writes = 0
+            
         else:
             
             HydrusData.Print( 'Received a call to commit, but was not in a transaction!' )
@@ -486,6 +547,47 @@ class HydrusDB( object ):
             
         
     
+    def _InitReadOnlyDBCursor( self ):
+        
+        db_path = os.path.join( self._db_dir, self._db_filenames[ 'main' ] )
+        
+        self._db = sqlite3.connect( db_path, isolation_level = None, detect_types = sqlite3.PARSE_DECLTYPES )
+        
+        self._c = self._db.cursor()
+        
+        self._c.execute( 'PRAGMA temp_store = 2;' )
+        
+        self._c.execute( 'PRAGMA main.cache_size = -10000;' )
+        
+        self._c.execute( 'ATTACH ":memory:" AS mem;' )
+        
+        self._AttachExternalDatabases()
+        
+        db_names = [ name for ( index, name, path ) in self._c.execute( 'PRAGMA database_list;' ) if name not in ( 'mem', 'temp' ) ]
+        
+        for db_name in db_names:
+            
+            self._c.execute( 'PRAGMA ' + db_name + '.cache_size = -10000;' )
+            
+        
+        def authoriser( action, arg1, arg2, db_name, source ):
+            
+            if action in READ_ONLY_DENIED_ACTIONS and db_name not in READ_ONLY_ALLOWED_DB_NAMES:
+                
+                self._thread_local.write_denied = True
+                
+                return sqlite3.SQLITE_DENY
+                
+            
+            return sqlite3.SQLITE_OK
+            
+        
+        self._db.set_authorizer( authoriser )
+        
+        self._thread_local.read_only = True
+        self._thread_local.write_denied = False
+        
+    
     def _InitDiskCache( self ):
         
         pass
@@ -496,6 +598,13 @@ class HydrusDB( object ):
         pass
         
     
+    def _InReadOnlyConnection( self ):
+        
+        # lazily populated caches belong to the main loop, so code that fills them should check this first
+        
+        return getattr( self._thread_local, 'read_only', False )
+        
+    
     def _ManageDBError( self, job, e ):
         
         raise NotImplementedError()
@@ -585,6 +694,67 @@ class HydrusDB( object ):
             
             self.publish_status_update()
             
+            self._RecordActionLatency( job, False )
+            
+        
+    
+    def _ProcessReadOnlyJob( self, priority, job ):
+        
+        ( action, args, kwargs ) = job.GetCallableTuple()
+        
+        self._thread_local.write_denied = False
+        
+        try:
+            
+            self._c.execute( 'BEGIN DEFERRED;' )
+            
+            try:
+                
+                result = self._Read( action, *args, **kwargs )
+                
+            finally:
+                
+                try:
+                    
+                    self._c.execute( 'ROLLBACK;' )
+                    
+                except sqlite3.OperationalError:
+                    
+                    pass # the error already ended the transaction
+                    
+                
+            
+        except Exception as e:
+            
+            if self._thread_local.write_denied:
+                
+                result = None
+                
+            else:
+                
+                db_traceback = 'Database ' + traceback.format_exc()
+                
+                first_line = HydrusData.ToUnicode( type( e ).__name__ ) + ': ' + HydrusData.ToUnicode( e )
+                
+                result = HydrusExceptions.DBException( first_line, db_traceback )
+                
+            
+        
+        if self._thread_local.write_denied:
+            
+            # this job wanted to write something after all, so the main loop has to do it
+            
+            self._jobs.put( ( priority, job ) )
+            
+            return
+            
+        
+        if job.IsSynchronous():
+            
+            job.PutResult( result )
+            
+        
+        self._RecordActionLatency( job, True )
         
     
     def _Read( self, action, *args, **kwargs ):
@@ -592,6 +762,33 @@ class HydrusDB( object ):
         raise NotImplementedError()
         
     
+    def _RecordActionLatency( self, job, read_only ):
+        
+        latency = HydrusData.GetNowPrecise() - job.GetCreationTime()
+        
+        action = job.GetAction()
+        
+        with self._lock:
+            
+            if action not in self._action_latencies:
+                
+                self._action_latencies[ action ] = [ 0, 0, 0.0, 0.0 ]
+                
+            
+            stats = self._action_latencies[ action ]
+            
+            stats[0] += 1
+            
+            if read_only:
+                
+                stats[1] += 1
+                
+            
+            stats[2] += latency
+            stats[3] = max( stats[3], latency )
+            
+        
+    
     def _RepairDB( self ):
         
         pass
@@ -710,6 +907,16 @@ class HydrusDB( object ):
         return self._currently_doing_job
         
     
+    def GetActionLatencies( self ):
+        
+        # action -> ( num_jobs, num_read_only_jobs, average_latency, max_latency ), in seconds from the job being made to its result being ready
+        
+        with self._lock:
+            
+            return { action : ( num_jobs, num_read_only_jobs, total_latency / num_jobs, max_latency ) for ( action, ( num_jobs, num_read_only_jobs, total_latency, max_latency ) ) in self._action_latencies.items() }
+            
+        
+    
     def GetApproxTotalFileSize( self ):
         
         total = 0
@@ -746,7 +953,7 @@ class HydrusDB( object ):
     
     def JobsQueueEmpty( self ):
         
-        return self._jobs.empty()
+        return self._jobs.empty() and self._read_only_jobs.empty()
         
     
     def MainLoop( self ):
@@ -783,6 +990,15 @@ class HydrusDB( object ):
                 
                 self.publish_status_update()
                 
+                is_write = job.GetType() in ( 'read_write', 'write' )
+                
+                if is_write:
+                    
+                    # it stays pending until it is committed, which may be inside _ProcessJob, so it has to be counted first
+                    
+                    self._num_uncommitted_writes += 1
+                    
+                
                 try:
                     
                     if HG.db_profile_mode:
@@ -802,6 +1018,25 @@ class HydrusDB( object ):
                     
                 except:
                     
+                    if is_write:
+                        
+                        # it will be counted again when it is retried
+                        
+                        if self._num_uncommitted_writes > 0:
+                            
+                            self._num_uncommitted_writes -= 1
+                            
+                        else:
+                            
+                            # a commit went through before the error and took it off the pending count, so it goes back on
+                            
+                            with self._lock:
+                                
+                                self._num_pending_writes += 1
+                                
+                            
+                        
+                    
                     error_count += 1
                     
                     if error_count > 5:
@@ -856,11 +1091,72 @@ class HydrusDB( object ):
             raise HydrusExceptions.ShutdownException( 'Application has shut down!' )
             
         
-        self._jobs.put( ( priority + 1, job ) ) # +1 so all writes of equal priority can clear out first
+        if job_type == 'read' and self._CanUseReadOnlyConnection( action ):
+            
+            self._read_only_jobs.put( ( priority + 1, job ) )
+            
+        else:
+            
+            if job_type == 'read_write':
+                
+                with self._lock:
+                    
+                    self._num_pending_writes += 1
+                    
+                
+            
+            self._jobs.put( ( priority + 1, job ) ) # +1 so all writes of equal priority can clear out first
+            
         
         return job.GetResult()
         
     
+    def ReadOnlyLoop( self ):
+        
+        try:
+            
+            self._InitReadOnlyDBCursor()
+            
+        except:
+            
+            HydrusData.Print( 'Could not start a read-only db connection:' )
+            
+            HydrusData.DebugPrint( traceback.format_exc() )
+            
+            return
+            
+        
+        with self._lock:
+            
+            self._num_read_only_loops_running += 1
+            
+        
+        while not ( ( self._local_shutdown or self._controller.ModelIsShutdown() ) and self._read_only_jobs.empty() ):
+            
+            try:
+                
+                ( priority, job ) = self._read_only_jobs.get( timeout = 1 )
+                
+                self._ProcessReadOnlyJob( priority, job )
+                
+            except Queue.Empty:
+                
+                pass
+                
+            
+        
+        with self._lock:
+            
+            self._num_read_only_loops_running -= 1
+            
+        
+        self._c.close()
+        self._db.close()
+        
+        self._c = None
+        self._db = None
+        
+    
     def ReadyToServeRequests( self ):
         
         return self._ready_to_serve_requests
@@ -897,6 +1193,11 @@ class HydrusDB( object ):
             raise HydrusExceptions.ShutdownException( 'Application has shut down!' )
             
         
+        with self._lock:
+            
+            self._num_pending_writes += 1
+            
+        
         self._jobs.put( ( priority, job ) )
         
         if synchronous: return job.GetResult()
@@ -671,7 +671,15 @@ def IntelligentMassIntersect( sets_to_reduce ):
         
         if answer is None:
             
-            answer = set( set_to_reduce )
+            if hasattr( set_to_reduce, 'intersection_update' ):
+                
+                # this keeps a HashIdBitmap as a bitmap
+                answer = set_to_reduce.copy()
+                
+            else:
+                
+                answer = set( set_to_reduce )
+                
             
         else:
             
@@ -981,7 +989,7 @@ def SplitIteratorIntoChunks( iterator, n ):
 
 def SplitListIntoChunks( xs, n ):
     
-    if isinstance( xs, set ):
+    if not isinstance( xs, ( list, tuple ) ):
         
         xs = list( xs )
         
@@ -1467,14 +1475,26 @@ class JobDatabase( object ):
         self._args = args
         self._kwargs = kwargs
         
+        self._creation_time = GetNowPrecise()
+        
         self._result_ready = threading.Event()
         
     
+    def GetAction( self ):
+        
+        return self._action
+        
+    
     def GetCallableTuple( self ):
         
         return ( self._action, self._args, self._kwargs )
         
     
+    def GetCreationTime( self ):
+        
+        return self._creation_time
+        
+    
     def GetResult( self ):
         
         time.sleep( 0.00001 ) # this one neat trick can save hassle on superquick jobs as event.wait can be laggy
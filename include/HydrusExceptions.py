@@ -43,6 +43,7 @@ class NoContentException( NetworkException ): pass
 class NotFoundException( NetworkException ): pass
 class NotModifiedException( NetworkException ): pass
 class PermissionException( NetworkException ): pass
+class RangeNotSatisfiableException( NetworkException ): pass
 class RedirectionException( NetworkException ): pass
 class ServerException( NetworkException ): pass
 class SessionException( NetworkException ): pass
@@ -9,6 +9,7 @@ import HydrusImageHandling
 import HydrusPaths
 import HydrusVideoHandling
 import os
+import shutil
 import threading
 import traceback
 import cStringIO
@@ -46,7 +47,71 @@ header_and_mime = [
     ( 8, 'AVI ', HC.VIDEO_AVI ),
     ( 0, '\x30\x26\xB2\x75\x8E\x66\xCF\x11\xA6\xD9\x00\xAA\x00\x62\xCE\x6C', HC.UNDETERMINED_WM )
     ]
-
+    
+class FileHasher( object ):
+    
+    # feed this a file's bytes in order and it has everything an import needs to hash and sniff, so nothing has to read the file again
+    
+    def __init__( self ):
+        
+        self._sha256 = hashlib.sha256()
+        self._md5 = hashlib.md5()
+        self._sha1 = hashlib.sha1()
+        self._sha512 = hashlib.sha512()
+        
+        self._header = ''
+        self._num_bytes = 0
+        
+    
+    def GetExtraHashes( self ):
+        
+        return ( self._md5.digest(), self._sha1.digest(), self._sha512.digest() )
+        
+    
+    def GetHash( self ):
+        
+        return self._sha256.digest()
+        
+    
+    def GetMime( self ):
+        
+        # None means the header was not enough, so ask GetMime with the path
+        
+        if self._num_bytes == 0:
+            
+            return None
+            
+        
+        mime = GetMimeFromHeader( self._header )
+        
+        if mime in ( HC.UNDETERMINED_WM, HC.UNDETERMINED_PNG ):
+            
+            return None
+            
+        
+        return mime
+        
+    
+    def GetNumBytes( self ):
+        
+        return self._num_bytes
+        
+    
+    def Update( self, block ):
+        
+        self._sha256.update( block )
+        self._md5.update( block )
+        self._sha1.update( block )
+        self._sha512.update( block )
+        
+        if len( self._header ) < 256:
+            
+            self._header += block[ : 256 - len( self._header ) ]
+            
+        
+        self._num_bytes += len( block )
+        
+    
 def SaveThumbnailToStreamPIL( pil_image, dimensions, f ):
     
     # when the palette is limited, the thumbnail antialias won't add new colours, so you get nearest-neighbour-like behaviour
@@ -66,6 +131,29 @@ def SaveThumbnailToStreamPIL( pil_image, dimensions, f ):
         pil_image.save( f, 'JPEG', quality = 92 )
         
     
+def CopyAndHashFile( source, dest ):
+    
+    # local imports copy to a temp path anyway, so we hash on the way through
+    
+    file_hasher = FileHasher()
+    
+    with open( source, 'rb' ) as f_source:
+        
+        with open( dest, 'wb' ) as f_dest:
+            
+            for block in HydrusPaths.ReadFileLikeAsBlocks( f_source ):
+                
+                f_dest.write( block )
+                
+                file_hasher.Update( block )
+                
+            
+        
+    
+    shutil.copystat( source, dest )
+    
+    return file_hasher
+    
 def GenerateThumbnail( path, mime, dimensions = HC.UNSCALED_THUMBNAIL_DIMENSIONS, percentage_in = 35 ):
     
     if mime in ( HC.IMAGE_JPEG, HC.IMAGE_PNG, HC.IMAGE_GIF ):
@@ -178,6 +266,20 @@ def GetExtraHashesFromPath( path ):
     
     return ( md5, sha1, sha512 )
     
+def GetFileHasherFromPath( path ):
+    
+    file_hasher = FileHasher()
+    
+    with open( path, 'rb' ) as f:
+        
+        for block in HydrusPaths.ReadFileLikeAsBlocks( f ):
+            
+            file_hasher.Update( block )
+            
+        
+    
+    return file_hasher
+    
 def GetFileInfo( path, mime = None ):
     
     size = os.path.getsize( path )
@@ -285,37 +387,31 @@ def GetMime( path ):
         bit_to_check = f.read( 256 )
         
     
-    for ( offset, header, mime ) in header_and_mime:
+    mime = GetMimeFromHeader( bit_to_check )
+    
+    if mime == HC.UNDETERMINED_WM:
         
-        offset_bit_to_check = bit_to_check[ offset: ]
+        if HydrusVideoHandling.HasVideoStream( path ):
+            
+            return HC.VIDEO_WMV
+            
         
-        if offset_bit_to_check.startswith( header ):
+        # we'll catch and verify wma later
+        
+    elif mime == HC.UNDETERMINED_PNG:
+        
+        if HydrusVideoHandling.HasVideoStream( path ):
             
-            if mime == HC.UNDETERMINED_WM:
-                
-                if HydrusVideoHandling.HasVideoStream( path ):
-                    
-                    return HC.VIDEO_WMV
-                    
-                
-                # we'll catch and verify wma later
-                
-            elif mime == HC.UNDETERMINED_PNG:
-                
-                if HydrusVideoHandling.HasVideoStream( path ):
-                    
-                    return HC.IMAGE_APNG
-                    
-                else:
-                    
-                    return HC.IMAGE_PNG
-                    
-                
-            else:
-                
-                return mime
-                
+            return HC.IMAGE_APNG
+            
+        else:
             
+            return HC.IMAGE_PNG
+            
+        
+    elif mime is not None:
+        
+        return mime
         
     
     try:
@@ -339,3 +435,19 @@ def GetMime( path ):
     
     return HC.APPLICATION_UNKNOWN
     
+def GetMimeFromHeader( bit_to_check ):
+    
+    # returns None if the header is not one we know, and the UNDETERMINED mimes need ffmpeg to finish the job
+    
+    for ( offset, header, mime ) in header_and_mime:
+        
+        offset_bit_to_check = bit_to_check[ offset: ]
+        
+        if offset_bit_to_check.startswith( header ):
+            
+            return mime
+            
+        
+    
+    return None
+    
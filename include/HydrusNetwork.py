@@ -5,9 +5,16 @@ import HydrusExceptions
 import HydrusGlobals as HG
 import HydrusNetworking
 import HydrusSerialisable
+import itertools
+import numpy
+import struct
 import threading
 
-INT_PARAMS = { 'expires', 'num', 'since', 'content_type', 'action', 'status' }
+# binary columns of ints are delta-encoded and then stored in the smallest of these that fits, so sorted ids mostly end up as one or two bytes each before zlib even sees them
+INT_COLUMN_DTYPES = [ '<i1', '<i2', '<i4', '<i8' ]
+INT_COLUMN_HEADER_STRUCT = '<BBI'
+
+INT_PARAMS = { 'expires', 'num', 'since', 'content_type', 'action', 'status', 'binary' }
 BYTE_PARAMS = { 'access_key', 'account_type_key', 'subject_account_key', 'hash', 'registration_key', 'subject_hash', 'subject_tag', 'share_key', 'update_hash' }
 
 def GenerateDefaultServiceDictionary( service_type ):
@@ -898,6 +905,148 @@ class AccountType( object ):
         return unknown_account_type
         
     
+class BinaryColumnReader( object ):
+    
+    def __init__( self, data ):
+        
+        self._data = data
+        self._offset = 0
+        
+    
+    def ReadBytesColumn( self ):
+        
+        lengths = self.ReadIntColumn()
+        
+        total_length = sum( lengths )
+        
+        blob = self._data[ self._offset : self._offset + total_length ]
+        
+        self._offset += total_length
+        
+        byte_strings = []
+        
+        start = 0
+        
+        for length in lengths:
+            
+            end = start + length
+            
+            byte_strings.append( blob[ start : end ] )
+            
+            start = end
+            
+        
+        return byte_strings
+        
+    
+    def ReadIntColumn( self ):
+        
+        ( dtype_index, has_nulls, num_ints ) = self.ReadStruct( INT_COLUMN_HEADER_STRUCT )
+        
+        if num_ints == 0:
+            
+            return []
+            
+        
+        if has_nulls:
+            
+            num_null_bytes = ( num_ints + 7 ) // 8
+            
+            nulls = numpy.unpackbits( numpy.frombuffer( self._data, dtype = 'uint8', count = num_null_bytes, offset = self._offset ) )[ : num_ints ]
+            
+            self._offset += num_null_bytes
+            
+        
+        deltas = numpy.frombuffer( self._data, dtype = INT_COLUMN_DTYPES[ dtype_index ], count = num_ints, offset = self._offset )
+        
+        self._offset += deltas.nbytes
+        
+        ints = numpy.cumsum( deltas, dtype = 'int64' ).tolist()
+        
+        if has_nulls:
+            
+            ints = [ None if null else i for ( i, null ) in zip( ints, nulls.tolist() ) ]
+            
+        
+        return ints
+        
+    
+    def ReadStruct( self, fmt ):
+        
+        size = struct.calcsize( fmt )
+        
+        result = struct.unpack( fmt, self._data[ self._offset : self._offset + size ] )
+        
+        self._offset += size
+        
+        return result
+        
+    
+class BinaryColumnWriter( object ):
+    
+    def __init__( self ):
+        
+        self._chunks = []
+        
+    
+    def GetBytes( self ):
+        
+        return ''.join( self._chunks )
+        
+    
+    def WriteBytesColumn( self, byte_strings ):
+        
+        byte_strings = list( byte_strings )
+        
+        self.WriteIntColumn( [ len( byte_string ) for byte_string in byte_strings ] )
+        
+        self._chunks.append( ''.join( byte_strings ) )
+        
+    
+    def WriteIntColumn( self, ints ):
+        
+        ints = list( ints )
+        
+        has_nulls = None in ints
+        
+        if has_nulls:
+            
+            nulls = numpy.array( [ i is None for i in ints ], dtype = 'bool' )
+            
+            ints = [ 0 if i is None else i for i in ints ]
+            
+        
+        array = numpy.array( ints, dtype = 'int64' )
+        
+        deltas = array.copy()
+        
+        deltas[ 1 : ] -= array[ : -1 ]
+        
+        for ( dtype_index, dtype ) in enumerate( INT_COLUMN_DTYPES ):
+            
+            info = numpy.iinfo( dtype )
+            
+            if len( deltas ) == 0 or ( deltas.min() >= info.min and deltas.max() <= info.max ):
+                
+                break
+                
+            
+        
+        self.WriteStruct( INT_COLUMN_HEADER_STRUCT, dtype_index, has_nulls, len( array ) )
+        
+        if has_nulls:
+            
+            self._chunks.append( numpy.packbits( nulls ).tostring() )
+            
+        
+        self._chunks.append( deltas.astype( dtype ).tostring() )
+        
+    
+    def WriteStruct( self, fmt, *values ):
+        
+        self._chunks.append( struct.pack( fmt, *values ) )
+        
+    
 class ClientToServerUpdate( HydrusSerialisable.SerialisableBase ):
     
     SERIALISABLE_TYPE = HydrusSerialisable.SERIALISABLE_TYPE_CLIENT_TO_SERVER_UPDATE
@@ -1215,13 +1364,62 @@ class ContentUpdate( HydrusSerialisable.SerialisableBase ):
         return []
         
     
+    def _CanSerialiseToBinary( self ):
+        
+        return set( self._content_data.keys() ).issubset( ( HC.CONTENT_TYPE_FILES, HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_TYPE_TAG_PARENTS, HC.CONTENT_TYPE_TAG_SIBLINGS ) )
+        
+    
+    def _GetSerialisableBinary( self ):
+        
+        # each content_type/action block is stored as columns, so mappings are a tag_id column, a count column, and then all their hash_ids in one big column
+        
+        writer = BinaryColumnWriter()
+        
+        blocks = [ ( content_type, action, data ) for ( content_type, actions_to_datas ) in self._content_data.items() for ( action, data ) in actions_to_datas.items() ]
+        
+        writer.WriteStruct( '<I', len( blocks ) )
+        
+        for ( content_type, action, data ) in blocks:
+            
+            writer.WriteStruct( '<BB', content_type, action )
+            
+            if content_type == HC.CONTENT_TYPE_MAPPINGS:
+                
+                writer.WriteIntColumn( ( tag_id for ( tag_id, hash_ids ) in data ) )
+                writer.WriteIntColumn( ( len( hash_ids ) for ( tag_id, hash_ids ) in data ) )
+                writer.WriteIntColumn( itertools.chain.from_iterable( ( hash_ids for ( tag_id, hash_ids ) in data ) ) )
+                
+            elif content_type == HC.CONTENT_TYPE_FILES and action == HC.CONTENT_UPDATE_DELETE:
+                
+                writer.WriteIntColumn( data )
+                
+            else:
+                
+                # rows of ints, like file info or tag sibling/parent pairs
+                
+                columns = zip( *data )
+                
+                writer.WriteStruct( '<B', len( columns ) )
+                
+                for column in columns:
+                    
+                    writer.WriteIntColumn( column )
+                    
+                
+            
+        
+        return writer.GetBytes()
+        
+    
     def _GetSerialisableInfo( self ):
         
         serialisable_info = []
         
-        for ( content_type, actions_to_datas ) in self._content_data.items():
+        # sorted so the json is the same however this was built--clients that download the binary rebuild the json and check its hash
+        
+        for ( content_type, actions_to_datas ) in sorted( self._content_data.items() ):
             
-            serialisable_actions_to_datas = actions_to_datas.items()
+            serialisable_actions_to_datas = sorted( actions_to_datas.items() )
             
             serialisable_info.append( ( content_type, serialisable_actions_to_datas ) )
             
@@ -1239,6 +1437,57 @@ class ContentUpdate( HydrusSerialisable.SerialisableBase ):
             
         
     
+    def _InitialiseFromSerialisableBinary( self, serialisable_binary ):
+        
+        reader = BinaryColumnReader( serialisable_binary )
+        
+        ( num_blocks, ) = reader.ReadStruct( '<I' )
+        
+        for i in range( num_blocks ):
+            
+            ( content_type, action ) = reader.ReadStruct( '<BB' )
+            
+            if content_type == HC.CONTENT_TYPE_MAPPINGS:
+                
+                tag_ids = reader.ReadIntColumn()
+                counts = reader.ReadIntColumn()
+                all_hash_ids = reader.ReadIntColumn()
+                
+                data = []
+                
+                start = 0
+                
+                for ( tag_id, count ) in zip( tag_ids, counts ):
+                    
+                    end = start + count
+                    
+                    data.append( ( tag_id, all_hash_ids[ start : end ] ) )
+                    
+                    start = end
+                    
+                
+            elif content_type == HC.CONTENT_TYPE_FILES and action == HC.CONTENT_UPDATE_DELETE:
+                
+                data = reader.ReadIntColumn()
+                
+            else:
+                
+                ( num_columns, ) = reader.ReadStruct( '<B' )
+                
+                columns = [ reader.ReadIntColumn() for j in range( num_columns ) ]
+                
+                data = zip( *columns )
+                
+            
+            if content_type not in self._content_data:
+                
+                self._content_data[ content_type ] = {}
+                
+            
+            self._content_data[ content_type ][ action ] = data
+            
+        
+    
     def AddRow( self, row ):
         
         ( content_type, action, data ) = row
@@ -1514,18 +1763,40 @@ class DefinitionsUpdate( HydrusSerialisable.SerialisableBase ):
         self._tag_ids_to_tags = {}
         
     
+    def _CanSerialiseToBinary( self ):
+        
+        return True
+        
+    
+    def _GetSerialisableBinary( self ):
+        
+        writer = BinaryColumnWriter()
+        
+        hash_rows = sorted( self._hash_ids_to_hashes.items() )
+        
+        writer.WriteIntColumn( ( hash_id for ( hash_id, hash ) in hash_rows ) )
+        writer.WriteBytesColumn( ( hash for ( hash_id, hash ) in hash_rows ) )
+        
+        tag_rows = sorted( self._tag_ids_to_tags.items() )
+        
+        writer.WriteIntColumn( ( tag_id for ( tag_id, tag ) in tag_rows ) )
+        writer.WriteBytesColumn( ( HydrusData.ToByteString( tag ) for ( tag_id, tag ) in tag_rows ) )
+        
+        return writer.GetBytes()
+        
+    
     def _GetSerialisableInfo( self ):
         
         serialisable_info = []
         
         if len( self._hash_ids_to_hashes ) > 0:
             
-            serialisable_info.append( ( HC.DEFINITIONS_TYPE_HASHES, [ ( hash_id, hash.encode( 'hex' ) ) for ( hash_id, hash ) in self._hash_ids_to_hashes.items() ] ) )
+            serialisable_info.append( ( HC.DEFINITIONS_TYPE_HASHES, [ ( hash_id, hash.encode( 'hex' ) ) for ( hash_id, hash ) in sorted( self._hash_ids_to_hashes.items() ) ] ) )
             
         
         if len( self._tag_ids_to_tags ) > 0:
             
-            serialisable_info.append( ( HC.DEFINITIONS_TYPE_TAGS, self._tag_ids_to_tags.items() ) )
+            serialisable_info.append( ( HC.DEFINITIONS_TYPE_TAGS, sorted( self._tag_ids_to_tags.items() ) ) )
             
         
         return serialisable_info
@@ -1546,6 +1817,21 @@ class DefinitionsUpdate( HydrusSerialisable.SerialisableBase ):
             
         
     
+    def _InitialiseFromSerialisableBinary( self, serialisable_binary ):
+        
+        reader = BinaryColumnReader( serialisable_binary )
+        
+        hash_ids = reader.ReadIntColumn()
+        hashes = reader.ReadBytesColumn()
+        
+        self._hash_ids_to_hashes = dict( zip( hash_ids, hashes ) )
+        
+        tag_ids = reader.ReadIntColumn()
+        tags = reader.ReadBytesColumn()
+        
+        self._tag_ids_to_tags = { tag_id : tag.decode( 'utf-8' ) for ( tag_id, tag ) in zip( tag_ids, tags ) }
+        
+    
     def AddRow( self, row ):
         
         ( definitions_type, key, value ) = row
@@ -2225,7 +2511,7 @@ class ServerServiceRepository( ServerServiceRestricted ):
         
         if update_due:
             
-            HG.server_busy = True
+            # no server_busy here--each step is short, so requests can just wait for the db between steps
             
             while update_due:
                 
@@ -2238,7 +2524,14 @@ class ServerServiceRepository( ServerServiceRestricted ):
                 
                 end = begin + HC.UPDATE_DURATION
                 
-                update_hashes = HG.server_controller.WriteSynchronous( 'create_update', service_key, begin, end )
+                # the db makes the update a bit at a time, so other requests can be served while it works
+                
+                finished = False
+                
+                while not finished:
+                    
+                    ( finished, update_hashes ) = HG.server_controller.WriteSynchronous( 'create_update', service_key, begin, end )
+                    
                 
                 next_update_due = end + HC.UPDATE_DURATION + 1
                 
@@ -2250,8 +2543,6 @@ class ServerServiceRepository( ServerServiceRestricted ):
                     
                 
             
-            HG.server_busy = False
-            
             with self._lock:
                 
                 self._SetDirty()
@@ -2390,3 +2681,12 @@ class UpdateBuilder( object ):
         return self._updates
         
     
+    def PopFinishedUpdates( self ):
+        
+        updates = self._updates
+        
+        self._updates = []
+        
+        return updates
+        
+    
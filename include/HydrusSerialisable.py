@@ -1,4 +1,5 @@
 import json
+import struct
 import zlib
 
 LZ4_OK = False
@@ -85,8 +86,33 @@ SERIALISABLE_TYPE_GALLERY_IMPORT = 68
 
 SERIALISABLE_TYPES_TO_OBJECT_TYPES = {}
 
+# some objects, like repository updates, are mostly big lists of ints and are slow and fat as json
+# these can dump to a binary network string: this prefix and then zlib( serialisable_type, binary_version, whatever the object writes )
+# json stays the default--binary is only sent to peers that ask for it
+BINARY_NETWORK_STRING_PREFIX = 'hydrus binary\x00'
+BINARY_HEADER_STRUCT = '>HH'
+
+def CreateFromBinaryNetworkString( network_string ):
+    
+    obj_string = zlib.decompress( network_string[ len( BINARY_NETWORK_STRING_PREFIX ) : ] )
+    
+    header_size = struct.calcsize( BINARY_HEADER_STRUCT )
+    
+    ( serialisable_type, binary_version ) = struct.unpack( BINARY_HEADER_STRUCT, obj_string[ : header_size ] )
+    
+    obj = SERIALISABLE_TYPES_TO_OBJECT_TYPES[ serialisable_type ]()
+    
+    obj.InitialiseFromSerialisableBinary( binary_version, buffer( obj_string, header_size ) )
+    
+    return obj
+    
 def CreateFromNetworkString( network_string ):
     
+    if network_string.startswith( BINARY_NETWORK_STRING_PREFIX ):
+        
+        return CreateFromBinaryNetworkString( network_string )
+        
+    
     try:
         
         obj_string = zlib.decompress( network_string )
@@ -156,12 +182,28 @@ class SerialisableBase( object ):
     SERIALISABLE_TYPE = SERIALISABLE_TYPE_BASE
     SERIALISABLE_NAME = 'Base Serialisable Object'
     SERIALISABLE_VERSION = 1
+    SERIALISABLE_BINARY_VERSION = 1
+    
+    def _CanSerialiseToBinary( self ):
+        
+        return False
+        
+    
+    def _GetSerialisableBinary( self ):
+        
+        raise NotImplementedError()
+        
     
     def _GetSerialisableInfo( self ):
         
         raise NotImplementedError()
         
     
+    def _InitialiseFromSerialisableBinary( self, serialisable_binary ):
+        
+        raise NotImplementedError()
+        
+    
     def _InitialiseFromSerialisableInfo( self, serialisable_info ):
         
         raise NotImplementedError()
@@ -172,6 +214,18 @@ class SerialisableBase( object ):
         return old_serialisable_info
         
     
+    def CanSerialiseToBinary( self ):
+        
+        return self._CanSerialiseToBinary()
+        
+    
+    def DumpToBinaryNetworkString( self ):
+        
+        obj_string = struct.pack( BINARY_HEADER_STRUCT, self.SERIALISABLE_TYPE, self.SERIALISABLE_BINARY_VERSION ) + self._GetSerialisableBinary()
+        
+        return BINARY_NETWORK_STRING_PREFIX + zlib.compress( obj_string, 9 )
+        
+    
     def DumpToNetworkString( self ):
         
         obj_string = self.DumpToString()
@@ -196,6 +250,18 @@ class SerialisableBase( object ):
         return ( self.SERIALISABLE_TYPE, self.SERIALISABLE_VERSION, self._GetSerialisableInfo() )
         
     
+    def InitialiseFromSerialisableBinary( self, binary_version, serialisable_binary ):
+        
+        # there is no binary update path--json is the long-term format, so an old binary version just means someone needs to regenerate the object
+        
+        if binary_version != self.SERIALISABLE_BINARY_VERSION:
+            
+            raise Exception( 'Could not load a ' + self.SERIALISABLE_NAME + ', as its binary version was ' + str( binary_version ) + ', but this software only understands ' + str( self.SERIALISABLE_BINARY_VERSION ) + '!' )
+            
+        
+        self._InitialiseFromSerialisableBinary( serialisable_binary )
+        
+    
     def InitialiseFromSerialisableInfo( self, version, serialisable_info ):
         
         while version < self.SERIALISABLE_VERSION:
@@ -5,14 +5,17 @@ import HydrusImageHandling
 import HydrusNetwork
 import HydrusPaths
 import HydrusSerialisable
+import errno
 import os
 import time
 import traceback
 from twisted.internet import reactor, defer
+from twisted.internet.interfaces import ISSLTransport
 from twisted.internet.threads import deferToThread
+from twisted.web import http
 from twisted.web.server import NOT_DONE_YET
 from twisted.web.resource import Resource
-from twisted.web.static import File as FileResource, NoRangeStaticProducer
+from twisted.web.static import File as FileResource
 import HydrusData
 import HydrusGlobals as HG
 
@@ -254,8 +257,238 @@ def ParseFileArguments( path, decompression_bombs_ok = False ):
     
     return args
     
+def ParseRangeHeader( range_header, size ):
+    
+    # returns ( offset, length ) for a single satisfiable byte range, or None if the whole file should be sent
+    # we only do single ranges--multipart/byteranges is not worth it for what we serve, and ignoring the header is allowed
+    
+    if range_header is None:
+        
+        return None
+        
+    
+    range_header = range_header.strip()
+    
+    if not range_header.startswith( 'bytes=' ):
+        
+        return None
+        
+    
+    byte_range = range_header[ 6 : ].strip()
+    
+    if ',' in byte_range or '-' not in byte_range:
+        
+        return None
+        
+    
+    ( start, end ) = byte_range.split( '-', 1 )
+    
+    try:
+        
+        if start == '':
+            
+            # a suffix range, 'the last n bytes'
+            
+            suffix_length = int( end )
+            
+            if suffix_length <= 0:
+                
+                raise HydrusExceptions.RangeNotSatisfiableException( 'Cannot serve a zero-length suffix range!' )
+                
+            
+            offset = max( size - suffix_length, 0 )
+            last_byte = size - 1
+            
+        else:
+            
+            offset = int( start )
+            
+            if end == '':
+                
+                last_byte = size - 1
+                
+            else:
+                
+                last_byte = int( end )
+                
+                if last_byte < offset:
+                    
+                    # syntactically invalid, so we ignore it
+                    
+                    return None
+                    
+                
+                last_byte = min( last_byte, size - 1 )
+                
+            
+        
+    except ValueError:
+        
+        return None
+        
+    
+    if offset >= size:
+        
+        raise HydrusExceptions.RangeNotSatisfiableException( 'That range is not within the file!' )
+        
+    
+    return ( offset, last_byte - offset + 1 )
+    
 hydrus_favicon = FileResource( os.path.join( HC.STATIC_DIR, 'hydrus.ico' ), defaultType = 'image/x-icon' )
 
+class FileProducer( object ):
+    
+    # a pull producer that sends a byte range of a file
+    # where we have os.sendfile and a plain tcp socket, the bytes go from the file to the socket without coming up into python
+    # otherwise, or whenever the socket is full, we write chunks through the request and let twisted buffer them
+    
+    CHUNK_SIZE = 65536
+    
+    def __init__( self, request, path, offset, length ):
+        
+        self._request = request
+        self._path = path
+        self._offset = offset
+        self._num_bytes_left = length
+        
+        self._f = None
+        self._socket_fd = None
+        
+    
+    def _Finish( self ):
+        
+        request = self._request
+        
+        self.stopProducing()
+        
+        request.unregisterProducer()
+        request.finish()
+        
+    
+    def _GetSocketFD( self ):
+        
+        if not hasattr( os, 'sendfile' ):
+            
+            return None
+            
+        
+        transport = self._request.transport
+        
+        if transport is None or ISSLTransport.providedBy( transport ) or not hasattr( transport, 'getHandle' ):
+            
+            return None
+            
+        
+        try:
+            
+            return transport.getHandle().fileno()
+            
+        except:
+            
+            return None
+            
+        
+    
+    def _TransportBufferIsEmpty( self ):
+        
+        # sendfile goes around the transport, so anything it still has buffered would end up after our bytes
+        
+        transport = self._request.transport
+        
+        data_buffer = getattr( transport, 'dataBuffer', None )
+        temp_data_buffer = getattr( transport, '_tempDataBuffer', None )
+        
+        if data_buffer is None or temp_data_buffer is None:
+            
+            return False
+            
+        
+        return len( data_buffer ) - getattr( transport, 'offset', 0 ) == 0 and len( temp_data_buffer ) == 0
+        
+    
+    def resumeProducing( self ):
+        
+        if self._request is None:
+            
+            return
+            
+        
+        if self._num_bytes_left == 0:
+            
+            self._Finish()
+            
+            return
+            
+        
+        if self._socket_fd is not None and self._request.startedWriting and self._TransportBufferIsEmpty():
+            
+            try:
+                
+                num_bytes_sent = os.sendfile( self._socket_fd, self._f.fileno(), self._offset, self._num_bytes_left )
+                
+            except OSError as e:
+                
+                if e.errno not in ( errno.EAGAIN, errno.EWOULDBLOCK ):
+                    
+                    raise
+                    
+                
+                num_bytes_sent = 0
+                
+            
+            if num_bytes_sent > 0:
+                
+                self._offset += num_bytes_sent
+                self._num_bytes_left -= num_bytes_sent
+                
+                # the transport does not know about these bytes, so it will not ask us for more
+                
+                reactor.callLater( 0, self.resumeProducing )
+                
+                return
+                
+            
+        
+        self._f.seek( self._offset )
+        
+        data = self._f.read( min( self.CHUNK_SIZE, self._num_bytes_left ) )
+        
+        if len( data ) == 0:
+            
+            # the file shrank under us
+            
+            self._Finish()
+            
+            return
+            
+        
+        self._offset += len( data )
+        self._num_bytes_left -= len( data )
+        
+        self._request.write( data )
+        
+    
+    def start( self ):
+        
+        self._f = open( self._path, 'rb' )
+        
+        self._socket_fd = self._GetSocketFD()
+        
+        self._request.registerProducer( self, False )
+        
+    
+    def stopProducing( self ):
+        
+        if self._f is not None:
+            
+            self._f.close()
+            
+            self._f = None
+            
+        
+        self._request = None
+        
+    
 class HydrusDomain( object ):
     
     def __init__( self, local_only ):
@@ -452,32 +685,80 @@ class HydrusResource( Resource ):
             path = response_context.GetPath()
             
             size = os.path.getsize( path )
+            last_modified = os.path.getmtime( path )
             
             mime = response_context.GetMime()
             
             content_type = HC.mime_string_lookup[ mime ]
             
-            content_length = size
-            
             ( base, filename ) = os.path.split( path )
             
             content_disposition = 'inline; filename="' + filename + '"'
             
-            # can't be unicode!
-            request.setHeader( 'Content-Type', str( content_type ) )
-            request.setHeader( 'Content-Length', str( content_length ) )
-            request.setHeader( 'Content-Disposition', str( content_disposition ) )
+            etag = response_context.GetETag()
             
-            request.setHeader( 'Expires', time.strftime( '%a, %d %b %Y %H:%M:%S GMT', time.gmtime( time.time() + 86400 * 365 ) ) )
-            request.setHeader( 'Cache-Control', str( 86400 * 365 ) )
-            
-            fileObject = open( path, 'rb' )
+            if etag is not None:
+                
+                # can't be unicode!
+                etag = str( '"' + etag + '"' )
+                
+                request.setHeader( 'ETag', etag )
+                
             
-            producer = NoRangeStaticProducer( request, fileObject )
+            request.setHeader( 'Last-Modified', http.datetimeToString( last_modified ) )
+            request.setHeader( 'Accept-Ranges', 'bytes' )
             
-            producer.start()
+            request.setHeader( 'Expires', time.strftime( '%a, %d %b %Y %H:%M:%S GMT', time.gmtime( time.time() + 86400 * 365 ) ) )
+            request.setHeader( 'Cache-Control', str( 86400 * 365 ) )
             
-            do_finish = False
+            if status_code == 200 and self._isNotModified( request, etag, last_modified ):
+                
+                request.setResponseCode( 304 )
+                
+                content_length = 0
+                
+            else:
+                
+                offset = 0
+                content_length = size
+                
+                if status_code == 200 and self._rangeIsCurrent( request, etag, last_modified ):
+                    
+                    try:
+                        
+                        byte_range = ParseRangeHeader( request.getHeader( 'Range' ), size )
+                        
+                        if byte_range is not None:
+                            
+                            ( offset, content_length ) = byte_range
+                            
+                            request.setResponseCode( 206 )
+                            request.setHeader( 'Content-Range', 'bytes ' + str( offset ) + '-' + str( offset + content_length - 1 ) + '/' + str( size ) )
+                            
+                        
+                    except HydrusExceptions.RangeNotSatisfiableException:
+                        
+                        content_length = 0
+                        
+                        request.setResponseCode( 416 )
+                        request.setHeader( 'Content-Range', 'bytes */' + str( size ) )
+                        
+                    
+                
+                # can't be unicode!
+                request.setHeader( 'Content-Type', str( content_type ) )
+                request.setHeader( 'Content-Length', str( content_length ) )
+                request.setHeader( 'Content-Disposition', str( content_disposition ) )
+                
+                if content_length > 0:
+                    
+                    producer = FileProducer( request, path, offset, content_length )
+                    
+                    producer.start()
+                    
+                    do_finish = False
+                    
+                
             
         elif response_context.HasBody():
             
@@ -630,6 +911,45 @@ class HydrusResource( Resource ):
         return request
         
     
+    def _isNotModified( self, request, etag, last_modified ):
+        
+        # if-none-match wins over if-modified-since when both are present
+        
+        if_none_match = request.getHeader( 'If-None-Match' )
+        
+        if if_none_match is not None:
+            
+            if etag is None:
+                
+                return False
+                
+            
+            tags = [ tag.strip() for tag in if_none_match.split( ',' ) ]
+            
+            # weak comparison is fine for a GET
+            
+            tags = [ tag[2:] if tag.startswith( 'W/' ) else tag for tag in tags ]
+            
+            return etag in tags or '*' in tags
+            
+        
+        if_modified_since = request.getHeader( 'If-Modified-Since' )
+        
+        if if_modified_since is not None:
+            
+            try:
+                
+                return int( last_modified ) <= http.stringToDatetime( if_modified_since )
+                
+            except:
+                
+                return False
+                
+            
+        
+        return False
+        
+    
     def _parseAccessKey( self, request ):
         
         if not request.requestHeaders.hasHeader( 'Hydrus-Key' ):
@@ -653,6 +973,34 @@ class HydrusResource( Resource ):
         return access_key
         
     
+    def _rangeIsCurrent( self, request, etag, last_modified ):
+        
+        # a range request with if-range only gets its range if the file has not changed
+        
+        if_range = request.getHeader( 'If-Range' )
+        
+        if if_range is None:
+            
+            return True
+            
+        
+        if_range = if_range.strip()
+        
+        if if_range.startswith( '"' ):
+            
+            return if_range == etag
+            
+        
+        try:
+            
+            return int( last_modified ) <= http.stringToDatetime( if_range )
+            
+        except:
+            
+            return False
+            
+        
+    
     def _reportDataUsed( self, request, num_bytes ):
         
         self._service.ReportDataUsed( num_bytes )
@@ -764,7 +1112,7 @@ class HydrusResourceWelcome( HydrusResource ):
     
 class ResponseContext( object ):
     
-    def __init__( self, status_code, mime = HC.APPLICATION_JSON, body = None, path = None, cookies = None ):
+    def __init__( self, status_code, mime = HC.APPLICATION_JSON, body = None, path = None, cookies = None, etag = None ):
         
         if isinstance( body, HydrusSerialisable.SerialisableBase ):
             
@@ -781,6 +1129,7 @@ class ResponseContext( object ):
         self._body = body
         self._path = path
         self._cookies = cookies
+        self._etag = etag
         
     
     def GetBody( self ):
@@ -790,6 +1139,8 @@ class ResponseContext( object ):
     
     def GetCookies( self ): return self._cookies
     
+    def GetETag( self ): return self._etag
+    
     def GetLength( self ): return len( self._body )
     
     def GetMime( self ): return self._mime
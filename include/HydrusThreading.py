@@ -3,12 +3,14 @@ import collections
 import HydrusExceptions
 import Queue
 import random
+import sys
 import threading
 import time
 import traceback
 import HydrusData
 import HydrusGlobals as HG
 import os
+import psutil
 
 NEXT_THREAD_CLEAROUT = 0
 
@@ -303,6 +305,46 @@ class THREADCallToThread( DAEMON ):
             
         
     
+class THREADWorkerPoolWorker( threading.Thread ):
+    
+    # not a hydrus DAEMON, as the model keeps submitting work (e.g. shutdown maintenance) after the view has gone, so we only stop on model shutdown
+    # it is a python daemon thread though, so a job stuck in some library call cannot hold the process open at exit
+    
+    def __init__( self, name, queue ):
+        
+        threading.Thread.__init__( self, name = name )
+        
+        self.daemon = True
+        
+        self._queue = queue
+        
+    
+    def run( self ):
+        
+        while True:
+            
+            try:
+                
+                ( priority, job_number, job ) = self._queue.get( timeout = 1 )
+                
+            except Queue.Empty:
+                
+                # only check shutdown once the queue is clear, so nothing is left waiting forever
+                
+                if IsThreadShuttingDown():
+                    
+                    return
+                    
+                
+                continue
+                
+            
+            job.Work()
+            
+            del job
+            
+        
+    
 class JobScheduler( threading.Thread ):
     
     def __init__( self, controller ):
@@ -686,3 +728,192 @@ class RepeatingJob( SchedulableJob ):
             
         
     
+class WorkerPool( object ):
+    
+    # a fixed set of threads chewing through a shared queue
+    # this is for cpu work that releases the GIL, like OpenCV and PIL decoding/resizing and hashlib, so it spreads over all cores
+    
+    def __init__( self, controller, name, num_workers = None ):
+        
+        if num_workers is None:
+            
+            num_workers = max( 1, psutil.cpu_count() or 1 )
+            
+        
+        self._controller = controller
+        self._name = name
+        self._num_workers = num_workers
+        
+        self._queue = Queue.PriorityQueue()
+        
+        self._workers = []
+        
+        self._lock = threading.Lock()
+        
+        self._next_job_number = 0
+        
+        self._shutting_down = False
+        
+    
+    def _MaintainWorkers( self ):
+        
+        self._workers = [ worker for worker in self._workers if worker.is_alive() ]
+        
+        while len( self._workers ) < self._num_workers:
+            
+            worker = THREADWorkerPoolWorker( self._name + ' worker', self._queue )
+            
+            worker.start()
+            
+            self._workers.append( worker )
+            
+        
+    
+    def GetNumWorkers( self ):
+        
+        return self._num_workers
+        
+    
+    def Map( self, func, items ):
+        
+        # results come back in the same order as items, and the first error is raised once all the jobs are done
+        
+        jobs = [ self.Submit( func, item ) for item in items ]
+        
+        for job in jobs:
+            
+            job.Wait()
+            
+        
+        return [ job.GetResult() for job in jobs ]
+        
+    
+    def Shutdown( self ):
+        
+        # the workers finish whatever is already queued and then stop
+        
+        with self._lock:
+            
+            self._shutting_down = True
+            
+            for worker in self._workers:
+                
+                ShutdownThread( worker )
+                
+            
+        
+    
+    def Submit( self, func, *args, **kwargs ):
+        
+        return self.SubmitWithPriority( 0, func, *args, **kwargs )
+        
+    
+    def SubmitWithPriority( self, priority, func, *args, **kwargs ):
+        
+        # lower priority number goes first, and jobs of equal priority go in submission order
+        
+        if HG.model_shutdown:
+            
+            raise HydrusExceptions.ShutdownException( 'Application is shutting down!' )
+            
+        
+        job = WorkerPoolJob( func, args, kwargs )
+        
+        with self._lock:
+            
+            if self._shutting_down:
+                
+                raise HydrusExceptions.ShutdownException( 'Worker pool ' + self._name + ' is shutting down!' )
+                
+            
+            self._MaintainWorkers()
+            
+            job_number = self._next_job_number
+            
+            self._next_job_number += 1
+            
+            self._queue.put( ( priority, job_number, job ) )
+            
+        
+        return job
+        
+    
+class WorkerPoolJob( object ):
+    
+    def __init__( self, func, args, kwargs ):
+        
+        self._func = func
+        self._args = args
+        self._kwargs = kwargs
+        
+        self._cancelled = False
+        
+        self._result = None
+        self._error_info = None
+        
+        self._done = threading.Event()
+        
+    
+    def Cancel( self ):
+        
+        # a job that has not started yet will be skipped by the worker
+        
+        self._cancelled = True
+        
+    
+    def GetResult( self ):
+        
+        self.Wait()
+        
+        if self._error_info is not None:
+            
+            # raise with the worker's traceback, so the error points at the job and not at us
+            
+            ( etype, value, tb ) = self._error_info
+            
+            raise etype, value, tb
+            
+        
+        return self._result
+        
+    
+    def IsCancelled( self ):
+        
+        return self._cancelled
+        
+    
+    def IsDone( self ):
+        
+        return self._done.is_set()
+        
+    
+    def Wait( self, timeout = None ):
+        
+        return self._done.wait( timeout )
+        
+    
+    def Work( self ):
+        
+        try:
+            
+            if self._cancelled:
+                
+                raise HydrusExceptions.CancelledException( 'Job was cancelled before it started!' )
+                
+            
+            self._result = self._func( *self._args, **self._kwargs )
+            
+        except Exception:
+            
+            self._error_info = sys.exc_info()
+            
+        finally:
+            
+            del self._func
+            del self._args
+            del self._kwargs
+            
+            self._done.set()
+            
+        
+    
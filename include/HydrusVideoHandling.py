@@ -1,3 +1,4 @@
+import bisect
 import HydrusConstants as HC
 import HydrusData
 import HydrusExceptions
@@ -188,6 +189,54 @@ def GetFFMPEGInfoLines( path, count_frames_manually = False ):
     
     return lines
     
+def GetFFMPEGKeyframeTimestamps( path ):
+    
+    # skip_frame nokey means ffmpeg only decodes the keyframes, so this is a quick pass even on a long file
+    
+    try:
+        
+        path.encode( 'ascii' ) # throwing unicode at the console is a mess best left for Python 3
+        
+    except UnicodeEncodeError:
+        
+        # copying a two hour video to temp is not worth it for an index, so it just seeks without one
+        
+        return []
+        
+    
+    cmd = [ FFMPEG_PATH, '-skip_frame', 'nokey', '-i', path, '-an', '-sn', '-vf', 'showinfo', '-f', 'null' ]
+    
+    if HC.PLATFORM_WINDOWS:
+        
+        cmd.append( 'NUL' )
+        
+    else:
+        
+        cmd.append( '/dev/null' )
+        
+    
+    try:
+        
+        proc = subprocess.Popen( cmd, bufsize = 10**5, stdout = subprocess.PIPE, stderr = subprocess.PIPE, startupinfo = HydrusData.GetHideTerminalSubprocessStartupInfo() )
+        
+    except:
+        
+        if not os.path.exists( FFMPEG_PATH ):
+            
+            raise Exception( 'FFMPEG was not found!' )
+            
+        else:
+            
+            raise
+            
+        
+    
+    ( stdout, stderr ) = proc.communicate()
+    
+    lines = stderr.splitlines()
+    
+    return ParseFFMPEGKeyframeTimestamps( lines )
+    
 def GetFFMPEGVideoProperties( path, count_frames_manually = False ):
     
     lines = GetFFMPEGInfoLines( path, count_frames_manually )
@@ -508,6 +557,37 @@ def ParseFFMPEGHasVideo( lines ):
     
     return True
     
+def ParseFFMPEGKeyframeTimestamps( lines ):
+    
+    # showinfo lines go like:
+    # [Parsed_showinfo_0 @ 0000000000d5a3c0] n:   3 pts: 307200 pts_time:20.02   pos: 5418410 fmt:yuv420p sar:1/1 s:1280x720 i:P iskey:1 type:I ...
+    
+    timestamps = set()
+    
+    for line in lines:
+        
+        if 'Parsed_showinfo' not in line:
+            
+            continue
+            
+        
+        match = re.search( r'pts_time:\s*(-?[0-9\.]+)', line )
+        
+        if match is not None:
+            
+            try:
+                
+                timestamps.add( max( 0.0, float( match.group( 1 ) ) ) )
+                
+            except ValueError:
+                
+                continue
+                
+            
+        
+    
+    return sorted( timestamps )
+    
 def ParseFFMPEGMimeText( lines ):
     
     try:
@@ -603,6 +683,45 @@ def ParseFFMPEGVideoResolution( lines ):
         raise HydrusExceptions.MimeException( 'Error parsing resolution!' )
         
     
+# restarting ffmpeg costs about this many frames of decoding through the pipe
+FRAMES_WORTH_A_SEEK = 24
+
+class VideoKeyframeIndex( object ):
+    
+    def __init__( self, timestamps, fps ):
+        
+        self._timestamps = timestamps
+        
+        self._frame_indices = sorted( { int( round( timestamp * fps ) ) for timestamp in timestamps } )
+        
+        if len( self._frame_indices ) == 0 or self._frame_indices[0] != 0:
+            
+            self._frame_indices.insert( 0, 0 )
+            
+        
+    
+    def GetEstimatedMemoryFootprint( self ):
+        
+        return 64 * len( self._frame_indices )
+        
+    
+    def GetKeyframeAtOrBefore( self, index ):
+        
+        i = bisect.bisect_right( self._frame_indices, index )
+        
+        return self._frame_indices[ max( 0, i - 1 ) ]
+        
+    
+    def GetNumKeyframes( self ):
+        
+        return len( self._frame_indices )
+        
+    
+    def GetTimestamps( self ):
+        
+        return list( self._timestamps )
+        
+    
 # This was built from moviepy's FFMPEG_VideoReader
 class VideoRendererFFMPEG( object ):
     
@@ -614,6 +733,8 @@ class VideoRendererFFMPEG( object ):
         self._num_frames = num_frames
         self._target_resolution = target_resolution
         
+        self._keyframe_index = None
+        
         self.lastread = None
         
         self.fps = float( self._num_frames ) / self._duration
@@ -784,10 +905,27 @@ class VideoRendererFFMPEG( object ):
         return result
         
     
+    def set_keyframe_index( self, keyframe_index ):
+        
+        self._keyframe_index = keyframe_index
+        
+    
     def set_position( self, pos ):
         
         rewind = pos < self.pos
-        jump_a_long_way_ahead = pos > self.pos + 60
+        
+        if self._keyframe_index is None:
+            
+            jump_a_long_way_ahead = pos > self.pos + 60
+            
+        else:
+            
+            # an input seek restarts decoding at the keyframe before pos, so if that keyframe is past where we are now, we can skip straight to it
+            
+            jump_to_keyframe = self._keyframe_index.GetKeyframeAtOrBefore( pos ) > self.pos + FRAMES_WORTH_A_SEEK
+            
+            jump_a_long_way_ahead = jump_to_keyframe or pos > self.pos + 60
+            
         
         if rewind or jump_a_long_way_ahead: self.initialize( pos )
         else: self.skip_frames( pos - self.pos )
@@ -27,6 +27,9 @@ import HydrusData
 import HydrusTags
 import HydrusGlobals as HG
 
+# how long a single 'create_update' step works before it hands the db back
+UPDATE_GENERATION_WORK_PERIOD = 1.0
+
 def GenerateRepositoryMasterMapTableNames( service_id ):
     
     suffix = str( service_id )
@@ -103,6 +106,8 @@ class DB( HydrusDB.HydrusDB ):
         
         self._account_type_cache = {}
         
+        self._repository_update_generation_jobs = {}
+        
         HydrusDB.HydrusDB.__init__( self, controller, db_dir, db_name, no_wal = no_wal )
         
     
@@ -1532,58 +1537,93 @@ class DB( HydrusDB.HydrusDB ):
     
     def _RepositoryCreateUpdate( self, service_key, begin, end ):
         
-        service_id = self._GetServiceId( service_key )
-        
-        ( name, ) = self._c.execute( 'SELECT name FROM services WHERE service_id = ?;', ( service_id, ) ).fetchone()
+        # the service calls this repeatedly until it says it is finished
+        # each call only does a second or so of work and writes out any update files that have filled up, so other jobs can get in between
         
-        HydrusData.Print( 'Creating update for ' + repr( name ) + ' from ' + HydrusData.ConvertTimestampToPrettyTime( begin, in_gmt = True ) + ' to ' + HydrusData.ConvertTimestampToPrettyTime( end, in_gmt = True ) )
+        service_id = self._GetServiceId( service_key )
         
-        updates = self._RepositoryGenerateUpdates( service_id, begin, end )
+        job_key = ( service_id, begin, end )
         
-        update_hashes = []
+        if job_key not in self._repository_update_generation_jobs:
+            
+            ( name, ) = self._c.execute( 'SELECT name FROM services WHERE service_id = ?;', ( service_id, ) ).fetchone()
+            
+            HydrusData.Print( 'Creating update for ' + repr( name ) + ' from ' + HydrusData.ConvertTimestampToPrettyTime( begin, in_gmt = True ) + ' to ' + HydrusData.ConvertTimestampToPrettyTime( end, in_gmt = True ) )
+            
+            update_generator = self._RepositoryGenerateUpdatesIncrementally( service_id, begin, end )
+            
+            self._repository_update_generation_jobs[ job_key ] = ( update_generator, [], [ 0, 0 ], HydrusData.GetNowPrecise() )
+            
         
-        total_definition_rows = 0
-        total_content_rows = 0
+        ( update_generator, update_hashes, total_rows, time_started ) = self._repository_update_generation_jobs[ job_key ]
         
-        if len( updates ) > 0:
+        try:
+            
+            ( updates, num_rows_done ) = update_generator.next()
             
-            for update in updates:
+        except StopIteration:
+            
+            del self._repository_update_generation_jobs[ job_key ]
+            
+            if len( update_hashes ) > 0:
                 
-                num_rows = update.GetNumRows()
+                ( update_table_name ) = GenerateRepositoryUpdateTableName( service_id )
                 
-                if isinstance( update, HydrusNetwork.DefinitionsUpdate ):
-                    
-                    total_definition_rows += num_rows
-                    
-                elif isinstance( update, HydrusNetwork.ContentUpdate ):
-                    
-                    total_content_rows += num_rows
-                    
+                master_hash_ids = self._GetMasterHashIds( update_hashes )
                 
-                update_bytes = update.DumpToNetworkString()
+                self._c.executemany( 'INSERT OR IGNORE INTO ' + update_table_name + ' ( master_hash_id ) VALUES ( ? );', ( ( master_hash_id, ) for master_hash_id in master_hash_ids ) )
                 
-                update_hash = hashlib.sha256( update_bytes ).digest()
+            
+            ( total_definition_rows, total_content_rows ) = total_rows
+            
+            rows_s = HydrusData.ToHumanInt( int( ( total_definition_rows + total_content_rows ) / max( HydrusData.GetNowPrecise() - time_started, 0.001 ) ) )
+            
+            HydrusData.Print( 'Update OK. ' + HydrusData.ToHumanInt( total_definition_rows ) + ' definition rows and ' + HydrusData.ToHumanInt( total_content_rows ) + ' content rows in ' + HydrusData.ToHumanInt( len( update_hashes ) ) + ' update files, at ' + rows_s + ' rows/s.' )
+            
+            return ( True, update_hashes )
+            
+        except:
+            
+            del self._repository_update_generation_jobs[ job_key ]
+            
+            raise
+            
+        
+        for update in updates:
+            
+            num_rows = update.GetNumRows()
+            
+            if isinstance( update, HydrusNetwork.DefinitionsUpdate ):
                 
-                dest_path = ServerFiles.GetExpectedFilePath( update_hash )
+                total_rows[0] += num_rows
                 
-                with open( dest_path, 'wb' ) as f:
-                    
-                    f.write( update_bytes )
-                    
+            elif isinstance( update, HydrusNetwork.ContentUpdate ):
                 
-                update_hashes.append( update_hash )
+                total_rows[1] += num_rows
                 
             
-            ( update_table_name ) = GenerateRepositoryUpdateTableName( service_id )
+            update_bytes = update.DumpToNetworkString()
             
-            master_hash_ids = self._GetMasterHashIds( update_hashes )
+            update_hash = hashlib.sha256( update_bytes ).digest()
             
-            self._c.executemany( 'INSERT OR IGNORE INTO ' + update_table_name + ' ( master_hash_id ) VALUES ( ? );', ( ( master_hash_id, ) for master_hash_id in master_hash_ids ) )
+            dest_path = ServerFiles.GetExpectedFilePath( update_hash )
+            
+            with open( dest_path, 'wb' ) as f:
+                
+                f.write( update_bytes )
+                
+            
+            update_hashes.append( update_hash )
             
         
-        HydrusData.Print( 'Update OK. ' + HydrusData.ToHumanInt( total_definition_rows ) + ' definition rows and ' + HydrusData.ToHumanInt( total_content_rows ) + ' content rows in ' + HydrusData.ToHumanInt( len( updates ) ) + ' update files.' )
+        if len( updates ) > 0:
+            
+            rows_s = HydrusData.ToHumanInt( int( num_rows_done / max( HydrusData.GetNowPrecise() - time_started, 0.001 ) ) )
+            
+            HydrusData.Print( 'Update progress: ' + HydrusData.ToHumanInt( num_rows_done ) + ' rows done at ' + rows_s + ' rows/s, ' + HydrusData.ToHumanInt( len( update_hashes ) ) + ' update files written so far.' )
+            
         
-        return update_hashes
+        return ( False, update_hashes )
         
     
     def _RepositoryDeleteFiles( self, service_id, account_id, service_hash_ids ):
@@ -1742,127 +1782,69 @@ class DB( HydrusDB.HydrusDB ):
     
     def _RepositoryGenerateUpdates( self, service_id, begin, end ):
         
-        MAX_DEFINITIONS_ROWS = 50000
-        MAX_CONTENT_ROWS = 250000
-        
-        MAX_CONTENT_CHUNK = 25000
-        
         updates = []
         
-        definitions_update_builder = HydrusNetwork.UpdateBuilder( HydrusNetwork.DefinitionsUpdate, MAX_DEFINITIONS_ROWS )
-        content_update_builder = HydrusNetwork.UpdateBuilder( HydrusNetwork.ContentUpdate, MAX_CONTENT_ROWS )
-        
-        ( service_hash_ids_table_name, service_tag_ids_table_name ) = GenerateRepositoryMasterMapTableNames( service_id )
-        
-        for ( service_hash_id, hash ) in self._c.execute( 'SELECT service_hash_id, hash FROM ' + service_hash_ids_table_name + ' NATURAL JOIN hashes WHERE hash_id_timestamp BETWEEN ? AND ?;', ( begin, end ) ):
-            
-            row = ( HC.DEFINITIONS_TYPE_HASHES, service_hash_id, hash )
-            
-            definitions_update_builder.AddRow( row )
-            
-        
-        for ( service_tag_id, tag ) in self._c.execute( 'SELECT service_tag_id, tag FROM ' + service_tag_ids_table_name + ' NATURAL JOIN tags WHERE tag_id_timestamp BETWEEN ? AND ?;', ( begin, end ) ):
-            
-            row = ( HC.DEFINITIONS_TYPE_TAGS, service_tag_id, tag )
+        for ( finished_updates, num_rows_done ) in self._RepositoryGenerateUpdatesIncrementally( service_id, begin, end ):
             
-            definitions_update_builder.AddRow( row )
+            updates.extend( finished_updates )
             
         
-        definitions_update_builder.Finish()
-        
-        updates.extend( definitions_update_builder.GetUpdates() )
+        return updates
         
-        #
+    
+    def _RepositoryGenerateUpdatesIncrementally( self, service_id, begin, end ):
         
-        ( current_files_table_name, deleted_files_table_name, pending_files_table_name, petitioned_files_table_name, ip_addresses_table_name ) = GenerateRepositoryFilesTableNames( service_id )
+        # rows are streamed through the builders one time slice at a time, so we only ever hold a slice's worth of rows and the updates not yet handed out
+        # about once a second, we yield the updates that have filled up and the number of rows done so far
+        # no cursor is left open across a yield, so the caller is free to do other jobs in between
         
-        table_join = self._RepositoryGetFilesInfoFilesTableJoin( service_id, HC.CONTENT_STATUS_CURRENT )
+        MAX_DEFINITIONS_ROWS = 50000
+        MAX_CONTENT_ROWS = 250000
         
-        for ( service_hash_id, size, mime, timestamp, width, height, duration, num_frames, num_words ) in self._c.execute( 'SELECT service_hash_id, size, mime, file_timestamp, width, height, duration, num_frames, num_words FROM ' + table_join + ' WHERE file_timestamp BETWEEN ? AND ?;', ( begin, end ) ):
-            
-            file_row = ( service_hash_id, size, mime, timestamp, width, height, duration, num_frames, num_words )
-            
-            content_update_builder.AddRow( ( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_ADD, file_row ) )
-            
+        SLICE_DURATION = 600
         
-        service_hash_ids = [ service_hash_id for ( service_hash_id, ) in self._c.execute( 'SELECT service_hash_id FROM ' + deleted_files_table_name + ' WHERE file_timestamp BETWEEN ? AND ?;', ( begin, end ) ) ]
+        definitions_update_builder = HydrusNetwork.UpdateBuilder( HydrusNetwork.DefinitionsUpdate, MAX_DEFINITIONS_ROWS )
+        content_update_builder = HydrusNetwork.UpdateBuilder( HydrusNetwork.ContentUpdate, MAX_CONTENT_ROWS )
         
-        for service_hash_id in service_hash_ids:
-            
-            content_update_builder.AddRow( ( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_DELETE, service_hash_id ) )
-            
+        definitions_stages = [ 'hashes', 'tags' ]
+        content_stages = [ 'new files', 'deleted files', 'new mappings', 'deleted mappings', 'new tag parents', 'deleted tag parents', 'new tag siblings', 'deleted tag siblings' ]
         
-        #
+        stages_and_builders = [ ( stage, definitions_update_builder ) for stage in definitions_stages ] + [ ( stage, content_update_builder ) for stage in content_stages ]
         
-        ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateRepositoryMappingsTableNames( service_id )
+        num_rows_done = 0
         
-        service_tag_ids_to_service_hash_ids = HydrusData.BuildKeyToListDict( self._c.execute( 'SELECT service_tag_id, service_hash_id FROM ' + current_mappings_table_name + ' WHERE mapping_timestamp BETWEEN ? AND ?;', ( begin, end ) ) )
+        time_of_last_yield = HydrusData.GetNowPrecise()
         
-        for ( service_tag_id, service_hash_ids ) in service_tag_ids_to_service_hash_ids.items():
+        for ( stage, update_builder ) in stages_and_builders:
             
-            for block_of_service_hash_ids in HydrusData.SplitListIntoChunks( service_hash_ids, MAX_CONTENT_CHUNK ):
+            if stage == content_stages[0]:
                 
-                row_weight = len( block_of_service_hash_ids )
-                
-                content_update_builder.AddRow( ( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( service_tag_id, block_of_service_hash_ids ) ), row_weight )
+                definitions_update_builder.Finish()
                 
             
-        
-        service_tag_ids_to_service_hash_ids = HydrusData.BuildKeyToListDict( self._c.execute( 'SELECT service_tag_id, service_hash_id FROM ' + deleted_mappings_table_name + ' WHERE mapping_timestamp BETWEEN ? AND ?;', ( begin, end ) ) )
-        
-        for ( service_tag_id, service_hash_ids ) in service_tag_ids_to_service_hash_ids.items():
-            
-            for block_of_service_hash_ids in HydrusData.SplitListIntoChunks( service_hash_ids, MAX_CONTENT_CHUNK ):
+            for slice_begin in range( begin, end + 1, SLICE_DURATION ):
                 
-                row_weight = len( block_of_service_hash_ids )
+                slice_end = min( slice_begin + SLICE_DURATION - 1, end )
                 
-                content_update_builder.AddRow( ( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_DELETE, ( service_tag_id, block_of_service_hash_ids ) ), row_weight )
+                for ( row, row_weight ) in self._RepositoryGetUpdateRows( service_id, stage, slice_begin, slice_end ):
+                    
+                    update_builder.AddRow( row, row_weight )
+                    
+                    num_rows_done += row_weight
+                    
+                
+                if HydrusData.TimeHasPassedFloat( time_of_last_yield + UPDATE_GENERATION_WORK_PERIOD ):
+                    
+                    yield ( definitions_update_builder.PopFinishedUpdates() + content_update_builder.PopFinishedUpdates(), num_rows_done )
+                    
+                    time_of_last_yield = HydrusData.GetNowPrecise()
+                    
                 
             
         
-        #
-        
-        ( current_tag_parents_table_name, deleted_tag_parents_table_name, pending_tag_parents_table_name, petitioned_tag_parents_table_name ) = GenerateRepositoryTagParentsTableNames( service_id )
-        
-        pairs = self._c.execute( 'SELECT child_service_tag_id, parent_service_tag_id FROM ' + current_tag_parents_table_name + ' WHERE parent_timestamp BETWEEN ? AND ?;', ( begin, end ) ).fetchall()
-        
-        for pair in pairs:
-            
-            content_update_builder.AddRow( ( HC.CONTENT_TYPE_TAG_PARENTS, HC.CONTENT_UPDATE_ADD, pair ) )
-            
-        
-        pairs = self._c.execute( 'SELECT child_service_tag_id, parent_service_tag_id FROM ' + deleted_tag_parents_table_name + ' WHERE parent_timestamp BETWEEN ? AND ?;', ( begin, end ) ).fetchall()
-        
-        for pair in pairs:
-            
-            content_update_builder.AddRow( ( HC.CONTENT_TYPE_TAG_PARENTS, HC.CONTENT_UPDATE_DELETE, pair ) )
-            
-        
-        #
-        
-        ( current_tag_siblings_table_name, deleted_tag_siblings_table_name, pending_tag_siblings_table_name, petitioned_tag_siblings_table_name ) = GenerateRepositoryTagSiblingsTableNames( service_id )
-        
-        pairs = self._c.execute( 'SELECT bad_service_tag_id, good_service_tag_id FROM ' + current_tag_siblings_table_name + ' WHERE sibling_timestamp BETWEEN ? AND ?;', ( begin, end ) ).fetchall()
-        
-        for pair in pairs:
-            
-            content_update_builder.AddRow( ( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_UPDATE_ADD, pair ) )
-            
-        
-        pairs = self._c.execute( 'SELECT bad_service_tag_id, good_service_tag_id FROM ' + deleted_tag_siblings_table_name + ' WHERE sibling_timestamp BETWEEN ? AND ?;', ( begin, end ) ).fetchall()
-        
-        for pair in pairs:
-            
-            content_update_builder.AddRow( ( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_UPDATE_DELETE, pair ) )
-            
-        
-        #
-        
         content_update_builder.Finish()
         
-        updates.extend( content_update_builder.GetUpdates() )
-        
-        return updates
+        yield ( definitions_update_builder.PopFinishedUpdates() + content_update_builder.PopFinishedUpdates(), num_rows_done )
         
     
     def _RepositoryGetAccountInfo( self, service_id, account_id ):
@@ -2473,6 +2455,111 @@ class DB( HydrusDB.HydrusDB ):
         return HydrusNetwork.Petition( action, petitioner_account, reason, contents )
         
     
+    def _RepositoryGetUpdateRows( self, service_id, stage, begin, end ):
+        
+        # generates the ( row, row_weight ) pairs for one stage of update generation in one time window
+        
+        MAX_CONTENT_CHUNK = 25000
+        
+        if stage == 'hashes':
+            
+            ( service_hash_ids_table_name, service_tag_ids_table_name ) = GenerateRepositoryMasterMapTableNames( service_id )
+            
+            for ( service_hash_id, hash ) in self._c.execute( 'SELECT service_hash_id, hash FROM ' + service_hash_ids_table_name + ' NATURAL JOIN hashes WHERE hash_id_timestamp BETWEEN ? AND ?;', ( begin, end ) ):
+                
+                yield ( ( HC.DEFINITIONS_TYPE_HASHES, service_hash_id, hash ), 1 )
+                
+            
+        elif stage == 'tags':
+            
+            ( service_hash_ids_table_name, service_tag_ids_table_name ) = GenerateRepositoryMasterMapTableNames( service_id )
+            
+            for ( service_tag_id, tag ) in self._c.execute( 'SELECT service_tag_id, tag FROM ' + service_tag_ids_table_name + ' NATURAL JOIN tags WHERE tag_id_timestamp BETWEEN ? AND ?;', ( begin, end ) ):
+                
+                yield ( ( HC.DEFINITIONS_TYPE_TAGS, service_tag_id, tag ), 1 )
+                
+            
+        elif stage == 'new files':
+            
+            table_join = self._RepositoryGetFilesInfoFilesTableJoin( service_id, HC.CONTENT_STATUS_CURRENT )
+            
+            for file_row in self._c.execute( 'SELECT service_hash_id, size, mime, file_timestamp, width, height, duration, num_frames, num_words FROM ' + table_join + ' WHERE file_timestamp BETWEEN ? AND ?;', ( begin, end ) ):
+                
+                yield ( ( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_ADD, file_row ), 1 )
+                
+            
+        elif stage == 'deleted files':
+            
+            ( current_files_table_name, deleted_files_table_name, pending_files_table_name, petitioned_files_table_name, ip_addresses_table_name ) = GenerateRepositoryFilesTableNames( service_id )
+            
+            for ( service_hash_id, ) in self._c.execute( 'SELECT service_hash_id FROM ' + deleted_files_table_name + ' WHERE file_timestamp BETWEEN ? AND ?;', ( begin, end ) ):
+                
+                yield ( ( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_DELETE, service_hash_id ), 1 )
+                
+            
+        elif stage in ( 'new mappings', 'deleted mappings' ):
+            
+            ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateRepositoryMappingsTableNames( service_id )
+            
+            if stage == 'new mappings':
+                
+                ( mappings_table_name, action ) = ( current_mappings_table_name, HC.CONTENT_UPDATE_ADD )
+                
+            else:
+                
+                ( mappings_table_name, action ) = ( deleted_mappings_table_name, HC.CONTENT_UPDATE_DELETE )
+                
+            
+            service_tag_ids_to_service_hash_ids = HydrusData.BuildKeyToListDict( self._c.execute( 'SELECT service_tag_id, service_hash_id FROM ' + mappings_table_name + ' WHERE mapping_timestamp BETWEEN ? AND ?;', ( begin, end ) ) )
+            
+            for ( service_tag_id, service_hash_ids ) in service_tag_ids_to_service_hash_ids.items():
+                
+                service_hash_ids.sort() # the binary update format delta-encodes these, so sorted ids pack much smaller
+                
+                for block_of_service_hash_ids in HydrusData.SplitListIntoChunks( service_hash_ids, MAX_CONTENT_CHUNK ):
+                    
+                    yield ( ( HC.CONTENT_TYPE_MAPPINGS, action, ( service_tag_id, block_of_service_hash_ids ) ), len( block_of_service_hash_ids ) )
+                    
+                
+            
+        elif stage in ( 'new tag parents', 'deleted tag parents' ):
+            
+            ( current_tag_parents_table_name, deleted_tag_parents_table_name, pending_tag_parents_table_name, petitioned_tag_parents_table_name ) = GenerateRepositoryTagParentsTableNames( service_id )
+            
+            if stage == 'new tag parents':
+                
+                ( tag_parents_table_name, action ) = ( current_tag_parents_table_name, HC.CONTENT_UPDATE_ADD )
+                
+            else:
+                
+                ( tag_parents_table_name, action ) = ( deleted_tag_parents_table_name, HC.CONTENT_UPDATE_DELETE )
+                
+            
+            for pair in self._c.execute( 'SELECT child_service_tag_id, parent_service_tag_id FROM ' + tag_parents_table_name + ' WHERE parent_timestamp BETWEEN ? AND ?;', ( begin, end ) ):
+                
+                yield ( ( HC.CONTENT_TYPE_TAG_PARENTS, action, pair ), 1 )
+                
+            
+        elif stage in ( 'new tag siblings', 'deleted tag siblings' ):
+            
+            ( current_tag_siblings_table_name, deleted_tag_siblings_table_name, pending_tag_siblings_table_name, petitioned_tag_siblings_table_name ) = GenerateRepositoryTagSiblingsTableNames( service_id )
+            
+            if stage == 'new tag siblings':
+                
+                ( tag_siblings_table_name, action ) = ( current_tag_siblings_table_name, HC.CONTENT_UPDATE_ADD )
+                
+            else:
+                
+                ( tag_siblings_table_name, action ) = ( deleted_tag_siblings_table_name, HC.CONTENT_UPDATE_DELETE )
+                
+            
+            for pair in self._c.execute( 'SELECT bad_service_tag_id, good_service_tag_id FROM ' + tag_siblings_table_name + ' WHERE sibling_timestamp BETWEEN ? AND ?;', ( begin, end ) ):
+                
+                yield ( ( HC.CONTENT_TYPE_TAG_SIBLINGS, action, pair ), 1 )
+                
+            
+        
+    
     def _RepositoryHasFile( self, service_key, hash ):
         
         if not self._MasterHashExists( hash ):
@@ -1,14 +1,69 @@
+import hashlib
 import HydrusConstants as HC
 import HydrusData
 import HydrusExceptions
 import HydrusGlobals as HG
+import HydrusSerialisable
 import itertools
 import os
+import threading
+
+binary_update_lock = threading.Lock()
 
 def GetAllHashes( file_type ):
     
     return { os.path.split( path )[1].decode( 'hex' ) for path in IterateAllPaths( file_type ) }
     
+def GetBinaryUpdatePath( update_hash ):
+    
+    # the binary form is made once and kept next to the json. an empty file means the rebuilt json does not match the update hash--older updates were not dumped in a stable order--so the json has to go
+    
+    path = GetExpectedBinaryUpdatePath( update_hash )
+    
+    with binary_update_lock:
+        
+        if not os.path.exists( path ):
+            
+            with open( GetFilePath( update_hash ), 'rb' ) as f:
+                
+                update_network_string = f.read()
+                
+            
+            update = HydrusSerialisable.CreateFromNetworkString( update_network_string )
+            
+            binary_network_string = ''
+            
+            if update.CanSerialiseToBinary() and hashlib.sha256( update.DumpToNetworkString() ).digest() == update_hash:
+                
+                binary_network_string = update.DumpToBinaryNetworkString()
+                
+            
+            with open( path, 'wb' ) as f:
+                
+                f.write( binary_network_string )
+                
+            
+        
+    
+    if os.path.getsize( path ) == 0:
+        
+        return None
+        
+    
+    return path
+    
+def GetExpectedBinaryUpdatePath( update_hash ):
+    
+    files_dir = HG.server_controller.GetFilesDir()
+    
+    hash_encoded = update_hash.encode( 'hex' )
+    
+    first_two_chars = hash_encoded[:2]
+    
+    path = os.path.join( files_dir, first_two_chars, hash_encoded + '.binary' )
+    
+    return path
+    
 def GetExpectedFilePath( hash ):
     
     files_dir = HG.server_controller.GetFilesDir()
@@ -67,7 +122,11 @@ def IterateAllPaths( file_type ):
         
         for filename in filenames:
             
-            if file_type == 'file' and filename.endswith( '.thumbnail' ):
+            if filename.endswith( '.binary' ):
+                
+                continue
+                
+            elif file_type == 'file' and filename.endswith( '.thumbnail' ):
                 
                 continue
                 
@@ -371,7 +371,7 @@ class HydrusResourceRestrictedRepositoryFile( HydrusResourceRestricted ):
         
         path = ServerFiles.GetFilePath( hash )
         
-        response_context = HydrusServerResources.ResponseContext( 200, mime = mime, path = path )
+        response_context = HydrusServerResources.ResponseContext( 200, mime = mime, path = path, etag = hash.encode( 'hex' ) )
         
         return response_context
         
@@ -416,7 +416,7 @@ class HydrusResourceRestrictedRepositoryThumbnail( HydrusResourceRestricted ):
         
         path = ServerFiles.GetThumbnailPath( hash )
         
-        response_context = HydrusServerResources.ResponseContext( 200, mime = HC.APPLICATION_OCTET_STREAM, path = path )
+        response_context = HydrusServerResources.ResponseContext( 200, mime = HC.APPLICATION_OCTET_STREAM, path = path, etag = hash.encode( 'hex' ) )
         
         return response_context
         
@@ -481,7 +481,21 @@ class HydrusResourceRestrictedUpdate( HydrusResourceRestricted ):
         
         path = ServerFiles.GetFilePath( update_hash )
         
-        response_context = HydrusServerResources.ResponseContext( 200, mime = HC.APPLICATION_OCTET_STREAM, path = path )
+        if request.hydrus_args.get( 'binary', 0 ) == 1:
+            
+            # the client can read the compact binary format. the update is stored and hashed as json, so we only send binary when we know the json it rebuilds will match
+            
+            binary_path = ServerFiles.GetBinaryUpdatePath( update_hash )
+            
+            if binary_path is not None:
+                
+                response_context = HydrusServerResources.ResponseContext( 200, mime = HC.APPLICATION_OCTET_STREAM, path = binary_path, etag = update_hash.encode( 'hex' ) + '.binary' )
+                
+                return response_context
+                
+            
+        
+        response_context = HydrusServerResources.ResponseContext( 200, mime = HC.APPLICATION_OCTET_STREAM, path = path, etag = update_hash.encode( 'hex' ) )
         
         return response_context
         
@@ -0,0 +1,139 @@
+import ClientBitmaps
+import random
+import unittest
+
+class TestHashIdBitmap( unittest.TestCase ):
+    
+    def _GetRandomHashIds( self ):
+        
+        # some sparse ids spread over many containers, and a dense run that will be stored as a bitmap container
+        
+        sparse_hash_ids = { random.randint( 1, 10000000 ) for i in range( 2000 ) }
+        dense_hash_ids = set( random.sample( xrange( 65536, 65536 * 3 ), 30000 ) )
+        
+        return sparse_hash_ids.union( dense_hash_ids )
+        
+    
+    def test_basics( self ):
+        
+        bitmap = ClientBitmaps.HashIdBitmap()
+        
+        self.assertEqual( len( bitmap ), 0 )
+        self.assertFalse( bitmap )
+        
+        bitmap.add( 5 )
+        bitmap.add( 5 )
+        bitmap.add( 70000 )
+        
+        self.assertEqual( len( bitmap ), 2 )
+        self.assertTrue( 5 in bitmap )
+        self.assertTrue( 70000 in bitmap )
+        self.assertFalse( 6 in bitmap )
+        
+        bitmap.discard( 5 )
+        bitmap.discard( 123 )
+        
+        self.assertEqual( list( bitmap ), [ 70000 ] )
+        
+        bitmap = ClientBitmaps.HashIdBitmap( xrange( 0, 100000 ) )
+        
+        self.assertEqual( len( bitmap ), 100000 )
+        self.assertEqual( list( bitmap ), range( 0, 100000 ) )
+        self.assertTrue( bitmap.GetMemoryUsage() < 100000 )
+        
+    
+    def test_set_operations( self ):
+        
+        random.seed( 12 )
+        
+        for i in range( 5 ):
+            
+            a = self._GetRandomHashIds()
+            b = self._GetRandomHashIds()
+            
+            bitmap_a = ClientBitmaps.HashIdBitmap( a )
+            bitmap_b = ClientBitmaps.HashIdBitmap( b )
+            
+            self.assertEqual( len( bitmap_a ), len( a ) )
+            self.assertEqual( list( bitmap_a ), sorted( a ) )
+            
+            self.assertEqual( set( bitmap_a.intersection( bitmap_b ) ), a.intersection( b ) )
+            self.assertEqual( set( bitmap_a.union( bitmap_b ) ), a.union( b ) )
+            self.assertEqual( set( bitmap_a.difference( bitmap_b ) ), a.difference( b ) )
+            
+            self.assertEqual( len( bitmap_a.intersection( b ) ), len( a.intersection( b ) ) )
+            self.assertEqual( len( bitmap_a.difference( b ) ), len( a.difference( b ) ) )
+            
+            bitmap_c = bitmap_a.copy()
+            
+            bitmap_c.intersection_update( bitmap_b )
+            bitmap_c.update( a.difference( b ) )
+            
+            self.assertEqual( set( bitmap_c ), a )
+            self.assertEqual( len( bitmap_c ), len( a ) )
+            
+            for hash_id in random.sample( b, 100 ):
+                
+                self.assertEqual( hash_id in bitmap_a, hash_id in a )
+                
+            
+        
+    
+    def test_single_edits( self ):
+        
+        random.seed( 13 )
+        
+        hash_ids = self._GetRandomHashIds()
+        
+        bitmap = ClientBitmaps.HashIdBitmap()
+        
+        for hash_id in random.sample( hash_ids, len( hash_ids ) ):
+            
+            bitmap.add( hash_id )
+            
+        
+        # queued edits are seen before they are applied, and the last edit of an id wins
+        
+        self.assertTrue( 5 not in bitmap )
+        
+        bitmap.add( 5 )
+        
+        self.assertTrue( 5 in bitmap )
+        
+        bitmap.discard( 5 )
+        
+        self.assertTrue( 5 not in bitmap )
+        
+        self.assertEqual( len( bitmap ), len( hash_ids ) )
+        self.assertEqual( bitmap, ClientBitmaps.HashIdBitmap( hash_ids ) )
+        self.assertEqual( bitmap, hash_ids )
+        self.assertEqual( hash_ids, bitmap )
+        
+        to_discard = random.sample( hash_ids, len( hash_ids ) // 2 )
+        
+        for hash_id in to_discard:
+            
+            bitmap.discard( hash_id )
+            bitmap.discard( hash_id )
+            
+        
+        hash_ids.difference_update( to_discard )
+        
+        self.assertEqual( len( bitmap ), len( hash_ids ) )
+        self.assertEqual( list( bitmap ), sorted( hash_ids ) )
+        self.assertEqual( bitmap, ClientBitmaps.HashIdBitmap( hash_ids ) )
+        self.assertEqual( bitmap, hash_ids )
+        
+        hash_ids.add( 10000001 )
+        
+        self.assertNotEqual( bitmap, hash_ids )
+        self.assertNotEqual( bitmap, ClientBitmaps.HashIdBitmap( hash_ids ) )
+        
+        for hash_id in list( hash_ids ):
+            
+            bitmap.discard( hash_id )
+            
+        
+        self.assertEqual( len( bitmap ), 0 )
+        self.assertEqual( bitmap, ClientBitmaps.HashIdBitmap() )
+        self.assertEqual( bitmap.GetMemoryUsage(), 0 )
@@ -0,0 +1,563 @@
+import ClientBitmaps
+import ClientCaches
+import ClientThreading
+import HydrusConstants as HC
+import HydrusPaths
+import HydrusVideoHandling
+import os
+import threading
+import unittest
+import HydrusGlobals as HG
+from mock import patch
+
+class TestClientFilesManager( unittest.TestCase ):
+    
+    def test_clear_orphans_resume( self ):
+        
+        client_files_manager = ClientCaches.ClientFilesManager( HG.test_controller )
+        
+        HG.test_controller.GetWrite( 'serialisable_simple' )
+        
+        orphan_hash = ( 'c0' + '11' * 31 ).decode( 'hex' )
+        imported_since_hash = ( 'c1' + '11' * 31 ).decode( 'hex' )
+        
+        client_files_manager.LocklessAddFileFromString( orphan_hash, HC.IMAGE_PNG, 'orphan' )
+        client_files_manager.LocklessAddFileFromString( imported_since_hash, HC.IMAGE_PNG, 'imported since' )
+        
+        orphan_path = client_files_manager.LocklessGetFilePath( orphan_hash, HC.IMAGE_PNG )
+        imported_since_path = client_files_manager.LocklessGetFilePath( imported_since_hash, HC.IMAGE_PNG )
+        
+        # the old run finished every folder and then was cancelled before it deleted anything
+        
+        all_prefixes = HG.test_controller.Read( 'client_files_locations' ).keys()
+        
+        checkpoint = { 'scan_description' : [ None ], 'done_prefixes' : all_prefixes, 'orphan_paths' : [ orphan_path, imported_since_path ], 'orphan_thumbnails' : [] }
+        
+        HG.test_controller.SetRead( 'serialisable_simple', checkpoint )
+        HG.test_controller.SetRead( 'filter_orphans', [ orphan_hash ] )
+        
+        delete_to_recycle_bin = HC.options[ 'delete_to_recycle_bin' ]
+        
+        HC.options[ 'delete_to_recycle_bin' ] = False
+        
+        try:
+            
+            client_files_manager.ClearOrphans()
+            
+        finally:
+            
+            HC.options[ 'delete_to_recycle_bin' ] = delete_to_recycle_bin
+            
+        
+        self.assertFalse( os.path.exists( orphan_path ) )
+        self.assertTrue( os.path.exists( imported_since_path ) )
+        
+        checkpoint_writes = HG.test_controller.GetWrite( 'serialisable_simple' )
+        
+        self.assertEqual( checkpoint_writes[-1][0], ( 'clear_orphans_checkpoint', None ) )
+        
+    
+    def test_file_integrity_checkpoints( self ):
+        
+        client_files_manager = ClientCaches.ClientFilesManager( HG.test_controller )
+        
+        HG.test_controller.GetWrite( 'serialisable_simple' )
+        HG.test_controller.GetWrite( 'clear_file_records' )
+        
+        present_hash = ( 'a0' + '11' * 31 ).decode( 'hex' )
+        missing_hash = ( 'a1' + '11' * 31 ).decode( 'hex' )
+        
+        client_files_manager.LocklessAddFileFromString( present_hash, HC.IMAGE_PNG, 'present' )
+        
+        HG.test_controller.SetRead( 'serialisable_simple', None )
+        HG.test_controller.SetRead( 'file_integrity_info', [ ( present_hash, HC.IMAGE_PNG ), ( missing_hash, HC.IMAGE_PNG ) ] )
+        
+        client_files_manager.CheckFileIntegrity( 'quick' )
+        
+        # a checkpoint after each folder, and then it is cleared
+        
+        checkpoint_writes = HG.test_controller.GetWrite( 'serialisable_simple' )
+        
+        self.assertEqual( len( checkpoint_writes ), 3 )
+        
+        ( ( name, checkpoint ), kwargs ) = checkpoint_writes[0]
+        
+        self.assertEqual( name, 'file_integrity_checkpoint' )
+        self.assertEqual( checkpoint[ 'scan_description' ], [ 'quick', None, None ] )
+        self.assertEqual( set( checkpoint[ 'done_prefixes' ] ), { 'fa0', 'fa1' } )
+        self.assertEqual( checkpoint[ 'missing_hashes' ], [ missing_hash.encode( 'hex' ) ] )
+        
+        self.assertEqual( checkpoint_writes[-1][0], ( 'file_integrity_checkpoint', None ) )
+        
+        [ ( ( hashes, ), kwargs ) ] = HG.test_controller.GetWrite( 'clear_file_records' )
+        
+        self.assertEqual( hashes, [ missing_hash ] )
+        
+        #
+        
+        found_since_hash = ( 'b0' + '11' * 31 ).decode( 'hex' ) # missing when the old run checked, but it has turned up since
+        still_missing_hash = ( 'b1' + '11' * 31 ).decode( 'hex' )
+        skipped_hash = ( 'b2' + '11' * 31 ).decode( 'hex' ) # missing, but in a folder the old run already did, so not looked at again
+        new_missing_hash = ( 'b3' + '11' * 31 ).decode( 'hex' )
+        
+        client_files_manager.LocklessAddFileFromString( found_since_hash, HC.IMAGE_PNG, 'found since' )
+        
+        checkpoint = { 'scan_description' : [ 'quick', None, None ], 'done_prefixes' : [ 'fb0', 'fb1', 'fb2' ], 'missing_hashes' : [ found_since_hash.encode( 'hex' ), still_missing_hash.encode( 'hex' ) ], 'incorrect_hashes' : [] }
+        
+        HG.test_controller.SetRead( 'serialisable_simple', checkpoint )
+        HG.test_controller.SetRead( 'file_integrity_info', [ ( hash, HC.IMAGE_PNG ) for hash in ( found_since_hash, still_missing_hash, skipped_hash, new_missing_hash ) ] )
+        
+        client_files_manager.CheckFileIntegrity( 'quick' )
+        
+        checkpoint_writes = HG.test_controller.GetWrite( 'serialisable_simple' )
+        
+        self.assertEqual( len( checkpoint_writes ), 2 )
+        
+        self.assertEqual( set( checkpoint[ 'done_prefixes' ] ), { 'fb0', 'fb1', 'fb2', 'fb3' } )
+        
+        [ ( ( hashes, ), kwargs ) ] = HG.test_controller.GetWrite( 'clear_file_records' )
+        
+        self.assertEqual( set( hashes ), { still_missing_hash, new_missing_hash } )
+        
+    
+    def test_copy_file_fast( self ):
+        
+        source = os.path.join( HG.test_controller.GetDBDir(), 'copy_source' )
+        dest = os.path.join( HG.test_controller.GetDBDir(), 'copy_dest' )
+        
+        data = os.urandom( 65536 ) * 3 + 'tail'
+        
+        with open( source, 'wb' ) as f:
+            
+            f.write( data )
+            
+        
+        os.utime( source, ( 1000000000, 1000000000 ) )
+        
+        copied_block_sizes = []
+        
+        HydrusPaths.CopyFileFast( source, dest, block_copied_hook = copied_block_sizes.append )
+        
+        with open( dest, 'rb' ) as f:
+            
+            self.assertEqual( f.read(), data )
+            
+        
+        self.assertEqual( sum( copied_block_sizes ), len( data ) )
+        self.assertTrue( HydrusPaths.PathsHaveSameSizeAndDate( source, dest ) )
+        
+        # overwriting a longer file
+        
+        with open( source, 'wb' ) as f:
+            
+            f.write( 'short' )
+            
+        
+        HydrusPaths.CopyFileFast( source, dest )
+        
+        with open( dest, 'rb' ) as f:
+            
+            self.assertEqual( f.read(), 'short' )
+            
+        
+    
+    def test_maintenance_leaves_lock_free( self ):
+        
+        # the db thread takes the lock to look up file paths, so the long scans must not hold it while they wait on the db
+        
+        client_files_manager = ClientCaches.ClientFilesManager( HG.test_controller )
+        
+        hash = ( 'd1' + '11' * 31 ).decode( 'hex' )
+        
+        client_files_manager.LocklessAddFileFromString( hash, HC.IMAGE_PNG, 'file' )
+        
+        lock_states_during_db_calls = []
+        
+        def record_lock_state():
+            
+            lock_was_free = client_files_manager._lock.acquire( False )
+            
+            if lock_was_free:
+                
+                client_files_manager._lock.release()
+                
+            
+            lock_states_during_db_calls.append( lock_was_free )
+            
+        
+        original_read = HG.test_controller.Read
+        original_write_synchronous = HG.test_controller.WriteSynchronous
+        
+        def read( name, *args, **kwargs ):
+            
+            record_lock_state()
+            
+            return original_read( name, *args, **kwargs )
+            
+        
+        def write_synchronous( name, *args, **kwargs ):
+            
+            record_lock_state()
+            
+            return original_write_synchronous( name, *args, **kwargs )
+            
+        
+        HG.test_controller.SetRead( 'serialisable_simple', None )
+        HG.test_controller.SetRead( 'file_integrity_info', [ ( hash, HC.IMAGE_PNG ) ] )
+        HG.test_controller.SetRead( 'filter_orphans', [] )
+        
+        HG.test_controller.Read = read
+        HG.test_controller.WriteSynchronous = write_synchronous
+        
+        try:
+            
+            client_files_manager.CheckFileIntegrity( 'quick' )
+            client_files_manager.ClearOrphans()
+            
+        finally:
+            
+            del HG.test_controller.Read
+            del HG.test_controller.WriteSynchronous
+            
+        
+        self.assertTrue( len( lock_states_during_db_calls ) > 4 )
+        self.assertTrue( all( lock_states_during_db_calls ) )
+        
+        HG.test_controller.GetWrite( 'serialisable_simple' )
+        HG.test_controller.GetWrite( 'clear_file_records' )
+        
+    
+    def test_migrate_prefixes( self ):
+        
+        client_files_manager = ClientCaches.ClientFilesManager( HG.test_controller )
+        
+        HG.test_controller.GetWrite( 'set_client_files_location' )
+        
+        hash = ( 'e0' + '11' * 31 ).decode( 'hex' )
+        
+        client_files_manager.LocklessAddFileFromString( hash, HC.IMAGE_PNG, 'moving file' )
+        
+        source_location = HG.test_controller.Read( 'client_files_locations' )[ 'fe0' ]
+        dest_location = os.path.join( HG.test_controller.GetDBDir(), 'client_files_moved' )
+        
+        HydrusPaths.MakeSureDirectoryExists( dest_location )
+        
+        migrating_path = os.path.join( dest_location, 'fe0' + ClientCaches.MIGRATING_PREFIX_SUFFIX )
+        
+        # a cancelled move leaves everything where it was
+        
+        job_key = ClientThreading.JobKey( cancellable = True )
+        
+        job_key.Cancel()
+        
+        result = client_files_manager._MigratePrefixes( job_key, { 'fe0' : ( source_location, dest_location ) } )
+        
+        self.assertFalse( result )
+        self.assertEqual( client_files_manager.LocklessGetFilePath( hash, HC.IMAGE_PNG ), os.path.join( source_location, 'fe0', hash.encode( 'hex' ) + '.png' ) )
+        self.assertFalse( os.path.exists( os.path.join( dest_location, 'fe0' ) ) )
+        self.assertEqual( HG.test_controller.GetWrite( 'set_client_files_location' ), [] )
+        
+        # the db write happens outside the lock, as the db thread takes it to look up file paths
+        
+        lock_states_during_write = []
+        
+        original_write_synchronous = HG.test_controller.WriteSynchronous
+        
+        def write_synchronous( name, *args, **kwargs ):
+            
+            if name == 'set_client_files_location':
+                
+                lock_was_free = client_files_manager._lock.acquire( False )
+                
+                if lock_was_free:
+                    
+                    client_files_manager._lock.release()
+                    
+                
+                lock_states_during_write.append( lock_was_free )
+                
+            
+            original_write_synchronous( name, *args, **kwargs )
+            
+        
+        HG.test_controller.WriteSynchronous = write_synchronous
+        
+        try:
+            
+            job_key = ClientThreading.JobKey( cancellable = True )
+            
+            result = client_files_manager._MigratePrefixes( job_key, { 'fe0' : ( source_location, dest_location ) } )
+            
+        finally:
+            
+            del HG.test_controller.WriteSynchronous
+            
+        
+        self.assertTrue( result )
+        self.assertEqual( lock_states_during_write, [ True ] )
+        self.assertEqual( HG.test_controller.GetWrite( 'set_client_files_location' ), [ ( ( 'fe0', dest_location ), {} ) ] )
+        
+        dest_path = os.path.join( dest_location, 'fe0', hash.encode( 'hex' ) + '.png' )
+        
+        self.assertEqual( client_files_manager.LocklessGetFilePath( hash, HC.IMAGE_PNG ), dest_path )
+        self.assertFalse( os.path.exists( migrating_path ) )
+        
+        with open( dest_path, 'rb' ) as f:
+            
+            self.assertEqual( f.read(), 'moving file' )
+            
+        
+    
+class TestData( object ):
+    
+    def __init__( self, footprint ):
+        
+        self._footprint = footprint
+        
+    
+    def GetEstimatedMemoryFootprint( self ):
+        
+        return self._footprint
+        
+    
+class TestDataCache( unittest.TestCase ):
+    
+    def test_accounting( self ):
+        
+        data_cache = ClientCaches.DataCache( HG.test_controller, 1000 )
+        
+        for i in range( 5 ):
+            
+            data_cache.AddData( i, TestData( 100 ) )
+            
+        
+        self.assertEqual( data_cache.GetStatistics(), ( 5, 500, 1000, 0, 0, 0 ) )
+        
+        data_cache.DeleteData( 3 )
+        data_cache.DeleteData( 3 )
+        
+        self.assertFalse( data_cache.HasData( 3 ) )
+        self.assertEqual( data_cache.GetIfHasData( 3 ), None )
+        self.assertEqual( data_cache.GetData( 2 ).GetEstimatedMemoryFootprint(), 100 )
+        
+        self.assertEqual( data_cache.GetStatistics(), ( 4, 400, 1000, 1, 1, 0 ) )
+        
+        data_cache.Clear()
+        
+        self.assertEqual( data_cache.GetStatistics()[ : 2 ], ( 0, 0 ) )
+        
+    
+    def test_eviction( self ):
+        
+        data_cache = ClientCaches.DataCache( HG.test_controller, 1000 )
+        
+        for i in range( 7 ):
+            
+            data_cache.AddData( i, TestData( 100 ) )
+            
+        
+        data_cache.AddData( 'big', TestData( 250 ) )
+        
+        for i in range( 7 ):
+            
+            data_cache.GetData( i )
+            
+        
+        # the big item is worth the least per byte, so it should make way for the new small one
+        
+        data_cache.AddData( 7, TestData( 100 ) )
+        
+        self.assertFalse( data_cache.HasData( 'big' ) )
+        
+        for i in range( 8 ):
+            
+            self.assertTrue( data_cache.HasData( i ) )
+            
+        
+        for i in range( 8, 20 ):
+            
+            data_cache.AddData( i, TestData( 100 ) )
+            
+        
+        ( num_items, total_footprint, cache_size, num_hits, num_misses, num_evictions ) = data_cache.GetStatistics()
+        
+        self.assertEqual( num_items, 10 )
+        self.assertEqual( total_footprint, 1000 )
+        self.assertEqual( num_evictions, 11 )
+        
+    
+class TestTagPostingListCache( unittest.TestCase ):
+    
+    def test_eviction( self ):
+        
+        # every posting list here is 100 hash_ids, which is 200 bytes
+        
+        cache = ClientCaches.TagPostingListCache( 1000 )
+        
+        for tag_id in range( 5 ):
+            
+            cache.AddPostingList( 1, 2, tag_id, HC.CONTENT_STATUS_CURRENT, ClientBitmaps.HashIdBitmap( range( 100 ) ) )
+            
+        
+        self.assertEqual( cache.GetCacheSize(), 1000 )
+        
+        # touch the oldest, so the second oldest goes first
+        
+        cache.GetPostingList( 1, 2, 0, HC.CONTENT_STATUS_CURRENT )
+        
+        cache.AddPostingList( 1, 2, 5, HC.CONTENT_STATUS_CURRENT, ClientBitmaps.HashIdBitmap( range( 100 ) ) )
+        
+        self.assertEqual( cache.GetPostingList( 1, 2, 1, HC.CONTENT_STATUS_CURRENT ), None )
+        
+        for tag_id in ( 0, 2, 3, 4, 5 ):
+            
+            self.assertNotEqual( cache.GetPostingList( 1, 2, tag_id, HC.CONTENT_STATUS_CURRENT ), None )
+            
+        
+        # a list bigger than the whole cache is not kept at all
+        
+        cache.AddPostingList( 1, 2, 6, HC.CONTENT_STATUS_CURRENT, ClientBitmaps.HashIdBitmap( range( 1000 ) ) )
+        
+        self.assertEqual( cache.GetPostingList( 1, 2, 6, HC.CONTENT_STATUS_CURRENT ), None )
+        self.assertNotEqual( cache.GetPostingList( 1, 2, 5, HC.CONTENT_STATUS_CURRENT ), None )
+        
+        # shrinking the cache drops the least recently used
+        
+        cache.SetCacheSize( 400 )
+        
+        self.assertEqual( cache.GetCacheSize(), 400 )
+        
+        self.assertEqual( [ tag_id for tag_id in range( 6 ) if cache.GetPostingList( 1, 2, tag_id, HC.CONTENT_STATUS_CURRENT ) is not None ], [ 4, 5 ] )
+        
+    
+    def test_updates( self ):
+        
+        cache = ClientCaches.TagPostingListCache( 1048576 )
+        
+        cache.AddPostingList( 1, 2, 10, HC.CONTENT_STATUS_CURRENT, ClientBitmaps.HashIdBitmap( [ 1, 2, 3 ] ) )
+        cache.AddPostingList( 1, 2, 10, HC.CONTENT_STATUS_PENDING, ClientBitmaps.HashIdBitmap( [ 4 ] ) )
+        cache.AddPostingList( 3, 2, 10, HC.CONTENT_STATUS_CURRENT, ClientBitmaps.HashIdBitmap( [ 1 ] ) )
+        
+        cache.AddHashIds( 1, 2, 10, HC.CONTENT_STATUS_CURRENT, [ 5 ] )
+        cache.DeleteHashIds( 1, 2, 10, HC.CONTENT_STATUS_CURRENT, [ 1 ] )
+        
+        # edits to a list we do not have are ignored, rather than making a partial list
+        
+        cache.AddHashIds( 1, 2, 11, HC.CONTENT_STATUS_CURRENT, [ 5 ] )
+        
+        self.assertEqual( set( cache.GetPostingList( 1, 2, 10, HC.CONTENT_STATUS_CURRENT ) ), { 2, 3, 5 } )
+        self.assertEqual( cache.GetPostingList( 1, 2, 11, HC.CONTENT_STATUS_CURRENT ), None )
+        
+        cache.DeleteHashIdsFromDomain( 1, 2, [ 2, 4 ] )
+        
+        self.assertEqual( set( cache.GetPostingList( 1, 2, 10, HC.CONTENT_STATUS_CURRENT ) ), { 3, 5 } )
+        self.assertEqual( set( cache.GetPostingList( 1, 2, 10, HC.CONTENT_STATUS_PENDING ) ), set() )
+        
+        cache.DeleteDomain( 1, 2 )
+        
+        self.assertEqual( cache.GetPostingList( 1, 2, 10, HC.CONTENT_STATUS_CURRENT ), None )
+        self.assertEqual( set( cache.GetPostingList( 3, 2, 10, HC.CONTENT_STATUS_CURRENT ) ), { 1 } )
+        
+        cache.Clear()
+        
+        self.assertEqual( cache.GetPostingList( 3, 2, 10, HC.CONTENT_STATUS_CURRENT ), None )
+        
+    
+class TestVideoKeyframeIndexCache( unittest.TestCase ):
+    
+    class _Media( object ):
+        
+        def __init__( self, hash ):
+            
+            self._hash = hash
+            
+        
+        def GetDuration( self ): return 10000
+        def GetHash( self ): return self._hash
+        def GetMime( self ): return HC.VIDEO_WEBM
+        def GetNumFrames( self ): return 100
+        
+    
+    def test_indexing( self ):
+        
+        hash = ( 'd0' + '11' * 31 ).decode( 'hex' )
+        
+        HG.test_controller.client_files_manager.LocklessAddFileFromString( hash, HC.VIDEO_WEBM, 'video' )
+        
+        media = self._Media( hash )
+        
+        # ffmpeg failed, so we seek without an index, but we do not save that
+        
+        cache = ClientCaches.VideoKeyframeIndexCache( HG.test_controller )
+        
+        with patch.object( HydrusVideoHandling, 'GetFFMPEGKeyframeTimestamps', lambda path: [] ):
+            
+            keyframe_index = cache.GetKeyframeIndex( media )
+            
+        
+        self.assertEqual( keyframe_index.GetNumKeyframes(), 1 )
+        self.assertFalse( os.path.exists( cache._GetPath( hash ) ) )
+        
+        # two canvases open the video at once, and ffmpeg runs once
+        
+        cache = ClientCaches.VideoKeyframeIndexCache( HG.test_controller )
+        
+        ffmpeg_paths = []
+        ffmpeg_started = threading.Event()
+        ffmpeg_can_finish = threading.Event()
+        
+        def get_timestamps( path ):
+            
+            ffmpeg_paths.append( path )
+            
+            ffmpeg_started.set()
+            
+            ffmpeg_can_finish.wait( 10 )
+            
+            return [ 0.0, 2.5, 5.0 ]
+            
+        
+        keyframe_indices = []
+        
+        def open_canvas():
+            
+            keyframe_indices.append( cache.GetKeyframeIndex( media ) )
+            
+        
+        with patch.object( HydrusVideoHandling, 'GetFFMPEGKeyframeTimestamps', get_timestamps ):
+            
+            threads = [ threading.Thread( target = open_canvas ) for i in range( 2 ) ]
+            
+            threads[0].start()
+            
+            ffmpeg_started.wait( 10 )
+            
+            threads[1].start()
+            
+            ffmpeg_can_finish.set()
+            
+            for thread in threads:
+                
+                thread.join( 10 )
+                
+            
+        
+        self.assertEqual( len( ffmpeg_paths ), 1 )
+        self.assertEqual( len( keyframe_indices ), 2 )
+        self.assertIs( keyframe_indices[0], keyframe_indices[1] )
+        self.assertEqual( keyframe_indices[0].GetKeyframeAtOrBefore( 30 ), 25 )
+        
+        # and the next session reads it from disk
+        
+        cache = ClientCaches.VideoKeyframeIndexCache( HG.test_controller )
+        
+        with patch.object( HydrusVideoHandling, 'GetFFMPEGKeyframeTimestamps', lambda path: self.fail( 'the index was not saved!' ) ):
+            
+            self.assertEqual( cache.GetKeyframeIndex( media ).GetTimestamps(), [ 0.0, 2.5, 5.0 ] )
+            
+        
+        cache.DeleteKeyframeIndices( [ hash ] )
+        
+        self.assertFalse( os.path.exists( cache._GetPath( hash ) ) )
+        
+    
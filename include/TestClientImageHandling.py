@@ -1,6 +1,11 @@
+import ClientConstants as CC
 import ClientImageHandling
+import ClientSimilarFiles
 import collections
+import cv2
 import HydrusConstants as HC
+import HydrusData
+import numpy
 import os
 import TestConstants
 import unittest
@@ -13,3 +18,115 @@ class TestImageHandling( unittest.TestCase ):
         
         self.assertEqual( phashes, set( [ '\xb4M\xc7\xb2M\xcb8\x1c' ] ) )
         
+    
+    def test_phash_batch_matches_single( self ):
+        
+        # the batched hash must give exactly the bits the old one-at-a-time cv2.dct code did, or stored phashes stop matching new ones
+        
+        def old_phash( phash_tile ):
+            
+            dct_88 = cv2.dct( numpy.float32( phash_tile ) )[:8,:8]
+            
+            median = numpy.median( dct_88.reshape( 64 )[1:] )
+            
+            dct_88_boolean = dct_88 > median
+            
+            return ''.join( ( chr( reduce( lambda a, b: ( a << 1 ) + int( b ), dct_88_boolean[i], 0 ) ) for i in range( 8 ) ) )
+            
+        
+        phash_tiles = []
+        
+        for filename in sorted( os.listdir( HC.STATIC_DIR ) ):
+            
+            if filename.endswith( '.png' ):
+                
+                numpy_image = ClientImageHandling.GenerateNumpyImage( os.path.join( HC.STATIC_DIR, filename ), HC.IMAGE_PNG )
+                
+                phash_tiles.append( ClientImageHandling.GenerateShapePerceptualHashTileFromNumPyImage( numpy_image ) )
+                
+            
+        
+        random_state = numpy.random.RandomState( 5 )
+        
+        phash_tiles.extend( ( random_state.randint( 0, 256, ( 32, 32 ) ).astype( 'uint8' ) for i in range( 200 ) ) )
+        
+        # low-contrast tiles put a lot of dct values near the median, where any rounding difference would flip bits
+        
+        phash_tiles.extend( ( random_state.randint( 126, 130, ( 32, 32 ) ).astype( 'uint8' ) for i in range( 200 ) ) )
+        
+        phashes = ClientSimilarFiles.ConvertUInt64sToPHashes( ClientImageHandling.GenerateShapePerceptualHashUInt64sFromTiles( phash_tiles ) )
+        
+        self.assertEqual( phashes, [ old_phash( phash_tile ) for phash_tile in phash_tiles ] )
+        
+    
+    def test_phash_batch( self ):
+        
+        numpy_image = ClientImageHandling.GenerateNumpyImage( os.path.join( HC.STATIC_DIR, 'hydrus.png' ), HC.IMAGE_PNG )
+        
+        phash_tile = ClientImageHandling.GenerateShapePerceptualHashTileFromNumPyImage( numpy_image )
+        
+        flat_tile = phash_tile.copy()
+        
+        flat_tile[:] = 128
+        
+        phashes_uint64 = ClientImageHandling.GenerateShapePerceptualHashUInt64sFromTiles( [ phash_tile, flat_tile, phash_tile ] )
+        
+        self.assertEqual( ClientSimilarFiles.ConvertUInt64sToPHashes( phashes_uint64 ), [ '\xb4M\xc7\xb2M\xcb8\x1c', CC.BLANK_PHASH, '\xb4M\xc7\xb2M\xcb8\x1c' ] )
+        
+        self.assertEqual( list( ClientSimilarFiles.ConvertPHashesToUInt64s( ClientSimilarFiles.ConvertUInt64sToPHashes( phashes_uint64 ) ) ), list( phashes_uint64 ) )
+        
+    
+class TestPHashIndex( unittest.TestCase ):
+    
+    def test_search( self ):
+        
+        rows = [ ( phash_id, os.urandom( 8 ) ) for phash_id in range( 1, 3000 ) ]
+        
+        # a couple of near neighbours of the first phash
+        
+        ( first_phash_id, first_phash ) = rows[0]
+        
+        rows.append( ( 5000, chr( ord( first_phash[0] ) ^ 1 ) + first_phash[1:] ) )
+        rows.append( ( 5001, first_phash[:7] + chr( ord( first_phash[7] ) ^ 7 ) ) )
+        
+        phash_index = ClientSimilarFiles.PHashIndex( rows )
+        
+        self.assertEqual( phash_index.GetNumPHashes(), len( rows ) )
+        
+        for max_hamming_distance in ( 0, 4, 10 ):
+            
+            expected_phash_ids = { phash_id for ( phash_id, phash ) in rows if HydrusData.Get64BitHammingDistance( first_phash, phash ) <= max_hamming_distance }
+            
+            self.assertEqual( phash_index.Search( [ first_phash ], max_hamming_distance ), expected_phash_ids )
+            
+        
+        self.assertTrue( { first_phash_id, 5000, 5001 }.issubset( phash_index.Search( [ first_phash ], 3 ) ) )
+        
+        phash_index.DeletePHashIds( { 5000 } )
+        
+        self.assertEqual( phash_index.GetNumPHashes(), len( rows ) - 1 )
+        
+        self.assertNotIn( 5000, phash_index.Search( [ first_phash ], 3 ) )
+        self.assertIn( 5001, phash_index.Search( [ first_phash ], 3 ) )
+        
+        phash_index.AddPHashes( [ ( 5000, rows[-2][1] ) ] )
+        
+        self.assertIn( 5000, phash_index.Search( [ first_phash ], 3 ) )
+        
+    
+    def test_search_block( self ):
+        
+        rows = [ ( phash_id, os.urandom( 8 ) ) for phash_id in range( 1, 3000 ) ]
+        
+        phash_index = ClientSimilarFiles.PHashIndex( rows )
+        
+        search_rows = [ ( phash_id * 10, phash ) for ( phash_id, phash ) in rows[:200] ]
+        
+        for max_hamming_distance in ( 0, 12 ):
+            
+            expected_results = { ( search_id, phash_id ) for ( search_id, search_phash ) in search_rows for ( phash_id, phash ) in rows if HydrusData.Get64BitHammingDistance( search_phash, phash ) <= max_hamming_distance }
+            
+            self.assertEqual( set( phash_index.SearchBlock( search_rows, max_hamming_distance ) ), expected_results )
+            
+        
+    
@@ -1,4 +1,5 @@
 import ClientConstants as CC
+import ClientDefaults
 import ClientNetworking
 import ClientNetworkingBandwidth
 import ClientNetworkingContexts
@@ -8,11 +9,15 @@ import ClientNetworkingLogin
 import ClientNetworkingSessions
 import ClientServices
 import collections
+import hashlib
 import HydrusConstants as HC
 import HydrusData
 import HydrusExceptions
+import HydrusFileHandling
 import HydrusNetworking
+import HydrusPaths
 import os
+import Queue
 import TestConstants
 import threading
 import time
@@ -55,6 +60,16 @@ def catch_wew_ok( url, request ):
     
     return GOOD_RESPONSE
     
+@urlmatch( netloc = 'wew.lad' )
+def catch_wew_resume( url, request ):
+    
+    if request.headers.get( 'Range', None ) != 'bytes=128-' or request.headers.get( 'If-Range', None ) != '"wew"':
+        
+        return response( 200, GOOD_RESPONSE, { 'Accept-Ranges' : 'bytes', 'ETag' : '"wew"' }, 'OK' )
+        
+    
+    return response( 206, GOOD_RESPONSE[ 128 : ], { 'Accept-Ranges' : 'bytes', 'ETag' : '"wew"', 'Content-Range' : 'bytes 128-255/256' }, 'Partial Content' )
+    
 @urlmatch( netloc = MOCK_HYDRUS_ADDRESS )
 def catch_hydrus_error( url, request ):
     
@@ -220,6 +235,147 @@ class TestBandwidthManager( unittest.TestCase ):
         pass
         
     
+class TestNetworkDomainManager( unittest.TestCase ):
+    
+    def _GetTestURLs( self, url_matches ):
+        
+        urls = []
+        
+        for url_match in url_matches:
+            
+            example_url = url_match.GetExampleURL()
+            
+            urls.append( example_url )
+            urls.append( ClientNetworkingDomain.ConvertHTTPSToHTTP( example_url ) )
+            urls.append( example_url.replace( '://', '://www.', 1 ) )
+            urls.append( example_url.replace( '://', '://subdomain.', 1 ) )
+            urls.append( example_url + '/extra' )
+            urls.append( example_url.split( '?' )[0] )
+            urls.append( '/'.join( example_url.split( '/' )[ : 3 ] ) + '/not_a_real_path/123' )
+            
+        
+        return urls
+        
+    
+    def _GetURLMatchSlowly( self, url_matches, url ):
+        
+        # the old way--test every url class for the domain in turn
+        
+        domain = ClientNetworkingDomain.ConvertDomainIntoSecondLevelDomain( ClientNetworkingDomain.ConvertURLIntoDomain( url ) )
+        
+        for url_match in url_matches:
+            
+            if url_match.GetDomain() == domain and url_match.Matches( url ):
+                
+                return url_match
+                
+            
+        
+        return None
+        
+    
+    def _GetSortedDefaultURLMatches( self ):
+        
+        url_matches = ClientDefaults.GetDefaultURLMatches()
+        
+        self.assertTrue( len( url_matches ) > 0 )
+        
+        ClientNetworkingDomain.NetworkDomainManager.STATICSortURLMatchesDescendingComplexity( url_matches )
+        
+        return url_matches
+        
+    
+    def benchmark_url_match_index( self ):
+        
+        # a microbenchmark of the index against the old linear test on the default url classes
+        # it asserts nothing and is only run with 'test.py benchmark'--test_url_match_index checks the results
+        
+        url_matches = self._GetSortedDefaultURLMatches()
+        
+        urls = self._GetTestURLs( url_matches )
+        
+        domains_to_url_matches = collections.defaultdict( list )
+        
+        for url_match in url_matches:
+            
+            domains_to_url_matches[ url_match.GetDomain() ].append( url_match )
+            
+        
+        num_passes = 5
+        
+        started = HydrusData.GetNowPrecise()
+        
+        for i in range( num_passes ):
+            
+            for url in urls:
+                
+                domain = ClientNetworkingDomain.ConvertDomainIntoSecondLevelDomain( ClientNetworkingDomain.ConvertURLIntoDomain( url ) )
+                
+                for url_match in domains_to_url_matches[ domain ]:
+                    
+                    if url_match.Matches( url ):
+                        
+                        break
+                        
+                    
+                
+            
+        
+        linear_time = HydrusData.GetNowPrecise() - started
+        
+        url_match_index = ClientNetworkingDomain.URLMatchIndex( url_matches )
+        
+        started = HydrusData.GetNowPrecise()
+        
+        for url in urls:
+            
+            url_match_index.GetURLMatch( url )
+            
+        
+        indexed_first_pass_time = HydrusData.GetNowPrecise() - started
+        
+        started = HydrusData.GetNowPrecise()
+        
+        for i in range( num_passes - 1 ):
+            
+            for url in urls:
+                
+                url_match_index.GetURLMatch( url )
+                
+            
+        
+        indexed_time = indexed_first_pass_time + HydrusData.GetNowPrecise() - started
+        
+        num_lookups = num_passes * len( urls )
+        
+        print( 'url class lookup, ' + HydrusData.ToHumanInt( num_lookups ) + ' lookups over ' + HydrusData.ToHumanInt( len( url_matches ) ) + ' default url classes: linear ' + str( round( linear_time, 4 ) ) + 's, indexed ' + str( round( indexed_time, 4 ) ) + 's, of which first pass ' + str( round( indexed_first_pass_time, 4 ) ) + 's' )
+        
+    
+    def test_url_match_index( self ):
+        
+        url_matches = self._GetSortedDefaultURLMatches()
+        
+        domain_manager = ClientNetworkingDomain.NetworkDomainManager()
+        
+        domain_manager.SetURLMatches( url_matches )
+        
+        for url in self._GetTestURLs( url_matches ):
+            
+            expected_url_match = self._GetURLMatchSlowly( url_matches, url )
+            
+            self.assertIs( domain_manager.GetURLMatch( url ), expected_url_match )
+            
+            # and again, from the cache
+            
+            self.assertIs( domain_manager.GetURLMatch( url ), expected_url_match )
+            
+        
+        with self.assertRaises( HydrusExceptions.URLMatchException ):
+            
+            domain_manager.GetURLMatch( 'not a url' )
+            
+        
+    
 class TestNetworkingEngine( unittest.TestCase ):
     
     def test_engine_shutdown_app( self ):
@@ -280,6 +436,84 @@ class TestNetworkingEngine( unittest.TestCase ):
         self.assertTrue( engine.IsShutdown() )
         
     
+    def test_engine_slots( self ):
+        
+        mock_controller = TestConstants.MockController()
+        bandwidth_manager = ClientNetworkingBandwidth.NetworkBandwidthManager()
+        session_manager = ClientNetworkingSessions.NetworkSessionManager()
+        domain_manager = ClientNetworkingDomain.NetworkDomainManager()
+        login_manager = ClientNetworkingLogin.NetworkLoginManager()
+        
+        engine = ClientNetworking.NetworkEngine( mock_controller, bandwidth_manager, session_manager, domain_manager, login_manager )
+        
+        mock_controller.new_options.SetInteger( 'max_network_jobs', 4 )
+        mock_controller.new_options.SetInteger( 'max_network_jobs_per_domain', 3 )
+        
+        # started jobs never finish, so they hold their slots
+        
+        started_jobs = Queue.Queue()
+        
+        def wait_for_starts( num_starts ):
+            
+            for i in range( num_starts ):
+                
+                started_jobs.get( timeout = 10 )
+                
+            
+            # the engine starts jobs under its lock, so once we have it, the pass that started them is done
+            
+            with engine._lock:
+                
+                return list( engine._jobs_running )
+                
+            
+        
+        with patch.object( ClientNetworkingJobs.NetworkJob, 'Start', lambda job: started_jobs.put( job ) ):
+            
+            subscription_key = HydrusData.GenerateKey()
+            downloader_page_key = HydrusData.GenerateKey()
+            
+            subscription_jobs = [ ClientNetworkingJobs.NetworkJobSubscription( subscription_key, 'GET', MOCK_URL ) for i in range( 5 ) ]
+            downloader_jobs = [ ClientNetworkingJobs.NetworkJobDownloader( downloader_page_key, 'GET', 'https://other.site/' + str( i ) ) for i in range( 5 ) ]
+            one_off_job = ClientNetworkingJobs.NetworkJob( 'GET', 'https://third.site/' )
+            
+            for job in subscription_jobs + downloader_jobs + [ one_off_job ]:
+                
+                engine.AddJob( job )
+                
+            
+            mock_controller.CallToThread( engine.MainLoop )
+            
+            running_jobs = wait_for_starts( 4 )
+            
+            # the one-off goes first, and then the two queues take turns
+            
+            self.assertEqual( len( running_jobs ), 4 )
+            self.assertIn( one_off_job, running_jobs )
+            self.assertEqual( len( [ job for job in running_jobs if job in subscription_jobs ] ), 2 )
+            self.assertEqual( len( [ job for job in running_jobs if job in downloader_jobs ] ), 1 )
+            
+            mock_controller.new_options.SetInteger( 'max_network_jobs', 20 )
+            
+            engine._new_work_to_do.set()
+            
+            running_jobs = wait_for_starts( 3 )
+            
+            # now each domain is held to three
+            
+            self.assertEqual( len( running_jobs ), 7 )
+            self.assertEqual( len( [ job for job in running_jobs if job in subscription_jobs ] ), 3 )
+            self.assertEqual( len( [ job for job in running_jobs if job in downloader_jobs ] ), 3 )
+            
+            with engine._lock:
+                
+                self.assertEqual( len( engine._jobs_awaiting_slot ), 4 )
+                
+            
+        
+        engine.Shutdown()
+        
+    
     def test_engine_simple_job( self ):
         
         mock_controller = TestConstants.MockController()
@@ -329,9 +563,9 @@ class TestNetworkingEngine( unittest.TestCase ):
     
 class TestNetworkingJob( unittest.TestCase ):
     
-    def _GetJob( self, for_login = False ):
+    def _GetJob( self, for_login = False, temp_path = None ):
         
-        job = ClientNetworkingJobs.NetworkJob( 'GET', MOCK_URL )
+        job = ClientNetworkingJobs.NetworkJob( 'GET', MOCK_URL, temp_path = temp_path )
         
         job.SetForLogin( for_login )
         
@@ -499,6 +733,41 @@ class TestNetworkingJob( unittest.TestCase ):
             
         
     
+    def test_done_ok_to_temp_path( self ):
+        
+        ( os_file_handle, temp_path ) = HydrusPaths.GetTempPath()
+        
+        try:
+            
+            with HTTMock( catch_all ):
+                
+                with HTTMock( catch_wew_ok ):
+                    
+                    job = self._GetJob( temp_path = temp_path )
+                    
+                    job.Start()
+                    
+                    self.assertFalse( job.HasError() )
+                    
+                    with open( temp_path, 'rb' ) as f:
+                        
+                        self.assertEqual( f.read(), GOOD_RESPONSE )
+                        
+                    
+                    file_hasher = job.GetFileHasher()
+                    
+                    self.assertEqual( file_hasher.GetHash(), hashlib.sha256( GOOD_RESPONSE ).digest() )
+                    self.assertEqual( file_hasher.GetExtraHashes(), ( hashlib.md5( GOOD_RESPONSE ).digest(), hashlib.sha1( GOOD_RESPONSE ).digest(), hashlib.sha512( GOOD_RESPONSE ).digest() ) )
+                    self.assertEqual( file_hasher.GetNumBytes(), 256 )
+                    
+                
+            
+        finally:
+            
+            HydrusPaths.CleanUpTempPath( os_file_handle, temp_path )
+            
+        
+    
     def test_error( self ):
         
         with HTTMock( catch_all ):
@@ -536,6 +805,56 @@ class TestNetworkingJob( unittest.TestCase ):
         pass
         
     
+    def test_resume_to_temp_path( self ):
+        
+        ( os_file_handle, temp_path ) = HydrusPaths.GetTempPath()
+        
+        try:
+            
+            # pretend the first half came in before the connection broke, and some junk after it
+            
+            with open( temp_path, 'wb' ) as f:
+                
+                f.write( GOOD_RESPONSE[ : 128 ] + 'junk' )
+                
+            
+            with HTTMock( catch_all ):
+                
+                with HTTMock( catch_wew_resume ):
+                    
+                    job = self._GetJob( temp_path = temp_path )
+                    
+                    partial_file_hasher = HydrusFileHandling.FileHasher()
+                    
+                    partial_file_hasher.Update( GOOD_RESPONSE[ : 128 ] )
+                    
+                    job._partial_file_hasher = partial_file_hasher
+                    job._resume_validator = ( 'ETag', '"wew"' )
+                    
+                    job.Start()
+                    
+                    self.assertFalse( job.HasError() )
+                    
+                    with open( temp_path, 'rb' ) as f:
+                        
+                        self.assertEqual( f.read(), GOOD_RESPONSE )
+                        
+                    
+                    file_hasher = job.GetFileHasher()
+                    
+                    self.assertEqual( file_hasher.GetHash(), hashlib.sha256( GOOD_RESPONSE ).digest() )
+                    self.assertEqual( file_hasher.GetNumBytes(), 256 )
+                    
+                    self.assertEqual( job._GetResumeOffset(), 0 )
+                    
+                
+            
+        finally:
+            
+            HydrusPaths.CleanUpTempPath( os_file_handle, temp_path )
+            
+        
+    
 class TestNetworkingJobHydrus( unittest.TestCase ):
     
     def _GetJob( self, for_login = False ):
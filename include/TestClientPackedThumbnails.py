@@ -0,0 +1,86 @@
+import ClientPackedThumbnails
+import HydrusData
+import os
+import shutil
+import tempfile
+import unittest
+
+class TestPackedThumbnailStore( unittest.TestCase ):
+    
+    def setUp( self ):
+        
+        self._dir = tempfile.mkdtemp()
+        
+    
+    def tearDown( self ):
+        
+        shutil.rmtree( self._dir )
+        
+    
+    def test_store( self ):
+        
+        store = ClientPackedThumbnails.PackedThumbnailStore( self._dir )
+        
+        hashes_to_thumbnails = { HydrusData.GenerateKey() : os.urandom( 1000 + i ) for i in range( 20 ) }
+        
+        self.assertEqual( store.GetThumbnails( hashes_to_thumbnails.keys() ), {} )
+        
+        for ( hash, thumbnail ) in hashes_to_thumbnails.items():
+            
+            store.SetThumbnail( hash, thumbnail )
+            
+        
+        self.assertEqual( store.GetThumbnails( hashes_to_thumbnails.keys() ), hashes_to_thumbnails )
+        
+        ( replaced_hash, deleted_hash ) = hashes_to_thumbnails.keys()[ : 2 ]
+        
+        hashes_to_thumbnails[ replaced_hash ] = os.urandom( 500 )
+        
+        store.SetThumbnail( replaced_hash, hashes_to_thumbnails[ replaced_hash ] )
+        store.DeleteThumbnails( ( deleted_hash, ) )
+        
+        del hashes_to_thumbnails[ deleted_hash ]
+        
+        self.assertFalse( store.HasThumbnail( deleted_hash ) )
+        self.assertEqual( store.GetThumbnails( hashes_to_thumbnails.keys() + [ deleted_hash ] ), hashes_to_thumbnails )
+        
+        # a fresh store should read the same from the index
+        
+        store.Close()
+        
+        store = ClientPackedThumbnails.PackedThumbnailStore( self._dir )
+        
+        self.assertEqual( store.GetThumbnails( hashes_to_thumbnails.keys() ), hashes_to_thumbnails )
+        
+        store.Close()
+        
+    
+    def test_compaction( self ):
+        
+        store = ClientPackedThumbnails.PackedThumbnailStore( self._dir )
+        
+        hash = HydrusData.GenerateKey()
+        
+        thumbnail = os.urandom( 1048576 )
+        
+        for i in range( 6 ):
+            
+            thumbnail = os.urandom( 1048576 )
+            
+            store.SetThumbnail( hash, thumbnail )
+            
+        
+        pack_path = os.path.join( self._dir, ClientPackedThumbnails.PACK_FILENAME )
+        
+        self.assertTrue( os.path.getsize( pack_path ) < 6 * 1048576 )
+        self.assertEqual( store.GetThumbnails( ( hash, ) ), { hash : thumbnail } )
+        
+        store.Close()
+        
+        store = ClientPackedThumbnails.PackedThumbnailStore( self._dir )
+        
+        self.assertEqual( store.GetThumbnails( ( hash, ) ), { hash : thumbnail } )
+        
+        store.Close()
+        
+    
@@ -0,0 +1,111 @@
+import ClientParsing
+import HydrusConstants as HC
+import unittest
+import HydrusGlobals as HG
+
+# a gallery page of posts, each with a link, a tag and a thumbnail
+EXAMPLE_HTML = u'<html><body>' + u''.join( ( u'<div class="post"><a href="/post/' + str( i ) + u'">post</a><span class="tag">tag' + str( i ) + u'</span><img src="/thumbs/' + str( i ) + u'.jpg"/></div>' for i in range( 20 ) ) ) + u'</body></html>'
+
+class TestParseSession( unittest.TestCase ):
+    
+    def _GetFormula( self, tag_name, content_to_fetch, attribute_to_fetch = None ):
+        
+        tag_rules = []
+        
+        tag_rules.append( ClientParsing.ParseRuleHTML( rule_type = ClientParsing.HTML_RULE_TYPE_DESCENDING, tag_name = 'div', tag_attributes = { 'class' : 'post' } ) )
+        tag_rules.append( ClientParsing.ParseRuleHTML( rule_type = ClientParsing.HTML_RULE_TYPE_DESCENDING, tag_name = tag_name ) )
+        
+        return ClientParsing.ParseFormulaHTML( tag_rules = tag_rules, content_to_fetch = content_to_fetch, attribute_to_fetch = attribute_to_fetch )
+        
+    
+    def test_page_parser( self ):
+        
+        content_parsers = []
+        
+        content_parsers.append( ClientParsing.ContentParser( name = 'post urls', content_type = HC.CONTENT_TYPE_URLS, formula = self._GetFormula( 'a', ClientParsing.HTML_CONTENT_ATTRIBUTE, 'href' ), additional_info = ( HC.URL_TYPE_POST, 50 ) ) )
+        content_parsers.append( ClientParsing.ContentParser( name = 'tags', content_type = HC.CONTENT_TYPE_MAPPINGS, formula = self._GetFormula( 'span', ClientParsing.HTML_CONTENT_STRING ), additional_info = '' ) )
+        content_parsers.append( ClientParsing.ContentParser( name = 'thumbs', content_type = HC.CONTENT_TYPE_URLS, formula = self._GetFormula( 'img', ClientParsing.HTML_CONTENT_ATTRIBUTE, 'src' ), additional_info = ( HC.URL_TYPE_FILE, 50 ) ) )
+        
+        page_parser = ClientParsing.PageParser( 'gallery', content_parsers = content_parsers )
+        
+        parse_session = ClientParsing.ParseSession()
+        
+        all_parse_results = page_parser.Parse( { 'url' : 'https://example.com/gallery' }, EXAMPLE_HTML, parse_session = parse_session )
+        
+        self.assertEqual( len( all_parse_results ), 1 )
+        
+        parse_results = all_parse_results[0]
+        
+        self.assertEqual( len( parse_results ), 60 )
+        
+        self.assertEqual( ClientParsing.GetURLsFromParseResults( parse_results, ( HC.URL_TYPE_POST, ) )[0], 'https://example.com/post/0' )
+        self.assertEqual( len( ClientParsing.GetTagsFromParseResults( parse_results ) ), 20 )
+        
+        # the page is parsed once, and the three formulas share the nodes their first rule found
+        
+        timings = parse_session.GetTimings()
+        
+        self.assertEqual( [ description for ( description, time_taken ) in timings ].count( 'parsing the html' ), 1 )
+        self.assertEqual( len( timings ), 4 )
+        
+        self.assertEqual( len( parse_session._node_keys_to_nodes ), 4 )
+        
+    
+    def test_soup_parser( self ):
+        
+        html = u'<table><tr><td>cell</td></tr></table>'
+        
+        # html5lib is the default, so parsers see the same tree they always have
+        
+        soup = ClientParsing.ParseSession().GetSoup( html )
+        
+        if ClientParsing.HTML5LIB_IS_OK:
+            
+            self.assertEqual( soup.table.tr.parent.name, 'tbody' )
+            
+        
+        self.assertEqual( soup.td.string, 'cell' )
+        
+        # lxml is opt-in, through the options or by the caller
+        
+        HG.test_controller.new_options.SetBoolean( 'parse_html_with_lxml', True )
+        
+        try:
+            
+            soups = [ ClientParsing.ParseSession().GetSoup( html ), ClientParsing.ParseSession( prefer_lxml = True ).GetSoup( html ) ]
+            
+        finally:
+            
+            HG.test_controller.new_options.SetBoolean( 'parse_html_with_lxml', False )
+            
+        
+        for soup in soups:
+            
+            if ClientParsing.LXML_IS_OK:
+                
+                self.assertEqual( soup.table.tr.parent.name, 'table' )
+                
+            
+            self.assertEqual( soup.td.string, 'cell' )
+            
+        
+        self.assertEqual( ClientParsing.ParseSession( prefer_lxml = False ).GetSoup( html ).td.string, 'cell' )
+        
+    
+    def test_subsidiary_page_parser( self ):
+        
+        sub_content_parsers = [ ClientParsing.ContentParser( name = 'tags', content_type = HC.CONTENT_TYPE_MAPPINGS, formula = ClientParsing.ParseFormulaHTML( tag_rules = [ ClientParsing.ParseRuleHTML( rule_type = ClientParsing.HTML_RULE_TYPE_DESCENDING, tag_name = 'span' ) ], content_to_fetch = ClientParsing.HTML_CONTENT_STRING ), additional_info = '' ) ]
+        
+        sub_page_parser = ClientParsing.PageParser( 'post', content_parsers = sub_content_parsers )
+        
+        post_formula = ClientParsing.ParseFormulaHTML( tag_rules = [ ClientParsing.ParseRuleHTML( rule_type = ClientParsing.HTML_RULE_TYPE_DESCENDING, tag_name = 'div', tag_attributes = { 'class' : 'post' } ) ], content_to_fetch = ClientParsing.HTML_CONTENT_HTML )
+        
+        page_parser = ClientParsing.PageParser( 'gallery', sub_page_parsers = [ ( post_formula, sub_page_parser ) ] )
+        
+        all_parse_results = page_parser.Parse( {}, EXAMPLE_HTML )
+        
+        self.assertEqual( len( all_parse_results ), 20 )
+        
+        self.assertEqual( [ ClientParsing.GetTagsFromParseResults( parse_results ) for parse_results in all_parse_results ], [ { 'tag' + str( i ) } for i in range( 20 ) ] )
+        
+    
@@ -14,7 +14,9 @@ import ClientImportFileSeeds
 import ClientRatings
 import ClientSearch
 import ClientServices
+import ClientThreading
 import collections
+import hashlib
 import HydrusConstants as HC
 import HydrusData
 import HydrusExceptions
@@ -25,12 +27,14 @@ import HydrusSerialisable
 import itertools
 import os
 import ServerDB
+import ServerFiles
 import shutil
 import sqlite3
 import stat
 import TestConstants
 import time
 import threading
+import traceback
 import unittest
 import wx
 
@@ -81,6 +85,33 @@ class TestClientDB( unittest.TestCase ):
         cls._delete_db()
         
     
+    @classmethod
+    def _release_db( cls ):
+        
+        cls._db._CloseDBCursor()
+        
+        cls._clear_db()
+        
+    
+    @classmethod
+    def _take_over_db( cls ):
+        
+        # some db internals are only reachable from the db thread, so we stop its loop and drive a fresh cursor from here
+        
+        cls._db.Shutdown()
+        
+        while not cls._db.LoopIsFinished():
+            
+            time.sleep( 0.1 )
+            
+        
+        cls._db._InitDBCursor()
+        
+        cls._db._InitCaches()
+        
+        return cls._db
+        
+    
     def _read( self, action, *args, **kwargs ): return TestClientDB._db.Read( action, HC.HIGH_PRIORITY, *args, **kwargs )
     def _write( self, action, *args, **kwargs ): return TestClientDB._db.Write( action, HC.HIGH_PRIORITY, True, *args, **kwargs )
     
@@ -237,6 +268,117 @@ class TestClientDB( unittest.TestCase ):
             
         
     
+    def test_deferred_ac_caches( self ):
+        
+        TestClientDB._clear_db()
+        
+        hash = '\xadm5\x99\xa6\xc4\x89\xa5u\xeb\x19\xc0&\xfa\xce\x97\xa9\xcdey\xe7G(\xb0\xce\x94\xa6\x01\xd22\xf3\xc3'
+        
+        path = os.path.join( HC.STATIC_DIR, 'hydrus.png' )
+        
+        file_import_job = ClientImportFileSeeds.FileImportJob( path )
+        
+        file_import_job.GenerateHashAndStatus()
+        
+        file_import_job.GenerateInfo()
+        
+        self._write( 'import_file', file_import_job )
+        
+        content_update = HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'car', ( hash, ) ) )
+        
+        self._write( 'content_updates', { CC.LOCAL_TAG_SERVICE_KEY : [ content_update ] } )
+        
+        #
+        
+        db = TestClientDB._take_over_db()
+        
+        try:
+            
+            db._BeginImmediate()
+            
+            tag_service_id = db._local_tag_service_id
+            
+            db._DeferACCaches( tag_service_id )
+            
+            deferred_ac_caches = db._GetDeferredACCaches( tag_service_id )
+            
+            self.assertIn( ( db._combined_file_service_id, tag_service_id ), deferred_ac_caches )
+            self.assertIn( ( db._local_file_service_id, tag_service_id ), deferred_ac_caches )
+            
+            # while deferred, new mappings skip the ac counts, but autocomplete still sees them through live counts
+            
+            content_update = HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'cat', ( hash, ) ) )
+            
+            db._ProcessContentUpdates( { CC.LOCAL_TAG_SERVICE_KEY : [ content_update ] }, do_pubsubs = False )
+            
+            combined_ac_cache_table_name = ClientDB.GenerateCombinedFilesMappingsCacheTableName( tag_service_id )
+            
+            self.assertEqual( db._c.execute( 'SELECT COUNT( * ) FROM ' + combined_ac_cache_table_name + ';' ).fetchone(), ( 1, ) )
+            
+            ( cache_files_table_name, cache_current_mappings_table_name, cache_deleted_mappings_table_name, cache_pending_mappings_table_name, specific_ac_cache_table_name ) = ClientDB.GenerateSpecificMappingsCacheTableNames( db._local_file_service_id, tag_service_id )
+            
+            self.assertEqual( db._c.execute( 'SELECT COUNT( * ) FROM ' + specific_ac_cache_table_name + ';' ).fetchone(), ( 1, ) )
+            
+            # but the specific mappings tables are still kept up to date, so file searches and media results see the new tag straight away
+            
+            hash_id = db._GetHashId( hash )
+            
+            self.assertEqual( set( db._GetHashIdsFromTag( CC.LOCAL_FILE_SERVICE_KEY, CC.LOCAL_TAG_SERVICE_KEY, 'cat', True, False ) ), { hash_id } )
+            self.assertEqual( set( db._GetHashIdsFromWildcard( CC.LOCAL_FILE_SERVICE_KEY, CC.LOCAL_TAG_SERVICE_KEY, 'ca*', True, False ) ), { hash_id } )
+            
+            ( media_result, ) = db._GetMediaResults( ( hash_id, ) )
+            
+            self.assertEqual( set( media_result.GetTagsManager().GetCurrent( CC.LOCAL_TAG_SERVICE_KEY ) ), { 'car', 'cat' } )
+            
+            for file_service_key in ( CC.COMBINED_FILE_SERVICE_KEY, CC.LOCAL_FILE_SERVICE_KEY ):
+                
+                result = db._GetAutocompletePredicates( tag_service_key = CC.LOCAL_TAG_SERVICE_KEY, file_service_key = file_service_key, search_text = 'ca*' )
+                
+                self.assertEqual( { ( p.GetValue(), p.GetCount( HC.CONTENT_STATUS_CURRENT ) ) for p in result }, { ( 'car', 1 ), ( 'cat', 1 ) } )
+                
+            
+            # the marks live in json_dict, so they survive a restart
+            
+            db._Commit()
+            
+            db._InitCaches()
+            
+            self.assertEqual( db._GetDeferredACCaches( tag_service_id ), deferred_ac_caches )
+            
+            # and a rollback takes the in-memory marks back with it
+            
+            db._BeginImmediate()
+            
+            db._SetDeferredACCaches( set() )
+            
+            db._Rollback()
+            
+            self.assertEqual( db._GetDeferredACCaches( tag_service_id ), deferred_ac_caches )
+            
+            #
+            
+            job_key = ClientThreading.JobKey()
+            
+            self.assertTrue( db._RegenerateDeferredACCaches( job_key, tag_service_id ) )
+            
+            self.assertEqual( db._GetDeferredACCaches(), set() )
+            
+            self.assertEqual( db._c.execute( 'SELECT COUNT( * ) FROM ' + combined_ac_cache_table_name + ';' ).fetchone(), ( 2, ) )
+            self.assertEqual( db._c.execute( 'SELECT COUNT( * ) FROM ' + specific_ac_cache_table_name + ';' ).fetchone(), ( 2, ) )
+            
+            for file_service_key in ( CC.COMBINED_FILE_SERVICE_KEY, CC.LOCAL_FILE_SERVICE_KEY ):
+                
+                result = db._GetAutocompletePredicates( tag_service_key = CC.LOCAL_TAG_SERVICE_KEY, file_service_key = file_service_key, search_text = 'ca*' )
+                
+                self.assertEqual( { ( p.GetValue(), p.GetCount( HC.CONTENT_STATUS_CURRENT ) ) for p in result }, { ( 'car', 1 ), ( 'cat', 1 ) } )
+                
+            
+        finally:
+            
+            TestClientDB._release_db()
+            
+        
+    
     def test_export_folders( self ):
         
         file_search_context = ClientSearch.FileSearchContext(file_service_key = HydrusData.GenerateKey(), tag_service_key = HydrusData.GenerateKey(), predicates = [ ClientSearch.Predicate( HC.PREDICATE_TYPE_TAG, 'test' ) ] )
@@ -1000,6 +1142,193 @@ class TestClientDB( unittest.TestCase ):
         self.assertEqual( mr_num_words, None )
         
     
+    def test_tag_posting_lists_cache( self ):
+        
+        TestClientDB._clear_db()
+        
+        hashes = []
+        
+        for filename in ( 'hydrus.png', 'hydrus_32.png' ):
+            
+            file_import_job = ClientImportFileSeeds.FileImportJob( os.path.join( HC.STATIC_DIR, filename ) )
+            
+            file_import_job.GenerateHashAndStatus()
+            
+            file_import_job.GenerateInfo()
+            
+            self._write( 'import_file', file_import_job )
+            
+            hashes.append( file_import_job.GetHash() )
+            
+        
+        content_update = HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'car', hashes ) )
+        
+        self._write( 'content_updates', { CC.LOCAL_TAG_SERVICE_KEY : [ content_update ] } )
+        
+        #
+        
+        db = TestClientDB._take_over_db()
+        
+        try:
+            
+            db._BeginImmediate()
+            
+            # the cache is sized from the options at init, not on every search
+            
+            new_options = db._GetJSONDump( HydrusSerialisable.SERIALISABLE_TYPE_CLIENT_OPTIONS )
+            
+            self.assertEqual( db._tag_posting_lists_cache.GetCacheSize(), new_options.GetInteger( 'tag_search_cache_size_mb' ) * 1048576 )
+            
+            ( hash_id_a, hash_id_b ) = [ db._GetHashId( hash ) for hash in hashes ]
+            
+            tag_id = db._GetTagId( 'car' )
+            
+            # a filtered search still caches the whole posting list, so a later search with a different filter is served from memory
+            
+            hash_ids = db._GetHashIdsFromTag( CC.LOCAL_FILE_SERVICE_KEY, CC.LOCAL_TAG_SERVICE_KEY, 'car', True, False, allowed_hash_ids = { hash_id_a } )
+            
+            self.assertEqual( set( hash_ids ), { hash_id_a } )
+            
+            posting_list = db._tag_posting_lists_cache.GetPostingList( db._local_file_service_id, db._local_tag_service_id, tag_id, HC.CONTENT_STATUS_CURRENT )
+            
+            self.assertEqual( set( posting_list ), { hash_id_a, hash_id_b } )
+            
+            hash_ids = db._GetHashIdsFromTag( CC.LOCAL_FILE_SERVICE_KEY, CC.LOCAL_TAG_SERVICE_KEY, 'car', True, False, allowed_hash_ids = { hash_id_b } )
+            
+            self.assertEqual( set( hash_ids ), { hash_id_b } )
+            
+            # mapping changes are applied to the cached list in place
+            
+            content_update = HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_DELETE, ( 'car', ( hashes[0], ) ) )
+            
+            db._ProcessContentUpdates( { CC.LOCAL_TAG_SERVICE_KEY : [ content_update ] }, do_pubsubs = False )
+            
+            self.assertEqual( set( db._GetHashIdsFromTag( CC.LOCAL_FILE_SERVICE_KEY, CC.LOCAL_TAG_SERVICE_KEY, 'car', True, False ) ), { hash_id_b } )
+            
+            # a filtered search only fetches the whole posting list if it will fit in the cache
+            
+            db._tag_posting_lists_cache.Clear()
+            
+            db._tag_posting_lists_cache.SetCacheSize( 1 )
+            
+            hash_ids = db._GetHashIdsFromTag( CC.LOCAL_FILE_SERVICE_KEY, CC.LOCAL_TAG_SERVICE_KEY, 'car', True, False, allowed_hash_ids = { hash_id_a, hash_id_b } )
+            
+            self.assertEqual( set( hash_ids ), { hash_id_b } )
+            self.assertEqual( db._tag_posting_lists_cache.GetPostingList( db._local_file_service_id, db._local_tag_service_id, tag_id, HC.CONTENT_STATUS_CURRENT ), None )
+            
+            db._tag_posting_lists_cache.SetCacheSize( 1048576 )
+            
+            hash_ids = db._GetHashIdsFromTag( CC.LOCAL_FILE_SERVICE_KEY, CC.LOCAL_TAG_SERVICE_KEY, 'car', True, False, allowed_hash_ids = { hash_id_a, hash_id_b } )
+            
+            self.assertEqual( set( hash_ids ), { hash_id_b } )
+            self.assertEqual( set( db._tag_posting_lists_cache.GetPostingList( db._local_file_service_id, db._local_tag_service_id, tag_id, HC.CONTENT_STATUS_CURRENT ) ), { hash_id_b } )
+            
+            # saving new options resizes it, and 0 turns it off, when the filter goes straight to the db again
+            
+            new_options.SetInteger( 'tag_search_cache_size_mb', 0 )
+            
+            db._SetJSONDump( new_options )
+            
+            self.assertEqual( db._tag_posting_lists_cache.GetCacheSize(), 0 )
+            self.assertEqual( db._tag_posting_lists_cache.GetPostingList( db._local_file_service_id, db._local_tag_service_id, tag_id, HC.CONTENT_STATUS_CURRENT ), None )
+            
+            hash_ids = db._GetHashIdsFromTag( CC.LOCAL_FILE_SERVICE_KEY, CC.LOCAL_TAG_SERVICE_KEY, 'car', True, False, allowed_hash_ids = { hash_id_a, hash_id_b } )
+            
+            self.assertEqual( set( hash_ids ), { hash_id_b } )
+            
+        finally:
+            
+            TestClientDB._release_db()
+            
+        
+    
+    def test_tag_search_planning( self ):
+        
+        TestClientDB._clear_db()
+        
+        hashes = []
+        
+        for filename in ( 'hydrus.png', 'hydrus_32.png', '8chan.png' ):
+            
+            file_import_job = ClientImportFileSeeds.FileImportJob( os.path.join( HC.STATIC_DIR, filename ) )
+            
+            file_import_job.GenerateHashAndStatus()
+            
+            file_import_job.GenerateInfo()
+            
+            self._write( 'import_file', file_import_job )
+            
+            hashes.append( file_import_job.GetHash() )
+            
+        
+        ( hash_a, hash_b, hash_c ) = hashes
+        
+        content_updates = []
+        
+        content_updates.append( HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'common', ( hash_a, hash_b, hash_c ) ) ) )
+        content_updates.append( HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'series:middle', ( hash_a, hash_b ) ) ) )
+        content_updates.append( HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'rare', ( hash_a, ) ) ) )
+        
+        self._write( 'content_updates', { CC.LOCAL_TAG_SERVICE_KEY : content_updates } )
+        
+        # every order of the same tags should give the same files, whatever the planner does with them
+        
+        for tags in itertools.permutations( [ 'common', 'middle', 'rare' ] ):
+            
+            predicates = [ ClientSearch.Predicate( HC.PREDICATE_TYPE_TAG, tag ) for tag in tags ]
+            
+            search_context = ClientSearch.FileSearchContext( file_service_key = CC.LOCAL_FILE_SERVICE_KEY, tag_service_key = CC.LOCAL_TAG_SERVICE_KEY, predicates = predicates )
+            
+            self.assertEqual( len( self._read( 'file_query_ids', search_context ) ), 1 )
+            
+        
+        predicates = [ ClientSearch.Predicate( HC.PREDICATE_TYPE_TAG, 'common' ), ClientSearch.Predicate( HC.PREDICATE_TYPE_TAG, 'series:middle' ) ]
+        
+        search_context = ClientSearch.FileSearchContext( file_service_key = CC.LOCAL_FILE_SERVICE_KEY, tag_service_key = CC.LOCAL_TAG_SERVICE_KEY, predicates = predicates )
+        
+        self.assertEqual( len( self._read( 'file_query_ids', search_context ) ), 2 )
+        
+        #
+        
+        db = TestClientDB._take_over_db()
+        
+        try:
+            
+            ( hash_id_a, hash_id_b, hash_id_c ) = [ db._GetHashId( hash ) for hash in hashes ]
+            
+            # the estimate resolves the tag exactly as the search does, so an unnamespaced tag counts every namespace
+            
+            for file_service_key in ( CC.COMBINED_FILE_SERVICE_KEY, CC.LOCAL_FILE_SERVICE_KEY ):
+                
+                for ( tag, expected_hash_ids ) in [ ( 'common', { hash_id_a, hash_id_b, hash_id_c } ), ( 'middle', { hash_id_a, hash_id_b } ), ( 'series:middle', { hash_id_a, hash_id_b } ), ( 'rare', { hash_id_a } ), ( 'series:rare', set() ), ( 'not a tag', set() ) ]:
+                    
+                    estimate = db._GetTagCountEstimate( file_service_key, CC.LOCAL_TAG_SERVICE_KEY, tag, True, False )
+                    
+                    self.assertEqual( estimate, len( expected_hash_ids ) )
+                    
+                    hash_ids = db._GetHashIdsFromTag( file_service_key, CC.LOCAL_TAG_SERVICE_KEY, tag, True, False )
+                    
+                    self.assertEqual( set( hash_ids ), expected_hash_ids )
+                    
+                    # the 'filter' strategy, with a small and a big allowed set
+                    
+                    for allowed_hash_ids in ( { hash_id_a, hash_id_c }, set( range( hash_id_c + 1, hash_id_c + 20000 ) ).union( ( hash_id_a, hash_id_c ) ) ):
+                        
+                        hash_ids = db._GetHashIdsFromTag( file_service_key, CC.LOCAL_TAG_SERVICE_KEY, tag, True, False, allowed_hash_ids = allowed_hash_ids )
+                        
+                        self.assertEqual( set( hash_ids ), expected_hash_ids.intersection( allowed_hash_ids ) )
+                        
+                    
+                
+            
+            self.assertEqual( db._GetTagCountEstimate( CC.COMBINED_FILE_SERVICE_KEY, CC.LOCAL_TAG_SERVICE_KEY, 'common', False, False ), 0 )
+            
+        finally:
+            
+            TestClientDB._release_db()
+            
+        
+    
     def test_tag_censorship( self ):
         
         result = self._read( 'tag_censorship' )
@@ -1092,6 +1421,122 @@ class TestClientDB( unittest.TestCase ):
         self.assertTrue( result, ( pixiv_id, password ) )
         
     
+    def test_read_only_after_inline_commit( self ):
+        
+        # a write that commits inside its own job must not leave the read-only connections switched off
+        
+        TestClientDB._db.TRANSACTION_COMMIT_TIME = -1
+        
+        try:
+            
+            self._write( 'serialisable_simple', 'inline commit test', 123 )
+            
+        finally:
+            
+            del TestClientDB._db.TRANSACTION_COMMIT_TIME
+            
+        
+        with TestClientDB._db._lock:
+            
+            self.assertEqual( TestClientDB._db._num_pending_writes, 0 )
+            
+        
+        self.assertEqual( self._read( 'serialisable_simple', 'inline commit test' ), 123 )
+        
+    
+    def test_reads_alongside_writes( self ):
+        
+        TestClientDB._clear_db()
+        
+        path = os.path.join( HC.STATIC_DIR, 'hydrus.png' )
+        
+        file_import_job = ClientImportFileSeeds.FileImportJob( path )
+        
+        file_import_job.GenerateHashAndStatus()
+        
+        file_import_job.GenerateInfo()
+        
+        self._write( 'import_file', file_import_job )
+        
+        hash = file_import_job.GetHash()
+        
+        # these go to the read-only connections whenever no write is queued or uncommitted
+        
+        errors = []
+        
+        stop_event = threading.Event()
+        
+        def do_reads():
+            
+            try:
+                
+                while not stop_event.is_set():
+                    
+                    ( media_result, ) = self._read( 'media_results', ( hash, ) )
+                    
+                    media_result.GetInbox()
+                    
+                    self._read( 'autocomplete_predicates', tag_service_key = CC.LOCAL_TAG_SERVICE_KEY, search_text = 't*' )
+                    
+                
+            except Exception:
+                
+                errors.append( traceback.format_exc() )
+                
+            
+        
+        read_threads = [ threading.Thread( target = do_reads ) for i in range( 3 ) ]
+        
+        for read_thread in read_threads:
+            
+            read_thread.start()
+            
+        
+        try:
+            
+            for i in range( 20 ):
+                
+                # a read straight after a write must always see it, wherever the read is served
+                
+                for ( content_update_action, expected_inbox ) in ( ( HC.CONTENT_UPDATE_ARCHIVE, False ), ( HC.CONTENT_UPDATE_INBOX, True ) ):
+                    
+                    content_update = HydrusData.ContentUpdate( HC.CONTENT_TYPE_FILES, content_update_action, ( hash, ) )
+                    
+                    self._write( 'content_updates', { CC.COMBINED_LOCAL_FILE_SERVICE_KEY : [ content_update ] } )
+                    
+                    ( media_result, ) = self._read( 'media_results', ( hash, ) )
+                    
+                    self.assertEqual( media_result.GetInbox(), expected_inbox )
+                    
+                
+                tag = 'tag ' + str( i )
+                
+                content_update = HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( tag, ( hash, ) ) )
+                
+                self._write( 'content_updates', { CC.LOCAL_TAG_SERVICE_KEY : [ content_update ] } )
+                
+                result = self._read( 'autocomplete_predicates', tag_service_key = CC.LOCAL_TAG_SERVICE_KEY, search_text = tag, exact_match = True )
+                
+                self.assertEqual( [ predicate.GetValue() for predicate in result ], [ tag ] )
+                
+            
+        finally:
+            
+            stop_event.set()
+            
+            for read_thread in read_threads:
+                
+                read_thread.join()
+                
+            
+        
+        self.assertEqual( errors, [] )
+        
+        result = self._read( 'autocomplete_predicates', tag_service_key = CC.LOCAL_TAG_SERVICE_KEY, search_text = 't*' )
+        
+        self.assertEqual( len( result ), 20 )
+        
+    
     def test_repo_downloads( self ):
         
         result = self._read( 'downloads' )
@@ -1131,6 +1576,105 @@ class TestClientDB( unittest.TestCase ):
         self.assertEqual( result, set() )
         
     
+    def test_repository_update_pipeline( self ):
+        
+        definitions_update = HydrusNetwork.DefinitionsUpdate()
+        
+        definitions_update.AddRow( ( HC.DEFINITIONS_TYPE_TAGS, 1, 'series:test' ) )
+        definitions_update.AddRow( ( HC.DEFINITIONS_TYPE_HASHES, 2, HydrusData.GenerateKey() ) )
+        
+        content_update = HydrusNetwork.ContentUpdate()
+        
+        content_update.AddRow( ( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 1, [ 2, 3, 4 ] ) ) )
+        
+        other_content_update = HydrusNetwork.ContentUpdate()
+        
+        other_content_update.AddRow( ( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_DELETE, ( 1, [ 3 ] ) ) )
+        
+        updates = [ definitions_update, content_update, other_content_update ]
+        
+        client_files_manager = HG.test_controller.client_files_manager
+        new_options = HG.test_controller.new_options
+        
+        lookahead = new_options.GetInteger( 'repository_update_processing_lookahead' )
+        
+        db = TestClientDB._take_over_db()
+        
+        paths = []
+        
+        try:
+            
+            db._BeginImmediate()
+            
+            hash_ids = []
+            
+            for update in updates:
+                
+                update_network_string = update.DumpToNetworkString()
+                
+                hash = hashlib.sha256( update_network_string ).digest()
+                
+                path = client_files_manager._GenerateExpectedFilePath( hash, HC.APPLICATION_HYDRUS_UPDATE_DEFINITIONS )
+                
+                with open( path, 'wb' ) as f:
+                    
+                    f.write( update_network_string )
+                    
+                
+                paths.append( path )
+                
+                hash_ids.append( db._GetHashId( hash ) )
+                
+            
+            # with no lookahead they load in the db thread, otherwise the next few load in the worker pool while the db processes, and the order has to hold either way
+            
+            for test_lookahead in ( 0, 1, 4 ):
+                
+                new_options.SetInteger( 'repository_update_processing_lookahead', test_lookahead )
+                
+                pipeline_report = collections.Counter()
+                
+                results = [ ( hash_id, update.DumpToString() ) for ( hash_id, update ) in db._IterateRepositoryUpdates( hash_ids, pipeline_report ) ]
+                
+                self.assertEqual( results, [ ( hash_id, update.DumpToString() ) for ( hash_id, update ) in zip( hash_ids, updates ) ] )
+                
+                self.assertEqual( pipeline_report[ 'num_updates' ], 3 )
+                
+                for key in ( 'load_time', 'wait_time', 'apply_time' ):
+                    
+                    self.assertIn( key, pipeline_report )
+                    self.assertGreaterEqual( pipeline_report[ key ], 0 )
+                    
+                
+            
+            # stopping part way cancels the loads still in flight and only counts what was handed over
+            
+            pipeline_report = collections.Counter()
+            
+            update_iterator = db._IterateRepositoryUpdates( hash_ids, pipeline_report )
+            
+            ( hash_id, update ) = next( update_iterator )
+            
+            self.assertEqual( hash_id, hash_ids[0] )
+            
+            update_iterator.close()
+            
+            self.assertEqual( pipeline_report[ 'num_updates' ], 1 )
+            
+        finally:
+            
+            new_options.SetInteger( 'repository_update_processing_lookahead', lookahead )
+            
+            for path in paths:
+                
+                try: os.remove( path )
+                except: pass
+                
+            
+            TestClientDB._release_db()
+            
+        
+    
     def test_services( self ):
         
         result = self._read( 'services', ( HC.LOCAL_FILE_DOMAIN, HC.LOCAL_FILE_TRASH_DOMAIN, HC.COMBINED_LOCAL_FILE, HC.LOCAL_TAG ) )
@@ -1399,3 +1943,122 @@ class TestServerDB( unittest.TestCase ):
         
         self._test_content_creation()
         
+    
+    def test_update_creation( self ):
+        
+        # a fresh db, so this test has the admin registration key to itself
+        
+        db_dir = os.path.join( TestConstants.DB_DIR, 'server_updates' )
+        
+        os.makedirs( db_dir )
+        
+        db = ServerDB.DB( HG.test_controller, db_dir, 'server' )
+        
+        def read( action, *args, **kwargs ): return db.Read( action, HC.HIGH_PRIORITY, *args, **kwargs )
+        def write( action, *args, **kwargs ): return db.Write( action, HC.HIGH_PRIORITY, True, *args, **kwargs )
+        
+        try:
+            
+            admin_access_key = read( 'access_key', HC.SERVER_ADMIN_KEY, 'init' )
+            admin_account_key = read( 'account_key_from_access_key', HC.SERVER_ADMIN_KEY, admin_access_key )
+            admin_account = read( 'account', HC.SERVER_ADMIN_KEY, admin_account_key )
+            
+            tag_service_key = HydrusData.GenerateKey()
+            
+            services = read( 'services' )
+            
+            services.append( HydrusNetwork.GenerateService( tag_service_key, HC.TAG_REPOSITORY, 'tag repo', 100 ) )
+            
+            service_keys_to_access_keys = write( 'services', admin_account, services )
+            
+            account_key = read( 'account_key_from_access_key', tag_service_key, service_keys_to_access_keys[ tag_service_key ] )
+            account = read( 'account', tag_service_key, account_key )
+            
+            hashes = [ HydrusData.GenerateKey() for i in range( 20 ) ]
+            
+            client_to_server_update = HydrusNetwork.ClientToServerUpdate()
+            
+            client_to_server_update.AddContent( HC.CONTENT_UPDATE_PEND, HydrusNetwork.Content( HC.CONTENT_TYPE_MAPPINGS, ( u'character:samus aran', hashes ) ) )
+            client_to_server_update.AddContent( HC.CONTENT_UPDATE_PEND, HydrusNetwork.Content( HC.CONTENT_TYPE_MAPPINGS, ( u'series:metroid', hashes[:5] ) ) )
+            
+            write( 'update', tag_service_key, account, client_to_server_update )
+            
+            now = HydrusData.GetNow()
+            
+            begin = now - 3600
+            end = now + 3600
+            
+            # every step now hands back after one time slice, so the update takes many steps
+            
+            old_work_period = ServerDB.UPDATE_GENERATION_WORK_PERIOD
+            
+            ServerDB.UPDATE_GENERATION_WORK_PERIOD = 0.0
+            
+            try:
+                
+                num_steps = 0
+                
+                finished = False
+                
+                while not finished:
+                    
+                    ( finished, update_hashes ) = write( 'create_update', tag_service_key, begin, end )
+                    
+                    num_steps += 1
+                    
+                
+            finally:
+                
+                ServerDB.UPDATE_GENERATION_WORK_PERIOD = old_work_period
+                
+            
+            self.assertGreater( num_steps, 1 )
+            
+            service_hash_ids_to_hashes = {}
+            service_tag_ids_to_tags = {}
+            new_mappings = []
+            
+            for update_hash in update_hashes:
+                
+                with open( ServerFiles.GetFilePath( update_hash ), 'rb' ) as f:
+                    
+                    update = HydrusSerialisable.CreateFromNetworkString( f.read() )
+                    
+                
+                if isinstance( update, HydrusNetwork.DefinitionsUpdate ):
+                    
+                    service_hash_ids_to_hashes.update( update.GetHashIdsToHashes() )
+                    service_tag_ids_to_tags.update( update.GetTagIdsToTags() )
+                    
+                else:
+                    
+                    new_mappings.extend( update.GetNewMappings() )
+                    
+                
+            
+            tags_to_hashes = { service_tag_ids_to_tags[ service_tag_id ] : { service_hash_ids_to_hashes[ service_hash_id ] for service_hash_id in service_hash_ids } for ( service_tag_id, service_hash_ids ) in new_mappings }
+            
+            self.assertEqual( tags_to_hashes, { u'character:samus aran' : set( hashes ), u'series:metroid' : set( hashes[:5] ) } )
+            
+            # the finished job is cleared, so asking again makes the same update from scratch
+            
+            finished = False
+            
+            while not finished:
+                
+                ( finished, update_hashes_again ) = write( 'create_update', tag_service_key, begin, end )
+                
+            
+            self.assertEqual( update_hashes_again, update_hashes )
+            
+        finally:
+            
+            db.Shutdown()
+            
+            while not db.LoopIsFinished():
+                
+                time.sleep( 0.1 )
+                
+            
+        
+    
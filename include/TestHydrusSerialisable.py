@@ -23,6 +23,27 @@ import wx
 
 class TestSerialisables( unittest.TestCase ):
     
+    def _binary_dump_and_load_and_test( self, obj, test_func ):
+        
+        network_string = obj.DumpToNetworkString()
+        
+        self.assertFalse( network_string.startswith( HydrusSerialisable.BINARY_NETWORK_STRING_PREFIX ) )
+        
+        self.assertTrue( obj.CanSerialiseToBinary() )
+        
+        binary_network_string = obj.DumpToBinaryNetworkString()
+        
+        self.assertTrue( binary_network_string.startswith( HydrusSerialisable.BINARY_NETWORK_STRING_PREFIX ) )
+        
+        dupe_obj = HydrusSerialisable.CreateFromNetworkString( binary_network_string )
+        
+        test_func( obj, dupe_obj )
+        
+        # clients rebuild the json from the binary and check it against the update hash
+        
+        self.assertEqual( dupe_obj.DumpToNetworkString(), network_string )
+        
+    
     def _dump_and_load_and_test( self, obj, test_func ):
         
         serialisable_tuple = obj.GetSerialisableTuple()
@@ -151,6 +172,66 @@ class TestSerialisables( unittest.TestCase ):
             
         
     
+    def test_SERIALISABLE_TYPE_CONTENT_UPDATE( self ):
+        
+        def test( obj, dupe_obj ):
+            
+            self.assertEqual( obj.GetNumRows(), dupe_obj.GetNumRows() )
+            
+            self.assertEqual( [ tuple( row ) for row in obj.GetNewFiles() ], [ tuple( row ) for row in dupe_obj.GetNewFiles() ] )
+            self.assertEqual( list( obj.GetDeletedFiles() ), list( dupe_obj.GetDeletedFiles() ) )
+            
+            self.assertEqual( [ ( tag_id, list( hash_ids ) ) for ( tag_id, hash_ids ) in obj.GetNewMappings() ], [ ( tag_id, list( hash_ids ) ) for ( tag_id, hash_ids ) in dupe_obj.GetNewMappings() ] )
+            self.assertEqual( [ ( tag_id, list( hash_ids ) ) for ( tag_id, hash_ids ) in obj.GetDeletedMappings() ], [ ( tag_id, list( hash_ids ) ) for ( tag_id, hash_ids ) in dupe_obj.GetDeletedMappings() ] )
+            
+            self.assertEqual( [ tuple( pair ) for pair in obj.GetNewTagParents() ], [ tuple( pair ) for pair in dupe_obj.GetNewTagParents() ] )
+            self.assertEqual( [ tuple( pair ) for pair in obj.GetDeletedTagSiblings() ], [ tuple( pair ) for pair in dupe_obj.GetDeletedTagSiblings() ] )
+            
+        
+        content_update = HydrusNetwork.ContentUpdate()
+        
+        content_update.AddRow( ( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_ADD, ( 5, 123456, HC.IMAGE_JPEG, 1500000000, 640, 480, None, None, None ) ) )
+        content_update.AddRow( ( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_ADD, ( 2, 98765432, HC.VIDEO_WEBM, 1500000123, 1920, 1080, 65000, 1600, None ) ) )
+        content_update.AddRow( ( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_DELETE, 70000 ) )
+        content_update.AddRow( ( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_DELETE, 3 ) )
+        content_update.AddRow( ( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 1, [ 1, 2, 3, 1000000, 1000001 ] ) ) )
+        content_update.AddRow( ( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 2, [ 5 ] ) ) )
+        content_update.AddRow( ( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_DELETE, ( 10000000000, range( 100000, 200000, 3 ) ) ) )
+        content_update.AddRow( ( HC.CONTENT_TYPE_TAG_PARENTS, HC.CONTENT_UPDATE_ADD, ( 7, 8 ) ) )
+        content_update.AddRow( ( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_UPDATE_DELETE, ( 9, 1 ) ) )
+        
+        self._dump_and_load_and_test( content_update, test )
+        
+        self._binary_dump_and_load_and_test( content_update, test )
+        
+        self._dump_and_load_and_test( HydrusNetwork.ContentUpdate(), test )
+        self._binary_dump_and_load_and_test( HydrusNetwork.ContentUpdate(), test )
+        
+    
+    def test_SERIALISABLE_TYPE_DEFINITIONS_UPDATE( self ):
+        
+        def test( obj, dupe_obj ):
+            
+            self.assertEqual( obj.GetHashIdsToHashes(), dupe_obj.GetHashIdsToHashes() )
+            self.assertEqual( obj.GetTagIdsToTags(), dupe_obj.GetTagIdsToTags() )
+            
+        
+        definitions_update = HydrusNetwork.DefinitionsUpdate()
+        
+        for i in range( 100 ):
+            
+            definitions_update.AddRow( ( HC.DEFINITIONS_TYPE_HASHES, i * 7, HydrusData.GenerateKey() ) )
+            
+        
+        definitions_update.AddRow( ( HC.DEFINITIONS_TYPE_TAGS, 1, u'character:samus aran' ) )
+        definitions_update.AddRow( ( HC.DEFINITIONS_TYPE_TAGS, 5, u'\u30b5\u30e0\u30b9' ) )
+        definitions_update.AddRow( ( HC.DEFINITIONS_TYPE_TAGS, 3, u'' ) )
+        
+        self._dump_and_load_and_test( definitions_update, test )
+        
+        self._binary_dump_and_load_and_test( definitions_update, test )
+        
+    
     def test_SERIALISABLE_TYPE_DUPLICATE_ACTION_OPTIONS( self ):
         
         def test( obj, dupe_obj ):
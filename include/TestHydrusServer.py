@@ -8,6 +8,7 @@ import HydrusConstants as HC
 import HydrusEncryption
 import HydrusNetwork
 import HydrusPaths
+import HydrusSerialisable
 import HydrusServer
 import HydrusServerResources
 import os
@@ -18,6 +19,7 @@ import ssl
 import TestConstants
 import time
 import unittest
+import zlib
 from twisted.internet import reactor
 from twisted.internet.endpoints import TCP4ClientEndpoint, connectProtocol
 from twisted.internet.defer import deferredGenerator, waitForDeferred
@@ -278,6 +280,58 @@ class TestServer( unittest.TestCase ):
         
         #
         
+        file_request = '/file?share_key=' + share_key.encode( 'hex' ) + '&hash=' + hashes[0].encode( 'hex' )
+        
+        connection.request( 'GET', file_request, headers = { 'Range' : 'bytes=100-199' } )
+        
+        response = connection.getresponse()
+        
+        data = response.read()
+        
+        self.assertEqual( response.status, 206 )
+        self.assertEqual( response.getheader( 'Content-Range' ), 'bytes 100-199/' + str( len( EXAMPLE_FILE ) ) )
+        self.assertEqual( data, EXAMPLE_FILE[ 100 : 200 ] )
+        
+        connection.request( 'GET', file_request, headers = { 'Range' : 'bytes=-50' } )
+        
+        response = connection.getresponse()
+        
+        data = response.read()
+        
+        self.assertEqual( response.status, 206 )
+        self.assertEqual( data, EXAMPLE_FILE[ -50 : ] )
+        
+        connection.request( 'GET', file_request, headers = { 'Range' : 'bytes=' + str( len( EXAMPLE_FILE ) ) + '-' } )
+        
+        response = connection.getresponse()
+        
+        data = response.read()
+        
+        self.assertEqual( response.status, 416 )
+        
+        etag = '"' + hashes[0].encode( 'hex' ) + '"'
+        
+        connection.request( 'GET', file_request, headers = { 'If-None-Match' : etag } )
+        
+        response = connection.getresponse()
+        
+        data = response.read()
+        
+        self.assertEqual( response.status, 304 )
+        self.assertEqual( data, '' )
+        
+        connection.request( 'GET', file_request, headers = { 'If-None-Match' : '"' + HydrusData.GenerateKey().encode( 'hex' ) + '"' } )
+        
+        response = connection.getresponse()
+        
+        data = response.read()
+        
+        self.assertEqual( response.status, 200 )
+        self.assertEqual( response.getheader( 'ETag' ), etag )
+        self.assertEqual( data, EXAMPLE_FILE )
+        
+        #
+        
         HG.test_controller.SetRead( 'local_booru_share_keys', [] )
         
         local_booru_manager.RefreshShares()
@@ -388,11 +442,48 @@ class TestServer( unittest.TestCase ):
         
         response = service.Request( HC.GET, 'update', { 'update_hash' : content_update_hash } )
         
-        try: os.remove( path )
-        except: pass
-        
         self.assertEqual( response, content_update_network_string )
         
+        # the binary form is made once, kept next to the json, and rebuilds the json the client checks against the update hash
+        
+        binary_path = ServerFiles.GetExpectedBinaryUpdatePath( content_update_hash )
+        
+        response = service.Request( HC.GET, 'update', { 'update_hash' : content_update_hash, 'binary' : 1 } )
+        
+        self.assertTrue( response.startswith( HydrusSerialisable.BINARY_NETWORK_STRING_PREFIX ) )
+        self.assertTrue( os.path.exists( binary_path ) )
+        
+        self.assertEqual( service._DownloadUpdateNetworkString( content_update_hash ), content_update_network_string )
+        
+        for p in ( path, binary_path ):
+            
+            try: os.remove( p )
+            except: pass
+            
+        
+        # an update whose json does not rebuild the same, like the older ones that were not dumped in a stable order, stays json
+        
+        old_content_update_network_string = zlib.compress( content_update.DumpToString(), 1 )
+        
+        old_content_update_hash = hashlib.sha256( old_content_update_network_string ).digest()
+        
+        path = ServerFiles.GetExpectedFilePath( old_content_update_hash )
+        
+        binary_path = ServerFiles.GetExpectedBinaryUpdatePath( old_content_update_hash )
+        
+        with open( path, 'wb' ) as f: f.write( old_content_update_network_string )
+        
+        response = service.Request( HC.GET, 'update', { 'update_hash' : old_content_update_hash, 'binary' : 1 } )
+        
+        self.assertEqual( response, old_content_update_network_string )
+        self.assertEqual( os.path.getsize( binary_path ), 0 )
+        
+        for p in ( path, binary_path ):
+            
+            try: os.remove( p )
+            except: pass
+            
+        
         # metadata
         
         metadata = HydrusNetwork.Metadata()
@@ -0,0 +1,136 @@
+import HydrusExceptions
+import HydrusThreading
+import threading
+import time
+import traceback
+import unittest
+
+def BrokenJob( x ):
+    
+    raise ValueError( 'job ' + str( x ) + ' broke' )
+    
+class TestWorkerPool( unittest.TestCase ):
+    
+    def test_error( self ):
+        
+        pool = HydrusThreading.WorkerPool( None, 'test', num_workers = 2 )
+        
+        try:
+            
+            job = pool.Submit( BrokenJob, 5 )
+            
+            try:
+                
+                job.GetResult()
+                
+                self.fail( 'The job error was not raised!' )
+                
+            except ValueError as e:
+                
+                self.assertEqual( str( e ), 'job 5 broke' )
+                
+                # the traceback should still lead into the job
+                
+                self.assertIn( 'BrokenJob', traceback.format_exc() )
+                
+            
+            with self.assertRaises( ValueError ):
+                
+                pool.Map( BrokenJob, range( 3 ) )
+                
+            
+        finally:
+            
+            pool.Shutdown()
+            
+        
+    
+    def test_map_and_submit( self ):
+        
+        pool = HydrusThreading.WorkerPool( None, 'test', num_workers = 4 )
+        
+        try:
+            
+            self.assertEqual( pool.GetNumWorkers(), 4 )
+            
+            job = pool.Submit( lambda a, b = 0: a + b, 3, b = 4 )
+            
+            self.assertEqual( job.GetResult(), 7 )
+            self.assertTrue( job.IsDone() )
+            
+            self.assertEqual( pool.Map( lambda x: x * x, range( 100 ) ), [ x * x for x in range( 100 ) ] )
+            
+        finally:
+            
+            pool.Shutdown()
+            
+        
+    
+    def test_priority_and_cancel( self ):
+        
+        pool = HydrusThreading.WorkerPool( None, 'test', num_workers = 1 )
+        
+        try:
+            
+            gate = threading.Event()
+            
+            order = []
+            
+            # the one worker is stuck on this until we let it go, so the rest queue up
+            
+            blocker = pool.Submit( gate.wait )
+            
+            low = pool.SubmitWithPriority( 5, order.append, 'low' )
+            high = pool.SubmitWithPriority( 1, order.append, 'high' )
+            cancelled = pool.SubmitWithPriority( 1, order.append, 'cancelled' )
+            
+            cancelled.Cancel()
+            
+            gate.set()
+            
+            low.GetResult()
+            
+            self.assertEqual( order, [ 'high', 'low' ] )
+            
+            with self.assertRaises( HydrusExceptions.CancelledException ):
+                
+                cancelled.GetResult()
+                
+            
+        finally:
+            
+            pool.Shutdown()
+            
+        
+    
+    def test_shutdown( self ):
+        
+        pool = HydrusThreading.WorkerPool( None, 'test', num_workers = 2 )
+        
+        gate = threading.Event()
+        
+        jobs = [ pool.Submit( gate.wait ) ] + [ pool.Submit( lambda x: x, i ) for i in range( 10 ) ]
+        
+        workers = list( pool._workers )
+        
+        pool.Shutdown()
+        
+        with self.assertRaises( HydrusExceptions.ShutdownException ):
+            
+            pool.Submit( lambda: None )
+            
+        
+        gate.set()
+        
+        # what was queued before the shutdown still gets done
+        
+        self.assertEqual( [ job.GetResult() for job in jobs[1:] ], range( 10 ) )
+        
+        for worker in workers:
+            
+            worker.join( 10 )
+            
+            self.assertFalse( worker.is_alive() )
+            
+        
+    
@@ -0,0 +1,60 @@
+import HydrusVideoHandling
+import unittest
+
+class TestVideoKeyframes( unittest.TestCase ):
+    
+    def test_keyframe_index( self ):
+        
+        # 10fps, so keyframes at 0, 2.5s and 5s are frames 0, 25 and 50
+        
+        keyframe_index = HydrusVideoHandling.VideoKeyframeIndex( [ 0.0, 2.5, 5.0 ], 10.0 )
+        
+        self.assertEqual( keyframe_index.GetNumKeyframes(), 3 )
+        self.assertEqual( keyframe_index.GetTimestamps(), [ 0.0, 2.5, 5.0 ] )
+        
+        self.assertEqual( keyframe_index.GetKeyframeAtOrBefore( 0 ), 0 )
+        self.assertEqual( keyframe_index.GetKeyframeAtOrBefore( 24 ), 0 )
+        self.assertEqual( keyframe_index.GetKeyframeAtOrBefore( 25 ), 25 )
+        self.assertEqual( keyframe_index.GetKeyframeAtOrBefore( 49 ), 25 )
+        self.assertEqual( keyframe_index.GetKeyframeAtOrBefore( 50 ), 50 )
+        self.assertEqual( keyframe_index.GetKeyframeAtOrBefore( 1000 ), 50 )
+        
+        # the start of the file is always somewhere to seek to, and timestamps that round to the same frame collapse
+        
+        keyframe_index = HydrusVideoHandling.VideoKeyframeIndex( [ 1.0, 1.01, 3.0 ], 10.0 )
+        
+        self.assertEqual( keyframe_index.GetNumKeyframes(), 3 )
+        
+        self.assertEqual( keyframe_index.GetKeyframeAtOrBefore( 5 ), 0 )
+        self.assertEqual( keyframe_index.GetKeyframeAtOrBefore( 15 ), 10 )
+        self.assertEqual( keyframe_index.GetKeyframeAtOrBefore( 35 ), 30 )
+        
+        keyframe_index = HydrusVideoHandling.VideoKeyframeIndex( [], 24.0 )
+        
+        self.assertEqual( keyframe_index.GetNumKeyframes(), 1 )
+        
+        self.assertEqual( keyframe_index.GetKeyframeAtOrBefore( 500 ), 0 )
+        
+    
+    def test_parse_keyframe_timestamps( self ):
+        
+        lines = []
+        
+        lines.append( 'Input #0, matroska,webm, from \'video.webm\':' )
+        lines.append( '  Duration: 00:00:30.03, start: 0.000000, bitrate: 1195 kb/s' )
+        lines.append( '[Parsed_showinfo_0 @ 0000000000d5a3c0] config in time_base: 1/1000, frame_rate: 30000/1001' )
+        lines.append( '[Parsed_showinfo_0 @ 0000000000d5a3c0] n:   0 pts:      0 pts_time:0       pos:     4096 fmt:yuv420p sar:1/1 s:1280x720 i:P iskey:1 type:I checksum:E4E1E9A8' )
+        lines.append( '[Parsed_showinfo_0 @ 0000000000d5a3c0] n:   1 pts:  10010 pts_time:10.01   pos:  1486344 fmt:yuv420p sar:1/1 s:1280x720 i:P iskey:1 type:I checksum:0CC9BC80' )
+        lines.append( '[Parsed_showinfo_0 @ 0000000000d5a3c0] n:   2 pts:  20020 pts_time:20.02   pos:  2905124 fmt:yuv420p sar:1/1 s:1280x720 i:P iskey:1 type:I checksum:9B6E2E7C' )
+        lines.append( '[Parsed_showinfo_0 @ 0000000000d5a3c0] n:   3 pts:  20020 pts_time:20.02   pos:  2905124 fmt:yuv420p sar:1/1 s:1280x720 i:P iskey:1 type:I checksum:9B6E2E7C' )
+        lines.append( '[Parsed_showinfo_0 @ 0000000000d5a3c0] n:   4 pts:    -33 pts_time:-0.033  pos:     4096 fmt:yuv420p sar:1/1 s:1280x720 i:P iskey:1 type:I checksum:E4E1E9A8' )
+        lines.append( 'frame=    4 fps=0.0 q=-0.0 Lsize=N/A time=00:00:20.05 bitrate=N/A speed= 151x' )
+        
+        timestamps = HydrusVideoHandling.ParseFFMPEGKeyframeTimestamps( lines )
+        
+        self.assertEqual( timestamps, [ 0.0, 10.01, 20.02 ] )
+        
+        self.assertEqual( HydrusVideoHandling.ParseFFMPEGKeyframeTimestamps( [] ), [] )
+        self.assertEqual( HydrusVideoHandling.ParseFFMPEGKeyframeTimestamps( [ 'Stream #0:0: Video: vp8, yuv420p, 1280x720' ] ), [] )
+        
+    
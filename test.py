@@ -21,6 +21,8 @@ from include import HydrusPubSub
 from include import HydrusSessions
 from include import HydrusTags
 from include import HydrusThreading
+from include import TestClientBitmaps
+from include import TestClientCaches
 from include import TestClientConstants
 from include import TestClientDaemons
 from include import TestClientData
@@ -29,6 +31,8 @@ from include import TestClientImportOptions
 from include import TestClientImportSubscriptions
 from include import TestClientListBoxes
 from include import TestClientNetworking
+from include import TestClientPackedThumbnails
+from include import TestClientParsing
 from include import TestConstants
 from include import TestDialogs
 from include import TestDB
@@ -39,6 +43,8 @@ from include import TestHydrusSerialisable
 from include import TestHydrusServer
 from include import TestHydrusSessions
 from include import TestHydrusTags
+from include import TestHydrusThreading
+from include import TestHydrusVideoHandling
 import collections
 import os
 import random
@@ -146,7 +152,7 @@ class Controller( object ):
         self.services_manager = ClientCaches.ServicesManager( self )
         self.client_files_manager = ClientCaches.ClientFilesManager( self )
         
-        self.parsing_cache = ClientCaches.ParsingCache()
+        self.file_processing_pool = HydrusThreading.WorkerPool( self, 'file processing' )
         
         bandwidth_manager = ClientNetworkingBandwidth.NetworkBandwidthManager()
         session_manager = ClientNetworkingSessions.NetworkSessionManager()
@@ -165,6 +171,10 @@ class Controller( object ):
         
         self.local_booru_manager = ClientCaches.LocalBooruCache( self )
         
+        self._caches = {}
+        
+        self._caches[ 'video_keyframes' ] = ClientCaches.VideoKeyframeIndexCache( self )
+        
         self._cookies = {}
         
         self._job_scheduler = HydrusThreading.JobScheduler( self )
@@ -340,11 +350,26 @@ class Controller( object ):
         return job
         
     
+    def CurrentlyIdle( self ):
+        
+        return True
+        
+    
     def DBCurrentlyDoingJob( self ):
         
         return False
         
     
+    def GetCache( self, name ):
+        
+        return self._caches[ name ]
+        
+    
+    def GetDBDir( self ):
+        
+        return self.db_dir
+        
+    
     def GetFilesDir( self ):
         
         return self._server_files_dir
@@ -458,13 +483,19 @@ class Controller( object ):
             
         if run_all or only_run == 'data':
             
+            suites.append( unittest.TestLoader().loadTestsFromModule( TestClientBitmaps ) )
+            suites.append( unittest.TestLoader().loadTestsFromModule( TestClientCaches ) )
             suites.append( unittest.TestLoader().loadTestsFromModule( TestClientConstants ) )
             suites.append( unittest.TestLoader().loadTestsFromModule( TestClientData ) )
             suites.append( unittest.TestLoader().loadTestsFromModule( TestClientImportOptions ) )
+            suites.append( unittest.TestLoader().loadTestsFromModule( TestClientPackedThumbnails ) )
+            suites.append( unittest.TestLoader().loadTestsFromModule( TestClientParsing ) )
             suites.append( unittest.TestLoader().loadTestsFromModule( TestFunctions ) )
             suites.append( unittest.TestLoader().loadTestsFromModule( TestHydrusSerialisable ) )
             suites.append( unittest.TestLoader().loadTestsFromModule( TestHydrusSessions ) )
             suites.append( unittest.TestLoader().loadTestsFromModule( TestHydrusTags ) )
+            suites.append( unittest.TestLoader().loadTestsFromModule( TestHydrusThreading ) )
+            suites.append( unittest.TestLoader().loadTestsFromModule( TestHydrusVideoHandling ) )
             
         if run_all or only_run == 'db':
             
@@ -492,6 +523,12 @@ class Controller( object ):
             suites.append( unittest.TestLoader().loadTestsFromModule( TestHydrusServer ) )
             
         
+        # benchmarks are timing only, so they are never part of the full run
+        if only_run == 'benchmark':
+            
+            suites.append( unittest.TestSuite( [ TestClientNetworking.TestNetworkDomainManager( 'benchmark_url_match_index' ) ] ) )
+            
+        
         suite = unittest.TestSuite( suites )
         
         runner = unittest.TextTestRunner( verbosity = 2 )